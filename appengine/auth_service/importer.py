@@ -38,6 +38,7 @@ in particular all caveats related to external group system names apply.
 """
 
 import contextlib
+import hashlib
 import logging
 import StringIO
 import tarfile
@@ -54,6 +55,13 @@ from components.auth import model
 from proto import config_pb2
 
 
+# Max number of group members written by a single import transaction. Bigger
+# imports are split into multiple AuthDB revisions.
+IMPORT_BATCH_MEMBERS = 100000
+# Max number of groups written by a single import transaction.
+IMPORT_BATCH_GROUPS = 100
+
+
 class BundleImportError(Exception):
   """Base class for errors while fetching external bundle."""
 
@@ -107,6 +115,51 @@ class GroupImporterConfig(ndb.Model):
   modified_ts = ndb.DateTimeProperty(auto_now=True, indexed=False)
 
 
+def import_digests_key(system):
+  """Key of GroupImportDigests entity of some external groups system."""
+  return ndb.Key('GroupImportDigests', system)
+
+
+class GroupImportDigests(ndb.Model):
+  """Digests of members of groups of an external system, as last imported.
+
+  Used to skip groups that didn't change since the last import without loading
+  them. Digests are removed before the groups are modified and put back once
+  the import succeeds, so a stored digest always matches the stored group.
+  """
+  # {group name -> hex digest of members, see group_digest}.
+  digests = ndb.JsonProperty(compressed=True)
+
+
+def group_digest(members):
+  """Returns hex SHA256 digest of a list of identities."""
+  h = hashlib.sha256()
+  for member in sorted(m.to_bytes() for m in members):
+    h.update(member)
+    h.update('\n')
+  return h.hexdigest()
+
+
+def get_import_digests(systems):
+  """Returns {group name -> digest} for groups imported from given systems."""
+  out = {}
+  for e in ndb.get_multi(import_digests_key(s) for s in systems):
+    if e and e.digests:
+      out.update(e.digests)
+  return out
+
+
+def put_import_digests(digests):
+  """Stores {system name -> {group name -> digest}} if it is different."""
+  systems = sorted(digests)
+  current = ndb.get_multi(import_digests_key(s) for s in systems)
+  ndb.put_multi([
+    GroupImportDigests(key=import_digests_key(s), digests=digests[s])
+    for s, e in zip(systems, current)
+    if not e or e.digests != digests[s]
+  ])
+
+
 def validate_config(text):
   """Deserializes text to config_pb2.GroupImporterConfig and validates it.
 
@@ -275,7 +328,9 @@ def ingest_tarball(name, content):
   # {system -> {group -> identities}} map (aka "bundles set") and import it into
   # the datastore.
   logging.info('Ingesting tarball "%s" uploaded by %s', name, caller.to_bytes())
-  bundles = load_tarball(content, entry.systems, entry.groups, entry.domain)
+  bundles = load_tarball(
+      content, entry.systems, entry.groups, entry.domain,
+      get_import_digests(entry.systems))
   return import_bundles(
       bundles, caller, 'Uploaded as "%s" tarball' % entry.name)
 
@@ -294,13 +349,19 @@ def import_external_groups():
   entries = list(config.tarball) + list(config.plainlist)
   futures = [fetch_file_async(e.url, e.oauth_scopes) for e in entries]
 
-  # {system name -> group name -> list of identities}
+  # Digests of groups as they were imported last time, to skip unchanged ones.
+  systems = ['external']
+  for e in config.tarball:
+    systems.extend(e.systems)
+  digests = get_import_digests(systems)
+
+  # {system name -> group name -> list of identities or None if unchanged}
   bundles = {}
   for e, future in zip(entries, futures):
     # Unpack tarball into {system name -> group name -> list of identities}.
     if isinstance(e, config_pb2.GroupImporterConfig.TarballEntry):
       fetched = load_tarball(
-          future.get_result(), e.systems, e.groups, e.domain)
+          future.get_result(), e.systems, e.groups, e.domain, digests)
       assert not (
           set(fetched) & set(bundles)), (fetched.keys(), bundles.keys())
       bundles.update(fetched)
@@ -310,6 +371,8 @@ def import_external_groups():
     if isinstance(e, config_pb2.GroupImporterConfig.PlainlistEntry):
       group = load_group_file(future.get_result(), e.domain)
       name = 'external/%s' % e.group
+      if digests.get(name) == group_digest(group):
+        group = None
       if 'external' not in bundles:
         bundles['external'] = {}
       assert name not in bundles['external'], name
@@ -323,7 +386,7 @@ def import_external_groups():
 
 
 def import_bundles(bundles, provided_by, change_log_comment):
-  """Imports given set of bundles all at once.
+  """Imports given set of bundles.
 
   A bundle is a dict with groups that is result of a processing of some tarball.
   A bundle specifies the _desired state_ of all groups under some system, e.g.
@@ -334,11 +397,18 @@ def import_bundles(bundles, provided_by, change_log_comment):
   {
     'ldap': {
       'ldap/group': [Identity(...), Identity(...)],
+      'ldap/unchanged': None,
     },
   }
 
+  None instead of list of identities means the group is known to be unchanged
+  since the last import (its digest matches), it is not touched at all.
+
+  Changes are applied in batches of at most IMPORT_BATCH_MEMBERS members and
+  IMPORT_BATCH_GROUPS groups, each batch being a separate AuthDB revision.
+
   Args:
-    bundles: dict {system name -> {group name -> list of identities}}.
+    bundles: dict {system name -> {group name -> list of identities or None}}.
     provided_by: auth.Identity to put in 'modified_by' or 'created_by' fields.
     change_log_comment: a comment to put in the change log.
 
@@ -351,9 +421,25 @@ def import_bundles(bundles, provided_by, change_log_comment):
 
   @ndb.transactional
   def snapshot_groups():
-    """Fetches all existing groups and AuthDB revision number."""
-    groups = model.AuthGroup.query(ancestor=model.root_key()).fetch_async()
-    return auth.get_auth_db_revision(), groups.get_result()
+    """Fetches AuthDB revision number and existing groups affected by import.
+
+    These are imported groups that may need an update, groups to be removed and
+    groups that reference them (see prepare_import).
+    """
+    names = set(
+        k.id() for k in model.AuthGroup.query(
+            ancestor=model.root_key()).fetch(keys_only=True))
+    to_fetch = set()
+    for system, groups in bundles.iteritems():
+      for name in names:
+        if name.startswith('%s/' % system):
+          if name not in groups:
+            to_fetch.add(name)
+            to_fetch.update(model.find_referencing_groups(name))
+          elif groups[name] is not None:
+            to_fetch.add(name)
+    entities = ndb.get_multi(model.group_key(n) for n in sorted(to_fetch))
+    return auth.get_auth_db_revision(), [e for e in entities if e]
 
   @ndb.transactional
   def apply_import(revision, entities_to_put, entities_to_delete, ts):
@@ -380,51 +466,109 @@ def import_bundles(bundles, provided_by, change_log_comment):
     auth.replicate_auth_db()
     return True
 
+  # Forget digests of groups that are about to change until the import is done.
+  # That way an interrupted import never leaves a digest of a group that doesn't
+  # match the group.
+  old_digests = get_import_digests(bundles)
+  put_import_digests({
+    system: {
+      name: old_digests[name] for name, members in groups.iteritems()
+      if members is None and name in old_digests
+    }
+    for system, groups in bundles.iteritems()
+  })
+
   # Try to apply the change until success or deadline. Split transaction into
   # two (assuming AuthDB changes infrequently) to avoid reading and writing too
   # much stuff from within a single transaction (and to avoid keeping the
-  # transaction open while calculating the diff).
+  # transaction open while calculating the diff). If AuthDB changes midway,
+  # start over: already applied batches show up as unchanged groups.
+  updated_groups = []
+  revision = 0
   while True:
     # Use same timestamp everywhere to reflect that groups were imported
-    # atomically within a single transaction.
+    # together.
     ts = utils.utcnow()
     entities_to_put = []
     entities_to_delete = []
-    revision, existing_groups = snapshot_groups()
+    current_revision, existing_groups = snapshot_groups()
     for system, groups in bundles.iteritems():
       to_put, to_delete = prepare_import(
           system, existing_groups, groups, ts, provided_by)
       entities_to_put.extend(to_put)
       entities_to_delete.extend(to_delete)
-    if not entities_to_put and not entities_to_delete:
-      break
-    if apply_import(revision, entities_to_put, entities_to_delete, ts):
-      revision += 1
+    for to_put, to_delete in split_in_batches(
+        entities_to_put, entities_to_delete):
+      if not apply_import(current_revision, to_put, to_delete, ts):
+        break
+      current_revision += 1
+      revision = current_revision
+      for e in to_put + to_delete:
+        logging.info('%s', e.key.id())
+        updated_groups.append(e.key.id())
+    else:
       break
 
-  if not entities_to_put and not entities_to_delete:
+  # All groups match the bundles now.
+  put_import_digests({
+    system: {
+      name: old_digests[name] if members is None else group_digest(members)
+      for name, members in groups.iteritems()
+      if members is not None or name in old_digests
+    }
+    for system, groups in bundles.iteritems()
+  })
+
+  if not revision:
     logging.info('No changes')
     return [], 0
 
   logging.info('Groups updated, new authDB rev is %d', revision)
-  updated_groups = []
-  for e in entities_to_put + entities_to_delete:
-    logging.info('%s', e.key.id())
-    updated_groups.append(e.key.id())
   return sorted(updated_groups), revision
 
 
-def load_tarball(content, systems, groups, domain):
+def split_in_batches(entities_to_put, entities_to_delete):
+  """Yields (entities to put, entities to delete) to apply in one transaction.
+
+  Each batch has at most IMPORT_BATCH_GROUPS entities with at most
+  IMPORT_BATCH_MEMBERS members in total (unless a single group is bigger).
+  """
+  to_put = []
+  to_delete = []
+  members = 0
+  for e, deletion in (
+      [(e, False) for e in entities_to_put] +
+      [(e, True) for e in entities_to_delete]):
+    size = 1 if deletion else max(len(e.members), 1)
+    if (to_put or to_delete) and (
+        len(to_put) + len(to_delete) >= IMPORT_BATCH_GROUPS or
+        members + size > IMPORT_BATCH_MEMBERS):
+      yield to_put, to_delete
+      to_put = []
+      to_delete = []
+      members = 0
+    (to_delete if deletion else to_put).append(e)
+    members += size
+  if to_put or to_delete:
+    yield to_put, to_delete
+
+
+def load_tarball(content, systems, groups, domain, digests=None):
   """Unzips tarball with groups and deserializes them.
 
+  The archive is decompressed and parsed as a stream, group by group. Members
+  of groups that didn't change are not kept.
+
   Args:
     content: byte buffer with *.tar.gz data.
     systems: names of external group systems expected to be in the bundle.
     groups: list of group name to extract, or empty to extract all.
     domain: email domain to append to naked user ids.
+    digests: optional dict {group name -> digest} of the last imported groups.
 
   Returns:
-    Dict {system name -> {group name -> list of identities}}.
+    Dict {system name -> {group name -> list of identities}}. Groups which
+    digest is in |digests| have None instead of the list of identities.
 
   Raises:
     BundleImportError on errors.
@@ -448,7 +592,10 @@ def load_tarball(content, systems, groups, domain):
       # bundle if at least one group file is broken. That way all existing
       # groups will stay intact. Simply ignoring broken group here will cause
       # the importer to remove it completely.
-      bundles[system][filename] = load_group_file(fileobj.read(), domain)
+      members = load_group_file(fileobj, domain)
+      if digests and digests.get(filename) == group_digest(members):
+        members = None
+      bundles[system][filename] = members
   except tarfile.TarError as exc:
     raise BundleUnpackError('Not a valid tar archive: %s' % exc)
   return bundles
@@ -457,10 +604,17 @@ def load_tarball(content, systems, groups, domain):
 def load_group_file(body, domain):
   """Given body of imported group file returns list of Identities.
 
+  |body| is either a string or a file object, which is read line by line.
+
   Raises BundleBadFormatError if group file is malformed.
   """
+  if isinstance(body, basestring):
+    body = body.splitlines()
   members = set()
-  for uid in body.strip().splitlines():
+  for line in body:
+    uid = line.strip()
+    if not uid:
+      continue
     email = '%s@%s' % (uid, domain) if domain else uid
     if email.endswith('@gtempaccount.com'):
       # See https://support.google.com/a/answer/185186?hl=en. These emails look
@@ -515,8 +669,10 @@ def prepare_import(
     system_name: name of external groups system being imported (e.g. 'ldap'),
       all existing groups belonging to that system will be replaced with
       |imported_groups|.
-    existing_groups: ALL existing groups (not only '<system name>/*' ones).
-    imported_groups: dict {imported group name -> list of identities}.
+    existing_groups: existing '<system name>/*' groups to update or remove and
+      groups that reference them.
+    imported_groups: dict {imported group name -> list of identities or None
+      if the group is unchanged}.
     timestamp: modification timestamp to set on all touched entities.
     provided_by: auth.Identity to put in 'modified_by' or 'created_by' fields.
 
@@ -576,12 +732,17 @@ def prepare_import(
     else:
       delete_group(group_name)
 
+  # Unchanged groups are not touched.
+  changed_groups = set(
+      name for name, members in imported_groups.iteritems()
+      if members is not None)
+
   # Create new groups.
-  for group_name in (set(imported_groups) - set(system_groups)):
+  for group_name in (changed_groups - set(system_groups)):
     create_group(group_name)
 
   # Update existing groups.
-  for group_name in (set(imported_groups) & set(system_groups)):
+  for group_name in (changed_groups & set(system_groups)):
     update_group(group_name)
 
   return to_put, to_delete
@@ -246,6 +246,73 @@ class ImporterTest(test_case.TestCase):
         groups=['ldap/group-a', 'ldap/group-b'],
         domain='example.com')
 
+  def test_load_tarball_digests(self):
+    bundle = build_tar_gz({
+      'ldap/changed': 'a\nb',
+      'ldap/unchanged': 'b\na',
+    })
+    digests = {
+      'ldap/changed': importer.group_digest([ident('a')]),
+      'ldap/unchanged': importer.group_digest([ident('a'), ident('b')]),
+    }
+    result = importer.load_tarball(
+        content=bundle,
+        systems=['ldap'],
+        groups=[],
+        domain='example.com',
+        digests=digests)
+    expected = {
+      'ldap': {
+        'ldap/changed': [ident('a'), ident('b')],
+        'ldap/unchanged': None,
+      },
+    }
+    self.assertEqual(expected, result)
+
+  def test_import_bundles_batches(self):
+    self.mock(importer, 'IMPORT_BATCH_GROUPS', 2)
+    group('ldap/deleted', ['a']).put()
+    bundles = {
+      'ldap': {
+        'ldap/a': [ident('a')],
+        'ldap/b': [ident('b')],
+        'ldap/c': [ident('c')],
+      },
+    }
+    groups, rev = importer.import_bundles(
+        bundles, model.get_service_self_identity(), 'comment')
+    self.assertEqual(['ldap/a', 'ldap/b', 'ldap/c', 'ldap/deleted'], groups)
+    self.assertEqual(2, rev)
+    self.assertEqual(['ldap/a', 'ldap/b', 'ldap/c'], sorted(fetch_groups()))
+    self.assertEqual(
+        {
+          'ldap/a': importer.group_digest([ident('a')]),
+          'ldap/b': importer.group_digest([ident('b')]),
+          'ldap/c': importer.group_digest([ident('c')]),
+        },
+        importer.get_import_digests(['ldap']))
+
+  def test_import_bundles_unchanged(self):
+    group('ldap/a', ['a']).put()
+    group('ldap/b', ['b']).put()
+    importer.put_import_digests({
+      'ldap': {
+        'ldap/a': importer.group_digest([ident('a')]),
+        'ldap/b': 'stale digest',
+      },
+    })
+    # 'ldap/a' is not touched, 'ldap/b' is compared to the stored group.
+    bundles = {'ldap': {'ldap/a': None, 'ldap/b': [ident('b')]}}
+    groups, rev = importer.import_bundles(
+        bundles, model.get_service_self_identity(), 'comment')
+    self.assertEqual(([], 0), (groups, rev))
+    self.assertEqual(
+        {
+          'ldap/a': importer.group_digest([ident('a')]),
+          'ldap/b': importer.group_digest([ident('b')]),
+        },
+        importer.get_import_digests(['ldap']))
+
   def test_import_external_groups(self):
     self.mock_now(datetime.datetime(2010, 1, 2, 3, 4, 5, 6))
 
@@ -250,11 +250,23 @@ def update_replicas_task(auth_db_rev):
   # Sign the blob, replicas check the signature.
   key_name, sig = sign_auth_db_blob(auth_db_blob)
 
+  # Replicas that are exactly one revision behind need only the difference
+  # with the previous revision, it's much smaller than an entire AuthDB.
+  delta = None
+  base_auth_db_rev = replication_state.auth_db_rev - 1
+  if any(r.auth_db_rev == base_auth_db_rev for r in stale_replicas):
+    delta_blob = pack_auth_db_delta(auth_db_blob)
+    if delta_blob:
+      delta = (delta_blob,) + sign_auth_db_blob(delta_blob)
+
   # Push the blob to all out-of-date replicas, in parallel.
   push_started_ts = utils.utcnow()
   futures = {
-    push_to_replica(
-        replica.replica_url, auth_db_blob, key_name, sig): replica
+    push_update_to_replica(
+        replica.replica_url,
+        replication_state.auth_db_rev,
+        (auth_db_blob, key_name, sig),
+        delta if replica.auth_db_rev == base_auth_db_rev else None): replica
     for replica in stale_replicas
   }
 
@@ -346,6 +358,38 @@ def pack_auth_db():
   return state, auth_db_blob
 
 
+def pack_auth_db_delta(auth_db_blob):
+  """Packs a difference between AuthDB in |auth_db_blob| and previous revision.
+
+  Args:
+    auth_db_blob: serialized ReplicationPushRequest, as returned by pack_auth_db.
+
+  Returns:
+    Serialized ReplicationDeltaPushRequest or None if the previous revision is
+    not stored.
+  """
+  new = replication_pb2.ReplicationPushRequest.FromString(auth_db_blob)
+  base_auth_db_rev = new.revision.auth_db_rev - 1
+  prev = get_auth_db_snapshot(base_auth_db_rev, skip_body=False)
+  if not prev:
+    logging.warning('AuthDB snapshot at rev %d is missing', base_auth_db_rev)
+    return None
+  old = replication_pb2.ReplicationPushRequest.FromString(
+      zlib.decompress(prev.auth_db_deflated))
+
+  req = replication_pb2.ReplicationDeltaPushRequest()
+  req.revision.CopyFrom(new.revision)
+  req.base_auth_db_rev = base_auth_db_rev
+  req.delta.CopyFrom(replication.auth_db_snapshot_delta_to_proto(
+      replication.proto_to_auth_db_snapshot(new.auth_db),
+      replication.proto_to_auth_db_snapshot(old.auth_db)))
+  req.auth_code_version = version.__version__
+  delta_blob = req.SerializeToString()
+
+  logging.debug('AuthDB delta blob size is %d bytes', len(delta_blob))
+  return delta_blob
+
+
 def sign_auth_db_blob(auth_db_blob):
   """Signs AuthDB blob with app's private key.
 
@@ -397,7 +441,42 @@ def store_auth_db_snapshot(replication_state, auth_db_blob):
 
 
 @ndb.tasklet
-def push_to_replica(replica_url, auth_db_blob, key_name, sig):
+def push_update_to_replica(replica_url, auth_db_rev, full, delta):
+  """Pushes the delta to a replica, falling back to an entire AuthDB.
+
+  Args:
+    replica_url: root URL of a replica (i.e. https://<host>).
+    auth_db_rev: revision being pushed.
+    full: tuple (auth_db_blob, key_name, sig) with an entire AuthDB.
+    delta: tuple (delta_blob, key_name, sig) with the difference with a
+        revision the replica is at, or None to push an entire AuthDB.
+
+  Returns:
+    Same as push_to_replica.
+
+  Raises:
+    Same as push_to_replica.
+  """
+  if delta:
+    try:
+      current_revision, auth_code_version = yield push_to_replica(
+          replica_url, *delta, is_delta=True)
+    except Exception as exc:
+      # Replicas running older code do not know about deltas at all.
+      logging.warning(
+          'Failed to push the delta to replica %s: %s', replica_url, exc)
+    else:
+      if current_revision.auth_db_rev >= auth_db_rev:
+        raise ndb.Return((current_revision, auth_code_version))
+      logging.warning(
+          'Replica %s skipped the delta, it is at rev %d',
+          replica_url, current_revision.auth_db_rev)
+  result = yield push_to_replica(replica_url, *full)
+  raise ndb.Return(result)
+
+
+@ndb.tasklet
+def push_to_replica(replica_url, auth_db_blob, key_name, sig, is_delta=False):
   """Pushes |auth_db_blob| to a replica via URLFetch POST.
 
   Args:
@@ -405,6 +484,8 @@ def push_to_replica(replica_url, auth_db_blob, key_name, sig):
     auth_db_blob: binary blob with serialized Auth DB.
     key_name: name of a RSA key used to generate a signature.
     sig: base64 encoded signature of |auth_db_blob|.
+    is_delta: True if |auth_db_blob| is serialized ReplicationDeltaPushRequest
+        rather than ReplicationPushRequest.
 
   Returns:
     Tuple:
@@ -437,7 +518,9 @@ def push_to_replica(replica_url, auth_db_blob, key_name, sig):
   # deadline plus 10 seconds to account for URL fetch own lags.
   ctx = ndb.get_context()
   result = yield ctx.urlfetch(
-      url=replica_url + '/auth/api/v1/internal/replication',
+      url=replica_url + (
+          '/auth/api/v1/internal/replication_delta' if is_delta else
+          '/auth/api/v1/internal/replication'),
       payload=auth_db_blob,
       method='POST',
       headers=headers,
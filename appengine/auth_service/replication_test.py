@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# Copyright 2017 The LUCI Authors. All rights reserved.
+# Use of this source code is governed under the Apache License, Version 2.0
+# that can be found in the LICENSE file.
+
+import logging
+import sys
+import unittest
+
+import test_env
+test_env.setup_test_env()
+
+from google.appengine.ext import ndb
+
+from components.auth.proto import replication_pb2
+from test_support import test_case
+
+import replication
+
+
+FULL = ('full-blob', 'key', 'full-sig')
+DELTA = ('delta-blob', 'key', 'delta-sig')
+
+
+def revision(auth_db_rev):
+  return replication_pb2.AuthDBRevision(
+      primary_id='primary', auth_db_rev=auth_db_rev, modified_ts=1)
+
+
+class PushUpdateToReplicaTest(test_case.TestCase):
+  def setUp(self):
+    super(PushUpdateToReplicaTest, self).setUp()
+    self.pushes = []
+    # is_delta -> result of the push, or exception to raise.
+    self.results = {}
+
+    def push_to_replica(replica_url, auth_db_blob, key_name, sig,
+                        is_delta=False):
+      self.pushes.append((replica_url, auth_db_blob, key_name, sig, is_delta))
+      future = ndb.Future()
+      result = self.results[is_delta]
+      if isinstance(result, Exception):
+        future.set_exception(result)
+      else:
+        future.set_result(result)
+      return future
+    self.mock(replication, 'push_to_replica', push_to_replica)
+
+  def push(self, delta=DELTA):
+    return replication.push_update_to_replica(
+        'https://replica.example.com', 5, FULL, delta).get_result()
+
+  def test_delta_applied(self):
+    self.results[True] = (revision(5), '1.0')
+    self.assertEqual((revision(5), '1.0'), self.push())
+    self.assertEqual([
+      ('https://replica.example.com', 'delta-blob', 'key', 'delta-sig', True),
+    ], self.pushes)
+
+  def test_delta_skipped(self):
+    # The replica is not at the base revision of the delta.
+    self.results[True] = (revision(3), '1.0')
+    self.results[False] = (revision(5), '1.0')
+    self.assertEqual((revision(5), '1.0'), self.push())
+    self.assertEqual([
+      ('https://replica.example.com', 'delta-blob', 'key', 'delta-sig', True),
+      ('https://replica.example.com', 'full-blob', 'key', 'full-sig', False),
+    ], self.pushes)
+
+  def test_delta_failed(self):
+    # E.g. the replica runs code that doesn't know about deltas.
+    self.results[True] = replication.FatalReplicaUpdateError('HTTP 404')
+    self.results[False] = (revision(5), None)
+    self.assertEqual((revision(5), None), self.push())
+    self.assertEqual([
+      ('https://replica.example.com', 'delta-blob', 'key', 'delta-sig', True),
+      ('https://replica.example.com', 'full-blob', 'key', 'full-sig', False),
+    ], self.pushes)
+
+  def test_no_delta(self):
+    self.results[False] = (revision(5), '1.0')
+    self.assertEqual((revision(5), '1.0'), self.push(delta=None))
+    self.assertEqual([
+      ('https://replica.example.com', 'full-blob', 'key', 'full-sig', False),
+    ], self.pushes)
+
+
+if __name__ == '__main__':
+  if '-v' in sys.argv:
+    unittest.TestCase.maxDiff = None
+    logging.basicConfig(level=logging.DEBUG)
+  else:
+    logging.basicConfig(level=logging.FATAL)
+  unittest.main()
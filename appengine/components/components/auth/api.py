@@ -33,6 +33,7 @@ from components.datastore_utils import config as ds_config
 from components import utils
 
 from . import config
+from . import globmatch
 from . import ipaddr
 from . import model
 from .proto import delegation_pb2
@@ -71,6 +72,9 @@ _additional_client_ids_cb = None
 
 # How soon process-global AuthDB cache expires, sec.
 _process_cache_expiration_sec = 30
+# Max number of revisions fetch_auth_db walks through to refresh cached AuthDB
+# incrementally. Beyond that it's cheaper to fetch everything.
+_MAX_INCREMENTAL_REVS = 100
 # True if fetch_auth_db was called at least once and created all root entities.
 _lazy_bootstrap_ran = False
 
@@ -154,7 +158,9 @@ class AuthDB(object):
       ip_whitelist_assignments=None,
       ip_whitelists=None,
       additional_client_ids=None,
-      entity_group_version=None):
+      entity_group_version=None,
+      cached_groups=None,
+      membership_index_from=None):
     """
     Args:
       replication_state: instance of AuthReplicationState entity.
@@ -166,6 +172,10 @@ class AuthDB(object):
       additional_client_ids: an additional list of OAuth2 client IDs to trust.
       entity_group_version: version of AuthGlobalConfig entity group at the
           moment when entities were fetched from it.
+      cached_groups: dict group name -> CachedGroup with groups to use as is,
+          e.g. unchanged groups of a previous AuthDB. 'groups' take precedence.
+      membership_index_from: AuthDB with exactly the same groups, its
+          membership index is reused instead of being rebuilt.
     """
     self.replication_state = replication_state or model.AuthReplicationState()
     self.global_config = global_config or model.AuthGlobalConfig()
@@ -175,13 +185,24 @@ class AuthDB(object):
         ip_whitelist_assignments or model.AuthIPWhitelistAssignments())
     self.entity_group_version = entity_group_version
 
+    # Whitelists and assignments compiled for checks done on every request, see
+    # is_in_ip_whitelist() and verify_ip_whitelisted().
+    self._ip_whitelist_subnets = {
+      name: self._compile_ip_whitelist(e)
+      for name, e in self.ip_whitelists.iteritems()
+    }
+    self._ip_whitelist_by_identity = {}
+    for assignment in self.ip_whitelist_assignments.assignments:
+      self._ip_whitelist_by_identity.setdefault(
+          assignment.identity, assignment.ip_whitelist)
+
     for secret in (secrets or []):
       assert secret.key.string_id() not in self.secrets, secret.key
       self.secrets[secret.key.string_id()] = secret
 
     # Preprocess groups for faster membership checks. Throw away original
     # entities to reduce memory usage.
-    self.groups = {}
+    self.groups = dict(cached_groups or {})
     for entity in (groups or []):
       self.groups[entity.key.string_id()] = CachedGroup(
           members=frozenset(m.to_bytes() for m in entity.members),
@@ -193,6 +214,14 @@ class AuthDB(object):
           created_by=entity.created_by,
           modified_ts=entity.modified_ts,
           modified_by=entity.modified_by)
+    if membership_index_from is not None:
+      self._direct_groups = membership_index_from._direct_groups
+      self._ancestors = membership_index_from._ancestors
+      self._group_globs = membership_index_from._group_globs
+      self._glob_groups = membership_index_from._glob_groups
+      self._groups_with_all = membership_index_from._groups_with_all
+    else:
+      self._build_membership_index()
 
     # A set of all allowed client IDs (as provided via config and the callback).
     client_ids = []
@@ -225,64 +254,107 @@ class AuthDB(object):
     """URL of a token server to use to generate tokens, provided by Primary."""
     return self.global_config.token_server_url
 
+  @staticmethod
+  def _compile_ip_whitelist(entity):
+    """Returns ipaddr.SubnetSet with the subnets of AuthIPWhitelist entity."""
+    subnets = []
+    for net in entity.subnets:
+      try:
+        subnets.append(ipaddr.subnet_from_string(net))
+      except ValueError:
+        logging.error(
+            'Invalid subnet in IP whitelist %s: %s', entity.key.id(), net)
+    return ipaddr.SubnetSet(subnets)
+
+  def _build_membership_index(self):
+    """Indexes the group graph to make membership checks cheap.
+
+    Sets:
+      _direct_groups: identity as bytes -> list with the names of the groups
+          that list it as a member.
+      _ancestors: group name -> frozenset with the names of the groups that
+          include it, directly or via nested groups, itself included.
+      _group_globs: group name -> tuple of compiled regexps, one per group with
+          globs among the group and its nested groups.
+      _glob_groups: list of (compiled regexp of the globs of a group, frozenset
+          of the groups that include it), for the reverse lookup.
+      _groups_with_all: names of the groups that include GROUP_ALL.
+
+    Flattening the membership of every identity instead would take one set of
+    groups per identity, that is too much memory for large snapshots.
+
+    Groups that include each other (a cycle) are merged, the same way the graph
+    walk did.
+    """
+    # Group name -> names of the groups that nest it.
+    parents = collections.defaultdict(list)
+    for name, group_obj in self.groups.iteritems():
+      for nested in group_obj.nested:
+        parents[nested].append(name)
+
+    # While the code to add groups refuses to add cycles, keep track of them
+    # to report them.
+    cycles = set()
+
+    def collect_ancestors(name):
+      # Returns the groups that include |name|, including itself.
+      seen = {name}
+      stack = [name]
+      while stack:
+        for parent in parents.get(stack.pop(), ()):
+          if parent == name:
+            cycles.add(name)
+          if parent not in seen:
+            seen.add(parent)
+            stack.append(parent)
+      return frozenset(seen)
+
+    direct_groups = {}
+    ancestors = {}
+    group_globs = collections.defaultdict(list)
+    self._glob_groups = []
+    for name, group_obj in self.groups.iteritems():
+      ancestors[name] = collect_ancestors(name)
+      for member in group_obj.members:
+        direct_groups.setdefault(member, []).append(name)
+      if group_obj.globs:
+        regexp = globmatch.compile_any(
+            sorted(g.to_bytes() for g in group_obj.globs))
+        self._glob_groups.append((regexp, ancestors[name]))
+        for ancestor in ancestors[name]:
+          group_globs[ancestor].append(regexp)
+
+    self._direct_groups = direct_groups
+    self._ancestors = ancestors
+    self._group_globs = {
+      name: tuple(regexps) for name, regexps in group_globs.iteritems()
+    }
+    self._groups_with_all = collect_ancestors(model.GROUP_ALL)
+    if cycles:
+      logging.warning(
+          'Cycle in a group graph: %s', ', '.join(sorted(cycles)))
+
   def is_group_member(self, group_name, identity):
     """Returns True if |identity| belongs to group |group_name|.
 
     Unknown groups are considered empty.
     """
-    # Will be used when checking self.group_members_set sets.
-    ident_as_bytes = identity.to_bytes()
-
-    # While the code to add groups refuses to add cycle, this code ensures that
-    # it doesn't go in a cycle by keeping track of the groups currently being
-    # visited via |current| stack.
-    current = []
+    # Wildcard group that matches all identities (including anonymous!).
+    if group_name in self._groups_with_all:
+      return True
 
-    # Used to avoid revisiting same groups multiple times in case of
-    # diamond-like graphs, e.g. A->B, A->C, B->D, C->D.
-    visited = set()
+    # An unknown group is empty.
+    if group_name not in self.groups:
+      logging.warning('Querying unknown group: %s', group_name)
+      return False
 
-    def is_member(group_name):
-      # Wildcard group that matches all identities (including anonymous!).
-      if group_name == model.GROUP_ALL:
+    ident_as_bytes = identity.to_bytes()
+    for name in self._direct_groups.get(ident_as_bytes, ()):
+      if group_name in self._ancestors[name]:
         return True
-
-      # An unknown group is empty.
-      group_obj = self.groups.get(group_name)
-      if not group_obj:
-        logging.warning(
-            'Querying unknown group: %s via %s', group_name, current)
-        return False
-
-      # In a group DAG a group can not reference any of its ancestors, since it
-      # creates a cycle.
-      if group_name in current:
-        logging.warning(
-            'Cycle in a group graph: %s via %s', group_name, current)
-        return False
-
-      # Explored this group already (and didn't find |identity| there) while
-      # visiting some sibling branch? Can happen in diamond-like graphs.
-      if group_name in visited:
-        return False
-
-      current.append(group_name)
-      try:
-        # Note that we don't include nested groups in GroupEssense.members sets
-        # because it blows up memory usage pretty bad. We don't have very deep
-        # nesting graphs, so checking nested groups separately is OK.
-        if ident_as_bytes in group_obj.members:
-          return True
-
-        if any(glob.match(identity) for glob in group_obj.globs):
-          return True
-
-        return any(is_member(nested) for nested in group_obj.nested)
-      finally:
-        current.pop()
-        visited.add(group_name)
-
-    return is_member(group_name)
+    return any(
+        regexp.match(ident_as_bytes)
+        for regexp in self._group_globs.get(group_name, ()))
 
   def get_group(self, group_name):
     """Returns AuthGroup entity reconstructing it from the cache.
@@ -350,12 +422,15 @@ class AuthDB(object):
     return set(model.Identity.from_bytes(m) for m in listing)
 
   def fetch_groups_with_member(self, ident):
-    """Returns a set of group names that have given Identity as a member.
-
-    This is expensive call, don't use it unless really necessary.
-    """
-    # TODO(vadimsh): This is currently very dumb and can probably be optimized.
-    return {g for g in self.groups if self.is_group_member(g, ident)}
+    """Returns a set of group names that have given Identity as a member."""
+    ident_as_bytes = ident.to_bytes()
+    out = set(self._groups_with_all)
+    for name in self._direct_groups.get(ident_as_bytes, ()):
+      out.update(self._ancestors[name])
+    for regexp, ancestors in self._glob_groups:
+      if regexp.match(ident_as_bytes):
+        out.update(ancestors)
+    return {g for g in out if g in self.groups}
 
   def get_group_names_with_prefix(self, prefix):
     """Returns a sorted list of group names that start with the given prefix."""
@@ -388,12 +463,12 @@ class AuthDB(object):
       ip: instance of ipaddr.IP.
       warn_if_missing: if True and IP whitelist is missing, logs a warning.
     """
-    whitelist = self.ip_whitelists.get(whitelist_name)
-    if not whitelist:
+    subnets = self._ip_whitelist_subnets.get(whitelist_name)
+    if subnets is None:
       if warn_if_missing:
         logging.error('Unknown IP whitelist: %s', whitelist_name)
       return False
-    return whitelist.is_ip_whitelisted(ip)
+    return ip in subnets
 
   def verify_ip_whitelisted(self, identity, ip):
     """Verifies IP is in a whitelist assigned to the Identity.
@@ -410,11 +485,8 @@ class AuthDB(object):
     """
     assert isinstance(identity, model.Identity), identity
 
-    for assignment in self.ip_whitelist_assignments.assignments:
-      if assignment.identity == identity:
-        whitelist_name = assignment.ip_whitelist
-        break
-    else:
+    whitelist_name = self._ip_whitelist_by_identity.get(identity)
+    if whitelist_name is None:
       return
 
     if not self.is_in_ip_whitelist(whitelist_name, ip):
@@ -832,7 +904,7 @@ def get_request_cache():
   return cache or reinitialize_request_cache()
 
 
-def fetch_auth_db(known_version=None):
+def fetch_auth_db(known_version=None, known_auth_db=None):
   """Returns instance of AuthDB.
 
   If |known_version| is None, this function always returns a new instance.
@@ -843,6 +915,10 @@ def fetch_auth_db(known_version=None):
   (meaning that there's no need to refetch AuthDB), otherwise it will fetch
   a fresh copy of AuthDB and return it.
 
+  If |known_auth_db| is given, only groups and IP whitelists changed since its
+  revision are fetched (see AuthRevisionChanges), the rest is reused from it.
+  Falls back to fetching everything if the changes are not known.
+
   Runs in transaction to guarantee consistency of fetched data. Effectively it
   fetches momentary snapshot of subset of root_key() entity group.
   """
@@ -888,32 +964,102 @@ def fetch_auth_db(known_version=None):
     # via multiple RPCs. All other instances will fetch it via single
     # memcache 'get'.
 
-    # Fetch all stuff in parallel. Fetch ALL groups and ALL secrets.
+    # Fetch all stuff in parallel. Fetch ALL secrets.
     replication_state_future = model.replication_state_key().get_async()
     global_config_future = root_key.get_async()
-    groups_future = model.AuthGroup.query(ancestor=root_key).fetch_async()
     secrets_future = model.AuthSecret.query(ancestor=root_key).fetch_async()
 
-    # It's fine to block here as long as it's the last fetch.
-    ip_whitelist_assignments, ip_whitelists = model.fetch_ip_whitelists()
+    # Fetch only changed groups and IP whitelists if possible, ALL otherwise.
+    changed = None
+    if known_auth_db is not None:
+      changed = _fetch_changed_names(
+          known_auth_db.auth_db_rev,
+          replication_state_future.get_result().auth_db_rev)
+    if changed is None:
+      groups_future = model.AuthGroup.query(ancestor=root_key).fetch_async()
+      # It's fine to block here as long as it's the last fetch.
+      ip_whitelist_assignments, ip_whitelists = model.fetch_ip_whitelists()
+      groups = groups_future.get_result()
+      cached_groups = None
+    else:
+      group_names, ip_whitelist_names = changed
+      groups_future = ndb.get_multi_async(
+          model.group_key(name) for name in group_names)
+      ip_whitelists_future = ndb.get_multi_async(
+          model.ip_whitelist_key(name) for name in ip_whitelist_names)
+      ip_whitelist_assignments = (
+          model.ip_whitelist_assignments_key().get() or
+          model.AuthIPWhitelistAssignments(
+              key=model.ip_whitelist_assignments_key()))
+      groups = [f.get_result() for f in groups_future]
+      groups = [g for g in groups if g]
+      cached_groups = {
+        name: group_obj
+        for name, group_obj in known_auth_db.groups.iteritems()
+        if name not in group_names
+      }
+      ip_whitelists = [
+        e for name, e in known_auth_db.ip_whitelists.iteritems()
+        if name not in ip_whitelist_names
+      ]
+      ip_whitelists.extend(
+          e for e in (f.get_result() for f in ip_whitelists_future) if e)
+      logging.info(
+          'Refreshing AuthDB incrementally: %d groups, %d IP whitelists',
+          len(group_names), len(ip_whitelist_names))
 
     # Note that get_entity_group_version() uses same entity group (root_key)
     # internally and respects transactions. So all data fetched here does indeed
     # correspond to |current_version|.
+    same_groups = changed is not None and not changed[0]
     return AuthDB(
         replication_state=replication_state_future.get_result(),
         global_config=global_config_future.get_result(),
-        groups=groups_future.get_result(),
+        groups=groups,
         secrets=secrets_future.get_result(),
         ip_whitelist_assignments=ip_whitelist_assignments,
         ip_whitelists=ip_whitelists,
         additional_client_ids=additional_client_ids,
-        entity_group_version=current_version)
+        entity_group_version=current_version,
+        cached_groups=cached_groups,
+        membership_index_from=known_auth_db if same_groups else None)
 
   prepare()  # non-transactional work
   return fetch()
 
 
+def _fetch_changed_names(known_auth_db_rev, auth_db_rev):
+  """Returns names of groups and IP whitelists changed since a revision.
+
+  Changes are those made after |known_auth_db_rev| up to |auth_db_rev|.
+
+  Must be called inside AuthDB entity group transaction.
+
+  Returns:
+    Tuple (set of group names, set of IP whitelist names) or None if the changes
+    are not known, e.g. the revision didn't change (so AuthDB was modified
+    without a revision bump), or AuthRevisionChanges entities are missing.
+  """
+  if not (0 < auth_db_rev - known_auth_db_rev <= _MAX_INCREMENTAL_REVS):
+    return None
+  keys = [
+    model.revision_changes_key(rev)
+    for rev in xrange(known_auth_db_rev + 1, auth_db_rev + 1)
+  ]
+  by_rev = {e.key.id(): e for e in ndb.get_multi(keys) if e}
+  group_names = set()
+  ip_whitelist_names = set()
+  rev = auth_db_rev
+  while rev != known_auth_db_rev:
+    changes = by_rev.get(rev)
+    if not changes or changes.prev_auth_db_rev < known_auth_db_rev:
+      return None
+    group_names.update(changes.groups)
+    ip_whitelist_names.update(changes.ip_whitelists)
+    rev = changes.prev_auth_db_rev
+  return group_names, ip_whitelist_names
+
+
 def reset_local_state():
   """Resets all local caches to an initial state. Only for testing."""
   global _auth_db
@@ -977,7 +1123,8 @@ def get_process_auth_db():
   # Do the actual fetch outside the lock. Be careful to handle any unexpected
   # exception by 'fixing' the global state before leaving this function.
   try:
-    fresh_copy = fetch_auth_db(known_version=known_auth_db_version)
+    fresh_copy = fetch_auth_db(
+        known_version=known_auth_db_version, known_auth_db=known_auth_db)
     if fresh_copy is None:
       # No changes, entity group versions match, reuse same object.
       fresh_copy = known_auth_db
@@ -110,6 +110,56 @@ class AuthDBTest(test_case.TestCase):
     self.assertFalse(
         is_member([with_nesting, with_listing], model.Anonymous, 'WithNesting'))
 
+  def test_is_group_member_flattened(self):
+    joe = model.Identity(model.IDENTITY_USER, 'joe@example.com')
+    bot = model.Identity(model.IDENTITY_BOT, 'joe@example.com')
+
+    # A -> B -> C, C includes joe via a glob, B via a listing.
+    group_a = model.AuthGroup(id='A', nested=['B'])
+    group_b = model.AuthGroup(id='B', nested=['C', 'Missing'], members=[bot])
+    group_c = model.AuthGroup(
+        id='C',
+        globs=[
+          model.IdentityGlob(model.IDENTITY_USER, '*@example.com'),
+          model.IdentityGlob(model.IDENTITY_USER, 'x-*'),
+        ])
+    # D includes everyone via the wildcard group.
+    group_d = model.AuthGroup(id='D', nested=[model.GROUP_ALL])
+    db = api.AuthDB(groups=[group_a, group_b, group_c, group_d])
+
+    for group in ('A', 'B', 'C', 'D'):
+      self.assertTrue(db.is_group_member(group, joe), group)
+    for group in ('A', 'B', 'D'):
+      self.assertTrue(db.is_group_member(group, bot), group)
+    self.assertFalse(db.is_group_member('C', bot))
+    self.assertFalse(db.is_group_member('C', model.Anonymous))
+    self.assertTrue(db.is_group_member('D', model.Anonymous))
+    self.assertFalse(db.is_group_member('Missing', joe))
+
+  def test_fetch_groups_with_member(self):
+    joe = model.Identity(model.IDENTITY_USER, 'joe@example.com')
+    groups = [
+      model.AuthGroup(id='Listing', members=[joe]),
+      model.AuthGroup(
+          id='Glob',
+          globs=[model.IdentityGlob(model.IDENTITY_USER, '*@example.com')]),
+      model.AuthGroup(id='NestsListing', nested=['Listing']),
+      model.AuthGroup(id='NestsGlob', nested=['Glob', 'Missing']),
+      model.AuthGroup(id='NestsAll', nested=[model.GROUP_ALL]),
+      model.AuthGroup(id='Other', members=[model.Anonymous]),
+    ]
+    db = api.AuthDB(groups=groups)
+    self.assertEqual(
+        {'Listing', 'Glob', 'NestsListing', 'NestsGlob', 'NestsAll'},
+        db.fetch_groups_with_member(joe))
+    self.assertEqual(
+        {'NestsAll', 'Other'}, db.fetch_groups_with_member(model.Anonymous))
+    # It matches is_group_member() for all the groups.
+    for ident in (joe, model.Anonymous):
+      self.assertEqual(
+          {g.key.id() for g in groups if db.is_group_member(g.key.id(), ident)},
+          db.fetch_groups_with_member(ident))
+
   def test_list_group(self):
     list_group = (lambda groups, group, recursive:
         api.AuthDB(groups=groups).list_group(group, recursive))
@@ -273,6 +323,68 @@ class AuthDBTest(test_case.TestCase):
     self.assertTrue(auth_db.is_allowed_oauth_client_id('web_client_id'))
     self.assertFalse(auth_db.is_allowed_oauth_client_id(''))
 
+  def test_fetch_auth_db_incremental(self):
+    ident_a = model.Identity.from_bytes('user:a@example.com')
+    ident_b = model.Identity.from_bytes('user:b@example.com')
+    for name in ('A', 'B', 'C'):
+      ndb.transaction(lambda: model.bootstrap_group(name, [ident_a]))
+    old = api.fetch_auth_db()
+    self.assertEqual(3, old.auth_db_rev)
+
+    @ndb.transactional
+    def modify():
+      group_b = model.group_key('B').get()
+      group_b.members = [ident_b]
+      group_b.record_revision(modified_by=ident_a)
+      group_b.put()
+      group_c = model.group_key('C').get()
+      group_c.record_deletion(modified_by=ident_a)
+      group_c.key.delete()
+      model.replicate_auth_db()
+    modify()
+    ndb.transaction(
+        lambda: model.bootstrap_ip_whitelist('bots', ['127.0.0.1/32']))
+
+    fetched_groups = []
+    self.mock(
+        model.AuthGroup, '_post_get_hook',
+        classmethod(lambda _cls, key, _future: fetched_groups.append(key.id())))
+
+    auth_db = api.fetch_auth_db(known_auth_db=old)
+    self.assertEqual(5, auth_db.auth_db_rev)
+    # Only changed groups are fetched.
+    self.assertEqual(['B', 'C'], sorted(fetched_groups))
+    self.assertEqual(['A', 'B'], sorted(auth_db.groups))
+    # Unchanged groups are reused as is.
+    self.assertIs(old.groups['A'], auth_db.groups['A'])
+    self.assertTrue(auth_db.is_group_member('B', ident_b))
+    self.assertFalse(auth_db.is_group_member('B', ident_a))
+    self.assertEqual(['bots'], auth_db.ip_whitelists.keys())
+
+  def test_fetch_auth_db_incremental_same_groups(self):
+    ident_a = model.Identity.from_bytes('user:a@example.com')
+    ndb.transaction(lambda: model.bootstrap_group('A', [ident_a]))
+    old = api.fetch_auth_db()
+
+    # Only an IP whitelist changes, the membership index is reused.
+    ndb.transaction(
+        lambda: model.bootstrap_ip_whitelist('bots', ['127.0.0.1/32']))
+    auth_db = api.fetch_auth_db(known_auth_db=old)
+    self.assertEqual(['bots'], auth_db.ip_whitelists.keys())
+    self.assertIs(old._ancestors, auth_db._ancestors)
+    self.assertTrue(auth_db.is_group_member('A', ident_a))
+
+  def test_fetch_auth_db_incremental_no_rev_change(self):
+    ident_a = model.Identity.from_bytes('user:a@example.com')
+    ndb.transaction(lambda: model.bootstrap_group('A', [ident_a]))
+    old = api.fetch_auth_db()
+
+    # Modified without a revision bump, can't be refreshed incrementally.
+    model.AuthGroup(key=model.group_key('B'), members=[ident_a]).put()
+    auth_db = api.fetch_auth_db(known_auth_db=old)
+    self.assertEqual(['A', 'B'], sorted(auth_db.groups))
+    self.assertIsNot(old.groups['A'], auth_db.groups['A'])
+
   def test_get_secret(self):
     # Make AuthDB with two secrets.
     secret = model.AuthSecret.bootstrap('some_secret')
@@ -323,6 +435,18 @@ class AuthDBTest(test_case.TestCase):
       ),
     )
 
+  def test_is_in_ip_whitelist(self):
+    auth_db = self.make_auth_db_with_ip_whitelist()
+    is_in = lambda name, ip: auth_db.is_in_ip_whitelist(
+        name, ipaddr.ip_from_string(ip))
+    self.assertTrue(is_in('bots', '192.168.1.1'))
+    self.assertTrue(is_in('bots', '::1'))
+    self.assertTrue(is_in('bots', '0:0:0:0:0:0:1:1'))
+    self.assertFalse(is_in('bots', '192.168.1.2'))
+    self.assertFalse(is_in('bots', '127.0.0.1'))
+    self.assertTrue(is_in('some ip whitelist', '127.0.0.1'))
+    self.assertFalse(is_in('missing', '127.0.0.1'))
+
   def test_verify_ip_whitelisted_ok(self):
     # Should not raise: IP is whitelisted.
     ident = model.Identity(model.IDENTITY_USER, 'a@example.com')
@@ -370,7 +494,7 @@ class TestAuthDBCache(test_case.TestCase):
 
   def set_fetched_auth_db(self, auth_db):
     """Mocks fetch_auth_db to return |auth_db|."""
-    def mock_fetch_auth_db(known_version=None):
+    def mock_fetch_auth_db(known_version=None, known_auth_db=None):
       if (known_version is not None and
           auth_db.entity_group_version == known_version):
         return None
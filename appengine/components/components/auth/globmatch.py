@@ -20,6 +20,19 @@ def match(s, pat):
   return bool(re.match(_translate(pat), s))
 
 
+def compile_any(pats):
+  """Returns a compiled regexp that matches strings matching any of 'pats'.
+
+  It is faster than calling match() for each pattern when there are many.
+  Returns None if 'pats' is empty.
+  """
+  if not pats:
+    return None
+  if any('\n' in pat for pat in pats):
+    raise ValueError('Multiline patterns are not supported')
+  return re.compile('|'.join('(?:%s)' % _translate(pat) for pat in pats))
+
+
 def _translate(pat):
   """Given a pattern, returns a regexp string for it."""
   out = '^'
@@ -37,6 +37,18 @@ class GlobMatchTest(unittest.TestCase):
     self.assertTrue(globmatch.match('p-abc', 'p-*'))
     self.assertFalse(globmatch.match('not-p-abc', 'p-*'))
 
+  def test_compile_any(self):
+    self.assertIsNone(globmatch.compile_any([]))
+    r = globmatch.compile_any(['*@domain.com', 'p-*', 'abc'])
+    self.assertTrue(r.match('abc@domain.com'))
+    self.assertTrue(r.match('p-abc'))
+    self.assertTrue(r.match('abc'))
+    self.assertFalse(r.match('abcd'))
+    self.assertFalse(r.match('abc@notdomain.com'))
+    self.assertFalse(r.match('not-p-abc'))
+    with self.assertRaises(ValueError):
+      globmatch.compile_any(['a\nb'])
+
 
 if __name__ == '__main__':
   if '-v' in sys.argv:
@@ -16,6 +16,7 @@ __all__ = [
   'normalize_ip',
   'normalize_subnet',
   'Subnet',
+  'SubnetSet',
   'subnet_from_string',
   'subnet_to_string',
 ]
@@ -165,3 +166,32 @@ def normalize_subnet(subnet_str):
 def is_in_subnet(ip, subnet):
   """True if given IP instance belongs to Subnet."""
   return ip.bits == subnet.bits and (ip.value & subnet.mask) == subnet.base
+
+
+class SubnetSet(object):
+  """A set of IPv4 and IPv6 subnets compiled for fast IP lookups.
+
+  It is a prefix trie where each level holds all the subnets with the same
+  prefix length, hashed by their prefix. Checking an IP is one set lookup per
+  distinct prefix length, instead of one is_in_subnet() call per subnet.
+  """
+
+  def __init__(self, subnets=()):
+    # IP bits -> list of (number of ignored bits, frozenset of prefixes).
+    levels = collections.defaultdict(lambda: collections.defaultdict(set))
+    for subnet in subnets:
+      ignored = subnet.bits - bin(subnet.mask).count('1')
+      levels[subnet.bits][ignored].add(subnet.base >> ignored)
+    # Shortest prefixes first, they match the most IPs.
+    self._levels = {
+      bits: [(ignored, frozenset(p)) for ignored, p in sorted(
+          prefixes.iteritems(), reverse=True)]
+      for bits, prefixes in levels.iteritems()
+    }
+
+  def __contains__(self, ip):
+    """True if given IP instance belongs to one of the subnets."""
+    for ignored, prefixes in self._levels.get(ip.bits, ()):
+      if (ip.value >> ignored) in prefixes:
+        return True
+    return False
@@ -201,6 +201,34 @@ class IpAddrTest(test_case.TestCase):
 
     self.assertFalse(call('0:0:0:0:0:0:0:0', '0.0.0.0/32'))
 
+  def test_subnet_set(self):
+    subnets = ipaddr.SubnetSet(
+        ipaddr.subnet_from_string(s) for s in (
+          '127.0.0.1',
+          '192.168.0.0/24',
+          '192.168.0.0/16',
+          '10.1.0.0/31',
+          'ffff:fffe:fffd:fffc:fffb:fffa:fff0:0/112',
+        ))
+    contains = lambda ip: ipaddr.ip_from_string(ip) in subnets
+
+    self.assertTrue(contains('127.0.0.1'))
+    self.assertFalse(contains('127.0.0.2'))
+    self.assertTrue(contains('192.168.0.25'))
+    self.assertTrue(contains('192.168.1.25'))
+    self.assertFalse(contains('192.169.0.25'))
+    self.assertTrue(contains('10.1.0.1'))
+    self.assertFalse(contains('10.1.0.2'))
+    self.assertTrue(contains('ffff:fffe:fffd:fffc:fffb:fffa:fff0:1234'))
+    self.assertFalse(contains('ffff:fffe:fffd:fffc:fffb:fffa:fff1:1234'))
+    # IPv4 and IPv6 are never mixed.
+    self.assertFalse(contains('0:0:0:0:0:0:7f00:1'))
+
+    everything = ipaddr.SubnetSet([ipaddr.subnet_from_string('0.0.0.0/0')])
+    self.assertTrue(ipaddr.ip_from_string('1.2.3.4') in everything)
+    self.assertFalse(ipaddr.ip_from_string('::1') in everything)
+    self.assertFalse(ipaddr.ip_from_string('1.2.3.4') in ipaddr.SubnetSet())
+
 
 if __name__ == '__main__':
   if '-v' in sys.argv:
@@ -177,6 +177,11 @@ def historical_revision_key(auth_db_rev):
   return ndb.Key('Rev', auth_db_rev, parent=root_key())
 
 
+def revision_changes_key(auth_db_rev):
+  """Key of AuthRevisionChanges entity of a concrete revision."""
+  return ndb.Key('AuthRevisionChanges', auth_db_rev, parent=root_key())
+
+
 ################################################################################
 ## Identity & IdentityGlob.
 
@@ -590,6 +595,37 @@ class AuthReplicationState(ndb.Model, datastore_utils.SerializableModelMixin):
   modified_ts = ndb.DateTimeProperty(auto_now_add=True, indexed=False)
 
 
+class AuthRevisionChanges(ndb.Model):
+  """Names of groups and IP whitelists changed by some revision of AuthDB.
+
+  Key is revision_changes_key(<revision>). Written in the transaction that
+  commits the revision, on Primary and Replicas. Used to refresh a cached AuthDB
+  by fetching only the groups and IP whitelists that changed.
+  """
+  # Disable useless in-process per-request cache.
+  _use_cache = False
+
+  # Previous revision of AuthDB. Replicas may skip revisions.
+  prev_auth_db_rev = ndb.IntegerProperty(indexed=False)
+  # Names of groups created, modified or removed by the revision.
+  groups = ndb.StringProperty(repeated=True, indexed=False)
+  # Names of IP whitelists created, modified or removed by the revision.
+  ip_whitelists = ndb.StringProperty(repeated=True, indexed=False)
+
+
+def make_revision_changes(prev_auth_db_rev, auth_db_rev, keys):
+  """Returns AuthRevisionChanges for a revision that touched given keys."""
+  changes = AuthRevisionChanges(
+      key=revision_changes_key(auth_db_rev),
+      prev_auth_db_rev=prev_auth_db_rev)
+  for key in keys:
+    if key.kind() == 'AuthGroup':
+      changes.groups.append(key.id())
+    elif key.kind() == 'AuthIPWhitelist':
+      changes.ip_whitelists.append(key.id())
+  return changes
+
+
 def replicate_auth_db():
   """Increments auth_db_rev, updates historical log, triggers replication.
 
@@ -712,6 +748,10 @@ class _AuthDBTransaction(object):
       c.entity.make_historical_copy(c.deletion, c.comment)
       for c in self.changes
     ]
+    puts.append(make_revision_changes(
+        self.replication_state.auth_db_rev - 1,
+        self.replication_state.auth_db_rev,
+        [c.entity.key for c in self.changes]))
     ndb.put_multi(puts + [self.replication_state])
     for cb in _commit_callbacks:
       cb(self.replication_state.auth_db_rev)
@@ -19,7 +19,7 @@ DESCRIPTOR = _descriptor.FileDescriptor(
   name='replication.proto',
   package='components.auth.proto.replication',
   syntax='proto2',
-  serialized_pb=_b('\n\x11replication.proto\x12!components.auth.proto.replication\"b\n\x11ServiceLinkTicket\x12\x12\n\nprimary_id\x18\x01 \x02(\t\x12\x13\n\x0bprimary_url\x18\x02 \x02(\t\x12\x14\n\x0cgenerated_by\x18\x03 \x02(\t\x12\x0e\n\x06ticket\x18\x04 \x02(\x0c\"O\n\x12ServiceLinkRequest\x12\x0e\n\x06ticket\x18\x01 \x02(\x0c\x12\x13\n\x0breplica_url\x18\x02 \x02(\t\x12\x14\n\x0cinitiated_by\x18\x03 \x02(\t\"\xb0\x01\n\x13ServiceLinkResponse\x12M\n\x06status\x18\x01 \x02(\x0e\x32=.components.auth.proto.replication.ServiceLinkResponse.Status\"J\n\x06Status\x12\x0b\n\x07SUCCESS\x10\x00\x12\x13\n\x0fTRANSPORT_ERROR\x10\x01\x12\x0e\n\nBAD_TICKET\x10\x02\x12\x0e\n\nAUTH_ERROR\x10\x03\"\xc0\x01\n\tAuthGroup\x12\x0c\n\x04name\x18\x01 \x02(\t\x12\x0f\n\x07members\x18\x02 \x03(\t\x12\r\n\x05globs\x18\x03 \x03(\t\x12\x0e\n\x06nested\x18\x04 \x03(\t\x12\x13\n\x0b\x64\x65scription\x18\x05 \x02(\t\x12\x12\n\ncreated_ts\x18\x06 \x02(\x03\x12\x12\n\ncreated_by\x18\x07 \x02(\t\x12\x13\n\x0bmodified_ts\x18\x08 \x02(\x03\x12\x13\n\x0bmodified_by\x18\t \x02(\t\x12\x0e\n\x06owners\x18\n \x01(\t\"\x97\x01\n\x0f\x41uthIPWhitelist\x12\x0c\n\x04name\x18\x01 \x02(\t\x12\x0f\n\x07subnets\x18\x02 \x03(\t\x12\x13\n\x0b\x64\x65scription\x18\x03 \x02(\t\x12\x12\n\ncreated_ts\x18\x04 \x02(\x03\x12\x12\n\ncreated_by\x18\x05 \x02(\t\x12\x13\n\x0bmodified_ts\x18\x06 \x02(\x03\x12\x13\n\x0bmodified_by\x18\x07 \x02(\t\"|\n\x19\x41uthIPWhitelistAssignment\x12\x10\n\x08identity\x18\x01 \x02(\t\x12\x14\n\x0cip_whitelist\x18\x02 \x02(\t\x12\x0f\n\x07\x63omment\x18\x03 \x02(\t\x12\x12\n\ncreated_ts\x18\x04 \x02(\x03\x12\x12\n\ncreated_by\x18\x05 \x02(\t\"\xec\x02\n\x06\x41uthDB\x12\x17\n\x0foauth_client_id\x18\x01 \x02(\t\x12\x1b\n\x13oauth_client_secret\x18\x02 \x02(\t\x12#\n\x1boauth_additional_client_ids\x18\x03 \x03(\t\x12<\n\x06groups\x18\x04 \x03(\x0b\x32,.components.auth.proto.replication.AuthGroup\x12I\n\rip_whitelists\x18\x06 \x03(\x0b\x32\x32.components.auth.proto.replication.AuthIPWhitelist\x12^\n\x18ip_whitelist_assignments\x18\x07 \x03(\x0b\x32<.components.auth.proto.replication.AuthIPWhitelistAssignment\x12\x18\n\x10token_server_url\x18\x08 \x01(\tJ\x04\x08\x05\x10\x06\"N\n\x0e\x41uthDBRevision\x12\x12\n\nprimary_id\x18\x01 \x02(\t\x12\x13\n\x0b\x61uth_db_rev\x18\x02 \x02(\x03\x12\x13\n\x0bmodified_ts\x18\x03 \x02(\x03\"Y\n\x12\x43hangeNotification\x12\x43\n\x08revision\x18\x01 \x01(\x0b\x32\x31.components.auth.proto.replication.AuthDBRevision\"\xb4\x01\n\x16ReplicationPushRequest\x12\x43\n\x08revision\x18\x01 \x01(\x0b\x32\x31.components.auth.proto.replication.AuthDBRevision\x12:\n\x07\x61uth_db\x18\x02 \x01(\x0b\x32).components.auth.proto.replication.AuthDB\x12\x19\n\x11\x61uth_code_version\x18\x03 \x01(\t\"\xe2\x03\n\x17ReplicationPushResponse\x12Q\n\x06status\x18\x01 \x02(\x0e\x32\x41.components.auth.proto.replication.ReplicationPushResponse.Status\x12K\n\x10\x63urrent_revision\x18\x02 \x01(\x0b\x32\x31.components.auth.proto.replication.AuthDBRevision\x12X\n\nerror_code\x18\x03 \x01(\x0e\x32\x44.components.auth.proto.replication.ReplicationPushResponse.ErrorCode\x12\x19\n\x11\x61uth_code_version\x18\x04 \x01(\t\"H\n\x06Status\x12\x0b\n\x07\x41PPLIED\x10\x00\x12\x0b\n\x07SKIPPED\x10\x01\x12\x13\n\x0fTRANSIENT_ERROR\x10\x02\x12\x0f\n\x0b\x46\x41TAL_ERROR\x10\x03\"h\n\tErrorCode\x12\x11\n\rNOT_A_REPLICA\x10\x01\x12\r\n\tFORBIDDEN\x10\x02\x12\x15\n\x11MISSING_SIGNATURE\x10\x03\x12\x11\n\rBAD_SIGNATURE\x10\x04\x12\x0f\n\x0b\x42\x41\x44_REQUEST\x10\x05')
+  serialized_pb=_b('\n\x11replication.proto\x12!components.auth.proto.replication\"b\n\x11ServiceLinkTicket\x12\x12\n\nprimary_id\x18\x01 \x02(\t\x12\x13\n\x0bprimary_url\x18\x02 \x02(\t\x12\x14\n\x0cgenerated_by\x18\x03 \x02(\t\x12\x0e\n\x06ticket\x18\x04 \x02(\x0c\"O\n\x12ServiceLinkRequest\x12\x0e\n\x06ticket\x18\x01 \x02(\x0c\x12\x13\n\x0breplica_url\x18\x02 \x02(\t\x12\x14\n\x0cinitiated_by\x18\x03 \x02(\t\"\xb0\x01\n\x13ServiceLinkResponse\x12M\n\x06status\x18\x01 \x02(\x0e\x32=.components.auth.proto.replication.ServiceLinkResponse.Status\"J\n\x06Status\x12\x0b\n\x07SUCCESS\x10\x00\x12\x13\n\x0fTRANSPORT_ERROR\x10\x01\x12\x0e\n\nBAD_TICKET\x10\x02\x12\x0e\n\nAUTH_ERROR\x10\x03\"\xc0\x01\n\tAuthGroup\x12\x0c\n\x04name\x18\x01 \x02(\t\x12\x0f\n\x07members\x18\x02 \x03(\t\x12\r\n\x05globs\x18\x03 \x03(\t\x12\x0e\n\x06nested\x18\x04 \x03(\t\x12\x13\n\x0b\x64\x65scription\x18\x05 \x02(\t\x12\x12\n\ncreated_ts\x18\x06 \x02(\x03\x12\x12\n\ncreated_by\x18\x07 \x02(\t\x12\x13\n\x0bmodified_ts\x18\x08 \x02(\x03\x12\x13\n\x0bmodified_by\x18\t \x02(\t\x12\x0e\n\x06owners\x18\n \x01(\t\"\x97\x01\n\x0f\x41uthIPWhitelist\x12\x0c\n\x04name\x18\x01 \x02(\t\x12\x0f\n\x07subnets\x18\x02 \x03(\t\x12\x13\n\x0b\x64\x65scription\x18\x03 \x02(\t\x12\x12\n\ncreated_ts\x18\x04 \x02(\x03\x12\x12\n\ncreated_by\x18\x05 \x02(\t\x12\x13\n\x0bmodified_ts\x18\x06 \x02(\x03\x12\x13\n\x0bmodified_by\x18\x07 \x02(\t\"|\n\x19\x41uthIPWhitelistAssignment\x12\x10\n\x08identity\x18\x01 \x02(\t\x12\x14\n\x0cip_whitelist\x18\x02 \x02(\t\x12\x0f\n\x07\x63omment\x18\x03 \x02(\t\x12\x12\n\ncreated_ts\x18\x04 \x02(\x03\x12\x12\n\ncreated_by\x18\x05 \x02(\t\"\xec\x02\n\x06\x41uthDB\x12\x17\n\x0foauth_client_id\x18\x01 \x02(\t\x12\x1b\n\x13oauth_client_secret\x18\x02 \x02(\t\x12#\n\x1boauth_additional_client_ids\x18\x03 \x03(\t\x12<\n\x06groups\x18\x04 \x03(\x0b\x32,.components.auth.proto.replication.AuthGroup\x12I\n\rip_whitelists\x18\x06 \x03(\x0b\x32\x32.components.auth.proto.replication.AuthIPWhitelist\x12^\n\x18ip_whitelist_assignments\x18\x07 \x03(\x0b\x32<.components.auth.proto.replication.AuthIPWhitelistAssignment\x12\x18\n\x10token_server_url\x18\x08 \x01(\tJ\x04\x08\x05\x10\x06\"N\n\x0e\x41uthDBRevision\x12\x12\n\nprimary_id\x18\x01 \x02(\t\x12\x13\n\x0b\x61uth_db_rev\x18\x02 \x02(\x03\x12\x13\n\x0bmodified_ts\x18\x03 \x02(\x03\"Y\n\x12\x43hangeNotification\x12\x43\n\x08revision\x18\x01 \x01(\x0b\x32\x31.components.auth.proto.replication.AuthDBRevision\"\xb4\x01\n\x16ReplicationPushRequest\x12\x43\n\x08revision\x18\x01 \x01(\x0b\x32\x31.components.auth.proto.replication.AuthDBRevision\x12:\n\x07\x61uth_db\x18\x02 \x01(\x0b\x32).components.auth.proto.replication.AuthDB\x12\x19\n\x11\x61uth_code_version\x18\x03 \x01(\t\"\xe2\x03\n\x17ReplicationPushResponse\x12Q\n\x06status\x18\x01 \x02(\x0e\x32\x41.components.auth.proto.replication.ReplicationPushResponse.Status\x12K\n\x10\x63urrent_revision\x18\x02 \x01(\x0b\x32\x31.components.auth.proto.replication.AuthDBRevision\x12X\n\nerror_code\x18\x03 \x01(\x0e\x32\x44.components.auth.proto.replication.ReplicationPushResponse.ErrorCode\x12\x19\n\x11\x61uth_code_version\x18\x04 \x01(\t\"H\n\x06Status\x12\x0b\n\x07\x41PPLIED\x10\x00\x12\x0b\n\x07SKIPPED\x10\x01\x12\x13\n\x0fTRANSIENT_ERROR\x10\x02\x12\x0f\n\x0b\x46\x41TAL_ERROR\x10\x03\"h\n\tErrorCode\x12\x11\n\rNOT_A_REPLICA\x10\x01\x12\r\n\tFORBIDDEN\x10\x02\x12\x15\n\x11MISSING_SIGNATURE\x10\x03\x12\x11\n\rBAD_SIGNATURE\x10\x04\x12\x0f\n\x0b\x42\x41\x44_REQUEST\x10\x05\"\x80\x01\n\x0b\x41uthDBDelta\x12:\n\x07\x63hanged\x18\x01 \x01(\x0b\x32).components.auth.proto.replication.AuthDB\x12\x16\n\x0eremoved_groups\x18\x02 \x03(\t\x12\x1d\n\x15removed_ip_whitelists\x18\x03 \x03(\t\"\xd6\x01\n\x1bReplicationDeltaPushRequest\x12\x43\n\x08revision\x18\x01 \x01(\x0b\x32\x31.components.auth.proto.replication.AuthDBRevision\x12\x18\n\x10\x62\x61se_auth_db_rev\x18\x02 \x01(\x03\x12=\n\x05\x64\x65lta\x18\x03 \x01(\x0b\x32..components.auth.proto.replication.AuthDBDelta\x12\x19\n\x11\x61uth_code_version\x18\x04 \x01(\t')
 )
 _sym_db.RegisterFileDescriptor(DESCRIPTOR)
 
@@ -722,6 +722,103 @@ _REPLICATIONPUSHRESPONSE = _descriptor.Descriptor(
   serialized_end=2095,
 )
 
+
+_AUTHDBDELTA = _descriptor.Descriptor(
+  name='AuthDBDelta',
+  full_name='components.auth.proto.replication.AuthDBDelta',
+  filename=None,
+  file=DESCRIPTOR,
+  containing_type=None,
+  fields=[
+    _descriptor.FieldDescriptor(
+      name='changed', full_name='components.auth.proto.replication.AuthDBDelta.changed', index=0,
+      number=1, type=11, cpp_type=10, label=1,
+      has_default_value=False, default_value=None,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+    _descriptor.FieldDescriptor(
+      name='removed_groups', full_name='components.auth.proto.replication.AuthDBDelta.removed_groups', index=1,
+      number=2, type=9, cpp_type=9, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+    _descriptor.FieldDescriptor(
+      name='removed_ip_whitelists', full_name='components.auth.proto.replication.AuthDBDelta.removed_ip_whitelists', index=2,
+      number=3, type=9, cpp_type=9, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+  ],
+  extensions=[
+  ],
+  nested_types=[],
+  enum_types=[
+  ],
+  options=None,
+  is_extendable=False,
+  syntax='proto2',
+  extension_ranges=[],
+  oneofs=[
+  ],
+  serialized_start=2098,
+  serialized_end=2226,
+)
+
+
+_REPLICATIONDELTAPUSHREQUEST = _descriptor.Descriptor(
+  name='ReplicationDeltaPushRequest',
+  full_name='components.auth.proto.replication.ReplicationDeltaPushRequest',
+  filename=None,
+  file=DESCRIPTOR,
+  containing_type=None,
+  fields=[
+    _descriptor.FieldDescriptor(
+      name='revision', full_name='components.auth.proto.replication.ReplicationDeltaPushRequest.revision', index=0,
+      number=1, type=11, cpp_type=10, label=1,
+      has_default_value=False, default_value=None,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+    _descriptor.FieldDescriptor(
+      name='base_auth_db_rev', full_name='components.auth.proto.replication.ReplicationDeltaPushRequest.base_auth_db_rev', index=1,
+      number=2, type=3, cpp_type=2, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+    _descriptor.FieldDescriptor(
+      name='delta', full_name='components.auth.proto.replication.ReplicationDeltaPushRequest.delta', index=2,
+      number=3, type=11, cpp_type=10, label=1,
+      has_default_value=False, default_value=None,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+    _descriptor.FieldDescriptor(
+      name='auth_code_version', full_name='components.auth.proto.replication.ReplicationDeltaPushRequest.auth_code_version', index=3,
+      number=4, type=9, cpp_type=9, label=1,
+      has_default_value=False, default_value=_b("").decode('utf-8'),
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+  ],
+  extensions=[
+  ],
+  nested_types=[],
+  enum_types=[
+  ],
+  options=None,
+  is_extendable=False,
+  syntax='proto2',
+  extension_ranges=[],
+  oneofs=[
+  ],
+  serialized_start=2229,
+  serialized_end=2443,
+)
+
 _SERVICELINKRESPONSE.fields_by_name['status'].enum_type = _SERVICELINKRESPONSE_STATUS
 _SERVICELINKRESPONSE_STATUS.containing_type = _SERVICELINKRESPONSE
 _AUTHDB.fields_by_name['groups'].message_type = _AUTHGROUP
@@ -735,6 +832,9 @@ _REPLICATIONPUSHRESPONSE.fields_by_name['current_revision'].message_type = _AUTH
 _REPLICATIONPUSHRESPONSE.fields_by_name['error_code'].enum_type = _REPLICATIONPUSHRESPONSE_ERRORCODE
 _REPLICATIONPUSHRESPONSE_STATUS.containing_type = _REPLICATIONPUSHRESPONSE
 _REPLICATIONPUSHRESPONSE_ERRORCODE.containing_type = _REPLICATIONPUSHRESPONSE
+_AUTHDBDELTA.fields_by_name['changed'].message_type = _AUTHDB
+_REPLICATIONDELTAPUSHREQUEST.fields_by_name['revision'].message_type = _AUTHDBREVISION
+_REPLICATIONDELTAPUSHREQUEST.fields_by_name['delta'].message_type = _AUTHDBDELTA
 DESCRIPTOR.message_types_by_name['ServiceLinkTicket'] = _SERVICELINKTICKET
 DESCRIPTOR.message_types_by_name['ServiceLinkRequest'] = _SERVICELINKREQUEST
 DESCRIPTOR.message_types_by_name['ServiceLinkResponse'] = _SERVICELINKRESPONSE
@@ -746,6 +846,8 @@ DESCRIPTOR.message_types_by_name['AuthDBRevision'] = _AUTHDBREVISION
 DESCRIPTOR.message_types_by_name['ChangeNotification'] = _CHANGENOTIFICATION
 DESCRIPTOR.message_types_by_name['ReplicationPushRequest'] = _REPLICATIONPUSHREQUEST
 DESCRIPTOR.message_types_by_name['ReplicationPushResponse'] = _REPLICATIONPUSHRESPONSE
+DESCRIPTOR.message_types_by_name['AuthDBDelta'] = _AUTHDBDELTA
+DESCRIPTOR.message_types_by_name['ReplicationDeltaPushRequest'] = _REPLICATIONDELTAPUSHREQUEST
 
 ServiceLinkTicket = _reflection.GeneratedProtocolMessageType('ServiceLinkTicket', (_message.Message,), dict(
   DESCRIPTOR = _SERVICELINKTICKET,
@@ -824,5 +926,19 @@ ReplicationPushResponse = _reflection.GeneratedProtocolMessageType('ReplicationP
   ))
 _sym_db.RegisterMessage(ReplicationPushResponse)
 
+AuthDBDelta = _reflection.GeneratedProtocolMessageType('AuthDBDelta', (_message.Message,), dict(
+  DESCRIPTOR = _AUTHDBDELTA,
+  __module__ = 'replication_pb2'
+  # @@protoc_insertion_point(class_scope:components.auth.proto.replication.AuthDBDelta)
+  ))
+_sym_db.RegisterMessage(AuthDBDelta)
+
+ReplicationDeltaPushRequest = _reflection.GeneratedProtocolMessageType('ReplicationDeltaPushRequest', (_message.Message,), dict(
+  DESCRIPTOR = _REPLICATIONDELTAPUSHREQUEST,
+  __module__ = 'replication_pb2'
+  # @@protoc_insertion_point(class_scope:components.auth.proto.replication.ReplicationDeltaPushRequest)
+  ))
+_sym_db.RegisterMessage(ReplicationDeltaPushRequest)
+
 
 # @@protoc_insertion_point(module_scope)
@@ -272,6 +272,32 @@ def get_deleted_keys(new_entity_list, old_entity_list):
   return [old.key for old in old_entity_list if old.key not in new_by_key]
 
 
+def auth_db_snapshot_delta_to_proto(new_snapshot, old_snapshot):
+  """Returns replication_pb2.AuthDBDelta that turns |old_snapshot| into new one.
+
+  Global config and IP whitelist assignments are always included in full, since
+  they are small. Groups and IP whitelists are included only if they were added
+  or modified.
+  """
+  delta = replication_pb2.AuthDBDelta()
+  auth_db_snapshot_to_proto(
+      AuthDBSnapshot(
+          new_snapshot.global_config,
+          get_changed_entities(new_snapshot.groups, old_snapshot.groups),
+          get_changed_entities(
+              new_snapshot.ip_whitelists, old_snapshot.ip_whitelists),
+          new_snapshot.ip_whitelist_assignments),
+      delta.changed)
+  delta.removed_groups.extend(
+      key.id()
+      for key in get_deleted_keys(new_snapshot.groups, old_snapshot.groups))
+  delta.removed_ip_whitelists.extend(
+      key.id()
+      for key in get_deleted_keys(
+          new_snapshot.ip_whitelists, old_snapshot.ip_whitelists))
+  return delta
+
+
 def replace_auth_db(auth_db_rev, modified_ts, snapshot):
   """Replaces AuthDB in datastore if it's older than |auth_db_rev|.
 
@@ -314,35 +340,49 @@ def replace_auth_db(auth_db_rev, modified_ts, snapshot):
   keys_to_delete.extend(
       get_deleted_keys(snapshot.ip_whitelists, current.ip_whitelists))
 
-  @ndb.transactional
-  def update_auth_db():
-    # AuthDB changed since 'new_auth_db_snapshot' transaction? Back off.
-    state = model.get_replication_state()
-    if state.auth_db_rev != current_state.auth_db_rev:
-      return False, state
+  # Do the transactional update.
+  return _update_auth_db(
+      current_state.auth_db_rev, auth_db_rev, modified_ts,
+      entites_to_put, keys_to_delete)
+
+
+@ndb.transactional
+def _update_auth_db(
+    base_auth_db_rev, auth_db_rev, modified_ts, entites_to_put, keys_to_delete):
+  """Transactionally moves AuthDB from |base_auth_db_rev| to |auth_db_rev|.
+
+  Returns:
+    Tuple (True if update was applied, current AuthReplicationState value).
+  """
+  # AuthDB changed since the caller looked at it? Back off.
+  state = model.get_replication_state()
+  if state.auth_db_rev != base_auth_db_rev:
+    return False, state
 
-    # Update auth_db_rev in AuthReplicationState.
-    state.auth_db_rev = auth_db_rev
-    state.modified_ts = modified_ts
+  # Update auth_db_rev in AuthReplicationState.
+  state.auth_db_rev = auth_db_rev
+  state.modified_ts = modified_ts
 
-    # Apply changes.
-    futures = []
-    futures.extend(ndb.put_multi_async([state] + entites_to_put))
-    futures.extend(ndb.delete_multi_async(keys_to_delete))
+  # Record what changed, to allow cheap refresh of cached AuthDB copies.
+  changes = model.make_revision_changes(
+      base_auth_db_rev, auth_db_rev,
+      [e.key for e in entites_to_put] + keys_to_delete)
 
-    # Wait for all pending futures to complete. Aborting the transaction with
-    # outstanding futures is a bad idea (ndb complains in log about that).
-    ndb.Future.wait_all(futures)
+  # Apply changes.
+  futures = []
+  futures.extend(ndb.put_multi_async([state, changes] + entites_to_put))
+  futures.extend(ndb.delete_multi_async(keys_to_delete))
 
-    # Raise an exception, if any.
-    for future in futures:
-      future.check_success()
+  # Wait for all pending futures to complete. Aborting the transaction with
+  # outstanding futures is a bad idea (ndb complains in log about that).
+  ndb.Future.wait_all(futures)
 
-    # Success.
-    return True, state
+  # Raise an exception, if any.
+  for future in futures:
+    future.check_success()
 
-  # Do the transactional update.
-  return update_auth_db()
+  # Success.
+  return True, state
 
 
 def is_signed_by_primary(blob, key_name, sig):
@@ -392,3 +432,45 @@ def push_auth_db(revision, auth_db):
 
     # Need to retry. Try until success or deadline.
     assert current_state.auth_db_rev < revision.auth_db_rev
+
+
+def push_auth_db_delta(revision, base_auth_db_rev, delta):
+  """Accepts AuthDB delta push from Primary and applies it to replica.
+
+  The delta is applied only if replica is at |base_auth_db_rev| revision,
+  otherwise the push is skipped and Primary is expected to push an entire
+  AuthDB instead.
+
+  Args:
+    revision: replication_pb2.AuthDBRevision describing revision of pushed DB.
+    base_auth_db_rev: revision the delta is based on.
+    delta: replication_pb2.AuthDBDelta with changes since |base_auth_db_rev|.
+
+  Returns:
+    Tuple (True if update was applied, stored or updated AuthReplicationState).
+  """
+  assert model.is_replica()
+
+  # Not at the base revision? Primary will fall back to a full push.
+  state = model.get_replication_state()
+  if (state.primary_id != revision.primary_id or
+      state.auth_db_rev != base_auth_db_rev or
+      revision.auth_db_rev <= base_auth_db_rev):
+    return False, state
+
+  changed = proto_to_auth_db_snapshot(delta.changed)
+  entites_to_put = [changed.global_config, changed.ip_whitelist_assignments]
+  entites_to_put.extend(changed.groups)
+  entites_to_put.extend(changed.ip_whitelists)
+  keys_to_delete = [model.group_key(name) for name in delta.removed_groups]
+  keys_to_delete.extend(
+      model.ip_whitelist_key(name) for name in delta.removed_ip_whitelists)
+
+  # Unlike 'push_auth_db' do not retry: if some other task moved AuthDB from
+  # the base revision in the meantime, the delta is no longer applicable.
+  return _update_auth_db(
+      base_auth_db_rev,
+      revision.auth_db_rev,
+      utils.timestamp_to_datetime(revision.modified_ts),
+      entites_to_put,
+      keys_to_delete)
@@ -15,6 +15,7 @@ from google.appengine.ext import ndb
 from components import utils
 from components.auth import model
 from components.auth import replication
+from components.auth.proto import replication_pb2
 from test_support import test_case
 
 
@@ -577,6 +578,126 @@ class ReplaceAuthDbTest(test_case.TestCase):
     self.assertEqual(expected_state, state.to_dict())
 
 
+class PushAuthDbDeltaTest(test_case.TestCase):
+  """Tests for auth_db_snapshot_delta_to_proto and push_auth_db_delta."""
+
+  @staticmethod
+  def configure_as_replica(auth_db_rev):
+    model.AuthReplicationState(
+        key=model.replication_state_key(),
+        primary_id='primary',
+        primary_url='https://primary',
+        auth_db_rev=auth_db_rev,
+        modified_ts=datetime.datetime(2000, 1, 1, 1, 1, 1)).put()
+
+  @staticmethod
+  def make_group(name, members):
+    return model.AuthGroup(
+        key=model.group_key(name),
+        members=[model.Identity.from_bytes(m) for m in members],
+        created_ts=datetime.datetime(2014, 1, 1, 1, 1, 1),
+        created_by=model.Identity.from_bytes('user:creator@example.com'),
+        modified_ts=datetime.datetime(2014, 1, 1, 1, 1, 1),
+        modified_by=model.Identity.from_bytes('user:modifier@example.com'))
+
+  @staticmethod
+  def make_ip_whitelist(name):
+    return model.AuthIPWhitelist(
+        key=model.ip_whitelist_key(name),
+        subnets=['127.0.0.1/32'],
+        created_ts=datetime.datetime(2014, 1, 1, 1, 1, 1),
+        created_by=model.Identity.from_bytes('user:creator@example.com'),
+        modified_ts=datetime.datetime(2014, 1, 1, 1, 1, 1),
+        modified_by=model.Identity.from_bytes('user:modifier@example.com'))
+
+  @staticmethod
+  def make_revision(auth_db_rev):
+    return replication_pb2.AuthDBRevision(
+        primary_id='primary',
+        auth_db_rev=auth_db_rev,
+        modified_ts=utils.datetime_to_timestamp(
+            datetime.datetime(2014, 1, 1, 1, 1, 1)))
+
+  def make_snapshots(self):
+    old = make_snapshot_obj(
+        groups=[
+          self.make_group('keep', ['user:a@example.com']),
+          self.make_group('modify', ['user:a@example.com']),
+          self.make_group('remove', ['user:a@example.com']),
+        ],
+        ip_whitelists=[self.make_ip_whitelist('remove')])
+    new = make_snapshot_obj(
+        global_config=model.AuthGlobalConfig(
+            key=model.root_key(), oauth_client_id='new-client-id'),
+        groups=[
+          self.make_group('keep', ['user:a@example.com']),
+          self.make_group('modify', ['user:b@example.com']),
+          self.make_group('new', ['user:c@example.com']),
+        ])
+    return old, new
+
+  def test_delta_to_proto(self):
+    old, new = self.make_snapshots()
+    delta = replication.auth_db_snapshot_delta_to_proto(new, old)
+    self.assertEqual('new-client-id', delta.changed.oauth_client_id)
+    self.assertEqual(
+        ['modify', 'new'], [g.name for g in delta.changed.groups])
+    self.assertEqual(['remove'], list(delta.removed_groups))
+    self.assertEqual([], list(delta.changed.ip_whitelists))
+    self.assertEqual(['remove'], list(delta.removed_ip_whitelists))
+
+  def test_applies_delta(self):
+    old, new = self.make_snapshots()
+    self.configure_as_replica(1)
+    ndb.put_multi(
+        [old.global_config, old.ip_whitelist_assignments] +
+        old.groups + old.ip_whitelists)
+
+    applied, state = replication.push_auth_db_delta(
+        self.make_revision(2), 1,
+        replication.auth_db_snapshot_delta_to_proto(new, old))
+    self.assertTrue(applied)
+    self.assertEqual(2, state.auth_db_rev)
+
+    _, current = replication.new_auth_db_snapshot()
+    self.assertEqual(2, model.get_replication_state().auth_db_rev)
+    self.assertEqual('new-client-id', current.global_config.oauth_client_id)
+    self.assertEqual(
+        {
+          'keep': [model.Identity.from_bytes('user:a@example.com')],
+          'modify': [model.Identity.from_bytes('user:b@example.com')],
+          'new': [model.Identity.from_bytes('user:c@example.com')],
+        },
+        {g.key.id(): g.members for g in current.groups})
+    self.assertEqual([], current.ip_whitelists)
+
+    # Changes are recorded for incremental refresh of cached AuthDB.
+    changes = model.revision_changes_key(2).get()
+    self.assertEqual(1, changes.prev_auth_db_rev)
+    self.assertEqual(['modify', 'new', 'remove'], sorted(changes.groups))
+    self.assertEqual(['remove'], changes.ip_whitelists)
+
+  def test_skips_if_not_at_base_rev(self):
+    old, new = self.make_snapshots()
+    self.configure_as_replica(3)
+    applied, state = replication.push_auth_db_delta(
+        self.make_revision(4), 1,
+        replication.auth_db_snapshot_delta_to_proto(new, old))
+    self.assertFalse(applied)
+    self.assertEqual(3, state.auth_db_rev)
+    self.assertEqual([], model.AuthGroup.query().fetch())
+
+  def test_skips_other_primary(self):
+    old, new = self.make_snapshots()
+    self.configure_as_replica(1)
+    revision = self.make_revision(2)
+    revision.primary_id = 'another-primary'
+    applied, state = replication.push_auth_db_delta(
+        revision, 1, replication.auth_db_snapshot_delta_to_proto(new, old))
+    self.assertFalse(applied)
+    self.assertEqual(1, state.auth_db_rev)
+
+
 if __name__ == '__main__':
   if '-v' in sys.argv:
     unittest.TestCase.maxDiff = None
@@ -48,6 +48,8 @@ def get_rest_api_routes():
     webapp2.Route('/auth/api/v1/groups', GroupsHandler),
     webapp2.Route('/auth/api/v1/groups/<name:%s>' % group_re, GroupHandler),
     webapp2.Route('/auth/api/v1/internal/replication', ReplicationHandler),
+    webapp2.Route(
+        '/auth/api/v1/internal/replication_delta', ReplicationDeltaHandler),
     webapp2.Route('/auth/api/v1/ip_whitelists', IPWhitelistsHandler),
     webapp2.Route(
         '/auth/api/v1/ip_whitelists/<name:%s>' % ip_whitelist_re,
@@ -829,21 +831,12 @@ class ReplicationHandler(handler.AuthenticatingHandler):
       self.send_error(replication_pb2.ReplicationPushResponse.BAD_SIGNATURE)
       return
 
-    # Deserialize the request, check it is valid.
-    request = replication_pb2.ReplicationPushRequest.FromString(body)
-    if not request.HasField('revision') or not request.HasField('auth_db'):
+    # Deserialize and apply the request.
+    result = self.apply_push(body)
+    if result is None:
       self.send_error(replication_pb2.ReplicationPushResponse.BAD_REQUEST)
       return
-
-    # Handle it.
-    logging.info('Received AuthDB push: rev %d', request.revision.auth_db_rev)
-    if request.HasField('auth_code_version'):
-      logging.info(
-          'Primary\'s auth component version: %s', request.auth_code_version)
-    applied, state = replication.push_auth_db(request.revision, request.auth_db)
-    logging.info(
-        'AuthDB push %s: rev is %d',
-        'applied' if applied else 'skipped', state.auth_db_rev)
+    applied, state = result
 
     # Send the response.
     response = replication_pb2.ReplicationPushResponse()
@@ -858,6 +851,50 @@ class ReplicationHandler(handler.AuthenticatingHandler):
     response.auth_code_version = version.__version__
     self.send_response(response)
 
+  def apply_push(self, body):
+    """Applies serialized ReplicationPushRequest.
+
+    Returns:
+      Tuple (True if update was applied, current AuthReplicationState) or None
+      if the request is not valid.
+    """
+    request = replication_pb2.ReplicationPushRequest.FromString(body)
+    if not request.HasField('revision') or not request.HasField('auth_db'):
+      return None
+    logging.info('Received AuthDB push: rev %d', request.revision.auth_db_rev)
+    if request.HasField('auth_code_version'):
+      logging.info(
+          'Primary\'s auth component version: %s', request.auth_code_version)
+    applied, state = replication.push_auth_db(request.revision, request.auth_db)
+    logging.info(
+        'AuthDB push %s: rev is %d',
+        'applied' if applied else 'skipped', state.auth_db_rev)
+    return applied, state
+
+
+class ReplicationDeltaHandler(ReplicationHandler):
+  """Accepts AuthDB delta push from Primary."""
+
+  def apply_push(self, body):
+    """Applies serialized ReplicationDeltaPushRequest."""
+    request = replication_pb2.ReplicationDeltaPushRequest.FromString(body)
+    if (not request.HasField('revision') or
+        not request.HasField('base_auth_db_rev') or
+        not request.HasField('delta')):
+      return None
+    logging.info(
+        'Received AuthDB delta push: rev %d -> %d',
+        request.base_auth_db_rev, request.revision.auth_db_rev)
+    if request.HasField('auth_code_version'):
+      logging.info(
+          'Primary\'s auth component version: %s', request.auth_code_version)
+    applied, state = replication.push_auth_db_delta(
+        request.revision, request.base_auth_db_rev, request.delta)
+    logging.info(
+        'AuthDB delta push %s: rev is %d',
+        'applied' if applied else 'skipped', state.auth_db_rev)
+    return applied, state
+
 
 class IPWhitelistsHandler(handler.ApiHandler):
   """Lists all IP whitelists.
@@ -2,8 +2,10 @@
 # Use of this source code is governed under the Apache License, Version 2.0
 # that can be found in the LICENSE file.
 
+import collections
 import logging
 import re
+import threading
 
 from google.appengine.api import app_identity
 from google.appengine.api import lib_config
@@ -103,6 +105,44 @@ def _convert_config(content, dest_type):
   return msg
 
 
+# Maximum number of parsed config messages kept in memory by each process.
+PARSED_CONFIG_CACHE_SIZE = 100
+
+# (content_hash, dest_type) -> parsed message, the most recently used last.
+_parsed_config_cache = collections.OrderedDict()
+_parsed_config_cache_lock = threading.Lock()
+
+
+def _get_cached_config(content_hash, dest_type):
+  """Returns a copy of a parsed config message or None if it is not cached."""
+  if (not content_hash or dest_type is None or
+      not issubclass(dest_type, protobuf.message.Message)):
+    return None
+  key = (content_hash, dest_type)
+  with _parsed_config_cache_lock:
+    msg = _parsed_config_cache.pop(key, None)
+    if msg is None:
+      return None
+    _parsed_config_cache[key] = msg
+  # Callers may modify the returned message.
+  copy = dest_type()
+  copy.CopyFrom(msg)
+  return copy
+
+
+def _cache_config(content_hash, msg):
+  """Remembers a parsed config message, evicting the least recently used."""
+  if not content_hash or not isinstance(msg, protobuf.message.Message):
+    return
+  copy = type(msg)()
+  copy.CopyFrom(msg)
+  with _parsed_config_cache_lock:
+    _parsed_config_cache.pop((content_hash, type(msg)), None)
+    _parsed_config_cache[(content_hash, type(msg))] = copy
+    while len(_parsed_config_cache) > PARSED_CONFIG_CACHE_SIZE:
+      _parsed_config_cache.popitem(last=False)
+
+
 ################################################################################
 # Rest
 
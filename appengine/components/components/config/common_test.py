@@ -3,6 +3,7 @@
 # Use of this source code is governed under the Apache License, Version 2.0
 # that can be found in the LICENSE file.
 
+import collections
 import logging
 import sys
 import unittest
@@ -23,6 +24,31 @@ class CommonCase(test_case.TestCase):
   def test_convert_empty(self):
     self.assertIsNotNone(common._convert_config('', test_config_pb2.Config))
 
+  def test_parsed_config_cache(self):
+    self.mock(common, '_parsed_config_cache', collections.OrderedDict())
+    self.mock(common, 'PARSED_CONFIG_CACHE_SIZE', 2)
+    Config = test_config_pb2.Config
+    self.assertIsNone(common._get_cached_config('a', Config))
+    self.assertIsNone(common._get_cached_config('a', None))
+
+    msg = Config(param='a')
+    common._cache_config('a', msg)
+    common._cache_config('b', Config(param='b'))
+    common._cache_config('c', 'not a message')
+
+    # Returned and cached messages are copies.
+    cached = common._get_cached_config('a', Config)
+    self.assertEqual(cached, msg)
+    cached.param = 'changed'
+    msg.param = 'changed'
+    self.assertEqual(common._get_cached_config('a', Config).param, 'a')
+
+    # 'b' is the least recently used.
+    common._cache_config('d', Config(param='d'))
+    self.assertIsNone(common._get_cached_config('b', Config))
+    self.assertEqual(common._get_cached_config('a', Config).param, 'a')
+    self.assertEqual(common._get_cached_config('d', Config).param, 'd')
+
   def test_trim_app_id(self):
     trimmed_app_id = 'gce-backend'
     app_id_external = trimmed_app_id
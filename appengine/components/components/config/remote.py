@@ -5,8 +5,10 @@
 """remote.Provider reads configs from a remote config service."""
 
 import base64
+import collections
 import datetime
 import logging
+import threading
 import urllib
 
 # Config component is using google.protobuf package, it requires some python
@@ -29,6 +31,23 @@ MEMCACHE_PREFIX = 'components.config/v1/'
 CONFIG_MAX_TIME_SINCE_LAST_ACCESS = datetime.timedelta(days=7)
 # Update LastGoodConfig.last_access_ts if it will be deleted next day.
 UPDATE_LAST_ACCESS_TIME_FREQUENCY = datetime.timedelta(days=1)
+# Maximum number of configs in a configs/changed request, the limit of the
+# config service.
+CHANGED_CONFIGS_BATCH_SIZE = 1000
+# Parsed last good configs are served from the process cache without reading
+# the datastore for this long, then they are reloaded in the background.
+LAST_GOOD_CACHE_REFRESH_INTERVAL = datetime.timedelta(seconds=30)
+# A refresh that did not finish in this time is started again.
+LAST_GOOD_CACHE_REFRESH_TIMEOUT = datetime.timedelta(seconds=30)
+
+
+# Process cache of last good configs:
+# (config_set, path, dest_type) -> _LastGoodCacheEntry.
+_LastGoodCacheEntry = collections.namedtuple(
+    '_LastGoodCacheEntry',
+    ['revision', 'content_hash', 'config', 'loaded_ts', 'refresh_ts'])
+_last_good_cache = {}
+_last_good_cache_lock = threading.Lock()
 
 
 class LastGoodConfig(ndb.Model):
@@ -144,12 +163,63 @@ class Provider(object):
 
     revision, content_hash = yield self.get_config_hash_async(
         config_set, path, revision=revision)
-    content = None
-    if content_hash:
-      content = yield self.get_config_by_hash_async(content_hash)
-    config = common._convert_config(content, dest_type)
+    config = common._get_cached_config(content_hash, dest_type)
+    if config is None:
+      content = None
+      if content_hash:
+        content = yield self.get_config_by_hash_async(content_hash)
+      config = common._convert_config(content, dest_type)
+      common._cache_config(content_hash, config)
     raise ndb.Return(revision, config)
 
+  @ndb.tasklet
+  def get_changed_configs_async(self, known):
+    """Fetches configs that changed since known revisions in batch requests.
+
+    Sends one request per CHANGED_CONFIGS_BATCH_SIZE configs, in parallel.
+
+    Args:
+      known: a dict {(config_set, path): (revision, content_hash)} of configs
+        the caller has. Revision and content hash may be None.
+
+    Returns:
+      {(config_set, path): (revision, content_hash, content)} dict of configs
+      whose latest revision differs from the known one. Revision and content
+      hash are None if a config does not exist. Content is None if the content
+      hash did not change.
+      None if the config service does not support batch requests.
+    """
+    if not known:
+      raise ndb.Return({})
+    configs = [
+      {
+        'config_set': config_set,
+        'path': path,
+        'known_revision': revision,
+        'known_content_hash': content_hash,
+      }
+      for (config_set, path), (revision, content_hash)
+      in sorted(known.iteritems())
+    ]
+    responses = yield [
+      self._api_call_async(
+          'configs/changed',
+          method='POST',
+          payload={'configs': configs[i:i + CHANGED_CONFIGS_BATCH_SIZE]})
+      for i in xrange(0, len(configs), CHANGED_CONFIGS_BATCH_SIZE)
+    ]
+    if any(res is None for res in responses):
+      raise ndb.Return(None)
+    changed = {}
+    for res in responses:
+      for cfg in res.get('configs', []):
+        content = cfg.get('content')
+        if content is not None:
+          content = base64.b64decode(content)
+        changed[(cfg['config_set'], cfg['path'])] = (
+            cfg.get('revision'), cfg.get('content_hash'), content)
+    raise ndb.Return(changed)
+
   @ndb.tasklet
   def _get_configs_multi(self, url_path):
     """Returns a map config_set -> (revision, content)."""
@@ -218,7 +288,38 @@ class Provider(object):
     raise ndb.Return(None)
 
   @ndb.tasklet
-  def _update_last_good_config_async(self, config_key):
+  def _update_last_good_configs_async(self):
+    """Updates all LastGoodConfig entities.
+
+    Fetches changed configs in one batch request if the config service
+    supports it, otherwise checks each config separately.
+    """
+    configs = yield LastGoodConfig.query().fetch_async()
+    known = {
+      tuple(c.key.id().split(':', 1)): (c.revision, c.content_hash)
+      for c in configs
+    }
+    changed = yield self.get_changed_configs_async(known)
+    futures = []
+    for c in configs:
+      latest = None
+      if changed is not None:
+        config_set, path = c.key.id().split(':', 1)
+        # Configs absent in the response did not change.
+        latest = changed.get(
+            (config_set, path), (c.revision, c.content_hash, None))
+      futures.append(self._update_last_good_config_async(c.key, latest))
+    yield futures
+
+  @ndb.tasklet
+  def _update_last_good_config_async(self, config_key, latest=None):
+    """Updates a LastGoodConfig entity.
+
+    Args:
+      config_key: LastGoodConfig key.
+      latest: (revision, content_hash, content) tuple of the latest config, if
+        already known. Content may be None, then it is fetched if needed.
+    """
     now = utils.utcnow()
     current = yield config_key.get_async()
     earliest_access_ts = now - CONFIG_MAX_TIME_SINCE_LAST_ACCESS
@@ -228,8 +329,12 @@ class Provider(object):
       return
 
     config_set, path = config_key.id().split(':', 1)
-    revision, content_hash = yield self.get_config_hash_async(
-        config_set, path, use_memcache=False)
+    fetched_content = None
+    if latest:
+      revision, content_hash, fetched_content = latest
+    else:
+      revision, content_hash = yield self.get_config_hash_async(
+          config_set, path, use_memcache=False)
     if not revision:
       logging.warning(
           'Could not fetch hash of latest %s', config_key.id())
@@ -243,7 +348,9 @@ class Provider(object):
 
     content = None
     if current.content_hash != content_hash:
-      content = yield self.get_config_by_hash_async(content_hash)
+      content = fetched_content
+      if content is None:
+        content = yield self.get_config_by_hash_async(content_hash)
       if content is None:
         logging.warning(
             'Could not fetch config content %s by hash %s',
@@ -289,6 +396,7 @@ class Provider(object):
           'Updated last good config %s to %s',
           config_key.id(), revision)
     yield update()
+    _invalidate_last_good_cache(config_set, path)
 
 
 def _content_to_binary(proto_message_name, content):
@@ -303,9 +411,68 @@ def _content_to_binary(proto_message_name, content):
   return common._convert_config(content, dest_type).SerializeToString()
 
 
+def _copy_config(cfg):
+  """Returns a copy of a config message, so that callers can modify it."""
+  if not isinstance(cfg, protobuf.message.Message):
+    return cfg
+  copy = type(cfg)()
+  copy.CopyFrom(cfg)
+  return copy
+
+
+def _invalidate_last_good_cache(config_set, path):
+  with _last_good_cache_lock:
+    for key in _last_good_cache.keys():
+      if key[:2] == (config_set, path):
+        del _last_good_cache[key]
+
+
 @ndb.tasklet
 def _get_last_good_async(config_set, path, dest_type):
-  """Returns last good (rev, config) and updates last_access_ts if needed."""
+  """Returns last good (rev, config) from the process cache or the datastore.
+
+  Only the first request for a config in a process waits for the datastore.
+  Afterwards the cached config is returned right away. If it was loaded more
+  than LAST_GOOD_CACHE_REFRESH_INTERVAL ago, the first request to notice starts
+  a reload without waiting for it, so the next requests get the new config.
+  """
+  now = utils.utcnow()
+  key = (config_set, path, dest_type)
+  refresh = False
+  with _last_good_cache_lock:
+    entry = _last_good_cache.get(key)
+    if (entry and
+        now - entry.loaded_ts > LAST_GOOD_CACHE_REFRESH_INTERVAL and
+        (not entry.refresh_ts or
+         now - entry.refresh_ts > LAST_GOOD_CACHE_REFRESH_TIMEOUT)):
+      _last_good_cache[key] = entry._replace(refresh_ts=now)
+      refresh = True
+
+  if not entry:
+    result = yield _load_last_good_async(config_set, path, dest_type)
+    raise ndb.Return(result)
+  if refresh:
+    # Not waited for, the ndb event loop runs it while the request goes on.
+    _refresh_last_good_async(config_set, path, dest_type)
+  raise ndb.Return(entry.revision, _copy_config(entry.config))
+
+
+@ndb.tasklet
+def _refresh_last_good_async(config_set, path, dest_type):
+  """Reloads a last good config in the process cache, logging failures."""
+  try:
+    yield _load_last_good_async(config_set, path, dest_type)
+  except Exception:  # pylint: disable=broad-except
+    logging.exception(
+        'Could not refresh last good config %s:%s', config_set, path)
+
+
+@ndb.tasklet
+def _load_last_good_async(config_set, path, dest_type):
+  """Loads last good (rev, config), puts it to the process cache.
+
+  Updates last_access_ts if needed.
+  """
   now = utils.utcnow()
   last_good_id = '%s:%s' % (config_set, path)
 
@@ -343,6 +510,7 @@ def _get_last_good_async(config_set, path, dest_type):
 
   if not last_good or not last_good.revision:
     # The config wasn't loaded yet.
+    _put_last_good_cache(config_set, path, dest_type, None, None, None, now)
     raise ndb.Return(None, None)
 
   force_text = False
@@ -361,16 +529,37 @@ def _get_last_good_async(config_set, path, dest_type):
     force_text = True
 
   cfg = None
-  if proto_message_name:
-    if not last_good.content_binary or force_text:
-      logging.warning('loading a proto config from text, not binary')
-    else:
-      cfg = dest_type()
-      cfg.MergeFromString(last_good.content_binary)
-  cfg = cfg or common._convert_config(last_good.content, dest_type)
+  if proto_message_name and not force_text:
+    cfg = common._get_cached_config(last_good.content_hash, dest_type)
+  if cfg is None:
+    if proto_message_name:
+      if not last_good.content_binary or force_text:
+        logging.warning('loading a proto config from text, not binary')
+      else:
+        cfg = dest_type()
+        cfg.MergeFromString(last_good.content_binary)
+    cfg = cfg or common._convert_config(last_good.content, dest_type)
+    if not force_text:
+      common._cache_config(last_good.content_hash, cfg)
+  if not force_text:
+    _put_last_good_cache(
+        config_set, path, dest_type, last_good.revision,
+        last_good.content_hash, cfg, now)
   raise ndb.Return(last_good.revision, cfg)
 
 
+def _put_last_good_cache(
+    config_set, path, dest_type, revision, content_hash, cfg, now):
+  entry = _LastGoodCacheEntry(
+      revision=revision,
+      content_hash=content_hash,
+      config=_copy_config(cfg),
+      loaded_ts=now,
+      refresh_ts=None)
+  with _last_good_cache_lock:
+    _last_good_cache[(config_set, path, dest_type)] = entry
+
+
 def format_url(url_format, *args):
   return url_format % tuple(urllib.quote(a, '') for a in args)
 
@@ -388,6 +577,4 @@ def get_provider_async():
 def cron_update_last_good_configs():
   provider = get_provider_async().get_result()
   if provider:
-    f = LastGoodConfig.query().map_async(
-        provider._update_last_good_config_async, keys_only=True)
-    f.check_success()
+    provider._update_last_good_configs_async().check_success()
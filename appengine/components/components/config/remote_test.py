@@ -4,6 +4,7 @@
 # that can be found in the LICENSE file.
 
 import base64
+import collections
 import datetime
 import sys
 import unittest
@@ -17,6 +18,8 @@ from google.appengine.ext import ndb
 
 from components import auth
 from components import net
+from components import utils
+from components.config import common
 from components.config import remote
 from test_support import test_case
 
@@ -33,6 +36,9 @@ class RemoteTestCase(test_case.TestCase):
     provider_future = ndb.Future()
     provider_future.set_result(self.provider)
     self.mock(remote, 'get_provider_async', lambda: provider_future)
+    self.mock(common, '_parsed_config_cache', collections.OrderedDict())
+    self.mock(remote, '_last_good_cache', {})
+    self.changed_configs_supported = True
 
   @ndb.tasklet
   def json_request_async(self, url, **kwargs):
@@ -51,6 +57,29 @@ class RemoteTestCase(test_case.TestCase):
         'revision': 'aaaabbbb',
       })
 
+    if url == URL_PREFIX + 'configs/changed':
+      assert kwargs['method'] == 'POST'
+      if not self.changed_configs_supported:
+        raise net.NotFoundError('Not found', 404, None)
+      latest = {
+        ('services/foo', 'bar.cfg'): ('aaaabbbb', 'deadbeef', 'a config'),
+        ('services/foo', 'baz.cfg'): (
+            'aaaabbbb', 'badcoffee', 'param: "qux"'),
+      }
+      configs = []
+      for cfg in kwargs['payload']['configs']:
+        rev, content_hash, content = latest.get(
+            (cfg['config_set'], cfg['path']), (None, None, None))
+        if rev == cfg['known_revision']:
+          continue
+        res = {'config_set': cfg['config_set'], 'path': cfg['path']}
+        if rev:
+          res.update(revision=rev, content_hash=content_hash)
+          if content_hash != cfg['known_content_hash']:
+            res['content'] = base64.b64encode(content)
+        configs.append(res)
+      raise ndb.Return({'configs': configs})
+
     if url == URL_PREFIX + 'config/deadbeef':
       raise ndb.Return({
         'content':  base64.b64encode('a config'),
@@ -125,6 +154,8 @@ class RemoteTestCase(test_case.TestCase):
         content_hash='deadbeef',
         revision='aaaaaaaa').put()
 
+    # Drop the process cache.
+    remote._last_good_cache.clear()
     revision, content = self.provider.get_async(
         'services/foo', 'bar.cfg', store_last_good=True).get_result()
     self.assertEqual(revision, 'aaaaaaaa')
@@ -132,6 +163,62 @@ class RemoteTestCase(test_case.TestCase):
 
     self.assertFalse(net.json_request_async.called)
 
+  def test_last_good_process_cache(self):
+    now = datetime.datetime(2017, 1, 1)
+    self.mock_now(now)
+
+    def put(content):
+      remote.LastGoodConfig(
+          id='services/foo:bar.cfg',
+          content=content,
+          content_hash='hash-%s' % content,
+          revision='rev-%s' % content,
+          last_access_ts=now).put()
+
+    def get():
+      return self.provider.get_async(
+          'services/foo', 'bar.cfg', store_last_good=True).get_result()
+
+    put('a')
+    self.assertEqual(get(), ('rev-a', 'a'))
+
+    # Served from the process cache.
+    put('b')
+    self.mock_now(now, 10)
+    self.assertEqual(get(), ('rev-a', 'a'))
+
+    # A stale config is still served, the first request that notices it starts
+    # a refresh in the background.
+    self.mock_now(now, 40)
+    self.assertEqual(get(), ('rev-a', 'a'))
+    ndb.eventloop.run()
+    self.assertEqual(get(), ('rev-b', 'b'))
+
+    # While a refresh is in progress, no other one is started.
+    put('c')
+    self.mock_now(now, 80)
+    key = ('services/foo', 'bar.cfg', None)
+    remote._last_good_cache[key] = remote._last_good_cache[key]._replace(
+        refresh_ts=utils.utcnow())
+    self.assertEqual(get(), ('rev-b', 'b'))
+    ndb.eventloop.run()
+    self.assertEqual(get(), ('rev-b', 'b'))
+
+    # A refresh that did not finish in time is started again.
+    self.mock_now(
+        now, 80 + remote.LAST_GOOD_CACHE_REFRESH_TIMEOUT.total_seconds() + 1)
+    self.assertEqual(get(), ('rev-b', 'b'))
+    ndb.eventloop.run()
+    self.assertEqual(get(), ('rev-c', 'c'))
+
+    # The cached config is served if the refresh fails.
+    self.mock(remote, '_load_last_good_async', mock.Mock(
+        side_effect=Exception('datastore is down')))
+    self.mock_now(now, 160)
+    self.assertEqual(get(), ('rev-c', 'c'))
+    ndb.eventloop.run()
+    self.assertEqual(get(), ('rev-c', 'c'))
+
   def test_get_projects(self):
     projects = self.provider.get_projects_async().get_result()
     self.assertEqual(projects, [
@@ -227,6 +314,74 @@ class RemoteTestCase(test_case.TestCase):
 
     self.assertIsNone(old_cfg.key.get())
 
+  def test_cron_update_last_good_configs_batch(self):
+    self.provider.get_async(
+        'services/foo', 'bar.cfg', store_last_good=True).get_result()
+    self.provider.get_async(
+        'services/foo', 'baz.cfg', dest_type=test_config_pb2.Config,
+        store_last_good=True).get_result()
+    remote.cron_update_last_good_configs()
+
+    # Contents came with the batch response, nothing was fetched separately.
+    urls = [c[0][0] for c in net.json_request_async.call_args_list]
+    self.assertEqual(urls, [
+      'https://luci-config.appspot.com/_ah/api/config/v1/configs/changed',
+    ])
+    self.assertEqual(
+        remote.LastGoodConfig.get_by_id('services/foo:bar.cfg').content,
+        'a config')
+
+    # Nothing changed, nothing is returned.
+    net.json_request_async.reset_mock()
+    remote.cron_update_last_good_configs()
+    self.assertEqual(net.json_request_async.call_count, 1)
+
+  def test_get_changed_configs_async_batches(self):
+    self.mock(remote, 'CHANGED_CONFIGS_BATCH_SIZE', 2)
+    known = {
+      ('services/foo', 'bar.cfg'): (None, None),
+      ('services/foo', 'baz.cfg'): ('aaaabbbb', 'badcoffee'),
+      ('services/foo', 'qux.cfg'): ('aaaabbbb', 'c0ffee'),
+    }
+    changed = self.provider.get_changed_configs_async(known).get_result()
+    self.assertEqual(changed, {
+      ('services/foo', 'bar.cfg'): ('aaaabbbb', 'deadbeef', 'a config'),
+      ('services/foo', 'qux.cfg'): (None, None, None),
+    })
+    batches = [
+      [(c['config_set'], c['path']) for c in call[1]['payload']['configs']]
+      for call in net.json_request_async.call_args_list
+    ]
+    self.assertEqual(batches, [
+      [('services/foo', 'bar.cfg'), ('services/foo', 'baz.cfg')],
+      [('services/foo', 'qux.cfg')],
+    ])
+
+  def test_cron_update_last_good_configs_without_batch(self):
+    self.changed_configs_supported = False
+    self.provider.get_async(
+        'services/foo', 'bar.cfg', store_last_good=True).get_result()
+    remote.cron_update_last_good_configs()
+
+    revision, config = self.provider.get_async(
+        'services/foo', 'bar.cfg', store_last_good=True).get_result()
+    self.assertEqual(revision, 'aaaabbbb')
+    self.assertEqual(config, 'a config')
+
+  def test_get_async_caches_parsed_config(self):
+    self.mock(common, '_convert_config', mock.Mock(
+        side_effect=common._convert_config))
+    _, config1 = self.provider.get_async(
+        'services/foo', 'baz.cfg',
+        dest_type=test_config_pb2.Config).get_result()
+    _, config2 = self.provider.get_async(
+        'services/foo', 'baz.cfg',
+        dest_type=test_config_pb2.Config).get_result()
+    self.assertEqual(config1.param, 'qux')
+    self.assertEqual(config1, config2)
+    self.assertIsNot(config1, config2)
+    self.assertEqual(common._convert_config.call_count, 1)
+
 
 if __name__ == '__main__':
   if '-v' in sys.argv:
@@ -15,9 +15,11 @@ import calendar
 import collections
 import datetime
 import logging
+import random
 
 from google.appengine.api import datastore_errors
 from google.appengine.api import logservice
+from google.appengine.api import memcache
 from google.appengine.ext import ndb
 from google.appengine.runtime import DeadlineExceededError
 
@@ -39,6 +41,16 @@ RESOLUTIONS = ('days', 'hours', 'minutes')
 TOO_RECENT = 5 if not utils.is_local_dev_server() else 1
 
 
+# Number of memcache keys each counter is sharded into, to spread the load of
+# concurrent increments.
+COUNTER_SHARDS = 8
+
+
+# Name of the counter incremented on each add_counters() call. Its presence
+# tells that the counters of a minute were recorded.
+_COUNTER_MARKER = '_n'
+
+
 # One handled HTTP request and the associated statistics if any.
 StatsEntry = collections.namedtuple('StatsEntry', ('request', 'entries'))
 
@@ -46,7 +58,7 @@ StatsEntry = collections.namedtuple('StatsEntry', ('request', 'entries'))
 class StatisticsFramework(object):
   def __init__(
       self, root_key_id, snapshot_cls, generate_snapshot,
-      max_backtrack_days=5, max_minutes_per_process=120):
+      max_backtrack_days=5, max_minutes_per_process=120, direct_ingest=False):
     """Creates an instance to do bookkeeping of statistics.
 
     Arguments:
@@ -62,6 +74,11 @@ class StatisticsFramework(object):
           when starting fresh. It will always start looking at 00:00 on the
           given day in UTC time.
     - max_minutes_per_process: Maximum number of minutes to process at a time.
+    - direct_ingest: If True, the values recorded with add_counters() are
+          summed into the minute snapshot instead of calling generate_snapshot.
+          The counters are named after the integer properties of snapshot_cls.
+          generate_snapshot is still used for the minutes without any counter,
+          e.g. if memcache was flushed.
 
     ndb access to self.root_key is using both local cache and memcache but
     access to stats_day_cls, stats_hour_cls and stats_minute_cls does not use
@@ -76,6 +93,8 @@ class StatisticsFramework(object):
     self._generate_snapshot = generate_snapshot
     self._max_backtrack_days = max_backtrack_days
     self._max_minutes_per_process = max_minutes_per_process
+    self._direct_ingest = direct_ingest
+    self._counters_namespace = 'stats_%s' % root_key_id
 
     # Generate the model classes. The factories are members so they can be
     # overriden if necessary.
@@ -135,6 +154,27 @@ class StatisticsFramework(object):
         # At least something was processed, so it's fine.
         return count
 
+  def add_counters(self, counters):
+    """Increments counters for the current minute.
+
+    Only useful with direct_ingest. Each call updates a randomly selected shard
+    in a single memcache RPC.
+
+    Arguments:
+    - counters: dict of counter name to the integer value to add. Names must
+          be integer properties of snapshot_cls.
+
+    Returns:
+      True on success. On failure, the minute is likely to be undercounted.
+    """
+    assert self._direct_ingest
+    prefix = '%s/%d/' % (
+        _minute_id(utils.utcnow()), random.randint(0, COUNTER_SHARDS-1))
+    mapping = {prefix + k: v for k, v in counters.iteritems() if v}
+    mapping[prefix + _COUNTER_MARKER] = 1
+    return bool(memcache.offset_multi(
+        mapping, namespace=self._counters_namespace, initial_value=0))
+
   def day_key(self, day):
     """Returns the complete entity key for a specific day stats.
 
@@ -170,6 +210,32 @@ class StatisticsFramework(object):
 
   ### Protected code.
 
+  def _get_counters(self, moment):
+    """Returns the sum of the counters recorded for a minute.
+
+    Returns:
+      dict of counter name to value, or None if no counter was recorded for
+      this minute, in which case the logs must be used instead.
+    """
+    # Access to a protected member _XXX of a client class
+    # pylint: disable=W0212
+    names = [_COUNTER_MARKER] + sorted(
+        k for k, v in self.snapshot_cls._properties.iteritems()
+        if isinstance(v, ndb.IntegerProperty))
+    minute_id = _minute_id(moment)
+    keys = [
+      '%s/%d/%s' % (minute_id, shard, name)
+      for shard in xrange(COUNTER_SHARDS) for name in names
+    ]
+    values = memcache.get_multi(keys, namespace=self._counters_namespace)
+    counters = {}
+    for key, value in values.iteritems():
+      name = key.rsplit('/', 1)[1]
+      counters[name] = counters.get(name, 0) + int(value)
+    if not counters.pop(_COUNTER_MARKER, None):
+      return None
+    return counters
+
   def _set_last_processed_time(self, moment):
     """Saves the last minute processed.
 
@@ -315,10 +381,15 @@ class StatisticsFramework(object):
     futures = []
 
     if not minute:
-      # Call the harvesting function.
-      end = moment + datetime.timedelta(minutes=1)
-      minute_values = self._generate_snapshot(
-          calendar.timegm(moment.timetuple()), calendar.timegm(end.timetuple()))
+      counters = self._get_counters(moment) if self._direct_ingest else None
+      if counters is not None:
+        minute_values = self.snapshot_cls(**counters)
+      else:
+        # Call the harvesting function.
+        end = moment + datetime.timedelta(minutes=1)
+        minute_values = self._generate_snapshot(
+            calendar.timegm(moment.timetuple()),
+            calendar.timegm(end.timetuple()))
 
       minute = self.stats_minute_cls(
           id=minute_key_id, parent=hour.key, values_compressed=minute_values)
@@ -525,6 +596,11 @@ def _lowest_missing_bit(bitmap):
   return 64
 
 
+def _minute_id(moment):
+  """Returns the string identifying the minute of a datetime.datetime."""
+  return moment.strftime('%Y-%m-%dT%H:%M')
+
+
 def _yield_logs(start_time, end_time):
   """Yields logservice.RequestLogs for the requested time interval.
 
@@ -277,6 +277,44 @@ class StatsFrameworkTest(test_case.TestCase, stats_framework_mock.MockMixIn):
     self.assertEqual(
         expected, stats_framework.get_stats(handler, 'minutes', now, 100, True))
 
+  def test_framework_direct_ingest(self):
+    called = []
+
+    def gen_data(start, end):
+      """Returns fake statistics."""
+      self.assertEqual(start + 60, end)
+      called.append(start)
+      return Snapshot(requests=10)
+
+    handler = stats_framework.StatisticsFramework(
+        'test_framework', Snapshot, gen_data, direct_ingest=True)
+
+    now = get_now()
+    two_minutes_ago = strip_seconds(now) - datetime.timedelta(seconds=2*60)
+    self.mock_now(two_minutes_ago, 0)
+    self.assertTrue(handler.add_counters({'requests': 2}))
+    self.assertTrue(handler.add_counters({'requests': 3}))
+
+    self.mock_now(now, 0)
+    handler._set_last_processed_time(
+        strip_seconds(now) - datetime.timedelta(seconds=3*60))
+    self.assertEqual(2, handler.process_next_chunk(1))
+    # The minute without counters fell back to generate_snapshot.
+    self.assertEqual(
+        [calendar.timegm(
+            (two_minutes_ago + datetime.timedelta(seconds=60)).timetuple())],
+        called)
+
+    actual = [
+      (i['key'], i['requests'])
+      for i in stats_framework.get_stats(handler, 'minutes', now, 100, True)
+    ]
+    expected = [
+      (two_minutes_ago + datetime.timedelta(seconds=60), 10),
+      (two_minutes_ago, 5),
+    ]
+    self.assertEqual(expected, actual)
+
   def test_keys(self):
     handler = stats_framework.StatisticsFramework(
         'test_framework', Snapshot, self.fail)
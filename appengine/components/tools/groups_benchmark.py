@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# Copyright 2017 The LUCI Authors. All rights reserved.
+# Use of this source code is governed under the Apache License, Version 2.0
+# that can be found in the LICENSE file.
+
+"""Benchmarks group membership checks of AuthDB.
+
+Generates a random snapshot of groups, then compares AuthDB construction time
+and memory, is_group_member() and fetch_groups_with_member() with the walk of
+the group graph that was used before AuthDB flattened the graph when
+constructed.
+"""
+
+import optparse
+import os
+import random
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from test_support import test_env
+test_env.setup_test_env()
+
+from components.auth import api
+from components.auth import model
+
+
+def legacy_is_group_member(auth_db, group_name, identity):
+  """Walks the group graph for each check, like AuthDB used to do."""
+  ident_as_bytes = identity.to_bytes()
+  visited = set()
+
+  def is_member(group_name):
+    if group_name == model.GROUP_ALL:
+      return True
+    group_obj = auth_db.groups.get(group_name)
+    if not group_obj or group_name in visited:
+      return False
+    visited.add(group_name)
+    if ident_as_bytes in group_obj.members:
+      return True
+    if any(glob.match(identity) for glob in group_obj.globs):
+      return True
+    return any(is_member(nested) for nested in group_obj.nested)
+
+  return is_member(group_name)
+
+
+def legacy_fetch_groups_with_member(auth_db, ident):
+  return {
+    g for g in auth_db.groups if legacy_is_group_member(auth_db, g, ident)
+  }
+
+
+def make_identity(i):
+  return model.Identity(model.IDENTITY_USER, 'user%d@example.com' % i)
+
+
+def make_groups(rnd, nb_groups, nb_identities, members, nested, globs_ratio):
+  """Returns a list of AuthGroup forming a DAG, like a real snapshot."""
+  groups = []
+  for i in xrange(nb_groups):
+    g = model.AuthGroup(id='group-%d' % i)
+    g.members = [
+      make_identity(rnd.randrange(nb_identities))
+      for _ in xrange(rnd.randint(0, 2 * members))
+    ]
+    if rnd.random() < globs_ratio:
+      g.globs = [
+        model.IdentityGlob(model.IDENTITY_USER, 'user%d*@example.com' % i)
+      ]
+    # Only nest groups created before to not create cycles.
+    if i:
+      g.nested = [
+        'group-%d' % rnd.randrange(i)
+        for _ in xrange(rnd.randint(0, 2 * nested))
+      ]
+    groups.append(g)
+  return groups
+
+
+def timeit(fn, *args):
+  start = time.time()
+  out = fn(*args)
+  return time.time() - start, out
+
+
+def deep_size(obj, seen):
+  """Returns the size in bytes of |obj| and of the containers it references.
+
+  Objects in |seen| are not counted, so that shared objects are counted once.
+  """
+  if id(obj) in seen:
+    return 0
+  seen.add(id(obj))
+  size = sys.getsizeof(obj)
+  if isinstance(obj, dict):
+    for k, v in obj.iteritems():
+      size += deep_size(k, seen) + deep_size(v, seen)
+  elif isinstance(obj, (list, tuple, set, frozenset)):
+    for v in obj:
+      size += deep_size(v, seen)
+  return size
+
+
+def legacy_auth_db(groups):
+  """Returns AuthDB without the membership index, like AuthDB used to be."""
+  build = api.AuthDB._build_membership_index
+  api.AuthDB._build_membership_index = lambda _self: None
+  try:
+    return api.AuthDB(groups=groups)
+  finally:
+    api.AuthDB._build_membership_index = build
+
+
+def index_size(auth_db, seen):
+  return sum(
+      deep_size(getattr(auth_db, attr), seen)
+      for attr in (
+        '_direct_groups', '_ancestors', '_group_globs', '_glob_groups',
+        '_groups_with_all'))
+
+
+def main():
+  parser = optparse.OptionParser(description=sys.modules[__name__].__doc__)
+  parser.add_option(
+      '--groups', type='int', default=5000, help='Default: %default')
+  parser.add_option(
+      '--identities', type='int', default=50000, help='Default: %default')
+  parser.add_option(
+      '--members', type='int', default=20,
+      help='Average number of members per group. Default: %default')
+  parser.add_option(
+      '--nested', type='int', default=2,
+      help='Average number of nested groups per group. Default: %default')
+  parser.add_option(
+      '--globs', type='float', default=0.05,
+      help='Ratio of groups with a glob. Default: %default')
+  parser.add_option(
+      '--checks', type='int', default=20000,
+      help='Number of is_group_member() calls. Default: %default')
+  parser.add_option(
+      '--fetches', type='int', default=20,
+      help='Number of fetch_groups_with_member() calls. Default: %default')
+  parser.add_option('--seed', type='int', default=0, help='Default: %default')
+  options, args = parser.parse_args()
+  if args:
+    parser.error('Unexpected arguments: %s' % args)
+
+  rnd = random.Random(options.seed)
+  groups = make_groups(
+      rnd, options.groups, options.identities, options.members,
+      options.nested, options.globs)
+  print('%-28s  %10s  %10s' % ('', 'legacy', 'flattened'))
+  old, legacy_db = timeit(legacy_auth_db, groups)
+  new, auth_db = timeit(lambda: api.AuthDB(groups=groups))
+  print('%-28s  %9.3fs  %9.3fs' % (
+      'AuthDB(%d groups)' % len(groups), old, new))
+  seen = set()
+  old = deep_size(auth_db.groups, seen)
+  new = old + index_size(auth_db, seen)
+  print('%-28s  %8.1fMB  %8.1fMB' % (
+      'AuthDB groups memory', old / 1e6, new / 1e6))
+
+  checks = [
+    ('group-%d' % rnd.randrange(options.groups),
+      make_identity(rnd.randrange(options.identities)))
+    for _ in xrange(options.checks)
+  ]
+  idents = [
+    make_identity(rnd.randrange(options.identities))
+    for _ in xrange(options.fetches)
+  ]
+
+  def run_checks(fn):
+    return [fn(group, ident) for group, ident in checks]
+
+  def run_fetches(fn):
+    return [fn(ident) for ident in idents]
+
+  old, old_out = timeit(
+      run_checks, lambda g, i: legacy_is_group_member(legacy_db, g, i))
+  new, new_out = timeit(run_checks, auth_db.is_group_member)
+  assert old_out == new_out
+  print('%-28s  %9.3fs  %9.3fs' % (
+      '%d is_group_member' % len(checks), old, new))
+  old, old_out = timeit(
+      run_fetches, lambda i: legacy_fetch_groups_with_member(legacy_db, i))
+  new, new_out = timeit(run_fetches, auth_db.fetch_groups_with_member)
+  assert old_out == new_out
+  print('%-28s  %9.3fs  %9.3fs' % (
+      '%d fetch_groups_with_member' % len(idents), old, new))
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
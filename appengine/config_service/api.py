@@ -2,6 +2,7 @@
 # Use of this source code is governed under the Apache License, Version 2.0
 # that can be found in the LICENSE file.
 
+import collections
 import logging
 
 from google.appengine.api import memcache
@@ -26,6 +27,9 @@ import validation
 # This is used by endpoints indirectly.
 package = 'luci-config'
 
+# Maximum number of configs in a get_changed_configs request.
+MAX_CHANGED_CONFIGS_BATCH = 1000
+
 
 class Project(messages.Message):
   # Unique luci project id from services/luci-config:projects.cfg
@@ -438,6 +442,105 @@ class ConfigApi(remote.Service):
 
     return get_config_multi('refs', request.path, request.hashes_only)
 
+  ##############################################################################
+  # endpoint: get_changed_configs
+
+  class GetChangedConfigsRequestMessage(messages.Message):
+    class Config(messages.Message):
+      config_set = messages.StringField(1, required=True)
+      path = messages.StringField(2, required=True)
+      # Revision known to the requester. If it is still the latest revision,
+      # the config is not returned.
+      known_revision = messages.StringField(3)
+      # Content hash known to the requester. If it did not change, the content
+      # is not returned.
+      known_content_hash = messages.StringField(4)
+    configs = messages.MessageField(Config, 1, repeated=True)
+    # If True, response contents will be None.
+    hashes_only = messages.BooleanField(2, default=False)
+
+  class GetChangedConfigsResponseMessage(messages.Message):
+    class Config(messages.Message):
+      config_set = messages.StringField(1, required=True)
+      path = messages.StringField(2, required=True)
+      # None if the config does not exist or the requester has no access.
+      revision = messages.StringField(3)
+      content_hash = messages.StringField(4)
+      # None if request.hashes_only is True or the content hash is known.
+      content = messages.BytesField(5)
+      url = messages.StringField(6)
+    # Only configs whose latest revision differs from the known one.
+    configs = messages.MessageField(Config, 1, repeated=True)
+
+  @auth.endpoints_method(
+      GetChangedConfigsRequestMessage,
+      GetChangedConfigsResponseMessage,
+      http_method='POST',
+      path='configs/changed')
+  @auth.public # ACL check inside
+  def get_changed_configs(self, request):
+    """Gets latest versions of multiple configs if they changed."""
+    if len(request.configs) > MAX_CHANGED_CONFIGS_BATCH:
+      raise endpoints.BadRequestException(
+          'At most %d configs can be requested at once' %
+          MAX_CHANGED_CONFIGS_BATCH)
+    try:
+      for cfg in request.configs:
+        validation.validate_config_set(cfg.config_set)
+        validation.validate_path(cfg.path)
+    except ValueError as ex:
+      raise endpoints.BadRequestException(ex.message)
+
+    can_read = can_read_config_sets(
+        sorted(set(cfg.config_set for cfg in request.configs)))
+    revs_by_path = collections.defaultdict(dict)
+    for cfg in request.configs:
+      if can_read[cfg.config_set]:
+        revs_by_path[cfg.path][cfg.config_set] = None
+    hash_futures = {
+      path: storage.get_config_hashes_async(revs, path)
+      for path, revs in revs_by_path.iteritems()
+    }
+
+    res = self.GetChangedConfigsResponseMessage()
+    for cfg in request.configs:
+      rev, url, content_hash = None, None, None
+      if cfg.path in hash_futures:
+        rev, url, content_hash = (
+            hash_futures[cfg.path].get_result().get(cfg.config_set) or
+            (None, None, None))
+      if not content_hash:
+        rev, url = None, None
+      if rev == cfg.known_revision:
+        continue
+      res.configs.append(res.Config(
+          config_set=cfg.config_set,
+          path=cfg.path,
+          revision=rev,
+          content_hash=content_hash,
+          url=url,
+      ))
+
+    if not request.hashes_only:
+      known_hashes = {
+        (cfg.config_set, cfg.path): cfg.known_content_hash
+        for cfg in request.configs
+      }
+      to_fetch = [
+        c for c in res.configs
+        if c.content_hash and
+        c.content_hash != known_hashes[(c.config_set, c.path)]
+      ]
+      contents = storage.get_configs_by_hashes_async(
+          [c.content_hash for c in to_fetch]).get_result()
+      for c in to_fetch:
+        c.content = contents.get(c.content_hash)
+        if c.content is None:
+          logging.error(
+              'Blob %s referenced from %s:%s:%s was not found',
+              c.content_hash, c.config_set, c.revision, c.path)
+    return res
+
   ##############################################################################
   # endpoint: reimport
 
@@ -748,6 +748,129 @@ class ApiTest(test_case.EndpointsTestCase):
     resp = self.call_api('get_ref_configs', req).json_body
     self.assertEqual(resp, {})
 
+  ##############################################################################
+  # get_changed_configs
+
+  def test_get_changed_configs(self):
+    def get_config_hashes_async(revs, path):
+      self.assertEqual(path, 'my.cfg')
+      latest = {
+        'services/unchanged': ('rev1', 'https://x.com/+/rev1', 'hash1'),
+        'services/changed': ('rev3', 'https://x.com/+/rev3', 'hash3'),
+        'services/new': ('rev4', 'https://x.com/+/rev4', 'hash4'),
+        'services/same-content': ('rev5', 'https://x.com/+/rev5', 'hash2'),
+      }
+      return future({cs: latest.get(cs, (None, None, None)) for cs in revs})
+    self.mock(storage, 'get_config_hashes_async', get_config_hashes_async)
+    self.mock(storage, 'get_configs_by_hashes_async', mock.Mock())
+    storage.get_configs_by_hashes_async.return_value = future({
+      'hash3': 'changed content',
+      'hash4': 'new content',
+    })
+
+    req = {
+      'configs': [
+        {
+          'config_set': 'services/unchanged',
+          'path': 'my.cfg',
+          'known_revision': 'rev1',
+          'known_content_hash': 'hash1',
+        },
+        {
+          'config_set': 'services/changed',
+          'path': 'my.cfg',
+          'known_revision': 'rev2',
+          'known_content_hash': 'hash2',
+        },
+        {
+          'config_set': 'services/new',
+          'path': 'my.cfg',
+        },
+        {
+          'config_set': 'services/same-content',
+          'path': 'my.cfg',
+          'known_revision': 'rev2',
+          'known_content_hash': 'hash2',
+        },
+        {
+          'config_set': 'services/deleted',
+          'path': 'my.cfg',
+          'known_revision': 'rev2',
+          'known_content_hash': 'hash2',
+        },
+        {
+          'config_set': 'services/never-existed',
+          'path': 'my.cfg',
+        },
+      ],
+    }
+    resp = self.call_api('get_changed_configs', req).json_body
+
+    self.assertEqual(resp, {
+      'configs': [
+        {
+          'config_set': 'services/changed',
+          'path': 'my.cfg',
+          'revision': 'rev3',
+          'content_hash': 'hash3',
+          'content': base64.b64encode('changed content'),
+          'url': 'https://x.com/+/rev3',
+        },
+        {
+          'config_set': 'services/new',
+          'path': 'my.cfg',
+          'revision': 'rev4',
+          'content_hash': 'hash4',
+          'content': base64.b64encode('new content'),
+          'url': 'https://x.com/+/rev4',
+        },
+        {
+          'config_set': 'services/same-content',
+          'path': 'my.cfg',
+          'revision': 'rev5',
+          'content_hash': 'hash2',
+          'url': 'https://x.com/+/rev5',
+        },
+        {
+          'config_set': 'services/deleted',
+          'path': 'my.cfg',
+        },
+      ],
+    })
+    storage.get_configs_by_hashes_async.assert_called_once_with(
+        ['hash3', 'hash4'])
+
+  def test_get_changed_configs_without_permissions(self):
+    self.mock_no_project_access()
+    self.mock(storage, 'get_config_hashes_async', mock.Mock())
+
+    req = {
+      'configs': [
+        {
+          'config_set': 'projects/secret',
+          'path': 'my.cfg',
+          'known_revision': 'rev1',
+        },
+      ],
+    }
+    resp = self.call_api('get_changed_configs', req).json_body
+    self.assertEqual(resp, {
+      'configs': [
+        {
+          'config_set': 'projects/secret',
+          'path': 'my.cfg',
+        },
+      ],
+    })
+    self.assertFalse(storage.get_config_hashes_async.called)
+
+  def test_get_changed_configs_bad_request(self):
+    req = {
+      'configs': [{'config_set': 'xxx', 'path': 'my.cfg'}],
+    }
+    with self.call_should_fail(httplib.BAD_REQUEST):
+      self.call_api('get_changed_configs', req)
+
   ##############################################################################
   # reimport
 
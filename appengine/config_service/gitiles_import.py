@@ -13,11 +13,16 @@ from project.config_location.
 """
 
 import contextlib
+import datetime
+import hashlib
 import logging
 import os
+import posixpath
 import re
+import stat
 import StringIO
 import tarfile
+import uuid
 
 from google.appengine.api import urlfetch_errors
 from google.appengine.ext import ndb
@@ -26,10 +31,12 @@ from google.protobuf import text_format
 from components import config
 from components import gitiles
 from components import net
+from components import utils
 from components.config.proto import service_config_pb2
 
 import admin
 import common
+import metrics
 import notifications
 import projects
 import storage
@@ -46,6 +53,14 @@ DEFAULT_GITILES_IMPORT_CONFIG = service_config_pb2.ImportCfg.Gitiles(
     ref_config_default_path='luci',
 )
 
+# Task queue that runs imports of individual config sets.
+IMPORT_QUEUE = 'gitiles-import'
+# How long an import of a config set may take before another task may start
+# importing it.
+IMPORT_LEASE_DURATION = datetime.timedelta(minutes=10)
+# Imports of a config set enqueued within this many seconds are deduplicated.
+IMPORT_TASK_DEDUP_PERIOD = 10 * 60
+
 
 class Error(Exception):
   """A config set import-specific error."""
@@ -128,18 +143,36 @@ def _import_revision(config_set, base_location, commit, force_update):
     storage.Revision(key=rev_key),
   ]
 
-  # Fetch archive outside ConfigSet transaction.
-  archive = location.get_archive(
-      deadline=get_gitiles_config().fetch_archive_deadline)
-  if not archive:
+  # If a previous revision was imported from the same location, import only
+  # files that changed since then. Otherwise fetch the entire archive.
+  read_result = None
+  prev_hashes = None
+  if not force_update:
+    prev_hashes = _get_prev_file_hashes(config_set, base_location)
+  if prev_hashes is not None:
+    try:
+      read_result = _read_and_validate_tree(
+          config_set, rev_key, location, prev_hashes)
+    except (net.Error, Error):
+      logging.exception(
+          'Could not import %s incrementally, fetching archive', config_set)
+
+  if read_result is None:
+    # Fetch archive outside ConfigSet transaction.
+    archive = location.get_archive(
+        deadline=get_gitiles_config().fetch_archive_deadline)
+    if archive:
+      # Extract files and save them to Blobs outside ConfigSet transaction.
+      read_result = _read_and_validate_archive(
+          config_set, rev_key, archive, location)
+
+  if read_result is None:
     logging.warning(
         'Configuration %s does not exist. Probably it was deleted', config_set)
     attempt.success = True
     attempt.message = 'Config directory not found. Imported as empty'
   else:
-    # Extract files and save them to Blobs outside ConfigSet transaction.
-    files, validation_result = _read_and_validate_archive(
-        config_set, rev_key, archive, location)
+    files, validation_result = read_result
     if validation_result.has_errors:
       logging.warning('Invalid revision %s@%s', config_set, revision)
       notifications.notify_gitiles_rejection(
@@ -215,6 +248,117 @@ def _read_and_validate_archive(config_set, rev_key, archive, location):
   return entities, ctx.result()
 
 
+def _get_prev_file_hashes(config_set, location):
+  """Returns {path: content_hash} of the latest imported revision.
+
+  Returns None if there is no such revision or it was imported from a different
+  location.
+  """
+  config_set_entity = storage.ConfigSet.get_by_id(config_set)
+  if (not config_set_entity or not config_set_entity.latest_revision or
+      config_set_entity.location != str(location)):
+    return None
+  prev_rev_key = ndb.Key(
+      storage.ConfigSet, config_set,
+      storage.Revision, config_set_entity.latest_revision)
+  return {
+    f.key.id(): f.content_hash
+    for f in storage.File.query(ancestor=prev_rev_key)
+  }
+
+
+@ndb.tasklet
+def _list_files_async(location):
+  """Lists regular files under |location| recursively.
+
+  Returns:
+    {path: content_hash} dict with paths relative to |location|, or None if
+    the location does not exist.
+  """
+  tree = yield location.get_tree_async()
+  if tree is None:
+    raise ndb.Return(None)
+  files = {}
+  subdirs = []
+  for entry in tree.entries:
+    if entry.type == 'tree':
+      subdirs.append(entry.name)
+    elif entry.type == 'blob' and stat.S_ISREG(entry.mode):
+      # Git blob ids are hashes of the same form as computed by compute_hash.
+      files[entry.name] = 'v1:%s' % entry.id
+  subdir_files = yield [_list_files_async(location.join(d)) for d in subdirs]
+  for subdir, sub_files in zip(subdirs, subdir_files):
+    for name, content_hash in (sub_files or {}).iteritems():
+      files[posixpath.join(subdir, name)] = content_hash
+  raise ndb.Return(files)
+
+
+def _read_and_validate_tree(config_set, rev_key, location, prev_hashes):
+  """Imports files of a revision that changed since the previous revision.
+
+  Lists files with their hashes using Gitiles tree API. Files with the same
+  hash as in |prev_hashes| are neither fetched nor validated again. Changed
+  files are validated, their content is read from existing Blobs or fetched
+  from Gitiles if it was never imported before.
+
+  Returns:
+    (files, validation_result) tuple or None if the location does not exist.
+  """
+  hashes = _list_files_async(location).get_result()
+  if hashes is None:
+    return None
+
+  changed = sorted(
+      name for name, content_hash in hashes.iteritems()
+      if prev_hashes.get(name) != content_hash)
+  logging.info(
+      '%s: %d of %d files changed', config_set, len(changed), len(hashes))
+
+  # Read content of changed files that is already known, fetch the rest.
+  changed_hashes = sorted(set(hashes[name] for name in changed))
+  blobs = {
+    b.key.id(): b.content
+    for b in ndb.get_multi(
+        ndb.Key(storage.Blob, h) for h in changed_hashes)
+    if b
+  }
+  deadline = get_gitiles_config().fetch_archive_deadline
+  fetch_futures = {
+    name: location.join(name).get_file_content_async(deadline=deadline)
+    for name in changed if hashes[name] not in blobs
+  }
+  contents = {}
+  for name in changed:
+    if name in fetch_futures:
+      content = fetch_futures[name].get_result()
+      if content is None or storage.compute_hash(content) != hashes[name]:
+        raise Error('Could not fetch %s of %s' % (name, location))
+    else:
+      content = blobs[hashes[name]]
+    contents[name] = content
+
+  ctx = config.validation.Context()
+  for name in changed:
+    with ctx.prefix(name + ': '):
+      validation.validate_config(config_set, name, contents[name], ctx=ctx)
+  if ctx.result().has_errors:
+    return [], ctx.result()
+
+  ndb.Future.wait_all([
+    storage.import_blob_async(content=contents[name], content_hash=hashes[name])
+    for name in fetch_futures
+  ])
+  entities = [
+    storage.File(
+      id=name,
+      parent=rev_key,
+      content_hash=content_hash,
+      url=str(location.join(name)))
+    for name, content_hash in hashes.iteritems()
+  ]
+  return entities, ctx.result()
+
+
 def _import_config_set(config_set, location):
   """Imports the latest version of config set from a Gitiles location.
 
@@ -398,15 +542,13 @@ def _log_import_error(cs):
     logging.exception('Could not import %s', cs)
 
 
-def import_services(location_root):
-  """Imports all services, assuming they are in Gitiles.
-
-  Logs errors, does not raise them.
-  """
+def _list_services(location_root):
+  """Returns a list of (config_set, location) tuples of services in Gitiles."""
   # TODO(nodir): import services from location specified in services.cfg
   assert location_root
   tree = location_root.get_tree()
 
+  services = []
   for service_entry in tree.entries:
     service_id = service_entry.name
     if service_entry.type != 'tree':
@@ -416,55 +558,123 @@ def import_services(location_root):
       continue
     service_location = location_root._replace(
         path=os.path.join(location_root.path, service_entry.name))
-    cs = 'services/%s' % service_id
-    with _log_import_error(cs):
-      _import_config_set(cs, service_location)
-
+    services.append(('services/%s' % service_id, service_location))
+  return services
 
-def import_projects():
-  """Imports all project and ref config sets that are stored in Gitiles.
 
-  Logs errors, does not raise them.
-  """
-  cfg = get_gitiles_config()
-  projs = projects.get_projects()
+def _list_project_config_sets():
+  """Returns names of all project and ref config sets stored in Gitiles."""
+  projs = [
+    p for p in projects.get_projects()
+    if p.config_location.storage_type == GITILES_LOCATION_TYPE
+  ]
   refs = projects.get_refs([p.id for p in projs])
+  config_sets = []
   for project in projs:
-    loc = project.config_location
-    if loc.storage_type != GITILES_LOCATION_TYPE:
-      continue
-    try:
-      location = gitiles.Location.parse_resolve(loc.url)
-    except ValueError:
-      logging.exception('Invalid project location: %s', project.config_location)
-      continue
-    except net.AuthError as ex:
-      logging.error(
-          'Could not resolve %s due to permissions: %s',
-          project.config_location, ex.message)
-      continue
+    config_sets.append('projects/%s' % project.id)
+    config_sets.extend(
+        'projects/%s/%s' % (project.id, ref.name)
+        for ref in refs[project.id] or [])
+  return config_sets
+
+
+def _acquire_import_lease(config_set):
+  """Returns a lease owner id or None if the config set is being imported."""
+  key = storage.import_lease_key(config_set)
+  owner = uuid.uuid4().hex
+  now = utils.utcnow()
+
+  @ndb.transactional
+  def txn():
+    lease = key.get()
+    if lease and lease.expiration_ts > now:
+      return None
+    storage.ImportLease(
+        key=key, owner=owner,
+        expiration_ts=now + IMPORT_LEASE_DURATION).put()
+    return owner
+
+  return txn()
+
+
+def _release_import_lease(config_set, owner):
+  key = storage.import_lease_key(config_set)
+
+  @ndb.transactional
+  def txn():
+    lease = key.get()
+    if lease and lease.owner == owner:
+      key.delete()
+
+  txn()
+
+
+def run_import_task(config_set):
+  """Imports a config set unless another task is importing it already.
+
+  Reports import duration to ts_mon. Logs errors, does not raise them.
+  """
+  owner = _acquire_import_lease(config_set)
+  if not owner:
+    logging.info('%s is being imported by another task', config_set)
+    return
+  start = utils.utcnow()
+  success = False
+  try:
+    with _log_import_error(config_set):
+      import_config_set(config_set)
+      success = True
+  finally:
+    _release_import_lease(config_set, owner)
+    duration = utils.utcnow() - start
+    metrics.import_duration.add(
+        duration.total_seconds() * 1000,
+        fields={'config_set': config_set, 'success': success})
 
-    with _log_import_error('projects/%s' % project.id):
-      import_project(project.id, location)
 
+def _prioritize(config_sets):
+  """Orders config sets so that the ones with recent commits go first.
 
-    # Import refs of the project
-    for ref in refs[project.id] or []:
-      assert ref.name
-      assert ref.name.startswith('refs/'), ref.name
-      ref_location = location._replace(
-          treeish=ref.name,
-          path=ref.config_path or cfg.ref_config_default_path,
-      )
-      ref_cs = 'projects/%s/%s' % (project.id, ref.name)
-      with _log_import_error(ref_cs):
-        _import_config_set(ref_cs, ref_location)
+  Config sets that were not imported yet go before all others.
+  """
+  entities = ndb.get_multi(
+      ndb.Key(storage.ConfigSet, cs) for cs in config_sets)
+  latest_time = {
+    cs: (e and e.latest_revision_time) or datetime.datetime.max
+    for cs, e in zip(config_sets, entities)
+  }
+  return sorted(config_sets, key=latest_time.get, reverse=True)
+
+
+def enqueue_imports(config_sets):
+  """Enqueues import tasks, most recently changed config sets first.
+
+  Tasks enqueued for the same config set within IMPORT_TASK_DEDUP_PERIOD are
+  deduplicated, so that concurrent cron jobs do not enqueue the same work.
+
+  Returns:
+    True if all tasks were enqueued.
+  """
+  period = (
+      utils.datetime_to_timestamp(utils.utcnow()) /
+      (IMPORT_TASK_DEDUP_PERIOD * 10**6))
+  futures = [
+    utils.enqueue_task_async(
+        url='/internal/task/luci-config/gitiles_import/%s' % cs,
+        queue_name=IMPORT_QUEUE,
+        name='gitiles-import-%s-%d' % (hashlib.sha1(cs).hexdigest(), period))
+    for cs in _prioritize(config_sets)
+  ]
+  ndb.Future.wait_all(futures)
+  return all(f.get_result() for f in futures)
 
 
 def cron_run_import():  # pragma: no cover
+  config_sets = []
   conf = admin.GlobalConfig.fetch()
   if (conf and conf.services_config_storage_type == GITILES_STORAGE_TYPE and
       conf.services_config_location):
     loc = gitiles.Location.parse_resolve(conf.services_config_location)
-    import_services(loc)
-  import_projects()
+    config_sets += [cs for cs, _ in _list_services(loc)]
+  config_sets += _list_project_config_sets()
+  enqueue_imports(config_sets)
@@ -13,17 +13,20 @@ test_env.setup_test_env()
 from google.appengine.api import urlfetch_errors
 from google.appengine.ext import ndb
 
+import gae_ts_mon
 import mock
 
 from components import config
 from components import gitiles
 from components import net
+from components import utils
 from components.config.proto import project_config_pb2
 from components.config.proto import service_config_pb2
 from test_support import test_case
 
 import admin
 import gitiles_import
+import metrics
 import notifications
 import projects
 import storage
@@ -180,6 +183,109 @@ class GitilesImportTestCase(test_case.TestCase):
     self.assertEqual(val_msg.severity, config.Severity.ERROR)
     self.assertEqual(val_msg.text, 'test_archive/x: bad config!')
 
+  def test_import_revision_incremental(self):
+    loc = gitiles.Location(
+        hostname='localhost',
+        project='project',
+        treeish='master',
+        path='/')
+    storage.ConfigSet(
+        id='config_set',
+        latest_revision='deadbeef',
+        location=str(loc),
+        version=storage.ConfigSet.CUR_VERSION,
+    ).put()
+    prev_rev_key = ndb.Key(
+        storage.ConfigSet, 'config_set', storage.Revision, 'deadbeef')
+    unchanged_hash = storage.import_blob('unchanged')
+    known_hash = storage.import_blob('known')
+    storage.File(
+        id='unchanged.cfg', parent=prev_rev_key,
+        content_hash=unchanged_hash).put()
+    storage.File(
+        id='dir/changed.cfg', parent=prev_rev_key,
+        content_hash=storage.compute_hash('old')).put()
+
+    def get_tree_async(hostname, project, treeish, path):
+      self.assertEqual(hostname, 'localhost')
+      self.assertEqual(treeish, self.test_commit.sha)
+      entry = lambda name, content_hash, typ='blob', mode=33188: (
+          gitiles.TreeEntry(
+              id=content_hash[len('v1:'):], name=name, type=typ, mode=mode))
+      trees = {
+        '/': [
+          entry('unchanged.cfg', unchanged_hash),
+          entry('known.cfg', known_hash),
+          entry('link', known_hash, mode=40960),
+          entry('dir', 'v1:beef', typ='tree', mode=16384),
+        ],
+        '/dir': [
+          entry('changed.cfg', storage.compute_hash('new')),
+        ],
+      }
+      return future(gitiles.Tree(id='tree', entries=trees[path]))
+    self.mock(gitiles, 'get_tree_async', mock.Mock(side_effect=get_tree_async))
+    self.mock(
+        gitiles, 'get_file_content_async',
+        mock.Mock(return_value=future('new')))
+    self.mock(gitiles, 'get_archive', mock.Mock())
+
+    validated = []
+    def validate_config(config_set, filename, content, ctx):
+      validated.append((filename, content))
+    self.mock(validation, 'validate_config', validate_config)
+
+    gitiles_import._import_revision('config_set', loc, self.test_commit, False)
+
+    self.assertFalse(gitiles.get_archive.called)
+    gitiles.get_file_content_async.assert_called_once_with(
+        'localhost', 'project', self.test_commit.sha, '/dir/changed.cfg',
+        deadline=15)
+    self.assertEqual(
+        sorted(validated), [('dir/changed.cfg', 'new'), ('known.cfg', 'known')])
+    self.assert_attempt(True, 'Imported')
+
+    rev_key = ndb.Key(
+        storage.ConfigSet, 'config_set',
+        storage.Revision, self.test_commit.sha)
+    files = {
+      f.key.id(): f.content_hash
+      for f in storage.File.query(ancestor=rev_key)
+    }
+    self.assertEqual(files, {
+      'dir/changed.cfg': storage.compute_hash('new'),
+      'known.cfg': known_hash,
+      'unchanged.cfg': unchanged_hash,
+    })
+    self.assertEqual(
+        storage.Blob.get_by_id(storage.compute_hash('new')).content, 'new')
+
+  def test_import_revision_incremental_falls_back_to_archive(self):
+    self.mock_get_archive()
+    loc = gitiles.Location(
+        hostname='localhost',
+        project='project',
+        treeish='master',
+        path='/')
+    storage.ConfigSet(
+        id='config_set',
+        latest_revision='deadbeef',
+        location=str(loc),
+        version=storage.ConfigSet.CUR_VERSION,
+    ).put()
+    self.mock(gitiles, 'get_tree_async', mock.Mock(
+        side_effect=net.Error('Internal error', 500, 'Internal error')))
+
+    gitiles_import._import_revision('config_set', loc, self.test_commit, False)
+
+    self.assertTrue(gitiles.get_archive.called)
+    self.assert_attempt(True, 'Imported')
+    self.assertIsNotNone(storage.File.get_by_id(
+        'test_archive/x',
+        parent=ndb.Key(
+            storage.ConfigSet, 'config_set',
+            storage.Revision, self.test_commit.sha)))
+
   def mock_get_log(self):
     self.mock(gitiles, 'get_log', mock.Mock())
     gitiles.get_log.return_value = gitiles.Log(
@@ -324,8 +430,7 @@ class GitilesImportTestCase(test_case.TestCase):
           gitiles.Location.parse('https://localhost/project'))
     self.assert_attempt(False, 'Could not import: deadline exceeded')
 
-  def test_import_services(self):
-    self.mock(gitiles_import, '_import_config_set', mock.Mock())
+  def test_list_services(self):
     self.mock(gitiles, 'get_tree', mock.Mock())
     gitiles.get_tree.return_value = gitiles.Tree(
         id='abc',
@@ -351,13 +456,14 @@ class GitilesImportTestCase(test_case.TestCase):
         ],
     )
 
-    gitiles_import.import_services(
+    services = gitiles_import._list_services(
         gitiles.Location.parse('https://localhost/config'))
 
     gitiles.get_tree.assert_called_once_with(
         'localhost', 'config', 'HEAD', '/')
-    gitiles_import._import_config_set.assert_called_once_with(
-        'services/luci-config', 'https://localhost/config/+/HEAD/luci-config')
+    self.assertEqual(services, [
+      ('services/luci-config', 'https://localhost/config/+/HEAD/luci-config'),
+    ])
 
   def test_import_service(self):
     self.mock(gitiles_import, '_import_config_set', mock.Mock())
@@ -372,11 +478,11 @@ class GitilesImportTestCase(test_case.TestCase):
         'services/luci-config',
         'https://localhost/config/+/HEAD/luci-config')
 
-  def test_import_projects_and_refs(self):
+  def test_run_import_task_projects_and_refs(self):
+    gae_ts_mon.reset_for_unittest()
+    gae_ts_mon.initialize()
     self.mock(gitiles_import, '_import_config_set', mock.Mock())
-    self.mock(projects, 'get_projects', mock.Mock())
-    self.mock(projects, 'get_refs', mock.Mock())
-    projects.get_projects.return_value = [
+    projs = [
       service_config_pb2.Project(
           id='chromium',
           config_location=service_config_pb2.ConfigSetLocation(
@@ -395,15 +501,21 @@ class GitilesImportTestCase(test_case.TestCase):
           id='non-gitiles',
       ),
     ]
+    self.mock(projects, 'get_projects', mock.Mock(return_value=projs))
+    self.mock(projects, 'get_project', lambda project_id: {
+      p.id: p for p in projs
+    }.get(project_id))
     RefType = project_config_pb2.RefsCfg.Ref
-    projects.get_refs.return_value = {
+    self.mock(projects, 'get_refs', mock.Mock(return_value={
       'chromium': [
         RefType(name='refs/heads/master'),
         RefType(name='refs/heads/release42', config_path='/my-configs'),
       ],
-    }
+      'bad_location': None,
+    }))
 
-    gitiles_import.import_projects()
+    for cs in gitiles_import._list_project_config_sets():
+      gitiles_import.run_import_task(cs)
 
     self.assertEqual(gitiles_import._import_config_set.call_count, 3)
     gitiles_import._import_config_set.assert_any_call(
@@ -485,7 +597,9 @@ class GitilesImportTestCase(test_case.TestCase):
     with self.assertRaises(gitiles_import.NotFoundError):
       gitiles_import.import_ref('chromium', 'refs/heads/release42')
 
-  def test_import_projects_exception(self):
+  def test_run_import_task_exception(self):
+    gae_ts_mon.reset_for_unittest()
+    gae_ts_mon.initialize()
     self.mock(gitiles_import, 'import_project', mock.Mock())
     gitiles_import.import_project.side_effect = Exception
     self.mock(projects, 'get_refs', mock.Mock(return_value={
@@ -511,29 +625,118 @@ class GitilesImportTestCase(test_case.TestCase):
       )
     ]
 
-    gitiles_import.import_projects()
+    for cs in gitiles_import._list_project_config_sets():
+      gitiles_import.run_import_task(cs)
     self.assertEqual(gitiles_import.import_project.call_count, 2)
 
-  def test_import_projects_canonical(self):
-    self.mock(gitiles_import, 'import_project', mock.Mock())
-    self.mock(projects, 'get_refs', mock.Mock(return_value={
-      'chromium': [],
-    }))
-    self.mock(projects, 'get_projects', mock.Mock())
-    projects.get_projects.return_value = [
-      service_config_pb2.Project(
+  def test_run_import_task_canonical(self):
+    gae_ts_mon.reset_for_unittest()
+    gae_ts_mon.initialize()
+    self.mock(gitiles_import, '_import_config_set', mock.Mock())
+    self.mock(projects, 'get_project', mock.Mock())
+    projects.get_project.return_value = service_config_pb2.Project(
         id='chromium',
         config_location=service_config_pb2.ConfigSetLocation(
           url='https://localhost/a/chromium/src.git/',
           storage_type=service_config_pb2.ConfigSetLocation.GITILES,
         ),
-      ),
-    ]
+    )
 
-    gitiles_import.import_projects()
-    gitiles_import.import_project.assert_called_once_with(
-        'chromium',
-        gitiles.Location.parse_resolve('https://localhost/chromium/src'))
+    gitiles_import.run_import_task('projects/chromium')
+    gitiles_import._import_config_set.assert_called_once_with(
+        'projects/chromium', 'https://localhost/chromium/src/+/refs/heads/luci')
+
+  def test_run_import_task(self):
+    gae_ts_mon.reset_for_unittest()
+    gae_ts_mon.initialize()
+    self.mock(gitiles_import, 'import_config_set', mock.Mock())
+
+    gitiles_import.run_import_task('projects/chromium')
+
+    gitiles_import.import_config_set.assert_called_once_with(
+        'projects/chromium')
+    self.assertIsNone(storage.import_lease_key('projects/chromium').get())
+    self.assertEqual(1, metrics.import_duration.get(
+        fields={'config_set': 'projects/chromium', 'success': True}).count)
+
+  def test_run_import_task_failure(self):
+    gae_ts_mon.reset_for_unittest()
+    gae_ts_mon.initialize()
+    self.mock(gitiles_import, 'import_config_set', mock.Mock())
+    gitiles_import.import_config_set.side_effect = gitiles_import.Error('bad')
+
+    gitiles_import.run_import_task('projects/chromium')
+
+    self.assertIsNone(storage.import_lease_key('projects/chromium').get())
+    self.assertEqual(1, metrics.import_duration.get(
+        fields={'config_set': 'projects/chromium', 'success': False}).count)
+
+  def test_run_import_task_leased(self):
+    now = datetime.datetime(2017, 1, 1)
+    self.mock_now(now)
+    self.mock(gitiles_import, 'import_config_set', mock.Mock())
+    storage.ImportLease(
+        key=storage.import_lease_key('projects/chromium'),
+        owner='another task',
+        expiration_ts=now + datetime.timedelta(minutes=1)).put()
+
+    gitiles_import.run_import_task('projects/chromium')
+    self.assertFalse(gitiles_import.import_config_set.called)
+
+    # The lease of a task that died expires.
+    self.mock_now(now, 120)
+    gitiles_import.run_import_task('projects/chromium')
+    gitiles_import.import_config_set.assert_called_once_with(
+        'projects/chromium')
+
+  def test_enqueue_imports(self):
+    self.mock_now(datetime.datetime(2017, 1, 1))
+    self.mock(utils, 'enqueue_task_async', mock.Mock(return_value=future(True)))
+    for cs, days in (('projects/old', 1), ('projects/recent', 10)):
+      storage.ConfigSet(
+          id=cs,
+          location='https://localhost/project',
+          latest_revision='deadbeef',
+          latest_revision_time=datetime.datetime(2016, 1, days),
+      ).put()
+
+    self.assertTrue(gitiles_import.enqueue_imports(
+        ['projects/old', 'projects/new', 'projects/recent']))
+
+    urls = [c[1]['url'] for c in utils.enqueue_task_async.call_args_list]
+    self.assertEqual(urls, [
+      '/internal/task/luci-config/gitiles_import/projects/new',
+      '/internal/task/luci-config/gitiles_import/projects/recent',
+      '/internal/task/luci-config/gitiles_import/projects/old',
+    ])
+    names = [c[1]['name'] for c in utils.enqueue_task_async.call_args_list]
+    self.assertEqual(len(set(names)), 3)
+    for c in utils.enqueue_task_async.call_args_list:
+      self.assertEqual(c[1]['queue_name'], 'gitiles-import')
+
+    # Enqueueing again within the same period reuses task names.
+    utils.enqueue_task_async.reset_mock()
+    gitiles_import.enqueue_imports(['projects/old'])
+    self.assertIn(utils.enqueue_task_async.call_args[1]['name'], names)
+
+  def test_list_project_config_sets(self):
+    self.mock(projects, 'get_projects', mock.Mock(return_value=[
+      service_config_pb2.Project(
+          id='chromium',
+          config_location=service_config_pb2.ConfigSetLocation(
+            url='https://localhost/chromium/src/',
+            storage_type=service_config_pb2.ConfigSetLocation.GITILES,
+          ),
+      ),
+      service_config_pb2.Project(id='non-gitiles'),
+    ]))
+    self.mock(projects, 'get_refs', mock.Mock(return_value={
+      'chromium': [project_config_pb2.RefsCfg.Ref(name='refs/heads/master')],
+    }))
+    self.assertEqual(gitiles_import._list_project_config_sets(), [
+      'projects/chromium',
+      'projects/chromium/refs/heads/master',
+    ])
 
 
 if __name__ == '__main__':
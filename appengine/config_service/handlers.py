@@ -25,6 +25,13 @@ class CronGitilesImport(webapp2.RequestHandler):
     gitiles_import.cron_run_import()
 
 
+class TaskGitilesImport(webapp2.RequestHandler):
+  """Imports a single config set from Gitiles."""
+  @decorators.require_taskqueue(gitiles_import.IMPORT_QUEUE)
+  def post(self, config_set):
+    gitiles_import.run_import_task(config_set)
+
+
 class CronServicesMetadataRequest(webapp2.RequestHandler):
   """Updates stored service metadata."""
   @decorators.require_cronjob
@@ -81,5 +88,8 @@ def get_backend_routes():  # pragma: no cover
       webapp2.Route(
           r'/internal/cron/luci-config/update_services_metadata',
           CronServicesMetadataRequest
-      )
+      ),
+      webapp2.Route(
+          r'/internal/task/luci-config/gitiles_import/<config_set:.+>',
+          TaskGitilesImport),
   ]
@@ -9,6 +9,7 @@ APP_DIR = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, os.path.join(APP_DIR, 'components', 'third_party'))
 
 import endpoints
+import gae_ts_mon
 import webapp2
 
 from components import utils
@@ -45,8 +46,10 @@ def create_endpoints_app():  # pragma: no cover
 def create_backend_app():  # pragma: no cover
   """Returns WSGI app for backend."""
   bootstrap_templates()
-  return webapp2.WSGIApplication(
+  app = webapp2.WSGIApplication(
       handlers.get_backend_routes(), debug=utils.is_local_dev_server())
+  gae_ts_mon.initialize(app=app, cron_module='backend')
+  return app
 
 
 def initialize():  # pragma: no cover
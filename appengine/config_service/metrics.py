@@ -0,0 +1,19 @@
+# Copyright 2017 The LUCI Authors. All rights reserved.
+# Use of this source code is governed under the Apache License, Version 2.0
+# that can be found in the LICENSE file.
+
+"""Metrics to track with ts_mon."""
+
+import gae_ts_mon
+
+
+import_duration = gae_ts_mon.CumulativeDistributionMetric(
+    'config_service/gitiles_import/duration',
+    'Time taken to import a config set from Gitiles.',
+    [
+      gae_ts_mon.StringField('config_set'),
+      gae_ts_mon.BooleanField('success'),
+    ],
+    bucketer=gae_ts_mon.GeometricBucketer(growth_factor=10**0.05),
+    units=gae_ts_mon.MetricsDataUnits.MILLISECONDS,
+)
@@ -90,6 +90,19 @@ class ImportAttempt(ndb.Model):
   validation_messages = ndb.StructuredProperty(ValidationMessage, repeated=True)
 
 
+class ImportLease(ndb.Model):
+  """Prevents concurrent imports of the same config set.
+
+  Entity key:
+    Parent is ConfigSet (does not have to exist).
+    ID is "lease".
+  """
+  # An opaque string identifying the import task that holds the lease.
+  owner = ndb.StringProperty(required=True, indexed=False)
+  # When the lease expires if the owner does not release it.
+  expiration_ts = ndb.DateTimeProperty(required=True, indexed=False)
+
+
 class Revision(ndb.Model):
   """A single revision of a config set. Immutable.
 
@@ -123,6 +136,10 @@ def last_import_attempt_key(config_set):
   return ndb.Key(ConfigSet, config_set, ImportAttempt, 'last')
 
 
+def import_lease_key(config_set):
+  return ndb.Key(ConfigSet, config_set, ImportLease, 'lease')
+
+
 def get_file_keys(config_set, revision):
   return File.query(
       default_options=ndb.QueryOptions(keys_only=True),
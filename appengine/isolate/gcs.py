@@ -48,7 +48,7 @@ CHUNK_SIZE = 512 * 1024
 
 
 # Return value for get_file_info call.
-FileInfo = collections.namedtuple('FileInfo', ['size'])
+FileInfo = collections.namedtuple('FileInfo', ['size', 'etag'])
 
 
 def list_files(bucket, subdir=None, batch_size=100):
@@ -165,18 +165,20 @@ def get_file_info(bucket, filename):
   try:
     stat = cloudstorage.stat(
         '/%s/%s' % (bucket, filename), retry_params=_make_retry_params())
-    return FileInfo(size=stat.st_size)
+    return FileInfo(size=stat.st_size, etag=stat.etag)
   except cloudstorage.errors.NotFoundError:
     return None
 
 
-def read_file(bucket, filename, chunk_size=CHUNK_SIZE):
+def read_file(bucket, filename, chunk_size=CHUNK_SIZE, offset=0, length=None):
   """Reads a file and yields its content in chunks of a given size.
 
   Arguments:
     bucket: a bucket that contains the file.
     filename: name of the file to read.
     chunk_size: maximum size of a chunk to read and yield.
+    offset: byte offset inside the file to start reading from.
+    length: maximum number of bytes to read or None to read to the end.
 
   Yields:
     Chunks of a file (as str objects).
@@ -190,8 +192,15 @@ def read_file(bucket, filename, chunk_size=CHUNK_SIZE):
         path,
         read_buffer_size=chunk_size,
         retry_params=_make_retry_params()) as file_ref:
+      if offset:
+        file_ref.seek(offset)
       while True:
-        data = file_ref.read(chunk_size)
+        to_read = chunk_size
+        if length is not None:
+          to_read = min(chunk_size, length - bytes_read)
+          if to_read <= 0:
+            break
+        data = file_ref.read(to_read)
         if not data:
           break
         bytes_read += len(data)
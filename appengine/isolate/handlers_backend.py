@@ -7,6 +7,7 @@
 import binascii
 import hashlib
 import logging
+import threading
 import time
 import zlib
 
@@ -14,6 +15,7 @@ import webapp2
 from google.appengine import runtime
 from google.appengine.api import datastore_errors
 from google.appengine.api import memcache
+from google.appengine.api import taskqueue
 from google.appengine.ext import ndb
 
 import config
@@ -22,6 +24,7 @@ import mapreduce_jobs
 import model
 import stats
 import template
+import ts_mon_metrics
 from components import decorators
 from components import utils
 
@@ -30,6 +33,29 @@ from components import utils
 ITEMS_TO_DELETE_ASYNC = 100
 
 
+# Pull queue holding the entities pending verification. Each task payload is a
+# ContentEntry key id.
+VERIFY_PULL_QUEUE = 'verify-pull'
+
+
+# The maximum number of tasks leased from VERIFY_PULL_QUEUE by a single batch.
+VERIFY_BATCH_SIZE = 100
+
+
+# The number of GCS files read and hashed concurrently by a batch.
+VERIFY_CONCURRENCY = 8
+
+
+# Duration of the lease on the tasks of a batch. Tasks not deleted by then are
+# leased again by a later batch.
+VERIFY_LEASE_SECS = 10*60
+
+
+# Memcache namespace of the (etag, expanded size) of the GCS files already
+# hashed successfully, keyed by ContentEntry key id.
+_VERIFIED_ETAG_NAMESPACE = 'verified_etag'
+
+
 ### Utility
 
 
@@ -128,6 +154,185 @@ def incremental_delete(query, delete, check=None):
   return deleted_count
 
 
+def enqueue_verify_batch_now():
+  """Enqueues a task to verify a batch of entries from VERIFY_PULL_QUEUE.
+
+  Unlike handlers_endpoints_v1.enqueue_verify_batch_delayed(), the task is
+  neither named nor delayed. Used to chain batches and by the cron trigger.
+  """
+  return utils.enqueue_task('/internal/taskqueue/verify_batch', 'verify')
+
+
+def verify_gcs_entry(entry, gs_bucket):
+  """Reads the GCS file of |entry| and checks it matches its key.
+
+  It doesn't touch the datastore so it can safely be called concurrently.
+
+  Returns:
+    tuple(error, expanded_size, content). error is None if the file matches the
+    entry, otherwise it describes the problem and the entry must be purged.
+    content is only set for small .isolated files, to be saved in memcache.
+
+  Raises:
+    gcs.TransientError, gcs.ForbiddenError or gcs.AuthorizationError if the
+    verification should be retried later.
+  """
+  key_id = entry.key.id()
+  namespace, hash_key = key_id.rsplit('/', 1)
+  gs_file_info = gcs.get_file_info(gs_bucket, key_id)
+
+  # It's None if file is missing.
+  if not gs_file_info:
+    # According to the docs, GS is read-after-write consistent, so a file is
+    # missing only if it wasn't stored at all or it was deleted, in any case
+    # it's not a valid ContentEntry.
+    return 'No such GS file', 0, None
+
+  # Expected stored length and actual length should match.
+  if gs_file_info.size != entry.compressed_size:
+    return (
+        'Bad GS file: expected size is %d, actual size is %d' % (
+            entry.compressed_size, gs_file_info.size),
+        0, None)
+
+  save_to_memcache = (
+      entry.compressed_size <= model.MAX_MEMCACHE_ISOLATED and
+      entry.is_isolated)
+
+  # Do not hash the same GCS object twice, e.g. when the entity couldn't be
+  # saved after a successful verification.
+  etag = getattr(gs_file_info, 'etag', None)
+  if etag and not save_to_memcache:
+    verified = memcache.get(key_id, namespace=_VERIFIED_ETAG_NAMESPACE)
+    if verified and verified[0] == etag:
+      logging.info('%s was already hashed', key_id)
+      return None, verified[1], None
+
+  expanded_size = 0
+  digest = hashlib.sha1()
+  data = None
+  try:
+    # Start a loop where it reads the data in block.
+    stream = gcs.read_file(gs_bucket, key_id)
+    if save_to_memcache:
+      # Wraps stream with a generator that accumulates the data.
+      stream = Accumulator(stream)
+
+    for data in model.expand_content(namespace, stream):
+      expanded_size += len(data)
+      digest.update(data)
+      # Make sure the data is GC'ed.
+      del data
+  except gcs.NotFoundError:
+    # Somebody deleted a file between get_file_info and read_file calls.
+    return 'File was unexpectedly deleted', 0, None
+  except (gcs.ForbiddenError, gcs.AuthorizationError):
+    # Misconfiguration in Google Storage ACLs. Don't delete an entry, it may be
+    # fine.
+    raise
+  except (gcs.FatalError, zlib.error, IOError) as e:
+    # ForbiddenError and AuthorizationError inherit FatalError, so this except
+    # block should be last.
+    # It's broken or unreadable.
+    return (
+        'Failed to read the file (%s): %s' % (e.__class__.__name__, e),
+        0, None)
+
+  # Hashes should match.
+  if digest.hexdigest() != hash_key:
+    return (
+        'SHA-1 do not match data\n'
+        '%d bytes, %d bytes expanded, expected %d bytes' % (
+            entry.compressed_size, expanded_size, entry.expanded_size),
+        0, None)
+
+  if etag:
+    memcache.set(
+        key_id, (etag, expanded_size), time=24*60*60,
+        namespace=_VERIFIED_ETAG_NAMESPACE)
+  content = ''.join(stream.accumulated) if save_to_memcache else None
+  return None, expanded_size, content
+
+
+def verify_gcs_entries(keys, gs_bucket):
+  """Verifies the GCS files of the ContentEntry |keys|.
+
+  Up to VERIFY_CONCURRENCY files are read and hashed at once. The datastore
+  and memcache are updated by the calling thread once all the files are
+  processed.
+
+  Returns:
+    set of the key ids processed. The other ones must be retried later.
+  """
+  done = set()
+  to_check = []
+  for key, entry in zip(keys, ndb.get_multi(keys)):
+    if not entry:
+      logging.error('Failed to find entity %s', key.id())
+      done.add(key.id())
+    elif entry.is_verified or entry.content is not None:
+      # Typically verified by a previous batch.
+      ts_mon_metrics.on_entry_verified('skipped', 0, None)
+      done.add(key.id())
+    else:
+      to_check.append(entry)
+
+  results = {}
+  pending = to_check[::-1]
+  def worker():
+    while True:
+      try:
+        entry = pending.pop()
+      except IndexError:
+        return
+      try:
+        results[entry.key] = verify_gcs_entry(entry, gs_bucket)
+      except Exception as e:
+        logging.warning(
+            'Failed to verify %s (%s): %s',
+            entry.key.id(), e.__class__.__name__, e)
+
+  threads = [
+    threading.Thread(target=worker)
+    for _ in xrange(min(VERIFY_CONCURRENCY, len(to_check)))
+  ]
+  for t in threads:
+    t.start()
+  for t in threads:
+    t.join()
+
+  now = utils.utcnow()
+  to_put = []
+  to_purge = []
+  for entry in to_check:
+    latency = (now - entry.creation_ts).total_seconds()
+    if entry.key not in results:
+      ts_mon_metrics.on_entry_verified('retry', 0, latency)
+      continue
+    done.add(entry.key.id())
+    error, expanded_size, content = results[entry.key]
+    if error:
+      logging.error('Verification failed for %s: %s', entry.key.id(), error)
+      ts_mon_metrics.on_entry_verified('purged', 0, latency)
+      to_purge.append(entry.key)
+      continue
+    entry.expanded_size = expanded_size
+    entry.is_verified = True
+    to_put.append(entry)
+    if content is not None:
+      namespace, hash_key = entry.key.id().rsplit('/', 1)
+      model.save_in_memcache(namespace, hash_key, content)
+    ts_mon_metrics.on_entry_verified(
+        'verified', entry.compressed_size, latency)
+
+  if to_put:
+    ndb.put_multi(to_put)
+    logging.info('%d entries verified', len(to_put))
+  if to_purge:
+    model.delete_entry_and_gs_entry(to_purge)
+  return done
+
+
 ### Restricted handlers
 
 
@@ -336,60 +541,9 @@ class InternalVerifyWorkerHandler(webapp2.RequestHandler):
           'Should not be called with inline content\n%s', original_request)
       return
 
-    # Get GS file size.
-    gs_bucket = config.settings().gs_bucket
-    gs_file_info = gcs.get_file_info(gs_bucket, entry.key.id())
-
-    # It's None if file is missing.
-    if not gs_file_info:
-      # According to the docs, GS is read-after-write consistent, so a file is
-      # missing only if it wasn't stored at all or it was deleted, in any case
-      # it's not a valid ContentEntry.
-      self.purge_entry(entry, 'No such GS file\n%s', original_request)
-      return
-
-    # Expected stored length and actual length should match.
-    if gs_file_info.size != entry.compressed_size:
-      self.purge_entry(entry,
-          'Bad GS file: expected size is %d, actual size is %d\n%s',
-          entry.compressed_size, gs_file_info.size,
-          original_request)
-      return
-
-    save_to_memcache = (
-        entry.compressed_size <= model.MAX_MEMCACHE_ISOLATED and
-        entry.is_isolated)
-    expanded_size = 0
-    digest = hashlib.sha1()
-    data = None
-
     try:
-      # Start a loop where it reads the data in block.
-      stream = gcs.read_file(gs_bucket, entry.key.id())
-      if save_to_memcache:
-        # Wraps stream with a generator that accumulates the data.
-        stream = Accumulator(stream)
-
-      for data in model.expand_content(namespace, stream):
-        expanded_size += len(data)
-        digest.update(data)
-        # Make sure the data is GC'ed.
-        del data
-
-      # Hashes should match.
-      if digest.hexdigest() != hash_key:
-        self.purge_entry(entry,
-            'SHA-1 do not match data\n'
-            '%d bytes, %d bytes expanded, expected %d bytes\n%s',
-            entry.compressed_size, expanded_size,
-            entry.expanded_size, original_request)
-        return
-
-    except gcs.NotFoundError as e:
-      # Somebody deleted a file between get_file_info and read_file calls.
-      self.purge_entry(
-          entry, 'File was unexpectedly deleted\n%s', original_request)
-      return
+      error, expanded_size, content = verify_gcs_entry(
+          entry, config.settings().gs_bucket)
     except (gcs.ForbiddenError, gcs.AuthorizationError) as e:
       # Misconfiguration in Google Storage ACLs. Don't delete an entry, it may
       # be fine. Maybe ACL problems would be fixed before the next retry.
@@ -397,13 +551,8 @@ class InternalVerifyWorkerHandler(webapp2.RequestHandler):
           'CloudStorage auth issues (%s): %s', e.__class__.__name__, e)
       # Abort so the job is retried automatically.
       return self.abort(500)
-    except (gcs.FatalError, zlib.error, IOError) as e:
-      # ForbiddenError and AuthorizationError inherit FatalError, so this except
-      # block should be last.
-      # It's broken or unreadable.
-      self.purge_entry(entry,
-          'Failed to read the file (%s): %s\n%s',
-          e.__class__.__name__, e, original_request)
+    if error:
+      self.purge_entry(entry, '%s\n%s', error, original_request)
       return
 
     # Verified. Data matches the hash.
@@ -413,11 +562,89 @@ class InternalVerifyWorkerHandler(webapp2.RequestHandler):
     logging.info(
         '%d bytes (%d bytes expanded) verified\n%s',
         entry.compressed_size, expanded_size, original_request)
-    if save_to_memcache:
-      model.save_in_memcache(namespace, hash_key, ''.join(stream.accumulated))
+    if content is not None:
+      model.save_in_memcache(namespace, hash_key, content)
     future.wait()
 
 
+class InternalVerifyBatchWorkerHandler(webapp2.RequestHandler):
+  """Verifies a batch of objects stored in Cloud Storage.
+
+  Leases up to VERIFY_BATCH_SIZE tasks from the 'verify-pull' queue, each
+  naming an entity to verify, then reads and hashes the files concurrently.
+  Tasks that failed with a transient error are left in the queue and are leased
+  again once their lease expires.
+  """
+  # pylint: disable=R0201
+  @decorators.silence(
+      datastore_errors.InternalError,
+      datastore_errors.Timeout,
+      datastore_errors.TransactionFailedError,
+      runtime.DeadlineExceededError)
+  @decorators.require_taskqueue('verify')
+  def post(self):
+    start = time.time()
+    queue = taskqueue.Queue(VERIFY_PULL_QUEUE)
+    tasks = queue.lease_tasks(VERIFY_LEASE_SECS, VERIFY_BATCH_SIZE)
+    if not tasks:
+      return
+    if len(tasks) == VERIFY_BATCH_SIZE:
+      # There may be more work pending, chain another batch right away.
+      enqueue_verify_batch_now()
+
+    # Many tasks may name the same entity, e.g. when the same content was
+    # uploaded concurrently by multiple clients.
+    key_ids = sorted(set(t.payload for t in tasks))
+    done = verify_gcs_entries(
+        [model.entry_key_from_id(k) for k in key_ids],
+        config.settings().gs_bucket)
+    queue.delete_tasks([t for t in tasks if t.payload in done])
+    logging.info(
+        'Processed %d/%d entries from %d tasks',
+        len(done), len(key_ids), len(tasks))
+    ts_mon_metrics.on_verify_batch_completed(time.time() - start)
+
+
+class InternalVerifyTriggerHandler(webapp2.RequestHandler):
+  """Triggers a verification batch in case a kick was lost."""
+  @decorators.require_cronjob
+  def get(self):
+    if not enqueue_verify_batch_now():
+      self.abort(500, 'Failed to enqueue a verify task, see logs')
+
+
+class InternalPromoteWorkerHandler(webapp2.RequestHandler):
+  """Copies a frequently retrieved entry into the hot object cache."""
+
+  @decorators.silence(
+      datastore_errors.InternalError,
+      datastore_errors.Timeout,
+      gcs.TransientError,
+      runtime.DeadlineExceededError)
+  @decorators.require_taskqueue('promote')
+  def post(self, namespace, hash_key):
+    entry = model.get_entry_key(namespace, hash_key).get()
+    if not entry or not entry.is_verified:
+      logging.warning('Entry is missing or not verified')
+      return
+    if model.get_hot_content(namespace, hash_key) is not None:
+      logging.info('Already in the hot object cache')
+      return
+    if entry.content is not None:
+      content = entry.content
+      where = 'inline'
+    else:
+      try:
+        content = ''.join(
+            gcs.read_file(config.settings().gs_bucket, entry.key.id()))
+      except gcs.NotFoundError:
+        logging.error('Entity in DB but not in GCS')
+        return
+      where = 'GS; %s' % entry.key.id()
+    if model.save_hot_content(namespace, hash_key, content):
+      stats.add_entry(stats.PROMOTE, len(content), where)
+
+
 class InternalStatsUpdateHandler(webapp2.RequestHandler):
   """Called every few minutes to update statistics."""
   @decorators.require_cronjob
@@ -458,6 +685,8 @@ def get_routes():
     webapp2.Route(
         r'/internal/cron/cleanup/trigger/<name:[a-z_]+>',
         InternalCleanupTriggerHandler),
+    webapp2.Route(
+        r'/internal/cron/verify/trigger', InternalVerifyTriggerHandler),
 
     # Cleanup tasks.
     webapp2.Route(
@@ -477,6 +706,11 @@ def get_routes():
     webapp2.Route(
         r'/internal/taskqueue/verify%s' % namespace_key,
         InternalVerifyWorkerHandler),
+    webapp2.Route(
+        r'/internal/taskqueue/verify_batch', InternalVerifyBatchWorkerHandler),
+    webapp2.Route(
+        r'/internal/taskqueue/promote%s' % namespace_key,
+        InternalPromoteWorkerHandler),
 
     # Stats
     webapp2.Route(
@@ -8,7 +8,6 @@ import binascii
 import datetime
 import hashlib
 import logging
-import os
 import re
 import time
 import zlib
@@ -40,6 +39,22 @@ import stats
 MIN_SIZE_FOR_GS = 501
 
 
+# The maximum number of digests that can be retrieved by a single retrieve_batch
+# request.
+MAX_RETRIEVE_BATCH = 1000
+
+
+# The maximum number of content bytes returned inline by a single retrieve_batch
+# response. It must be well below the 32 MiB App Engine limit once base64
+# encoded.
+MAX_RETRIEVE_BATCH_BYTES = 16*1024*1024
+
+
+# Delay before a batch verifies the entities stored in GCS. Entities stored in
+# the meantime are verified by the same batch.
+VERIFY_BATCH_DELAY_SECS = 1
+
+
 ### Request Types
 
 
@@ -81,6 +96,12 @@ class RetrieveRequest(messages.Message):
   offset = messages.IntegerField(3, default=0)
 
 
+class RetrieveBatchRequest(messages.Message):
+  """Request to retrieve multiple small entries at once."""
+  digests = messages.StringField(1, repeated=True)
+  namespace = messages.MessageField(Namespace, 2)
+
+
 ### Response Types
 
 
@@ -102,6 +123,21 @@ class RetrievedContent(messages.Message):
   url = messages.StringField(2)
 
 
+class RetrievedItem(messages.Message):
+  """Content of one entry retrieved by retrieve_batch, or its GS URL."""
+  digest = messages.StringField(1)
+  content = messages.BytesField(2)
+  url = messages.StringField(3)
+
+
+class RetrievedBatch(messages.Message):
+  """Entries retrieved by retrieve_batch.
+
+  Entries that are missing, or that didn't fit in the response, are omitted.
+  """
+  items = messages.MessageField(RetrievedItem, 1, repeated=True)
+
+
 class PushPing(messages.Message):
   """Indicates whether data storage executed successfully."""
   ok = messages.BooleanField(1)
@@ -130,17 +166,30 @@ class TokenSigner(auth.TokenKind):
 
 
 @ndb.transactional
-def store_and_enqueue_verify_task(entry, task_queue_host):
+def store_and_enqueue_verify_task(entry):
   entry.put()
+  # The entity is verified by a batch leasing it from the pull queue, see
+  # enqueue_verify_batch_delayed().
   taskqueue.add(
-      url='/internal/taskqueue/verify/%s' % entry.key.id(),
-      params={'req': os.environ['REQUEST_LOG_ID']},
-      queue_name='verify',
-      headers={'Host': task_queue_host},
+      payload=entry.key.id(),
+      method='PULL',
+      queue_name='verify-pull',
       transactional=True,
   )
 
 
+def enqueue_verify_batch_delayed():
+  """Enqueues a task to verify the entities stored in the last second.
+
+  The task is named after the current second so concurrent requests share it,
+  and it is delayed so it picks the entities stored by all of them at once.
+  """
+  now = int(utils.time_time())
+  return utils.enqueue_task(
+      '/internal/taskqueue/verify_batch', 'verify',
+      name='verify-%d' % now, countdown=VERIFY_BATCH_DELAY_SECS)
+
+
 def entry_key_or_error(namespace, digest):
   try:
     return model.get_entry_key(namespace, digest)
@@ -283,13 +332,21 @@ class IsolateService(remote.Service):
       content = memcache_entry
       found = 'memcache'
     else:
+      content = model.get_hot_content(
+          request.namespace.namespace, request.digest)
+      found = 'hot'
+    if content is None:
       key = entry_key_or_error(request.namespace.namespace, request.digest)
+      hits = model.record_access_async(
+          request.namespace.namespace, request.digest)
       stored = key.get()
       if stored is None:
         logging.debug('%s', request.digest)
         raise endpoints.NotFoundException('Unable to retrieve the entry.')
       content = stored.content  # will be None if entity is in GCS
       found = 'inline'
+      if model.should_promote(stored, hits.get_result()):
+        self.enqueue_promote(request.namespace.namespace, request.digest)
 
     # Return and log stats here if something has been found.
     if content is not None:
@@ -316,6 +373,64 @@ class IsolateService(remote.Service):
         filename=key.id(),
         expiration=DEFAULT_LINK_EXPIRATION))
 
+  @auth.endpoints_method(RetrieveBatchRequest, RetrievedBatch)
+  @auth.require(acl.isolate_readable)
+  def retrieve_batch(self, request):
+    """Retrieves multiple entries at once.
+
+    Entries stored inline are returned inline, entries stored in GS are returned
+    as signed URLs. Missing entries and entries that do not fit in the response
+    are omitted; the client is expected to fetch them with retrieve.
+    """
+    if not request.namespace:
+      raise endpoints.BadRequestException('namespace is required.')
+    if len(request.digests) > MAX_RETRIEVE_BATCH:
+      raise endpoints.BadRequestException(
+          'Only up to %d items can be retrieved at once' % MAX_RETRIEVE_BATCH)
+    namespace = request.namespace.namespace
+    # Remove duplicates but keep the order.
+    digests = []
+    seen = set()
+    for digest in request.digests:
+      if digest not in seen:
+        seen.add(digest)
+        digests.append(digest)
+
+    cached = memcache.get_multi(digests, namespace='table_%s' % namespace)
+    keys = [
+      entry_key_or_error(namespace, d) for d in digests if d not in cached
+    ]
+    entities = dict(zip(
+        (k.id().rsplit('/', 1)[1] for k in keys), ndb.get_multi(keys)))
+
+    response = RetrievedBatch()
+    budget = MAX_RETRIEVE_BATCH_BYTES
+    returned = 0
+    for digest in digests:
+      content = cached.get(digest)
+      entity = None
+      if content is None:
+        entity = entities.get(digest)
+        if entity is None:
+          continue
+        content = entity.content
+      if content is None:
+        response.items.append(RetrievedItem(
+            digest=digest,
+            url=self.gs_url_signer.get_download_url(
+                filename=entity.key.id(),
+                expiration=DEFAULT_LINK_EXPIRATION)))
+        continue
+      if len(content) > budget:
+        continue
+      budget -= len(content)
+      returned += len(content)
+      response.items.append(RetrievedItem(digest=digest, content=content))
+    logging.debug(
+        'Requested %d, returned %d', len(request.digests), len(response.items))
+    stats.add_entry(stats.RETURN, returned, 'batch; %d' % len(response.items))
+    return response
+
   # TODO(kjlubick): Rework these APIs, the http_method part seems to break
   # API explorer.
   @auth.endpoints_method(
@@ -395,7 +510,7 @@ class IsolateService(remote.Service):
     else:
       # Enqueue verification task transactionally as the entity is stored.
       try:
-        store_and_enqueue_verify_task(entry, utils.get_task_queue_host())
+        store_and_enqueue_verify_task(entry)
       except (
           datastore_errors.Error,
           runtime.apiproxy_errors.CancelledError,
@@ -405,6 +520,8 @@ class IsolateService(remote.Service):
           taskqueue.Error) as e:
         raise endpoints.InternalServerErrorException(
             'Unable to store the entity: %s.' % e.__class__.__name__)
+      # If this fails, the entity is verified by a later batch or the cron job.
+      enqueue_verify_batch_delayed()
 
     stats.add_entry(
         stats.STORE, entry.compressed_size,
@@ -531,6 +648,12 @@ class IsolateService(remote.Service):
           settings.gs_private_key)
     return self._gs_url_signer
 
+  @staticmethod
+  def enqueue_promote(namespace, digest):
+    """Enqueues a task to copy a popular entry into the hot object cache."""
+    return utils.enqueue_task(
+        '/internal/taskqueue/promote/%s/%s' % (namespace, digest), 'promote')
+
   @staticmethod
   def tag_existing(collection):
     """Tag existing digests with new timestamp.
@@ -527,6 +527,96 @@ class IsolateServiceTest(test_case.EndpointsTestCase):
       self.call_api(
           'retrieve', self.message_to_dict(retrieve_request), 200)
 
+  def test_retrieve_hot_cache(self):
+    """Assert that popular entries are promoted to the hot object cache."""
+    self.mock(model, 'HOT_CACHE_MIN_HITS', 2)
+    content = 'Bright star, would I were stedfast as thou art'
+    request = self.store_request(content)
+    self.call_api('store_inline', self.message_to_dict(request), 200)
+    retrieve_request = handlers_endpoints_v1.RetrieveRequest(
+        digest=hash_content(content),
+        namespace=handlers_endpoints_v1.Namespace())
+    for _ in xrange(3):
+      response = self.call_api(
+          'retrieve', self.message_to_dict(retrieve_request), 200)
+      self.assertEqual(content, base64.b64decode(response.json['content']))
+    # Only promoted once.
+    self.assertEqual(1, self.execute_tasks())
+    self.assertEqual(content, model.get_hot_content('default', hash_content(
+        content)))
+
+    # The hot copy is served even if the entity is not readable anymore.
+    model.get_entry_key('default', hash_content(content)).delete()
+    response = self.call_api(
+        'retrieve', self.message_to_dict(retrieve_request), 200)
+    self.assertEqual(content, base64.b64decode(response.json['content']))
+
+    # Deleting the entry also removes it from the hot object cache.
+    self.mock(gcs, 'delete_file', lambda *_args, **_kwargs: None)
+    model.delete_entry_and_gs_entry(
+        [model.get_entry_key('default', hash_content(content))])
+    self.assertEqual(
+        None, model.get_hot_content('default', hash_content(content)))
+
+  def test_retrieve_batch_ok(self):
+    """Assert that inline, memcache and GS entries are retrieved at once."""
+    inline = 'Ode to a Nightingale'
+    request = self.store_request(inline)
+    self.call_api('store_inline', self.message_to_dict(request), 200)
+    cached = 'Ode on Melancholy'
+    model.save_in_memcache('default', hash_content(cached), cached)
+
+    big = pad_string('Endymion')
+    request = self.store_request(big)
+    self.mock(gcs, 'get_file_info', get_file_info_factory(big))
+    self.call_api('finalize_gs_upload', self.message_to_dict(request), 200)
+
+    missing = hash_content('Hyperion')
+    batch_request = handlers_endpoints_v1.RetrieveBatchRequest(
+        digests=[
+          hash_content(inline), hash_content(cached), hash_content(big),
+          missing, hash_content(inline),
+        ],
+        namespace=handlers_endpoints_v1.Namespace())
+    response = self.call_api(
+        'retrieve_batch', self.message_to_dict(batch_request), 200)
+    items = response.json['items']
+    self.assertEqual(
+        [hash_content(inline), hash_content(cached), hash_content(big)],
+        [i['digest'] for i in items])
+    self.assertEqual(inline, base64.b64decode(items[0]['content']))
+    self.assertEqual(cached, base64.b64decode(items[1]['content']))
+    self.assertNotIn('content', items[2])
+    self.assertTrue(items[2]['url'].startswith(self.store_prefix))
+
+    # clear the taskqueue
+    self.assertEqual(1, self.execute_tasks())
+
+  def test_retrieve_batch_over_budget(self):
+    """Assert that entries that do not fit in the response are omitted."""
+    self.mock(handlers_endpoints_v1, 'MAX_RETRIEVE_BATCH_BYTES', 30)
+    contents = ['La Belle Dame sans Merci', 'To Autumn']
+    for content in contents:
+      request = self.store_request(content)
+      self.call_api('store_inline', self.message_to_dict(request), 200)
+    batch_request = handlers_endpoints_v1.RetrieveBatchRequest(
+        digests=[hash_content(c) for c in contents],
+        namespace=handlers_endpoints_v1.Namespace())
+    response = self.call_api(
+        'retrieve_batch', self.message_to_dict(batch_request), 200)
+    self.assertEqual(
+        [hash_content(contents[0])],
+        [i['digest'] for i in response.json['items']])
+
+  def test_retrieve_batch_too_many(self):
+    """Assert that too large batches are rejected."""
+    batch_request = handlers_endpoints_v1.RetrieveBatchRequest(
+        digests=[hash_content(str(i)) for i in xrange(1001)],
+        namespace=handlers_endpoints_v1.Namespace())
+    with self.call_should_fail('400'):
+      self.call_api(
+          'retrieve_batch', self.message_to_dict(batch_request), 200)
+
   def test_server_details_ok(self):
     """Assert that server_details returns the correct version."""
     response = self.call_api('server_details', {}, 200).json
@@ -8,6 +8,7 @@ import collections
 import datetime
 import json
 import logging
+import re
 
 import webapp2
 
@@ -40,6 +41,9 @@ _GVIZ_DESCRIPTION = {
   'downloads_bytes': ('number', 'Downloaded'),
   'contains_requests': ('number', 'Lookups'),
   'contains_lookups': ('number', 'Items looked up'),
+  'hot_cache_hits': ('number', 'Hot cache hits'),
+  'hot_cache_misses': ('number', 'Hot cache misses'),
+  'hot_cache_promotions': ('number', 'Hot cache promotions'),
 }
 
 # Warning: modifying the order here requires updating templates/stats.html.
@@ -54,8 +58,15 @@ _GVIZ_COLUMNS_ORDER = (
   'uploads_bytes',
   'downloads_bytes',
   'contains_lookups',
+  'hot_cache_hits',
+  'hot_cache_misses',
+  'hot_cache_promotions',
 )
 
+# Maximum number of bytes returned by a single RetrieveStreamHandler response.
+# App Engine puts a limit of 32 MiB on a response, including headers.
+MAX_STREAM_SIZE = 32*1024*1024 - 64*1024
+
 _ISOLATED_ROOT_MEMBERS = (
   'algo',
   'command',
@@ -67,6 +78,46 @@ _ISOLATED_ROOT_MEMBERS = (
 )
 
 
+### Utility
+
+
+def parse_range_header(header, size):
+  """Parses a HTTP Range header for an entity of |size| bytes.
+
+  Only a single 'bytes' range is supported. Per RFC 7233, an absent, malformed
+  or unsupported header is ignored and the whole entity should be returned.
+
+  Returns:
+    tuple(first, last) of inclusive byte offsets, or None to return the whole
+    entity.
+
+  Raises:
+    ValueError if the range is not satisfiable.
+  """
+  if not header:
+    return None
+  match = re.match(r'^bytes=(\d*)-(\d*)$', header.strip())
+  if not match or match.groups() == ('', ''):
+    return None
+  first, last = match.groups()
+  if not first:
+    # Suffix range, e.g. 'bytes=-500' for the last 500 bytes.
+    length = int(last)
+    if not length or not size:
+      raise ValueError('Unsatisfiable range %r' % header)
+    return max(size - length, 0), size - 1
+  first = int(first)
+  if first >= size:
+    raise ValueError('Unsatisfiable range %r' % header)
+  if not last:
+    return first, size - 1
+  last = int(last)
+  if last < first:
+    # Syntactically invalid, ignore.
+    return None
+  return first, min(last, size - 1)
+
+
 ### Restricted handlers
 
 
@@ -305,6 +356,79 @@ class ContentHandler(auth.AuthenticatingHandler):
     return actual.issubset(_ISOLATED_ROOT_MEMBERS) and 'files' in actual
 
 
+class RetrieveStreamHandler(auth.AuthenticatingHandler):
+  """Returns the raw content of an entry, with support for HTTP Range requests.
+
+  Contrary to the 'retrieve' endpoint, the content is sent as is, without
+  base64 encoding, and entries in memcache, inline in the datastore or in GCS
+  are all served the same way. The content is the one stored, e.g. compressed
+  in compressed namespaces.
+  """
+
+  @auth.require(acl.isolate_readable)
+  def get(self, namespace, digest):
+    try:
+      raw_data, entity = model.get_content(namespace, digest)
+    except ValueError:
+      self.abort(400, 'Invalid key')
+    except LookupError:
+      self.abort(404, 'Unable to retrieve the entry')
+
+    if raw_data is not None:
+      size = len(raw_data)
+      found = 'memcache' if entity is None else 'inline'
+    else:
+      size = entity.compressed_size
+      found = 'GS; %s' % entity.key.id()
+
+    try:
+      byte_range = parse_range_header(self.request.headers.get('Range'), size)
+    except ValueError as e:
+      self.abort(416, str(e), headers={'Content-Range': 'bytes */%d' % size})
+
+    if byte_range:
+      first, last = byte_range
+    elif size > MAX_STREAM_SIZE:
+      # Only entries in GCS can be that large. Let GCS serve the whole file.
+      signer = gcs.URLSigner(
+          config.settings().gs_bucket,
+          config.settings().gs_client_id_email,
+          config.settings().gs_private_key)
+      stats.add_entry(stats.RETURN, size, found)
+      self.redirect(signer.get_download_url(entity.key.id()))
+      return
+    else:
+      first, last = 0, size - 1
+    # Clients must look at Content-Range and fetch the rest in a follow up
+    # request.
+    last = min(last, first + MAX_STREAM_SIZE - 1)
+    length = last - first + 1
+
+    if raw_data is not None:
+      content = [raw_data[first:last+1]]
+    else:
+      try:
+        content = list(gcs.read_file(
+            config.settings().gs_bucket, entity.key.id(), offset=first,
+            length=length))
+      except cloudstorage.NotFoundError:
+        logging.error('Entity in DB but not in GCS: deleting entity in DB')
+        entity.key.delete()
+        self.abort(404, 'Unable to retrieve the file from GCS')
+
+    stats.add_entry(stats.RETURN, length, found)
+    del self.response.headers['Content-Type']
+    self.response.headers['Content-Type'] = 'application/octet-stream'
+    self.response.headers['Accept-Ranges'] = 'bytes'
+    self.response.headers['ETag'] = '"%s"' % digest
+    if byte_range:
+      self.response.status = 206
+      self.response.headers['Content-Range'] = 'bytes %d-%d/%d' % (
+          first, last, size)
+    for data in content:
+      self.response.write(data)
+
+
 class StatsHandler(webapp2.RequestHandler):
   """Returns the statistics web page."""
   def get(self):
@@ -452,6 +576,10 @@ def get_routes():
       webapp2.Route(r'/', RootHandler),
       webapp2.Route(r'/newui', UIHandler),
     ])
+  routes.append(webapp2.Route(
+      r'/api/isolateservice/v1/retrieve_stream/'
+        r'<namespace:%s>/<digest:[0-9a-f]+>' % model.NAMESPACE_RE,
+      RetrieveStreamHandler))
   routes.extend(handlers_endpoints_v1.get_routes())
   return routes
 
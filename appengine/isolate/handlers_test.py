@@ -15,6 +15,7 @@ import test_env
 test_env.setup_test_env()
 
 import cloudstorage
+from google.appengine.api import taskqueue
 from google.appengine.ext import ndb
 
 import webtest
@@ -228,6 +229,151 @@ class MainTest(test_case.TestCase):
         '/content?namespace=default-gzip&digest=%s' % hashhex, status=404)
     self.assertEqual(None, key.get())
 
+  def test_retrieve_stream(self):
+    self.set_as_reader()
+    hashhex = self.gen_content_inline(content='Foo bar')
+    url = '/api/isolateservice/v1/retrieve_stream/default/%s' % hashhex
+    resp = self.app_frontend.get(url)
+    self.assertEqual(200, resp.status_int)
+    self.assertEqual('Foo bar', resp.body)
+    self.assertEqual('bytes', resp.headers['Accept-Ranges'])
+    self.assertEqual('application/octet-stream', resp.headers['Content-Type'])
+
+    resp = self.app_frontend.get(url, headers={'Range': 'bytes=2-4'})
+    self.assertEqual(206, resp.status_int)
+    self.assertEqual('o b', resp.body)
+    self.assertEqual('bytes 2-4/7', resp.headers['Content-Range'])
+
+    resp = self.app_frontend.get(url, headers={'Range': 'bytes=4-'})
+    self.assertEqual('bar', resp.body)
+    resp = self.app_frontend.get(url, headers={'Range': 'bytes=-2'})
+    self.assertEqual('ar', resp.body)
+    self.assertEqual('bytes 5-6/7', resp.headers['Content-Range'])
+
+    resp = self.app_frontend.get(
+        url, headers={'Range': 'bytes=7-'}, status=416)
+    self.assertEqual('bytes */7', resp.headers['Content-Range'])
+
+  def test_retrieve_stream_missing(self):
+    self.set_as_reader()
+    self.app_frontend.get(
+        '/api/isolateservice/v1/retrieve_stream/default/'
+        '0123456780123456780123456789990123456789',
+        status=404)
+
+  def test_retrieve_stream_gcs(self):
+    content = 'Foo bar'
+    compressed = zlib.compress(content)
+    namespace = 'default-gzip'
+    hashhex = hashlib.sha1(content).hexdigest()
+    calls = []
+
+    def read_file(bucket, key, offset, length):
+      self.assertEqual(u'sample-app', bucket)
+      self.assertEqual(namespace + '/' + hashhex, key)
+      calls.append((offset, length))
+      return [compressed[offset:offset+length]]
+    self.mock(gcs, 'read_file', read_file)
+
+    key = model.get_entry_key(namespace, hashhex)
+    model.new_content_entry(
+        key,
+        is_isolated=False,
+        compressed_size=len(compressed),
+        expanded_size=len(content),
+        is_verified=True).put()
+
+    self.set_as_reader()
+    url = '/api/isolateservice/v1/retrieve_stream/%s/%s' % (namespace, hashhex)
+    resp = self.app_frontend.get(url)
+    self.assertEqual(compressed, resp.body)
+    resp = self.app_frontend.get(url, headers={'Range': 'bytes=3-'})
+    self.assertEqual(206, resp.status_int)
+    self.assertEqual(compressed[3:], resp.body)
+    self.assertEqual(
+        [(0, len(compressed)), (3, len(compressed) - 3)], calls)
+
+  def test_parse_range_header(self):
+    parse = handlers_frontend.parse_range_header
+    self.assertEqual(None, parse(None, 10))
+    self.assertEqual(None, parse('bytes=-', 10))
+    self.assertEqual(None, parse('bytes=0-1,3-4', 10))
+    self.assertEqual(None, parse('bytes=5-2', 10))
+    self.assertEqual((0, 9), parse('bytes=0-', 10))
+    self.assertEqual((2, 9), parse('bytes=2-20', 10))
+    self.assertEqual((7, 9), parse('bytes=-3', 10))
+    self.assertEqual((0, 9), parse('bytes=-30', 10))
+    with self.assertRaises(ValueError):
+      parse('bytes=10-', 10)
+    with self.assertRaises(ValueError):
+      parse('bytes=-0', 10)
+
+  def test_verify_batch(self):
+    good = 'Foo bar' * 100
+    bad = 'Bad content' * 100
+    files = {}
+    keys = []
+    for content in (good, bad, 'Missing' * 100):
+      hashhex = hashlib.sha1(content).hexdigest()
+      key = model.get_entry_key('default', hashhex)
+      model.new_content_entry(
+          key,
+          is_isolated=False,
+          compressed_size=len(content),
+          expanded_size=len(content),
+          is_verified=False).put()
+      keys.append(key)
+      files[key.id()] = content
+      # Enqueue duplicates, they are verified once.
+      for _ in xrange(2):
+        taskqueue.add(
+            payload=key.id(), method='PULL',
+            queue_name=handlers_backend.VERIFY_PULL_QUEUE)
+    # Same size, different content.
+    files[keys[1].id()] = 'X' * len(bad)
+    del files[keys[2].id()]
+
+    def get_file_info(bucket, key_id):
+      self.assertEqual(u'sample-app', bucket)
+      content = files.get(key_id)
+      return gcs.FileInfo(len(content), 'etag') if content else None
+    self.mock(gcs, 'get_file_info', get_file_info)
+    self.mock(gcs, 'read_file', lambda _bucket, key_id: [files[key_id]])
+    self.mock(gcs, 'delete_file', lambda *_args, **_kwargs: None)
+
+    self.assertTrue(handlers_backend.enqueue_verify_batch_now())
+    self.assertEqual(1, self.execute_tasks())
+    self.assertTrue(keys[0].get().is_verified)
+    self.assertEqual(None, keys[1].get())
+    self.assertEqual(None, keys[2].get())
+    self.assertEqual(
+        [],
+        taskqueue.Queue(handlers_backend.VERIFY_PULL_QUEUE).lease_tasks(
+            60, 100))
+
+  def test_verify_gcs_entry_already_hashed(self):
+    content = 'Foo bar' * 100
+    hashhex = hashlib.sha1(content).hexdigest()
+    entry = model.new_content_entry(
+        model.get_entry_key('default', hashhex),
+        is_isolated=False,
+        compressed_size=len(content),
+        expanded_size=len(content),
+        is_verified=False)
+    reads = []
+    def read_file(_bucket, _key_id):
+      reads.append(1)
+      return [content]
+    self.mock(
+        gcs, 'get_file_info', lambda *_: gcs.FileInfo(len(content), 'etag'))
+    self.mock(gcs, 'read_file', read_file)
+    expected = (None, len(content), None)
+    self.assertEqual(
+        expected, handlers_backend.verify_gcs_entry(entry, 'sample-app'))
+    self.assertEqual(
+        expected, handlers_backend.verify_gcs_entry(entry, 'sample-app'))
+    self.assertEqual(1, len(reads))
+
   def test_config(self):
     self.set_as_admin()
     resp = self.app_frontend.get('/restricted/config')
@@ -270,16 +416,19 @@ class MainTest(test_case.TestCase):
     expected = (
         'google.visualization.Query.setResponse({"status":"ok","table":{"rows":'
         '[{"c":[{"v":"Date(2010,0,2)"},{"v":100},{"v":100},{"v":0},{"v":0},{"v"'
-        ':0},{"v":0},{"v":0},{"v":0},{"v":0}]}],"cols":[{"type":"date","id":"ke'
-        'y","label":"Day"},{"type":"number","id":"requests","label":"Total"},{"'
-        'type":"number","id":"other_requests","label":"Other"},{"type":"number"'
-        ',"id":"failures","label":"Failures"},{"type":"number","id":"uploads","'
-        'label":"Uploads"},{"type":"number","id":"downloads","label":"Downloads'
-        '"},{"type":"number","id":"contains_requests","label":"Lookups"},{"type'
-        '":"number","id":"uploads_bytes","label":"Uploaded"},{"type":"number","'
-        'id":"downloads_bytes","label":"Downloaded"},{"type":"number","id":"con'
-        'tains_lookups","label":"Items looked up"}]},"reqId":"0","version":"0.6'
-        '"});')
+        ':0},{"v":0},{"v":0},{"v":0},{"v":0},{"v":0},{"v":0},{"v":0}]}],"cols":'
+        '[{"type":"date","id":"key","label":"Day"},{"type":"number","id":"reque'
+        'sts","label":"Total"},{"type":"number","id":"other_requests","label":"'
+        'Other"},{"type":"number","id":"failures","label":"Failures"},{"type":"'
+        'number","id":"uploads","label":"Uploads"},{"type":"number","id":"downl'
+        'oads","label":"Downloads"},{"type":"number","id":"contains_requests","'
+        'label":"Lookups"},{"type":"number","id":"uploads_bytes","label":"Uploa'
+        'ded"},{"type":"number","id":"downloads_bytes","label":"Downloaded"},{"'
+        'type":"number","id":"contains_lookups","label":"Items looked up"},{"ty'
+        'pe":"number","id":"hot_cache_hits","label":"Hot cache hits"},{"type":"'
+        'number","id":"hot_cache_misses","label":"Hot cache misses"},{"type":"n'
+        'umber","id":"hot_cache_promotions","label":"Hot cache promotions"}]},"'
+        'reqId":"0","version":"0.6"});')
     response = self.app_frontend.get('/isolate/api/v1/stats/days?duration=1')
     self.assertEqual(expected, response.body)
 
@@ -289,16 +438,19 @@ class MainTest(test_case.TestCase):
     expected = (
         'google.visualization.Query.setResponse({"status":"ok","table":{"rows":'
         '[{"c":[{"v":"Date(2010,0,2,3,0,0)"},{"v":10},{"v":10},{"v":0},{"v":0},'
-        '{"v":0},{"v":0},{"v":0},{"v":0},{"v":0}]}],"cols":[{"type":"datetime",'
-        '"id":"key","label":"Time"},{"type":"number","id":"requests","label":"T'
-        'otal"},{"type":"number","id":"other_requests","label":"Other"},{"type"'
-        ':"number","id":"failures","label":"Failures"},{"type":"number","id":"u'
-        'ploads","label":"Uploads"},{"type":"number","id":"downloads","label":"'
-        'Downloads"},{"type":"number","id":"contains_requests","label":"Lookups'
-        '"},{"type":"number","id":"uploads_bytes","label":"Uploaded"},{"type":"'
-        'number","id":"downloads_bytes","label":"Downloaded"},{"type":"number",'
-        '"id":"contains_lookups","label":"Items looked up"}]},"reqId":"0","vers'
-        'ion":"0.6"});')
+        '{"v":0},{"v":0},{"v":0},{"v":0},{"v":0},{"v":0},{"v":0},{"v":0}]}],"co'
+        'ls":[{"type":"datetime","id":"key","label":"Time"},{"type":"number","i'
+        'd":"requests","label":"Total"},{"type":"number","id":"other_requests",'
+        '"label":"Other"},{"type":"number","id":"failures","label":"Failures"},'
+        '{"type":"number","id":"uploads","label":"Uploads"},{"type":"number","i'
+        'd":"downloads","label":"Downloads"},{"type":"number","id":"contains_re'
+        'quests","label":"Lookups"},{"type":"number","id":"uploads_bytes","labe'
+        'l":"Uploaded"},{"type":"number","id":"downloads_bytes","label":"Downlo'
+        'aded"},{"type":"number","id":"contains_lookups","label":"Items looked '
+        'up"},{"type":"number","id":"hot_cache_hits","label":"Hot cache hits"},'
+        '{"type":"number","id":"hot_cache_misses","label":"Hot cache misses"},{'
+        '"type":"number","id":"hot_cache_promotions","label":"Hot cache promoti'
+        'ons"}]},"reqId":"0","version":"0.6"});')
     response = self.app_frontend.get(
         '/isolate/api/v1/stats/hours?duration=1&now=')
     self.assertEqual(expected, response.body)
@@ -309,16 +461,19 @@ class MainTest(test_case.TestCase):
     expected = (
         'google.visualization.Query.setResponse({"status":"ok","table":{"rows":'
         '[{"c":[{"v":"Date(2010,0,2,3,4,0)"},{"v":1},{"v":1},{"v":0},{"v":0},{"'
-        'v":0},{"v":0},{"v":0},{"v":0},{"v":0}]}],"cols":[{"type":"datetime","i'
-        'd":"key","label":"Time"},{"type":"number","id":"requests","label":"Tot'
-        'al"},{"type":"number","id":"other_requests","label":"Other"},{"type":"'
-        'number","id":"failures","label":"Failures"},{"type":"number","id":"upl'
-        'oads","label":"Uploads"},{"type":"number","id":"downloads","label":"Do'
-        'wnloads"},{"type":"number","id":"contains_requests","label":"Lookups"}'
-        ',{"type":"number","id":"uploads_bytes","label":"Uploaded"},{"type":"nu'
-        'mber","id":"downloads_bytes","label":"Downloaded"},{"type":"number","i'
-        'd":"contains_lookups","label":"Items looked up"}]},"reqId":"0","versio'
-        'n":"0.6"});')
+        'v":0},{"v":0},{"v":0},{"v":0},{"v":0},{"v":0},{"v":0},{"v":0}]}],"cols'
+        '":[{"type":"datetime","id":"key","label":"Time"},{"type":"number","id"'
+        ':"requests","label":"Total"},{"type":"number","id":"other_requests","l'
+        'abel":"Other"},{"type":"number","id":"failures","label":"Failures"},{"'
+        'type":"number","id":"uploads","label":"Uploads"},{"type":"number","id"'
+        ':"downloads","label":"Downloads"},{"type":"number","id":"contains_requ'
+        'ests","label":"Lookups"},{"type":"number","id":"uploads_bytes","label"'
+        ':"Uploaded"},{"type":"number","id":"downloads_bytes","label":"Download'
+        'ed"},{"type":"number","id":"contains_lookups","label":"Items looked up'
+        '"},{"type":"number","id":"hot_cache_hits","label":"Hot cache hits"},{"'
+        'type":"number","id":"hot_cache_misses","label":"Hot cache misses"},{"t'
+        'ype":"number","id":"hot_cache_promotions","label":"Hot cache promotion'
+        's"}]},"reqId":"0","version":"0.6"});')
     response = self.app_frontend.get('/isolate/api/v1/stats/minutes?duration=1')
     self.assertEqual(expected, response.body)
 
@@ -24,6 +24,7 @@ import gae_ts_mon
 
 import config
 import handlers_backend
+import stats
 
 
 def create_application():
@@ -34,7 +35,7 @@ def create_application():
     return config.settings().enable_ts_monitoring
 
   gae_ts_mon.initialize(backend, is_enabled_fn=is_enabled_callback)
-  return backend
+  return stats.wrap_application(backend)
 
 
 app = create_application()
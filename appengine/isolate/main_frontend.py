@@ -28,6 +28,7 @@ import gae_ts_mon
 import config
 import handlers_frontend
 import handlers_endpoints_v1
+import stats
 
 
 def create_application():
@@ -47,7 +48,7 @@ def create_application():
       # luci-config service URL.
       config.ConfigApi,
   ])
-  return frontend, api
+  return stats.wrap_application(frontend), stats.wrap_application(api)
 
 
 frontend_app, endpoints_app = create_application()
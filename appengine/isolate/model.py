@@ -33,6 +33,27 @@ MAX_MEMCACHE_ISOLATED = 500*1024
 NAMESPACE_RE = r'[a-z0-9A-Z\-._]+'
 
 
+# An entry retrieved this number of times within HOT_CACHE_WINDOW_SECS is
+# promoted into the hot object cache in memcache.
+HOT_CACHE_MIN_HITS = 10
+
+
+# Duration of the window used to count the retrievals of an entry.
+HOT_CACHE_WINDOW_SECS = 5*60
+
+
+# Maximum size of an entry, as stored, to be admitted in the hot object cache.
+MAX_HOT_CACHE_SIZE = 8*1024*1024
+
+
+# Duration an entry is kept in the hot object cache, unless evicted earlier.
+HOT_CACHE_EXPIRATION_SECS = 60*60
+
+
+# Memcache values are limited to 1Mb so larger content is split in chunks.
+_MEMCACHE_CHUNK_SIZE = 1000*1024
+
+
 #### Models
 
 
@@ -214,6 +235,67 @@ def save_in_memcache(namespace, hash_key, content, async=False):
     logging.error(e)
 
 
+def record_access_async(namespace, hash_key):
+  """Counts a retrieval of an entry in the current time window.
+
+  Returns:
+    ndb.Future that returns the number of retrievals in the window so far, or
+    None if memcache is unavailable.
+  """
+  window = int(utils.time_time() / HOT_CACHE_WINDOW_SECS)
+  return ndb.get_context().memcache_incr(
+      '%s/%d' % (hash_key, window), initial_value=0,
+      namespace='hits_%s' % namespace)
+
+
+def should_promote(entry, hits):
+  """Returns True if the entry should be admitted in the hot object cache.
+
+  Only returns True once per window, when the threshold is reached.
+  """
+  return bool(
+      hits == HOT_CACHE_MIN_HITS and entry.is_verified and
+      entry.compressed_size <= MAX_HOT_CACHE_SIZE)
+
+
+def get_hot_content(namespace, hash_key):
+  """Returns the content of an entry from the hot object cache or None."""
+  namespace_key = 'hot_%s' % namespace
+  num_chunks = memcache.get(hash_key, namespace=namespace_key)
+  if not num_chunks:
+    return None
+  keys = ['%s/%d' % (hash_key, i) for i in xrange(num_chunks)]
+  chunks = memcache.get_multi(keys, namespace=namespace_key)
+  if len(chunks) != num_chunks:
+    # Partially evicted.
+    return None
+  return ''.join(chunks[k] for k in keys)
+
+
+def save_hot_content(namespace, hash_key, content):
+  """Stores the content of an entry in the hot object cache.
+
+  Returns True on success.
+  """
+  namespace_key = 'hot_%s' % namespace
+  chunks = {
+    '%s/%d' % (hash_key, i): content[offset:offset+_MEMCACHE_CHUNK_SIZE]
+    for i, offset in enumerate(
+        xrange(0, max(len(content), 1), _MEMCACHE_CHUNK_SIZE))
+  }
+  failed = memcache.set_multi(
+      chunks, time=HOT_CACHE_EXPIRATION_SECS, namespace=namespace_key)
+  if failed:
+    logging.warning(
+        'Failed to save %d/%d chunks to memcache.\n%s\\%s %d bytes',
+        len(failed), len(chunks), namespace_key, hash_key, len(content))
+    return False
+  # The chunk count is stored last so partial content is never returned.
+  return memcache.set(
+      hash_key, len(chunks), time=HOT_CACHE_EXPIRATION_SECS,
+      namespace=namespace_key)
+
+
 def new_content_entry(key, **kwargs):
   """Generates a new ContentEntry for the request.
 
@@ -241,6 +323,14 @@ def delete_entry_and_gs_entry(keys_to_delete):
   # this function operates only on keys, it can't distinguish "large" entries
   # stored in GS from "small" ones stored inline. So instead it tries to delete
   # all corresponding GS files, silently skipping ones that are not there.
+  # Stop serving the hot object cache copies, if any. The chunks expire on
+  # their own.
+  hot_keys = {}
+  for key in keys_to_delete:
+    namespace, hash_key = key.string_id().rsplit('/', 1)
+    hot_keys.setdefault(namespace, []).append(hash_key)
+  for namespace, hash_keys in hot_keys.iteritems():
+    memcache.delete_multi(hash_keys, namespace='hot_%s' % namespace)
   for key in keys_to_delete:
     # Always delete ContentEntry first.
     futures[key.delete_async()] = key.string_id()
@@ -67,6 +67,28 @@ class MainTest(test_case.TestCase):
     self.assertEqual(2, len(list(model.ContentEntry.query(ancestor=k))))
 
 
+  def test_hot_content(self):
+    self.mock(model, '_MEMCACHE_CHUNK_SIZE', 4)
+    self.assertEqual(None, model.get_hot_content('n', 'a' * 40))
+    self.assertTrue(model.save_hot_content('n', 'a' * 40, '0123456789'))
+    self.assertEqual('0123456789', model.get_hot_content('n', 'a' * 40))
+    self.assertTrue(model.save_hot_content('n', 'b' * 40, ''))
+    self.assertEqual('', model.get_hot_content('n', 'b' * 40))
+
+  def test_record_access(self):
+    self.mock(model, 'HOT_CACHE_MIN_HITS', 2)
+    entry = model.new_content_entry(
+        model.get_entry_key('n', 'a' * 40), is_verified=True,
+        compressed_size=10)
+    hits = [
+      model.record_access_async('n', 'a' * 40).get_result() for _ in xrange(3)
+    ]
+    self.assertEqual([1, 2, 3], hits)
+    self.assertEqual(
+        [False, True, False], [model.should_promote(entry, h) for h in hits])
+    entry.is_verified = False
+    self.assertEqual(False, model.should_promote(entry, 2))
+
 if __name__ == '__main__':
   if '-v' in sys.argv:
     unittest.TestCase.maxDiff = None
@@ -2,7 +2,11 @@
 # Use of this source code is governed under the Apache License, Version 2.0
 # that can be found in the LICENSE file.
 
-"""Generates statistics out of logs. Contains the backend code.
+"""Generates statistics out of counters or logs. Contains the backend code.
+
+The statistics are primarily gathered as memcache counters by the WSGI
+middleware returned by wrap_application(). The logs are only processed for the
+minutes without counters.
 
 The first 100mb of logs read is free. It's important to keep logs concise also
 for general performance concerns. Each http handler should strive to do only one
@@ -10,6 +14,7 @@ log entry at info level per request.
 """
 
 import logging
+import threading
 
 from google.appengine.ext import ndb
 
@@ -35,6 +40,13 @@ class _Snapshot(ndb.Model):
   contains_requests = ndb.IntegerProperty(default=0, indexed=False)
   contains_lookups = ndb.IntegerProperty(default=0, indexed=False)
 
+  # Number of downloads served from the hot object cache, number of downloads
+  # served from the datastore or GCS instead and number of entries promoted to
+  # the hot object cache.
+  hot_cache_hits = ndb.IntegerProperty(default=0, indexed=False)
+  hot_cache_misses = ndb.IntegerProperty(default=0, indexed=False)
+  hot_cache_promotions = ndb.IntegerProperty(default=0, indexed=False)
+
   # Total number of requests to calculate QPS
   requests = ndb.IntegerProperty(default=0, indexed=False)
   # Number of non-200 requests.
@@ -71,12 +83,18 @@ class _Snapshot(ndb.Model):
         utils.to_units(self.contains_requests),
         utils.to_units(self.contains_lookups))
 
+  def hot_cache_as_text(self):
+    return '%s hits, %s misses (%s promoted)' % (
+        utils.to_units(self.hot_cache_hits),
+        utils.to_units(self.hot_cache_misses),
+        utils.to_units(self.hot_cache_promotions))
+
 
 ### Utility
 
 
 # Text to store for the corresponding actions.
-_ACTION_NAMES = ['store', 'return', 'lookup', 'dupe']
+_ACTION_NAMES = ['store', 'return', 'lookup', 'dupe', 'promote']
 
 
 def _parse_line(line, values):
@@ -84,7 +102,7 @@ def _parse_line(line, values):
   """
   if line.count(';') < 2:
     return False
-  action_id, measurement, _rest = line.split('; ', 2)
+  action_id, measurement, rest = line.split('; ', 2)
   action = _ACTION_NAMES.index(action_id)
   measurement = int(measurement)
 
@@ -95,6 +113,10 @@ def _parse_line(line, values):
   elif action == RETURN:
     values.downloads += 1
     values.downloads_bytes += measurement
+    if rest == 'hot':
+      values.hot_cache_hits += 1
+    elif rest == 'inline' or rest.startswith('GS;'):
+      values.hot_cache_misses += 1
     return True
   elif action == LOOKUP:
     values.contains_requests += 1
@@ -102,10 +124,28 @@ def _parse_line(line, values):
     return True
   elif action == DUPE:
     return True
+  elif action == PROMOTE:
+    values.hot_cache_promotions += 1
+    return True
   else:
     return False
 
 
+# Counters accumulated by add_entry() for the current request, flushed by the
+# middleware returned by wrap_application().
+_request_state = threading.local()
+
+
+def _add_line_to_counters(line, counters):
+  """Updates a dict of counters with a processed statistics line."""
+  values = _Snapshot()
+  if _parse_line(line, values):
+    # Skip _Snapshot.to_dict() which adds computed values.
+    for key, value in ndb.Model.to_dict(values).iteritems():
+      if value:
+        counters[key] = counters.get(key, 0) + value
+
+
 def _extract_snapshot_from_logs(start_time, end_time):
   """Returns a _Snapshot from the processed logs for the specified interval.
 
@@ -133,11 +173,11 @@ def _extract_snapshot_from_logs(start_time, end_time):
 
 
 STATS_HANDLER = stats_framework.StatisticsFramework(
-    'global_stats', _Snapshot, _extract_snapshot_from_logs)
+    'global_stats', _Snapshot, _extract_snapshot_from_logs, direct_ingest=True)
 
 
 # Action to log.
-STORE, RETURN, LOOKUP, DUPE = range(4)
+STORE, RETURN, LOOKUP, DUPE, PROMOTE = range(5)
 
 
 def add_entry(action, number, where):
@@ -146,8 +186,35 @@ def add_entry(action, number, where):
   The format is simple enough that it doesn't require a regexp for faster
   processing.
   """
-  stats_framework.add_entry(
-      '%s; %d; %s' % (_ACTION_NAMES[action], number, where))
+  line = '%s; %d; %s' % (_ACTION_NAMES[action], number, where)
+  # Still log the entry, the logs are used when the counters are lost.
+  stats_framework.add_entry(line)
+  counters = getattr(_request_state, 'counters', None)
+  if counters is not None:
+    _add_line_to_counters(line, counters)
+
+
+def wrap_application(app):
+  """Returns a WSGI application counting the requests served by |app|.
+
+  The counters of the entries added with add_entry() during a request are
+  recorded along the request itself, in a single memcache call.
+  """
+  def wrapped(environ, start_response):
+    _request_state.counters = {}
+
+    def counting_start_response(status, headers, exc_info=None):
+      counters = _request_state.counters
+      _request_state.counters = None
+      if counters is not None:
+        counters['requests'] = 1
+        if int(status.split(' ', 1)[0]) >= 400:
+          counters['failures'] = 1
+        STATS_HANDLER.add_counters(counters)
+      return start_response(status, headers, exc_info)
+
+    return app(environ, counting_start_response)
+  return wrapped
 
 
 def generate_stats():
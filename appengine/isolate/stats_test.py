@@ -37,6 +37,27 @@ class Return(webapp2.RequestHandler):
     self.response.write('Yay')
 
 
+class ReturnHot(webapp2.RequestHandler):
+  def get(self):
+    """Generates fake stats."""
+    stats.add_entry(stats.RETURN, 4096, 'hot')
+    self.response.write('Yay')
+
+
+class ReturnInline(webapp2.RequestHandler):
+  def get(self):
+    """Generates fake stats."""
+    stats.add_entry(stats.RETURN, 4096, 'inline')
+    self.response.write('Yay')
+
+
+class Promote(webapp2.RequestHandler):
+  def get(self):
+    """Generates fake stats."""
+    stats.add_entry(stats.PROMOTE, 4096, 'GS; default/1234')
+    self.response.write('Yay')
+
+
 class Lookup(webapp2.RequestHandler):
   def get(self):
     """Generates fake stats."""
@@ -63,6 +84,9 @@ class StatsTest(test_case.TestCase, stats_framework_mock.MockMixIn):
     fake_routes = [
         ('/store', Store),
         ('/return', Return),
+        ('/return_hot', ReturnHot),
+        ('/return_inline', ReturnInline),
+        ('/promote', Promote),
         ('/lookup', Lookup),
         ('/dupe', Dupe),
     ]
@@ -91,6 +115,9 @@ class StatsTest(test_case.TestCase, stats_framework_mock.MockMixIn):
         'downloads': 0,
         'downloads_bytes': 0,
         'failures': 0,
+        'hot_cache_hits': 0,
+        'hot_cache_misses': 0,
+        'hot_cache_promotions': 0,
         'key': datetime.datetime(2010, 1, 2, 3, 4),
         'other_requests': 0,
         'requests': 1,
@@ -115,6 +142,29 @@ class StatsTest(test_case.TestCase, stats_framework_mock.MockMixIn):
     }
     self._test_handler('/return', expected)
 
+  def test_return_hot(self):
+    expected = {
+      'downloads': 1,
+      'downloads_bytes': 4096,
+      'hot_cache_hits': 1,
+    }
+    self._test_handler('/return_hot', expected)
+
+  def test_return_inline(self):
+    expected = {
+      'downloads': 1,
+      'downloads_bytes': 4096,
+      'hot_cache_misses': 1,
+    }
+    self._test_handler('/return_inline', expected)
+
+  def test_promote(self):
+    expected = {
+      'hot_cache_promotions': 1,
+      'other_requests': 1,
+    }
+    self._test_handler('/promote', expected)
+
   def test_lookup(self):
     expected = {
       'contains_lookups': 200,
@@ -128,6 +178,47 @@ class StatsTest(test_case.TestCase, stats_framework_mock.MockMixIn):
     }
     self._test_handler('/dupe', expected)
 
+  def test_direct_ingest(self):
+    stats_framework_mock.reset_timestamp(stats.STATS_HANDLER, self.now)
+    app = webtest.TestApp(
+        stats.wrap_application(self.app.app),
+        extra_environ={'REMOTE_ADDR': 'fake-ip'})
+    self.assertEqual('Yay', app.get('/return_hot').body)
+    self.assertEqual('Yay', app.get('/lookup').body)
+    app.get('/unknown', status=404)
+
+    # The logs are only used for the minutes without counters.
+    called = []
+    def extract_snapshot_from_logs(start_time, _end_time):
+      called.append(start_time)
+      return stats._Snapshot()
+    self.mock(
+        stats.STATS_HANDLER, '_generate_snapshot', extract_snapshot_from_logs)
+    self.mock_now(self.now, 60)
+    self.assertEqual(10, stats.generate_stats())
+    self.assertEqual(9, len(called))
+
+    actual = stats_framework.get_stats(
+        stats.STATS_HANDLER, 'minutes', self.now, 1, True)
+    expected = [
+      {
+        'contains_lookups': 200,
+        'contains_requests': 1,
+        'downloads': 1,
+        'downloads_bytes': 4096,
+        'failures': 1,
+        'hot_cache_hits': 1,
+        'hot_cache_misses': 0,
+        'hot_cache_promotions': 0,
+        'key': datetime.datetime(2010, 1, 2, 3, 4),
+        'other_requests': 1,
+        'requests': 3,
+        'uploads': 0,
+        'uploads_bytes': 0,
+      },
+    ]
+    self.assertEqual(expected, actual)
+
 
 if __name__ == '__main__':
   if '-v' in sys.argv:
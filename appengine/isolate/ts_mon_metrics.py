@@ -0,0 +1,73 @@
+# Copyright 2017 The LUCI Authors. All rights reserved.
+# Use of this source code is governed under the Apache License, Version 2.0
+# that can be found in the LICENSE file.
+
+"""Timeseries metrics."""
+
+import gae_ts_mon
+
+
+### All the metrics.
+
+
+# Custom bucketer with 12% resolution in the range of 1..10**5. Used for
+# durations in milliseconds and latencies in seconds.
+_bucketer = gae_ts_mon.GeometricBucketer(growth_factor=10**0.05,
+                                         num_finite_buckets=100)
+
+
+# Entries processed by the verification pipeline.
+# - result: one of 'verified', 'skipped', 'purged' or 'retry'.
+_verify_entries = gae_ts_mon.CounterMetric(
+    'isolate/verify/entries',
+    'Number of entries processed by the GCS verification pipeline.', [
+        gae_ts_mon.StringField('result'),
+    ])
+
+
+_verify_bytes = gae_ts_mon.CounterMetric(
+    'isolate/verify/bytes',
+    'Number of bytes, as stored in GCS, read and hashed by the verification '
+    'pipeline.', [
+        gae_ts_mon.StringField('result'),
+    ])
+
+
+_verify_latencies = gae_ts_mon.CumulativeDistributionMetric(
+    'isolate/verify/latencies',
+    'Delay between the upload of an entry and the end of its verification, in '
+    'seconds.', [
+        gae_ts_mon.StringField('result'),
+    ],
+    bucketer=_bucketer)
+
+
+_verify_batch_durations = gae_ts_mon.CumulativeDistributionMetric(
+    'isolate/verify/batch_durations',
+    'Wall time spent processing a batch of entries to verify, in '
+    'milliseconds.', None,
+    bucketer=_bucketer)
+
+
+### Public API.
+
+
+def on_entry_verified(result, size, latency):
+  """When the verification of an entry stored in GCS completes.
+
+  Arguments:
+    result: one of 'verified', 'skipped', 'purged' or 'retry'.
+    size: number of bytes read from GCS.
+    latency: seconds elapsed since the entry was stored, or None if unknown.
+  """
+  fields = {'result': result}
+  _verify_entries.increment(fields=fields)
+  if size:
+    _verify_bytes.increment_by(size, fields=fields)
+  if latency is not None:
+    _verify_latencies.add(latency, fields=fields)
+
+
+def on_verify_batch_completed(duration):
+  """When a batch of the verification pipeline completes."""
+  _verify_batch_durations.add(duration * 1000.)
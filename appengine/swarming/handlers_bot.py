@@ -7,6 +7,7 @@
 import base64
 import json
 import logging
+import zlib
 
 import webob
 import webapp2
@@ -965,6 +966,85 @@ class BotTaskUpdateHandler(_BotApiHandler):
         {'must_stop': state == task_result.State.CANCELED, 'ok': True})
 
 
+class BotTaskOutputHandler(_BotApiHandler):
+  """Receives the raw output of a running task from a Bot.
+
+  Unlike BotTaskUpdateHandler, the request body is the output itself, optionally
+  deflated, instead of being base64 encoded in a JSON dict. The bot id, the
+  output offset and the cost are passed as query parameters.
+
+  The final update of a task still goes through BotTaskUpdateHandler.
+  """
+
+  @auth.public  # auth happens in bot_auth.validate_bot_id_and_fetch_config()
+  def post(self, task_id):
+    bot_id = self.request.get('id')
+    if not bot_id:
+      self.abort_with_error(400, error='Missing id')
+    try:
+      output_chunk_start = int(self.request.get('offset'))
+      cost_usd = float(self.request.get('cost_usd') or 0)
+    except ValueError:
+      self.abort_with_error(400, error='Invalid offset or cost_usd')
+    output = self.request.body
+    compression = self.request.get('compression')
+    if compression == 'deflate':
+      try:
+        output = zlib.decompress(output)
+      except zlib.error as e:
+        self.abort_with_error(400, error='Failed to decompress output: %s' % e)
+    elif compression:
+      self.abort_with_error(
+          400, error='Unsupported compression: %s' % compression)
+
+    machine_type = None
+    bot_info = bot_management.get_info_key(bot_id).get()
+    if bot_info:
+      machine_type = bot_info.machine_type
+
+    # Make sure bot self-reported ID matches the authentication token. Raises
+    # auth.AuthorizationError if not.
+    bot_auth.validate_bot_id_and_fetch_config(bot_id, machine_type)
+
+    try:
+      state = task_scheduler.bot_update_task(
+          run_result_key=task_pack.unpack_run_result_key(task_id),
+          bot_id=bot_id,
+          output=output or None,
+          output_chunk_start=output_chunk_start,
+          exit_code=None,
+          duration=None,
+          hard_timeout=None,
+          io_timeout=None,
+          cost_usd=cost_usd,
+          outputs_ref=None,
+          cipd_pins=None,
+          performance_stats=None)
+      if not state:
+        logging.info('Failed to update, please retry')
+        self.abort_with_error(500, error='Failed to update, please retry')
+      bot_management.bot_event(
+          event_type='task_update', bot_id=bot_id,
+          external_ip=self.request.remote_addr,
+          authenticated_as=auth.get_peer_identity().to_bytes(),
+          dimensions=None, state=None,
+          version=None, quarantined=None, task_id=task_id, task_name=None)
+    except ValueError as e:
+      ereporter2.log_request(
+          request=self.request,
+          source='server',
+          category='task_failure',
+          message='Failed to update task: %s' % e)
+      self.abort_with_error(400, error=str(e))
+    except webob.exc.HTTPException:
+      raise
+    except Exception as e:
+      logging.exception('Internal error: %s', e)
+      self.abort_with_error(500, error=str(e))
+    self.send_response(
+        {'must_stop': state == task_result.State.CANCELED, 'ok': True})
+
+
 class BotTaskErrorHandler(_BotApiHandler):
   """It is a specialized version of ereporter2's /ereporter2/api/v1/on_error
   that also attaches a task id to it.
@@ -1049,6 +1129,8 @@ def get_routes():
       ('/swarming/api/v1/bot/task_update', BotTaskUpdateHandler),
       ('/swarming/api/v1/bot/task_update/<task_id:[a-f0-9]+>',
           BotTaskUpdateHandler),
+      ('/swarming/api/v1/bot/task_output/<task_id:[a-f0-9]+>',
+          BotTaskOutputHandler),
       ('/swarming/api/v1/bot/task_error', BotTaskErrorHandler),
       ('/swarming/api/v1/bot/task_error/<task_id:[a-f0-9]+>',
           BotTaskErrorHandler),
@@ -13,6 +13,7 @@ import StringIO
 import sys
 import unittest
 import zipfile
+import zlib
 
 # Setups environment.
 import test_env_handlers
@@ -33,6 +34,7 @@ from server import bot_code
 from server import bot_groups_config
 from server import bot_management
 from server import service_accounts
+from server import task_pack
 from server import task_queues
 
 
@@ -1037,6 +1039,39 @@ class BotApiTest(test_env_handlers.AppTestBase):
         '/swarming/api/v1/bot/task_update', params, status=500)
     self.assertEqual({u'error': u'Sorry!'}, response)
 
+  def test_task_output(self):
+    self.client_create_task_raw(
+        properties=dict(command=['python', 'runtest.py']))
+    params = self.do_handshake()
+    response = self.post_json('/swarming/api/v1/bot/poll', params)
+    task_id = response['manifest']['task_id']
+
+    url = '/swarming/api/v1/bot/task_output/%s' % task_id
+    response = self.app.post(
+        url + '?id=bot1&offset=0&cost_usd=0.1', 'hi\n',
+        content_type='application/octet-stream').json
+    self.assertEqual({u'must_stop': False, u'ok': True}, response)
+    response = self.app.post(
+        url + '?id=bot1&offset=3&cost_usd=0.2&compression=deflate',
+        zlib.compress('there\n'),
+        content_type='application/octet-stream').json
+    self.assertEqual({u'must_stop': False, u'ok': True}, response)
+
+    run_result = task_pack.unpack_run_result_key(task_id).get()
+    self.assertEqual('hi\nthere\n', run_result.get_output())
+    self.assertEqual(0.2, run_result.cost_usd)
+
+    # Corrupted or unexpected body.
+    self.app.post(
+        url + '?id=bot1&offset=9&compression=deflate', 'hi',
+        content_type='application/octet-stream', status=400)
+    self.app.post(
+        url + '?id=bot1&offset=9&compression=bzip2', 'hi',
+        content_type='application/octet-stream', status=400)
+    self.app.post(
+        url + '?id=bot1', 'hi', content_type='application/octet-stream',
+        status=400)
+
   def test_task_failure(self):
     self.mock(random, 'getrandbits', lambda _: 0x88)
     now = datetime.datetime(2010, 1, 2, 3, 4, 5)
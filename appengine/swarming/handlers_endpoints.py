@@ -7,6 +7,7 @@
 import datetime
 import logging
 import os
+import time
 
 from google.appengine.api import datastore_errors
 from google.appengine.api import memcache
@@ -48,6 +49,19 @@ _EDIT = object()
 _VIEW = object()
 
 
+# Maximum number of tasks that can be waited for in a single tasks/wait call.
+_WAIT_MAX_TASKS = 1000
+
+# Maximum duration of a tasks/wait call, to stay well below the 60 seconds
+# deadline of the frontend requests.
+_WAIT_MAX_TIMEOUT = 45
+
+# Delay between two reads of the task results in tasks/wait. The entities are
+# cached in memcache and the cache is updated on each put, so it is mostly
+# memcache reads.
+_WAIT_POLL_INTERVAL = 1.
+
+
 # Add support for BooleanField in protorpc in endpoints GET requests.
 _old_decode_field = protojson.ProtoJson.decode_field
 def _decode_field(self, field, value):
@@ -549,6 +563,73 @@ class SwarmingTasksService(remote.Service):
         matched=len(tasks),
         now=now)
 
+  @gae_ts_mon.instrument_endpoint()
+  @auth.endpoints_method(
+      swarming_rpcs.TasksWaitRequest, swarming_rpcs.TasksWaitResponse,
+      http_method='POST')
+  @auth.require(acl.can_access)
+  def wait(self, request):
+    """Waits until at least one of the tasks is not running anymore.
+
+    Returns the results of all the tasks that stopped running, or an empty list
+    if they are all still pending or running after timeout_secs. It permits to
+    wait for many tasks with a single hanging request instead of polling each
+    of them.
+    """
+    logging.debug('%s', request)
+    if not request.task_ids:
+      raise endpoints.BadRequestException('task_ids is required.')
+    if len(request.task_ids) > _WAIT_MAX_TASKS:
+      raise endpoints.BadRequestException(
+          'Can\'t wait for more than %d tasks.' % _WAIT_MAX_TASKS)
+    try:
+      keys = [
+        task_pack.get_request_and_result_keys(task_id)
+        for task_id in request.task_ids
+      ]
+    except ValueError as e:
+      raise endpoints.BadRequestException(e.message)
+    entities = ndb.get_multi(k for pair in keys for k in pair)
+    results = entities[1::2]
+    for task_id, request_obj, result in zip(
+        request.task_ids, entities[::2], results):
+      if not request_obj or not result:
+        raise endpoints.NotFoundException('%s not found.' % task_id)
+      if not acl.can_view_task(request_obj):
+        raise endpoints.ForbiddenException('%s is not accessible.' % task_id)
+
+    result_keys = [r.key for r in results]
+    deadline = utils.time_time() + max(
+        0, min(request.timeout_secs, _WAIT_MAX_TIMEOUT))
+    while True:
+      done = [
+        r for r in results
+        if r and r.state in task_result.State.STATES_NOT_RUNNING
+      ]
+      remaining = deadline - utils.time_time()
+      if done or remaining <= 0:
+        break
+      time.sleep(min(_WAIT_POLL_INTERVAL, remaining))
+      # Skip the context cache, otherwise the state would never change.
+      results = ndb.get_multi(result_keys, use_cache=False)
+
+    outputs = []
+    if request.include_output:
+      futures = [r.get_output_async() for r in done]
+      for f in futures:
+        output = f.get_result()
+        if output:
+          output = output.decode('utf-8', 'replace')
+        outputs.append(swarming_rpcs.TaskOutput(output=output))
+    return swarming_rpcs.TasksWaitResponse(
+        items=[
+          message_conversion.task_result_to_rpc(
+              r, request.include_performance_stats)
+          for r in done
+        ],
+        outputs=outputs,
+        now=utils.utcnow())
+
   @gae_ts_mon.instrument_endpoint()
   @auth.endpoints_method(
       swarming_rpcs.TasksCountRequest, swarming_rpcs.TasksCount,
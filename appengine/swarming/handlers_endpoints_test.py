@@ -38,6 +38,7 @@ from server import task_pack
 from server import task_queues
 from server import task_request
 from server import task_result
+from server import task_scheduler
 
 
 def message_to_dict(rpc_message):
@@ -922,6 +923,67 @@ class TasksApiTest(BaseTest):
     response = self.call_api('cancel', body={u'tags': [u'os:Win']})
     self.assertEqual(expected, response.json)
 
+  def test_wait_completed(self):
+    """Asserts that wait returns the tasks that completed with their output."""
+    now = datetime.datetime(2010, 1, 2, 3, 4, 5)
+    str_now = unicode(now.strftime(self.DATETIME_NO_MICRO))
+    self.mock_now(now)
+    self.mock(handlers_endpoints.time, 'sleep', lambda _: self.fail())
+    self.client_create_task_raw()
+    self.set_as_bot()
+    task_id = self.bot_run_task()
+    self.set_as_user()
+    _, pending_id = self.client_create_task_raw()
+    body = {
+      'task_ids': [pending_id, task_id],
+      'include_output': True,
+    }
+    actual = self.call_api('wait', body=body).json
+    self.assertEqual(str_now, actual['now'])
+    self.assertEqual(
+        [(task_id, u'COMPLETED')],
+        [(i['task_id'], i['state']) for i in actual['items']])
+    self.assertEqual([{u'output': u'rÉsult string'}], actual['outputs'])
+
+  def test_wait_timeout(self):
+    """Asserts that wait returns no item when all the tasks are pending."""
+    now = datetime.datetime(2010, 1, 2, 3, 4, 5)
+    str_now = unicode(now.strftime(self.DATETIME_NO_MICRO))
+    self.mock_now(now)
+    self.mock(handlers_endpoints.time, 'sleep', lambda _: self.fail())
+    _, task_id = self.client_create_task_raw()
+    body = {'task_ids': [task_id], 'timeout_secs': 0}
+    self.assertEqual({u'now': str_now}, self.call_api('wait', body=body).json)
+
+  def test_wait_canceled_while_waiting(self):
+    """Asserts that wait notices tasks that stop running during the call."""
+    _, task_id = self.client_create_task_raw()
+    request_key, result_key = task_pack.get_request_and_result_keys(task_id)
+    sleeps = []
+    def sleep(duration):
+      sleeps.append(duration)
+      task_scheduler.cancel_task(request_key.get(), result_key)
+    self.mock(handlers_endpoints.time, 'sleep', sleep)
+
+    body = {'task_ids': [task_id], 'timeout_secs': 10}
+    actual = self.call_api('wait', body=body).json
+    self.assertEqual([1.], sleeps)
+    self.assertEqual(
+        [(task_id, u'CANCELED')],
+        [(i['task_id'], i['state']) for i in actual['items']])
+    self.assertNotIn('outputs', actual)
+
+  def test_wait_bad_request(self):
+    self.call_api('wait', body={'task_ids': []}, status=400)
+    self.call_api('wait', body={'task_ids': ['foo']}, status=400)
+    self.call_api(
+        'wait',
+        body={'task_ids': ['12310'] * (handlers_endpoints._WAIT_MAX_TASKS+1)},
+        status=400)
+
+  def test_wait_unknown(self):
+    self.call_api('wait', body={'task_ids': ['12310']}, status=404)
+
   def test_list_ok(self):
     """Asserts that list requests all TaskResultSummaries."""
     first, second, str_now_120, start, end = self._gen_two_tasks()
@@ -336,7 +336,9 @@ FILES = (
     'utils/file_path.py',
     'utils/fs.py',
     'utils/grpc_proxy.py',
+    'utils/inotify.py',
     'utils/large.py',
+    'utils/local_daemon.py',
     'utils/logging_utils.py',
     'utils/lru.py',
     'utils/net.py',
@@ -77,6 +77,7 @@ class BotAuthTest(test_case.TestCase):
       self.assertEquals(cls, bots_pb2.BotsCfg)
       return None, cfg
     self.mock(config, 'get_self_config', get_self_config_mock)
+    self.mock(bot_groups_config, '_bot_groups_by_revisions', (None, None))
     utils.clear_cache(bot_groups_config._fetch_bot_groups)
 
   def mock_caller(self, ident, ip):
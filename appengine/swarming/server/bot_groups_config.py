@@ -65,17 +65,24 @@ BotGroupConfig = collections.namedtuple('BotGroupConfig', [
 # is optimized for fast lookup of BotGroupConfig by bot_id.
 _BotGroups = collections.namedtuple('_BotGroups', [
   'direct_matches', # dict bot_id => BotGroupConfig
-  'prefix_matches', # list of pairs (bot_id_prefix, BotGroupConfig)
+  'prefix_matches', # dict bot_id_prefix => BotGroupConfig
+  'prefix_lengths', # sorted tuple of distinct lengths of bot_id prefixes
   'machine_types',  # dict machine_type.name => BotGroupConfig
   'default_group',  # fallback BotGroupConfig or None if not defined
 ])
 
 
+# (revisions, _BotGroups) built by _fetch_bot_groups, where revisions identify
+# bots.cfg and bot_config scripts it was built from.
+_bot_groups_by_revisions = (None, None)
+
+
 # Default config to use on unconfigured server.
 def _default_bot_groups():
   return _BotGroups(
     direct_matches={},
-    prefix_matches=[],
+    prefix_matches={},
+    prefix_lengths=(),
     machine_types={},
     default_group=BotGroupConfig(
         version='default',
@@ -130,18 +137,28 @@ def get_bot_group_config(bot_id, machine_type):
   if gr is not None:
     return gr
 
-  for prefix, gr in cfg.prefix_matches:
-    if bot_id.startswith(prefix):
+  # Validated prefixes are never prefixes of each other, so at most one of
+  # them matches.
+  for length in cfg.prefix_lengths:
+    if length > len(bot_id):
+      break
+    gr = cfg.prefix_matches.get(bot_id[:length])
+    if gr is not None:
       return gr
 
   return cfg.default_group
 
 
-def _bot_group_proto_to_tuple(msg, trusted_dimensions):
+def _bot_group_proto_to_tuple(msg, trusted_dimensions, scripts):
   """bots_pb2.BotGroup => BotGroupConfig.
 
   Assumes body of bots_pb2.BotGroup is already validated (logs inconsistencies,
   but does not fail).
+
+  Args:
+    msg: bots_pb2.BotGroup to convert.
+    trusted_dimensions: list of trusted dimension keys.
+    scripts: dict bot_config_script => (rev, content), see _fetch_scripts.
   """
   dimensions = {unicode(k): set() for k in trusted_dimensions}
   for dim_kv_pair in msg.dimensions:
@@ -157,9 +174,7 @@ def _bot_group_proto_to_tuple(msg, trusted_dimensions):
 
   content = ''
   if msg.bot_config_script:
-    rev, content = config.get_self_config(
-        'scripts/' + msg.bot_config_script,
-        store_last_good=True)
+    rev, content = scripts.get(msg.bot_config_script, (None, None))
     if not rev or not content:
       # The entry is invalid. It points to a non existing file. It could be
       # because of a typo in the file name. An empty file is an invalid file,
@@ -237,7 +252,7 @@ def fetch_machine_types():
   Returns:
     A dict mapping the name of a MachineType to a bots_pb2.MachineType.
   """
-  cfg = _fetch_bots_config()
+  _, cfg = _fetch_bots_config()
   if not cfg:
     return {}
 
@@ -250,7 +265,11 @@ def fetch_machine_types():
 
 
 def _fetch_bots_config():
-  """Fetches bots.cfg."""
+  """Fetches bots.cfg.
+
+  Returns:
+    (rev, bots_pb2.BotsCfg) tuple, (None, None) if there's no bots.cfg.
+  """
   # store_last_good=True tells config components to update the config file
   # in a cron job. Here we juts read from the datastore. In case it's the first
   # call ever, or config doesn't exist, it returns (None, None).
@@ -260,28 +279,61 @@ def _fetch_bots_config():
     logging.debug('Using bots.cfg at rev %s', rev)
     # Callers can assume the config is already validated (as promised by
     # components.config). There should be no error at this point.
-  return cfg
+  return rev, cfg
+
+
+def _fetch_scripts(cfg):
+  """Fetches bot_config scripts referenced by bots.cfg.
+
+  Returns:
+    dict bot_config_script => (rev, content).
+  """
+  return {
+    name: config.get_self_config('scripts/' + name, store_last_good=True)
+    for name in set(e.bot_config_script for e in cfg.bot_group)
+    if name
+  }
 
 
 @utils.cache_with_expiration(60)
 def _fetch_bot_groups():
-  """Loads bots.cfg and parses it into _BotGroups struct.
+  """Loads bots.cfg and compiles it into _BotGroups struct.
+
+  The struct is rebuilt only when revision of bots.cfg or of bot_config scripts
+  referenced by it changes.
 
   If bots.cfg doesn't exist, returns default config that allows any caller from
   'bots' IP whitelist to act as a bot.
   """
-  cfg = _fetch_bots_config()
+  global _bot_groups_by_revisions
+  rev, cfg = _fetch_bots_config()
   if not cfg:
     logging.info('Didn\'t find bots.cfg, using default')
     return _default_bot_groups()
 
+  scripts = _fetch_scripts(cfg)
+  revisions = (rev, tuple(sorted(
+      (name, script_rev) for name, (script_rev, _) in scripts.iteritems())))
+  cached_revisions, bot_groups = _bot_groups_by_revisions
+  if rev and cached_revisions == revisions:
+    return bot_groups
+
+  bot_groups = _build_bot_groups(cfg, scripts)
+  if rev:
+    _bot_groups_by_revisions = (revisions, bot_groups)
+  return bot_groups
+
+
+def _build_bot_groups(cfg, scripts):
+  """Compiles bots_pb2.BotsCfg into _BotGroups struct."""
   direct_matches = {}
-  prefix_matches = []
+  prefix_matches = {}
   machine_types = {}
   default_group = None
 
   for entry in cfg.bot_group:
-    group_cfg = _bot_group_proto_to_tuple(entry, cfg.trusted_dimensions or [])
+    group_cfg = _bot_group_proto_to_tuple(
+        entry, cfg.trusted_dimensions or [], scripts)
 
     for bot_id_expr in entry.bot_id:
       try:
@@ -300,7 +352,12 @@ def _fetch_bot_groups():
       if not bot_id_prefix:
         logging.error('Skipping empty bot_id_prefix')
         continue
-      prefix_matches.append((bot_id_prefix, group_cfg))
+      if bot_id_prefix in prefix_matches:
+        logging.error(
+            'Bot prefix "%s" is specified in two different bot groups',
+            bot_id_prefix)
+        continue
+      prefix_matches[bot_id_prefix] = group_cfg
 
     for machine_type in entry.machine_type:
       machine_types[machine_type.name] = group_cfg
@@ -313,7 +370,11 @@ def _fetch_bot_groups():
         default_group = group_cfg
 
   return _BotGroups(
-      direct_matches, prefix_matches, machine_types, default_group)
+      direct_matches=direct_matches,
+      prefix_matches=prefix_matches,
+      prefix_lengths=tuple(sorted(set(len(p) for p in prefix_matches))),
+      machine_types=machine_types,
+      default_group=default_group)
 
 
 def _validate_email(ctx, email, designation):
@@ -87,16 +87,17 @@ class BotGroupsConfigTest(test_case.TestCase):
       for m in messages
     ])
 
-  def mock_config(self, cfg):
+  def mock_config(self, cfg, rev='123'):
     def get_self_config_mock(path, cls=None, **kwargs):
       self.assertEqual({'store_last_good': True}, kwargs)
       if path == 'bots.cfg':
         self.assertEqual(cls, bots_pb2.BotsCfg)
-        return '123', cfg
+        return rev, cfg
       self.assertEqual('scripts/foo.py', path)
-      return '123', 'print "Hi"'
+      return rev, 'print "Hi"'
 
     self.mock(config, 'get_self_config', get_self_config_mock)
+    self.mock(bot_groups_config, '_bot_groups_by_revisions', (None, None))
     utils.clear_cache(bot_groups_config._fetch_bot_groups)
 
   def test_version(self):
@@ -137,9 +138,34 @@ class BotGroupsConfigTest(test_case.TestCase):
       u'bot3': EXPECTED_GROUP_1,
       u'other_bot': EXPECTED_GROUP_2,
     }, cfg.direct_matches)
-    self.assertEquals([('bot', EXPECTED_GROUP_2)], cfg.prefix_matches)
+    self.assertEquals({'bot': EXPECTED_GROUP_2}, cfg.prefix_matches)
+    self.assertEquals((3,), cfg.prefix_lengths)
     self.assertEquals(EXPECTED_GROUP_3, cfg.default_group)
 
+  def test_fetch_bot_groups_reuses_same_revision(self):
+    builds = []
+    build_bot_groups = bot_groups_config._build_bot_groups
+    def build_bot_groups_mock(cfg, scripts):
+      builds.append(cfg)
+      return build_bot_groups(cfg, scripts)
+    self.mock(bot_groups_config, '_build_bot_groups', build_bot_groups_mock)
+
+    self.mock_config(TEST_CONFIG)
+    cfg = bot_groups_config._fetch_bot_groups()
+    utils.clear_cache(bot_groups_config._fetch_bot_groups)
+    self.assertIs(cfg, bot_groups_config._fetch_bot_groups())
+    self.assertEqual(1, len(builds))
+
+    # A new revision of bots.cfg is compiled again.
+    def get_self_config_mock(path, cls=None, **_kwargs):
+      if path == 'bots.cfg':
+        return '456', TEST_CONFIG
+      return '456', 'print "Hi"'
+    self.mock(config, 'get_self_config', get_self_config_mock)
+    utils.clear_cache(bot_groups_config._fetch_bot_groups)
+    self.assertIsNot(cfg, bot_groups_config._fetch_bot_groups())
+    self.assertEqual(2, len(builds))
+
   def test_get_bot_group_config(self):
     self.mock_config(TEST_CONFIG)
     self.assertEquals(
@@ -151,6 +177,31 @@ class BotGroupsConfigTest(test_case.TestCase):
     self.assertEquals(
         EXPECTED_GROUP_2, bot_groups_config.get_bot_group_config('?', 'mt'))
 
+  def test_get_bot_group_config_prefixes(self):
+    cfg = bots_pb2.BotsCfg(
+      bot_group=[
+        bots_pb2.BotGroup(
+            bot_id_prefix=['a-', 'bcd-'], auth=DEFAULT_AUTH_CFG,
+            dimensions=['pool:1']),
+        bots_pb2.BotGroup(
+            bot_id_prefix=['b-', 'xyzw'], auth=DEFAULT_AUTH_CFG,
+            dimensions=['pool:2']),
+        bots_pb2.BotGroup(auth=DEFAULT_AUTH_CFG, dimensions=['pool:3']),
+      ])
+    self.mock_config(cfg)
+    self.assertEquals(
+        (2, 4), bot_groups_config._fetch_bot_groups().prefix_lengths)
+    def pool(bot_id):
+      return bot_groups_config.get_bot_group_config(
+          bot_id, None).dimensions['pool']
+    self.assertEquals([u'1'], pool('a-1'))
+    self.assertEquals([u'1'], pool('bcd-1'))
+    self.assertEquals([u'2'], pool('b-1'))
+    self.assertEquals([u'2'], pool('xyzw'))
+    self.assertEquals([u'3'], pool('bcd'))
+    self.assertEquals([u'3'], pool('a'))
+    self.assertEquals([u'3'], pool('xyz-1'))
+
   def test_empty_config_is_valid(self):
     self.validator_test(bots_pb2.BotsCfg(), [])
 
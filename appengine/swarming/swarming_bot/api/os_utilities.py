@@ -29,6 +29,7 @@ import socket
 import subprocess
 import sys
 import tempfile
+import threading
 import time
 import urllib
 import urllib2
@@ -118,6 +119,19 @@ MONITORING_SCOPES = ['https://www.googleapis.com/auth/monitoring']
 _STARTED_TS = time.time()
 
 
+# Maximum age, in seconds, of the size of a named cache whose directory was left
+# untouched. Files can be modified deep in a cache without touching its root.
+_NAMED_CACHE_SIZE_MAX_AGE = 60*60
+
+
+# Memoized named caches sizes; dict(path: (signature, size, timestamp)).
+_named_caches_sizes = {}
+
+
+# Background sampler of the expensive values of get_state(), if started.
+_state_sampler = None
+
+
 def _write(filepath, content):
   """Writes out a file and returns True on success."""
   logging.info('Writing in %s:\n%s', filepath, content)
@@ -139,6 +153,98 @@ def _safe_read(filepath):
     return None
 
 
+def _get_caches_state():
+  """Returns the state of the caches as reported by get_state()."""
+  isolated_cached_info = get_isolated_cache_info()
+  return {
+    u'cipd': get_cipd_cache_info(),
+    u'isolated': {
+      u'items': len(isolated_cached_info),
+      u'size': sum(i[0] for i in isolated_cached_info.itervalues()),
+    },
+    u'named': get_named_caches_sizes(),
+  }
+
+
+def _get_nb_files_in_temp():
+  """Returns the number of files in TEMP or 'N/A'."""
+  try:
+    return len(os.listdir(tempfile.gettempdir()))
+  except OSError:
+    return 'N/A'
+
+
+class _StateSampler(object):
+  """Refreshes values in a background thread, each on its own cadence.
+
+  It makes reading an expensive value cheap, at the cost of staleness.
+  """
+  def __init__(self, fields):
+    """Arguments:
+    - fields: dict(name: (function, period)) of the values to sample, the
+      function to call and the number of seconds between two calls.
+    """
+    self._fields = fields
+    self._lock = threading.Lock()
+    # dict(name: (value, timestamp)).
+    self._values = {}
+    self._stop = threading.Event()
+    self._thread = threading.Thread(target=self._run, name='state_sampler')
+    self._thread.daemon = True
+
+  def start(self):
+    self._thread.start()
+
+  def stop(self):
+    self._stop.set()
+    self._thread.join()
+
+  def get(self, name):
+    """Returns tuple(value, age in seconds).
+
+    The value is sampled synchronously if it was never sampled before.
+    """
+    with self._lock:
+      item = self._values.get(name)
+    if item is None:
+      item = self._refresh(name)
+    return item[0], time.time() - item[1]
+
+  def _refresh(self, name):
+    item = (self._fields[name][0](), time.time())
+    with self._lock:
+      self._values[name] = item
+    return item
+
+  def _run(self):
+    due = {}
+    while not self._stop.is_set():
+      for name, (_, period) in sorted(self._fields.iteritems()):
+        if due.get(name, 0) <= time.time():
+          try:
+            self._refresh(name)
+          except Exception:
+            # Keep the previous value, if any.
+            logging.exception('Failed to sample %s', name)
+          due[name] = time.time() + period
+      self._stop.wait(max(0, min(due.itervalues()) - time.time()))
+
+
+# Values of get_state() refreshed by the background sampler and their refresh
+# period in seconds.
+_SAMPLED_STATE = {
+  u'caches': (_get_caches_state, 60),
+  u'nb_files_in_temp': (_get_nb_files_in_temp, 60),
+}
+
+
+def _get_sampled_state(name):
+  """Returns tuple(value, age in seconds) for a value in _SAMPLED_STATE."""
+  if _state_sampler:
+    return _state_sampler.get(name)
+  return _SAMPLED_STATE[name][0](), 0
+
+
 ### Public API.
 
 
@@ -657,6 +763,45 @@ def get_named_caches_info():
     return {}
 
 
+def get_named_caches_sizes():
+  """Returns the size of each named cache, keyed by cache name.
+
+  named_cache.py records the size of a cache in state.json when it is
+  uninstalled. For caches saved by older versions, walking a large cache is
+  slow so its size is only recomputed when the root directory of the cache was
+  modified, e.g. when a task mapped the cache, or when the size is older than
+  _NAMED_CACHE_SIZE_MAX_AGE.
+  """
+  now = time.time()
+  sizes = {}
+  paths = set()
+  for name, value in get_named_caches_info().iteritems():
+    entry = value[0]
+    if isinstance(entry, list):
+      # [relative path, size, number of files].
+      if len(entry) > 1 and isinstance(entry[1], (int, long)):
+        sizes[name] = entry[1]
+        continue
+      entry = entry[0]
+    path = os.path.join(u'c', entry)
+    paths.add(path)
+    try:
+      stat = os.stat(path)
+      signature = (stat.st_mtime, stat.st_ctime)
+    except OSError:
+      signature = None
+    item = _named_caches_sizes.get(path)
+    if (not signature or not item or item[0] != signature or
+        item[2] + _NAMED_CACHE_SIZE_MAX_AGE <= now):
+      item = (signature, get_recursive_size(path), now)
+      _named_caches_sizes[path] = item
+    sizes[name] = item[1]
+  # Forget the caches that were evicted.
+  for path in set(_named_caches_sizes).difference(paths):
+    _named_caches_sizes.pop(path, None)
+  return sizes
+
+
 def get_recursive_size(path):
   """Returns the total data size for the specified path."""
   try:
@@ -1091,24 +1236,12 @@ def get_state():
   # leaky resources. So that the server can decided to reboot the bot to clean
   # up.
   tmpdir = tempfile.gettempdir()
-  try:
-    nb_files_in_temp = len(os.listdir(tmpdir))
-  except OSError:
-    nb_files_in_temp = 'N/A'
-  isolated_cached_info = get_isolated_cache_info()
+  caches, caches_age = _get_sampled_state(u'caches')
+  nb_files_in_temp, nb_files_in_temp_age = _get_sampled_state(
+      u'nb_files_in_temp')
   state = {
     u'audio': get_audio(),
-    u'caches': {
-      u'cipd': get_cipd_cache_info(),
-      u'isolated': {
-        u'items': len(isolated_cached_info),
-        u'size': sum(i[0] for i in isolated_cached_info.itervalues()),
-      },
-      u'named': {
-        k: get_recursive_size(os.path.join(u'c', v[0]))
-        for k, v in get_named_caches_info().iteritems()
-      },
-    },
+    u'caches': caches,
     u'cpu_name': get_cpuinfo().get(u'name'),
     u'cost_usd_hour': get_cost_hour(),
     u'cwd': os.getcwd(),
@@ -1135,6 +1268,12 @@ def get_state():
     u'uptime': int(round(get_uptime())),
     u'user': getpass.getuser().decode('utf-8'),
   }
+  if _state_sampler:
+    # Number of seconds since the sampled values were refreshed.
+    state[u'state_age'] = {
+      u'caches': int(round(caches_age)),
+      u'nb_files_in_temp': int(round(nb_files_in_temp_age)),
+    }
   if sys.platform in ('cygwin', 'win32'):
     state[u'cygwin'] = [sys.platform == 'cygwin']
   if sys.platform == 'darwin':
@@ -1155,6 +1294,26 @@ def get_state():
   return state
 
 
+def start_state_sampler():
+  """Starts refreshing the expensive values of get_state() in the background.
+
+  get_state() then returns the last sampled values along their age in
+  'state_age' instead of blocking on slow disk I/O.
+  """
+  global _state_sampler
+  if not _state_sampler:
+    _state_sampler = _StateSampler(_SAMPLED_STATE)
+    _state_sampler.start()
+
+
+def stop_state_sampler():
+  """Stops the sampler started by start_state_sampler()."""
+  global _state_sampler
+  if _state_sampler:
+    _state_sampler.stop()
+    _state_sampler = None
+
+
 ## State mutating.
 
 
@@ -3,13 +3,16 @@
 # Use of this source code is governed under the Apache License, Version 2.0
 # that can be found in the LICENSE file.
 
+import json
 import logging
 import math
 import os
 import re
+import shutil
 import socket
 import subprocess
 import sys
+import tempfile
 import time
 import unittest
 
@@ -155,6 +158,71 @@ class TestOsUtilities(auto_stub.TestCase):
       self.fail(actual[u'quarantined'])
     self.assertEqual(expected, set(actual))
 
+  def test_get_state_sampled(self):
+    sampled = []
+    def get_caches_state():
+      sampled.append(1)
+      return {u'named': {}}
+    self.mock(
+        os_utilities, '_SAMPLED_STATE',
+        {
+          u'caches': (get_caches_state, 3600),
+          u'nb_files_in_temp': (lambda: 0, 3600),
+        })
+    os_utilities.start_state_sampler()
+    try:
+      actual = os_utilities.get_state()
+      actual = os_utilities.get_state()
+    finally:
+      os_utilities.stop_state_sampler()
+    self.assertEqual({u'named': {}}, actual[u'caches'])
+    self.assertEqual(0, actual[u'nb_files_in_temp'])
+    self.assertEqual(
+        [u'caches', u'nb_files_in_temp'], sorted(actual[u'state_age']))
+    # Sampled once by the background thread, except if get_state() won the
+    # race.
+    self.assertIn(len(sampled), (1, 2))
+    self.assertNotIn(u'state_age', os_utilities.get_state())
+
+  def test_get_named_caches_sizes(self):
+    tmp = tempfile.mkdtemp(prefix=u'os_utilities')
+    old_cwd = os.getcwd()
+    try:
+      os.chdir(tmp)
+      os.mkdir(u'c')
+      os.mkdir(os.path.join(u'c', u'ab'))
+      with open(os.path.join(u'c', u'ab', u'foo'), 'wb') as f:
+        f.write('1234')
+      with open(os.path.join(u'c', u'state.json'), 'wb') as f:
+        json.dump({'items': [[u'cache', [u'ab', 1]]]}, f)
+      walked = []
+      old_get_recursive_size = os_utilities.get_recursive_size
+      def get_recursive_size(path):
+        walked.append(path)
+        return old_get_recursive_size(path)
+      self.mock(os_utilities, 'get_recursive_size', get_recursive_size)
+      self.mock(os_utilities, '_named_caches_sizes', {})
+
+      self.assertEqual({u'cache': 4}, os_utilities.get_named_caches_sizes())
+      self.assertEqual({u'cache': 4}, os_utilities.get_named_caches_sizes())
+      self.assertEqual(1, len(walked))
+
+      # Mapping the cache into a task touches its directory.
+      stat = os.stat(os.path.join(u'c', u'ab'))
+      os.utime(os.path.join(u'c', u'ab'), (stat.st_atime, stat.st_mtime + 1))
+      self.assertEqual({u'cache': 4}, os_utilities.get_named_caches_sizes())
+      self.assertEqual(2, len(walked))
+
+      # The size recorded by named_cache.py is used as-is.
+      with open(os.path.join(u'c', u'state.json'), 'wb') as f:
+        json.dump(
+            {'items': [[u'cache', [[u'ab', 10, 1], 1]]], 'version': 3}, f)
+      self.assertEqual({u'cache': 10}, os_utilities.get_named_caches_sizes())
+      self.assertEqual(2, len(walked))
+    finally:
+      os.chdir(old_cwd)
+      shutil.rmtree(tmp)
+
   def test_get_hostname_gce_docker(self):
     self.mock(platforms, 'is_gce', lambda: True)
     self.mock(os.path, 'isfile', lambda _: True)
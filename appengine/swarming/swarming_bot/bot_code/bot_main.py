@@ -79,6 +79,7 @@ PASSLIST = (
   'logs',
   'README',
   'README.md',
+  'run_isolated_daemon.json',
   'swarming.lck',
   'swarming_bot.1.zip',
   'swarming_bot.2.zip',
@@ -613,6 +614,13 @@ def _run_isolated_flags(botobj):
     '--max-cache-size', str(settings['caches']['isolated']['size']),
     '--max-items', str(settings['caches']['isolated']['items']),
   ]
+  # Opt-in: upload the outputs while the task is still running.
+  if os.environ.get('SWARMING_INCREMENTAL_UPLOAD') == '1':
+    args.append('--incremental-upload')
+  # Opt-in: keep the named caches in place while tasks use a copy-on-write
+  # copy.
+  if os.environ.get('SWARMING_NAMED_CACHE_FORK') == '1':
+    args.append('--named-cache-fork')
 
   # Get the gRPC proxy from the config, but allow an environment variable to
   # override.
@@ -708,7 +716,10 @@ def _run_bot(arg_error):
   # TODO(maruel): Set quit_bit when stdin is closed on Windows.
 
   with subprocess42.set_signal_handler(subprocess42.STOP_SIGNALS, handler):
-    return _run_bot_inner(arg_error, quit_bit)
+    try:
+      return _run_bot_inner(arg_error, quit_bit)
+    finally:
+      os_utilities.stop_state_sampler()
 
 
 def _init_ts_mon():
@@ -779,6 +790,10 @@ def _run_bot_inner(arg_error, quit_bit):
 
   _call_hook_safe(True, botobj, 'on_bot_startup')
 
+  # Walking the caches is slow, so it is done in the background instead of
+  # blocking each poll in get_state().
+  os_utilities.start_state_sampler()
+
   # Initial attributes passed to bot.Bot in get_bot above were constructed for
   # 'fake' bot ID ('none'). Refresh them to match the real bot ID, now that we
   # have fully initialize bot.Bot object. Note that 'get_dimensions' and
@@ -1036,6 +1051,9 @@ def _run_manifest(botobj, manifest, start):
       command.extend(['--auth-params-file', auth_params_file])
     if botobj.remote.is_grpc:
       command.append('--is-grpc')
+    # Opt-in: reuse a long-lived run_isolated process across tasks.
+    if os.environ.get('SWARMING_RUN_ISOLATED_DAEMON') == '1':
+      command.append('--run-isolated-daemon')
     # Flags for run_isolated.py are passed through by task_runner.py as-is
     # without interpretation.
     command.append('--')
@@ -463,6 +463,9 @@ class TestBotMain(TestBotBase):
     self.mock(
         bot_main, '_get_dimensions', lambda _: self.attributes['dimensions'])
     self.mock(os_utilities, 'get_state', lambda *_: self.attributes['state'])
+    # threading.Event is mocked, do not start the background sampler.
+    self.mock(os_utilities, 'start_state_sampler', lambda: None)
+    self.mock(os_utilities, 'stop_state_sampler', lambda: None)
 
     # pylint: disable=unused-argument
     class Popen(object):
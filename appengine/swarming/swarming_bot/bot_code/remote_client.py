@@ -3,12 +3,14 @@
 # that can be found in the LICENSE file.
 
 import base64
+import json
 import logging
 import os
 import threading
 import time
 import traceback
 import urllib
+import zlib
 
 from utils import net
 
@@ -42,6 +44,11 @@ AUTH_HEADERS_EXPIRATION_SEC = 4*60+30
 NET_CONNECTION_TIMEOUT_SEC = 3*60
 
 
+# Output smaller than this is sent as-is to task_output; compressing it isn't
+# worth the CPU.
+MIN_OUTPUT_COMPRESSION_SIZE = 1024
+
+
 def createRemoteClient(server, auth, grpc_proxy):
   grpc_proxy = os.environ.get('SWARMING_GRPC_PROXY', grpc_proxy)
   if grpc_proxy:
@@ -229,6 +236,55 @@ class RemoteClientNative(object):
           resp.get('error') if resp else 'Failed to contact server')
     return not resp.get('must_stop', False)
 
+  def post_task_output(self, task_id, bot_id, output, output_chunk_start,
+                       cost_usd):
+    """Posts an intermediate task update carrying output to task_output.
+
+    Unlike post_task_update(), the output is sent as the raw request body
+    instead of being base64 encoded inside a JSON document, optionally deflated.
+    The final update, with the exit code, must still use post_task_update().
+
+    Arguments:
+      output: Incremental output since last call, as a str.
+      output_chunk_start: Total number of bytes of output previously sent, for
+          coherency with the server.
+      cost_usd: Cost of the task so far.
+
+    Returns:
+      False if the task should stop.
+
+    Raises:
+      InternalError if can't contact the server after many attempts or the
+      server replies with an error.
+    """
+    query = [
+      ('id', bot_id),
+      ('offset', output_chunk_start),
+      ('cost_usd', cost_usd),
+    ]
+    if len(output) >= MIN_OUTPUT_COMPRESSION_SIZE:
+      compressed = zlib.compress(output, 1)
+      if len(compressed) < len(output):
+        query.append(('compression', 'deflate'))
+        output = compressed
+    resp = net.url_read(
+        '%s/swarming/api/v1/bot/task_output/%s?%s' % (
+            self._server, task_id, urllib.urlencode(query)),
+        data=output,
+        content_type='application/octet-stream',
+        headers=self.get_authentication_headers(),
+        timeout=NET_CONNECTION_TIMEOUT_SEC,
+        follow_redirects=False)
+    try:
+      resp = json.loads(resp) if resp else None
+    except ValueError:
+      resp = None
+    logging.debug('post_task_output() = %s', resp)
+    if not resp or resp.get('error'):
+      raise InternalError(
+          resp.get('error') if resp else 'Failed to contact server')
+    return not resp.get('must_stop', False)
+
   def post_task_error(self, task_id, bot_id, message):
     """Logs task-specific info to the server"""
     data = {
@@ -203,6 +203,12 @@ class RemoteClientGrpc(object):
     should_continue = True
     return should_continue
 
+  def post_task_output(self, task_id, bot_id, output, output_chunk_start,
+                       cost_usd):
+    # The output is already streamed as raw bytes over ByteStream.
+    return self.post_task_update(
+        task_id, bot_id, {'cost_usd': cost_usd}, (output, output_chunk_start))
+
   def post_task_error(self, task_id, bot_id, message):
     req = tasks_pb2.UpdateTaskResultRequest()
     req.name = task_id + '/result'
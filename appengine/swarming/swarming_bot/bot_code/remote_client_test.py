@@ -115,6 +115,28 @@ class TestRemoteClient(auto_stub.TestCase):
     with self.assertRaises(remote_client.MintOAuthTokenError):
       c.mint_oauth_token('task_id', 'bot_id', 'account_id', ['a', 'b'])
 
+  def test_post_task_output(self):
+    c = remote_client.RemoteClientNative('http://localhost:1', None)
+    calls = []
+    def mocked_url_read(url, **kwargs):
+      calls.append((url, kwargs))
+      return '{"must_stop": true, "ok": true}'
+    self.mock(remote_client.net, 'url_read', mocked_url_read)
+    self.assertEqual(False, c.post_task_output('123', 'bot_id', 'hi', 4, 0.1))
+    self.assertEqual(1, len(calls))
+    url, kwargs = calls[0]
+    self.assertEqual(
+        'http://localhost:1/swarming/api/v1/bot/task_output/123?'
+        'id=bot_id&offset=4&cost_usd=0.1', url)
+    self.assertEqual('hi', kwargs['data'])
+    self.assertEqual('application/octet-stream', kwargs['content_type'])
+
+  def test_post_task_output_err(self):
+    c = remote_client.RemoteClientNative('http://localhost:1', None)
+    self.mock(remote_client.net, 'url_read', lambda *_args, **_kwargs: None)
+    with self.assertRaises(remote_client.InternalError):
+      c.post_task_output('123', 'bot_id', 'hi', 0, 0.1)
+
 
 if __name__ == '__main__':
   logging.basicConfig(
@@ -24,6 +24,7 @@ import time
 import traceback
 
 from utils import file_path
+from utils import local_daemon
 from utils import net
 from utils import on_error
 from utils import subprocess42
@@ -55,6 +56,14 @@ MIN_PACKET_INTERNAL = 10
 OUT_VERSION = 3
 
 
+# Name of the run_isolated daemon's address file, in the bot directory.
+RUN_ISOLATED_DAEMON_FILE = 'run_isolated_daemon.json'
+
+
+# Maximum time to wait for a newly started run_isolated daemon to listen.
+RUN_ISOLATED_DAEMON_START_TIMEOUT = 10.
+
+
 # On Windows, SIGTERM is actually sent as SIGBREAK since there's no real
 # SIGTERM.  SIGBREAK is not defined on posix since it's a pure Windows concept.
 SIG_BREAK_OR_TERM = (
@@ -83,6 +92,71 @@ def get_run_isolated():
   return [sys.executable, THIS_FILE, 'run_isolated']
 
 
+def get_run_isolated_version():
+  """Returns the version a run_isolated daemon must run to be reused.
+
+  It changes whenever the bot code is updated.
+  """
+  st = os.stat(THIS_FILE)
+  return '%s@%d:%d' % (THIS_FILE, st.st_mtime, st.st_size)
+
+
+def _is_alive(pid):
+  try:
+    os.kill(pid, 0)
+    return True
+  except OSError:
+    return False
+
+
+def start_in_run_isolated_daemon(bot_dir, args, cwd, env):
+  """Runs run_isolated in the long-lived run_isolated daemon.
+
+  Starts the daemon if it isn't running. Only supported on POSIX.
+
+  Returns:
+    local_daemon.Process or None if the daemon can't be used.
+  """
+  address_file = os.path.join(bot_dir, RUN_ISOLATED_DAEMON_FILE)
+  version = get_run_isolated_version()
+  address = local_daemon.read_address_file(address_file)
+  if address:
+    try:
+      return local_daemon.connect(address_file, version, args, cwd, env)
+    except local_daemon.Error as e:
+      logging.warning('Failed to use the run_isolated daemon: %s', e)
+    if _is_alive(address['pid']):
+      # Either it is exiting because it's running an older version or it is
+      # unhealthy. Do not start a second one.
+      return None
+    file_path.try_remove(address_file)
+
+  cmd = get_run_isolated() + [
+    '--daemon', address_file,
+    '--daemon-version', version,
+    '--log-file', os.path.join(bot_dir, 'logs', 'run_isolated.log'),
+  ]
+  logging.info('Starting the run_isolated daemon: %s', cmd)
+  try:
+    with open(os.devnull, 'r+b') as devnull:
+      subprocess42.Popen(
+          cmd, cwd=bot_dir, detached=True, close_fds=True,
+          stdin=devnull, stdout=devnull, stderr=devnull)
+  except OSError as e:
+    logging.warning('Failed to start the run_isolated daemon: %s', e)
+    return None
+  for _ in xrange(int(RUN_ISOLATED_DAEMON_START_TIMEOUT * 10)):
+    if os.path.isfile(address_file):
+      try:
+        return local_daemon.connect(address_file, version, args, cwd, env)
+      except local_daemon.Error as e:
+        logging.warning('Failed to use the run_isolated daemon: %s', e)
+        return None
+    time.sleep(0.1)
+  logging.warning('The run_isolated daemon failed to start')
+  return None
+
+
 def get_isolated_args(work_dir, task_details, isolated_result,
                       bot_file, run_isolated_flags):
   """Returns the command to call run_isolated. Mocked in tests."""
@@ -224,7 +298,7 @@ class InternalError(Exception):
 
 def load_and_run(
     in_file, swarming_server, is_grpc, cost_usd_hour, start, out_file,
-    run_isolated_flags, bot_file, auth_params_file):
+    run_isolated_flags, bot_file, auth_params_file, use_daemon=False):
   """Loads the task's metadata, prepares auth environment and executes the task.
 
   This may throw all sorts of exceptions in case of failure. It's up to the
@@ -307,7 +381,7 @@ def load_and_run(
       with luci_context.stage(_tmpdir=work_dir, **context_edits) as ctx_file:
         task_result = run_command(
             remote, task_details, work_dir, cost_usd_hour,
-            start, run_isolated_flags, bot_file, ctx_file)
+            start, run_isolated_flags, bot_file, ctx_file, use_daemon)
   except (ExitSignal, InternalError, remote_client.InternalError) as e:
     # This normally means run_command() didn't get the chance to run, as it
     # itself traps exceptions and will report accordingly. In this case, we want
@@ -396,12 +470,16 @@ def fail_without_command(remote, bot_id, task_id, params, cost_usd_hour,
 
 
 def run_command(remote, task_details, work_dir, cost_usd_hour,
-                task_start, run_isolated_flags, bot_file, ctx_file):
+                task_start, run_isolated_flags, bot_file, ctx_file,
+                use_daemon=False):
   """Runs a command and sends packets to the server to stream results back.
 
   Implements both I/O and hard timeouts. Sends the packets numbered, so the
   server can ensure they are processed in order.
 
+  If use_daemon is True, run_isolated is run by the long-lived run_isolated
+  daemon when possible, saving its startup cost.
+
   Returns:
     Metadata dict with the execution result.
 
@@ -477,14 +555,19 @@ def run_command(remote, task_details, work_dir, cost_usd_hour,
     # Start the command
     try:
       assert cmd and all(isinstance(a, basestring) for a in cmd)
-      proc = subprocess42.Popen(
-          cmd,
-          env=env,
-          cwd=work_dir,
-          detached=True,
-          stdout=subprocess42.PIPE,
-          stderr=subprocess42.STDOUT,
-          stdin=subprocess42.PIPE)
+      proc = None
+      if use_daemon and sys.platform != 'win32':
+        proc = start_in_run_isolated_daemon(
+            os.path.dirname(work_dir), ['-a', args_path], work_dir, env)
+      if not proc:
+        proc = subprocess42.Popen(
+            cmd,
+            env=env,
+            cwd=work_dir,
+            detached=True,
+            stdout=subprocess42.PIPE,
+            stderr=subprocess42.STDOUT,
+            stdin=subprocess42.PIPE)
     except OSError as e:
       return fail_on_start(
           1,
@@ -492,7 +575,8 @@ def run_command(remote, task_details, work_dir, cost_usd_hour,
 
     # Monitor the task
     output_chunk_start = 0
-    stdout = ''
+    # A bytearray is grown in place instead of creating a new str on every read.
+    stdout = bytearray()
     exit_code = None
     had_io_timeout = False
     must_signal_internal_failure = None
@@ -514,9 +598,15 @@ def run_command(remote, task_details, work_dir, cost_usd_hour,
           last_packet = monotonic_time()
           params['cost_usd'] = (
               cost_usd_hour * (last_packet - task_start) / 60. / 60.)
-          if not remote.post_task_update(
-              task_id, bot_id,
-              params, (stdout, output_chunk_start)):
+          if stdout:
+            # The output is sent as raw bytes, skipping the base64 JSON
+            # encoding.
+            should_continue = remote.post_task_output(
+                task_id, bot_id, str(stdout), output_chunk_start,
+                params['cost_usd'])
+          else:
+            should_continue = remote.post_task_update(task_id, bot_id, params)
+          if not should_continue:
             # Server is telling us to stop. Normally task cancellation.
             if not kill_sent:
               logging.warning('Server induced stop; sending SIGKILL')
@@ -524,7 +614,7 @@ def run_command(remote, task_details, work_dir, cost_usd_hour,
               kill_sent = True
 
           output_chunk_start += len(stdout)
-          stdout = ''
+          stdout = bytearray()
 
         # Send signal on timeout if necessary. Both are failures, not
         # internal_failures.
@@ -643,7 +733,8 @@ def run_command(remote, task_details, work_dir, cost_usd_hour,
     # already handling some.
     try:
       remote.post_task_update(
-          task_id, bot_id, params, (stdout, output_chunk_start), exit_code)
+          task_id, bot_id, params, (str(stdout), output_chunk_start),
+          exit_code)
     except remote_client.InternalError as e:
       logging.error('Internal error while finishing the task: %s', e)
       if not must_signal_internal_failure:
@@ -684,6 +775,9 @@ def main(args):
   parser.add_option(
       '--auth-params-file',
       help='Path to a file with bot authentication parameters')
+  parser.add_option(
+      '--run-isolated-daemon', action='store_true',
+      help='Runs run_isolated in a long-lived daemon shared across tasks')
 
   options, args = parser.parse_args(args)
   if not options.in_file or not options.out_file:
@@ -700,7 +794,8 @@ def main(args):
     load_and_run(
         options.in_file, options.swarming_server, options.is_grpc,
         options.cost_usd_hour, options.start, options.out_file,
-        args, options.bot_file, options.auth_params_file)
+        args, options.bot_file, options.auth_params_file,
+        options.run_isolated_daemon)
     return 0
   finally:
     logging.info('quitting')
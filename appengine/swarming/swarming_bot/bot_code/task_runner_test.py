@@ -14,6 +14,7 @@ import sys
 import tempfile
 import time
 import unittest
+import zlib
 
 import test_env_bot_code
 test_env_bot_code.setup_test_env()
@@ -24,6 +25,7 @@ import net_utils
 from depot_tools import fix_encoding
 from utils import file_path
 from utils import large
+from utils import local_daemon
 from utils import logging_utils
 from utils import subprocess42
 from libs import luci_context
@@ -218,7 +220,9 @@ class TestTaskRunner(TestTaskRunnerBase):
 
     def run_command(
         remote, task_details, work_dir,
-        cost_usd_hour, start, run_isolated_flags, bot_file, ctx_file):
+        cost_usd_hour, start, run_isolated_flags, bot_file, ctx_file,
+        use_daemon):
+      self.assertFalse(use_daemon)
       self.assertTrue(remote.uses_auth) # mainly to avoid "unused arg" warning
       self.assertTrue(isinstance(task_details, task_runner.TaskDetails))
       # Necessary for OSX.
@@ -277,7 +281,9 @@ class TestTaskRunner(TestTaskRunnerBase):
 
     def run_command(
         remote, task_details, work_dir,
-        cost_usd_hour, start, run_isolated_flags, bot_file, ctx_file):
+        cost_usd_hour, start, run_isolated_flags, bot_file, ctx_file,
+        use_daemon):
+      self.assertFalse(use_daemon)
       self.assertTrue(remote.uses_auth) # mainly to avoid unused arg warning
       self.assertTrue(isinstance(task_details, task_runner.TaskDetails))
       # Necessary for OSX.
@@ -345,6 +351,41 @@ class TestTaskRunner(TestTaskRunnerBase):
     }
     self.assertEqual(expected, self._run_command(task_details))
 
+  @unittest.skipIf(sys.platform == 'win32', 'posix only')
+  def test_run_command_raw_daemon(self):
+    # This runs the command for real, twice in the same run_isolated daemon.
+    address_file = os.path.join(
+        self.root_dir, task_runner.RUN_ISOLATED_DAEMON_FILE)
+    expected = {
+      u'exit_code': 0,
+      u'hard_timeout': False,
+      u'io_timeout': False,
+      u'must_signal_internal_failure': None,
+      u'version': task_runner.OUT_VERSION,
+    }
+    start = time.time()
+    self.mock(time, 'time', lambda: start + 10)
+    remote = remote_client.createRemoteClient('https://localhost:1', None,
+                                              False)
+    pids = []
+    try:
+      for _ in xrange(2):
+        self.requests(cost_usd=1, exit_code=0)
+        task_details = self.get_task_details('print(\'hi\')')
+        with luci_context.stage(local_auth=None) as ctx_file:
+          self.assertEqual(
+              expected,
+              task_runner.run_command(
+                  remote, task_details, self.work_dir, 3600.,
+                  start, ['--min-free-space', '1'], '/path/to/file', ctx_file,
+                  True))
+        pids.append(local_daemon.read_address_file(address_file)['pid'])
+    finally:
+      for pid in set(pids):
+        os.kill(pid, signal.SIGKILL)
+    self.assertEqual(2, len(pids))
+    self.assertEqual(pids[0], pids[1])
+
   def test_run_command_raw_with_auth(self):
     # This runs the command for real.
     self.requests(cost_usd=1, exit_code=0, auth_headers={'A': 'a'})
@@ -536,20 +577,17 @@ class TestTaskRunner(TestTaskRunnerBase):
         {'must_stop': False, 'ok': True},
       ),
       (
-        'https://localhost:1/swarming/api/v1/bot/task_update/23',
+        'https://localhost:1/swarming/api/v1/bot/task_output/23?'
+            'id=localhost&offset=0&cost_usd=10.0&compression=deflate',
         {
-          'data': {
-            'cost_usd': 10.,
-            'id': 'localhost',
-            'output': base64.b64encode('hi!\n' * 100002),
-            'output_chunk_start': 0,
-            'task_id': 23,
-          },
+          'data': zlib.compress('hi!\n' * 100002, 1),
+          'content_type': 'application/octet-stream',
           'follow_redirects': False,
           'timeout': 180,
           'headers': {},
         },
-        {'must_stop': False, 'ok': True},
+        '{"must_stop": false, "ok": true}',
+        None,
       ),
       (
         'https://localhost:1/swarming/api/v1/bot/task_update/23',
@@ -646,7 +684,8 @@ class TestTaskRunner(TestTaskRunnerBase):
   def test_main(self):
     def load_and_run(
         manifest, swarming_server, is_grpc, cost_usd_hour, start,
-        json_file, run_isolated_flags, bot_file, auth_params_file):
+        json_file, run_isolated_flags, bot_file, auth_params_file,
+        use_daemon):
       self.assertEqual('foo', manifest)
       self.assertEqual('http://localhost', swarming_server)
       self.assertFalse(is_grpc)
@@ -656,6 +695,7 @@ class TestTaskRunner(TestTaskRunnerBase):
       self.assertEqual(['--min-free-space', '1'], run_isolated_flags)
       self.assertEqual('/path/to/bot-file', bot_file)
       self.assertEqual('/path/to/auth-params-file', auth_params_file)
+      self.assertFalse(use_daemon)
 
     self.mock(task_runner, 'load_and_run', load_and_run)
     cmd = [
@@ -674,7 +714,8 @@ class TestTaskRunner(TestTaskRunnerBase):
   def test_main_grpc(self):
     def load_and_run(
         manifest, swarming_server, is_grpc, cost_usd_hour, start,
-        json_file, run_isolated_flags, bot_file, auth_params_file):
+        json_file, run_isolated_flags, bot_file, auth_params_file,
+        use_daemon):
       self.assertEqual('foo', manifest)
       self.assertEqual('http://localhost', swarming_server)
       self.assertTrue(is_grpc)
@@ -684,6 +725,7 @@ class TestTaskRunner(TestTaskRunnerBase):
       self.assertEqual(['--min-free-space', '1'], run_isolated_flags)
       self.assertEqual('/path/to/bot-file', bot_file)
       self.assertEqual('/path/to/auth-params-file', auth_params_file)
+      self.assertFalse(use_daemon)
 
     self.mock(task_runner, 'load_and_run', load_and_run)
     cmd = [
@@ -350,6 +350,17 @@ class TasksCountRequest(messages.Message):
   tags = messages.StringField(6, repeated=True)
 
 
+class TasksWaitRequest(messages.Message):
+  """Request to wait for any of the tasks to stop running."""
+  # Task IDs to wait for. Both summary and run IDs are accepted.
+  task_ids = messages.StringField(1, repeated=True)
+  # Maximum duration of the wait. It is capped by the server.
+  timeout_secs = messages.IntegerField(2, default=30)
+  include_performance_stats = messages.BooleanField(3, default=False)
+  # Returns the output of the tasks that stopped running.
+  include_output = messages.BooleanField(4, default=False)
+
+
 ### Task-Related Responses
 
 
@@ -489,6 +500,17 @@ class TasksCount(messages.Message):
   now = message_types.DateTimeField(2)
 
 
+class TasksWaitResponse(messages.Message):
+  """Results of the tasks that are not running anymore.
+
+  items is empty if all the tasks are still running at the end of the wait.
+  """
+  items = messages.MessageField(TaskResult, 1, repeated=True)
+  # Output of each item, in the same order. Only set with include_output.
+  outputs = messages.MessageField(TaskOutput, 2, repeated=True)
+  now = message_types.DateTimeField(3)
+
+
 class TasksTags(messages.Message):
   """Returns all the tags and tag possibilities in the fleet."""
   tasks_tags = messages.MessageField(StringListPair, 1, repeated=True)
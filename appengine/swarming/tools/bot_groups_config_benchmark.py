@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# Copyright 2017 The LUCI Authors. All rights reserved.
+# Use of this source code is governed under the Apache License, Version 2.0
+# that can be found in the LICENSE file.
+
+"""Benchmarks bot group resolution of bots.cfg.
+
+Generates a bots.cfg with many bots and bot_id prefixes, times its compilation
+into _BotGroups, then times get_bot_group_config() lookups against the linear
+scan of bot_id prefixes that was used before prefixes were indexed.
+"""
+
+import optparse
+import os
+import random
+import sys
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+import test_env
+test_env.setup_test_env()
+
+from proto import bots_pb2
+from server import bot_groups_config
+
+
+def legacy_get_bot_group_config(cfg, prefixes, bot_id):
+  """Scans all prefixes in config order, like get_bot_group_config used to do.
+  """
+  gr = cfg.direct_matches.get(bot_id)
+  if gr is not None:
+    return gr
+  for prefix, gr in prefixes:
+    if bot_id.startswith(prefix):
+      return gr
+  return cfg.default_group
+
+
+def make_bots_cfg(nb_bots, nb_groups, nb_prefixes):
+  """Returns bots_pb2.BotsCfg with nb_bots bots split among nb_groups groups."""
+  auth = bots_pb2.BotAuth(ip_whitelist='bots')
+  cfg = bots_pb2.BotsCfg()
+  per_group = max(nb_bots / nb_groups, 1)
+  for i in xrange(nb_groups):
+    group = cfg.bot_group.add(auth=auth, dimensions=['pool:pool%d' % i])
+    group.bot_id.append('bot%d-{0..%d}' % (i, per_group - 1))
+    group.bot_id_prefix.extend(
+        'prefix%d-' % j for j in xrange(i, nb_prefixes, nb_groups))
+  cfg.bot_group.add(auth=auth, dimensions=['pool:default'])
+  return cfg
+
+
+def timeit(fn, *args):
+  start = time.time()
+  out = fn(*args)
+  return time.time() - start, out
+
+
+def main():
+  parser = optparse.OptionParser(description=sys.modules[__name__].__doc__)
+  parser.add_option(
+      '--bots', type='int', default=100000, help='Default: %default')
+  parser.add_option(
+      '--groups', type='int', default=100, help='Default: %default')
+  parser.add_option(
+      '--prefixes', type='int', default=1000, help='Default: %default')
+  parser.add_option(
+      '--checks', type='int', default=100000,
+      help='Number of get_bot_group_config() calls. Default: %default')
+  parser.add_option('--seed', type='int', default=0, help='Default: %default')
+  options, args = parser.parse_args()
+  if args:
+    parser.error('Unexpected arguments: %s' % args)
+
+  bots_cfg = make_bots_cfg(options.bots, options.groups, options.prefixes)
+  duration, cfg = timeit(bot_groups_config._build_bot_groups, bots_cfg, {})
+  print('bots.cfg with %d bots and %d prefixes compiled in %.2fs' % (
+      len(cfg.direct_matches), len(cfg.prefix_matches), duration))
+
+  prefixes = [
+    (prefix, cfg.prefix_matches[prefix])
+    for entry in bots_cfg.bot_group
+    for prefix in entry.bot_id_prefix
+  ]
+  # Skip bots.cfg fetch, only lookups are timed.
+  bot_groups_config._fetch_bot_groups = lambda: cfg
+  direct = sorted(cfg.direct_matches)
+  rnd = random.Random(options.seed)
+  bot_ids = []
+  for _ in xrange(options.checks):
+    kind = rnd.randrange(3)
+    if kind == 0:
+      bot_ids.append(rnd.choice(direct))
+    elif kind == 1:
+      bot_ids.append(
+          'prefix%d-%d' % (rnd.randrange(options.prefixes), rnd.randrange(10)))
+    else:
+      bot_ids.append('unknown%d' % rnd.randrange(options.bots))
+
+  def run_checks(fn):
+    return [fn(bot_id) for bot_id in bot_ids]
+
+  print('%-28s  %10s  %10s' % ('', 'legacy', 'indexed'))
+  old, old_out = timeit(
+      run_checks, lambda b: legacy_get_bot_group_config(cfg, prefixes, b))
+  new, new_out = timeit(
+      run_checks, lambda b: bot_groups_config.get_bot_group_config(b, None))
+  assert old_out == new_out
+  print('%-28s  %9.3fs  %9.3fs' % (
+      '%d get_bot_group_config' % len(bot_ids), old, new))
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
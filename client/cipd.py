@@ -29,6 +29,14 @@ import isolateserver
 EXECUTABLE_SUFFIX = '.exe' if sys.platform == 'win32' else ''
 
 
+# Process-wide memoization used by get_client(), useful to long-lived
+# processes like the run_isolated daemon.
+# - {(service_url, package_name, immutable tag): instance_id}
+_resolved_tags = {}
+# - {binary_path: (instance_id, (st_mtime, st_size))}
+_installed_clients = {}
+
+
 if sys.platform == 'win32':
   def _ensure_batfile(client_path):
     base, _ = os.path.splitext(client_path)
@@ -352,6 +360,15 @@ def _fetch_cipd_client(disk_cache, instance_id, fetch_url, timeoutfn):
   raise Error('Could not fetch CIPD client after 5 retries')
 
 
+def _get_signature(path):
+  """Returns a value that changes whenever the file is replaced, or None."""
+  try:
+    st = fs.stat(path)
+    return st.st_mtime, st.st_size
+  except OSError:
+    return None
+
+
 @contextlib.contextmanager
 def get_client(service_url, package_name, version, cache_dir, timeout=None):
   """Returns a context manager that yields a CipdClient. A blocking call.
@@ -381,6 +398,8 @@ def get_client(service_url, package_name, version, cache_dir, timeout=None):
   # Is it an instance id already? They look like HEX SHA1.
   if isolated_format.is_valid_hash(version, hashlib.sha1):
     instance_id = version
+  elif (service_url, package_name, version) in _resolved_tags:
+    instance_id = _resolved_tags[(service_url, package_name, version)]
   elif ':' in version:  # it's an immutable tag, cache the resolved version
     # version_cache is {hash(package_name, tag) -> instance id} mapping.
     # It does not take a lot of disk space.
@@ -402,10 +421,27 @@ def get_client(service_url, package_name, version, cache_dir, timeout=None):
         instance_id = resolve_version(
             service_url, package_name, version, timeout=timeoutfn())
         version_cache.write(version_digest, instance_id)
+    _resolved_tags[(service_url, package_name, version)] = instance_id
   else:  # it's a ref, hit the backend
     instance_id = resolve_version(
         service_url, package_name, version, timeout=timeoutfn())
 
+  # A single host can run multiple swarming bots, but ATM they do not share
+  # same root bot directory. Thus, it is safe to use the same name for the
+  # binary.
+  cipd_bin_dir = unicode(os.path.join(cache_dir, 'bin'))
+  binary_path = os.path.join(cipd_bin_dir, 'cipd' + EXECUTABLE_SUFFIX)
+  client = CipdClient(
+      binary_path,
+      package_name=package_name,
+      instance_id=instance_id,
+      service_url=service_url)
+  installed = _installed_clients.get(binary_path)
+  if installed and installed == (instance_id, _get_signature(binary_path)):
+    # This process already installed this exact binary.
+    yield client
+    return
+
   # instance_cache is {instance_id -> client binary} mapping.
   # It is bounded by 5 client versions.
   instance_cache = isolateserver.DiskCache(
@@ -421,11 +457,6 @@ def get_client(service_url, package_name, version, cache_dir, timeout=None):
           service_url, package_name, instance_id, timeout=timeoutfn())
       _fetch_cipd_client(instance_cache, instance_id, fetch_url, timeoutfn)
 
-    # A single host can run multiple swarming bots, but ATM they do not share
-    # same root bot directory. Thus, it is safe to use the same name for the
-    # binary.
-    cipd_bin_dir = unicode(os.path.join(cache_dir, 'bin'))
-    binary_path = os.path.join(cipd_bin_dir, 'cipd' + EXECUTABLE_SUFFIX)
     if fs.isfile(binary_path):
       file_path.remove(binary_path)
     else:
@@ -435,12 +466,10 @@ def get_client(service_url, package_name, version, cache_dir, timeout=None):
       isolateserver.putfile(f, binary_path, 0511)  # -r-x--x--x
 
     _ensure_batfile(binary_path)
+    _installed_clients[binary_path] = (
+        instance_id, _get_signature(binary_path))
 
-    yield CipdClient(
-        binary_path,
-        package_name=package_name,
-        instance_id=instance_id,
-        service_url=service_url)
+    yield client
 
 
 def parse_package_args(packages):
@@ -42,6 +42,10 @@ NET_IO_FILE_CHUNK = 16 * 1024
 DOWNLOAD_READ_TIMEOUT = 60
 
 
+# Maximum number of items to retrieve in a single /retrieve_batch request.
+ITEMS_PER_FETCH_BATCH = 100
+
+
 # Stores the gRPC proxy address. Must be set if the storage API class is
 # IsolateServerGrpc (call 'set_grpc_proxy').
 _grpc_proxy = None
@@ -133,6 +137,23 @@ class StorageApi(object):
     """
     raise NotImplementedError()
 
+  @property
+  def batch_fetch_size(self):
+    """Maximum number of items 'fetch_batch' accepts, 0 if not supported."""
+    return 0
+
+  def fetch_batch(self, digests):
+    """Fetches multiple small objects at once.
+
+    Arguments:
+      digests: list of hash digests of items to download.
+
+    Returns:
+      A dict digest -> content (as str object). Items that could not be fetched
+      in the batch are omitted and must be retrieved with 'fetch'.
+    """
+    raise NotImplementedError()
+
   def push(self, item, push_state, content=None):
     """Uploads an |item| with content generated by |content| generator.
 
@@ -265,6 +286,13 @@ class IsolateServer(StorageApi):
     self._lock = threading.Lock()
     self._server_caps = None
     self._memory_use = 0
+    # GS URLs returned by /retrieve_batch, used by the next 'fetch' call.
+    self._fetch_urls = {}
+    self._batch_fetch_enabled = True
+    # Multiplex the many small requests over few connections when possible.
+    if (net.Http2Engine.is_supported() and
+        net.get_engine_class(self._base_url) is net.RequestsLibEngine):
+      net.set_engine_class(net.Http2Engine, self._base_url)
 
   @property
   def _server_capabilities(self):
@@ -294,12 +322,50 @@ class IsolateServer(StorageApi):
   def namespace(self):
     return self._namespace
 
+  @property
+  def batch_fetch_size(self):
+    return ITEMS_PER_FETCH_BATCH if self._batch_fetch_enabled else 0
+
+  def fetch_batch(self, digests):
+    assert len(digests) <= ITEMS_PER_FETCH_BATCH, len(digests)
+    response = net.url_read_json(
+        url='%s/api/isolateservice/v1/retrieve_batch' % self._base_url,
+        data={
+          'digests': digests,
+          'namespace': self._namespace_dict,
+        },
+        read_timeout=DOWNLOAD_READ_TIMEOUT)
+    if response is None:
+      # Either the server doesn't support it or it is failing. Items will be
+      # retrieved one by one by the caller.
+      logging.warning('/retrieve_batch failed, disabling batch fetching')
+      self._batch_fetch_enabled = False
+      return {}
+
+    out = {}
+    for item in response.get('items', []):
+      digest = item['digest']
+      if item.get('content') is not None:
+        out[digest] = base64.b64decode(item['content'])
+      elif item.get('url'):
+        with self._lock:
+          self._fetch_urls[digest] = item['url']
+    logging.info(
+        'Batch fetched %d/%d items inline', len(out), len(digests))
+    return out
+
   def fetch(self, digest, _size, offset):
     assert offset >= 0
-    source_url = '%s/api/isolateservice/v1/retrieve' % (
-        self._base_url)
-    logging.debug('download_file(%s, %d)', source_url, offset)
-    response = self._do_fetch(source_url, digest, offset)
+    with self._lock:
+      url = self._fetch_urls.pop(digest, None)
+    if url and not offset:
+      # The signed GS URL was already returned by /retrieve_batch.
+      response = {'url': url}
+    else:
+      source_url = '%s/api/isolateservice/v1/retrieve' % (
+          self._base_url)
+      logging.debug('download_file(%s, %d)', source_url, offset)
+      response = self._do_fetch(source_url, digest, offset)
 
     if not response:
       raise IOError(
@@ -19,6 +19,7 @@ import stat
 import sys
 import tarfile
 import tempfile
+import threading
 import time
 import zlib
 
@@ -28,6 +29,7 @@ from third_party.depot_tools import subcommand
 
 from utils import file_path
 from utils import fs
+from utils import inotify
 from utils import logging_utils
 from utils import lru
 from utils import net
@@ -71,6 +73,12 @@ DEADLOCK_TIMEOUT = 5 * 60
 ITEMS_PER_CONTAINS_QUERIES = (20, 20, 50, 50, 50, 100)
 
 
+# Maximum size of an item, in bytes, to be fetched as part of a batch instead
+# of individually. Batching saves one round trip per item, which dominates the
+# fetch time of small items.
+MAX_BATCH_FETCH_ITEM_SIZE = 64 * 1024
+
+
 # A list of already compressed extension types that should not receive any
 # compression before being uploaded.
 ALREADY_COMPRESSED_TYPES = [
@@ -227,6 +235,10 @@ def putfile(srcfileobj, dstpath, file_mode=None, size=-1, use_symlink=False):
     - SeCreateSymbolicLinkPrivilege is *stripped off* by UAC when a restricted
       RID is present in the token;
       https://msdn.microsoft.com/en-us/library/bb530410.aspx
+
+  Copies of files, either because the file must be writeable or as a fallback,
+  are reflinked or done in the kernel when supported by the file systems; see
+  file_path.readable_copy().
   """
   srcpath = fileobj_path(srcfileobj)
   if srcpath and size == -1:
@@ -450,7 +462,10 @@ class Storage(object):
 
   @property
   def net_thread_pool(self):
-    """AutoRetryThreadPool for IO-bound tasks, retries IOError."""
+    """IOAutoRetryThreadPool for IO-bound tasks, retries IOError.
+
+    Its concurrency adapts to the link and to the server throttling requests.
+    """
     if self._net_thread_pool is None:
       self._net_thread_pool = threading_utils.IOAutoRetryThreadPool()
     return self._net_thread_pool
@@ -464,6 +479,7 @@ class Storage(object):
       self._cpu_thread_pool = None
     if self._net_thread_pool:
       self._net_thread_pool.join()
+      logging.info('Network: %s', self._net_thread_pool.get_status())
       self._net_thread_pool.close()
       self._net_thread_pool = None
     logging.info('Done.')
@@ -669,6 +685,43 @@ class Storage(object):
     # really fast and most probably IO bound anyway.
     self.net_thread_pool.add_task_with_channel(channel, priority, fetch)
 
+  @property
+  def batch_fetch_size(self):
+    """Maximum number of items 'async_fetch_batch' accepts, 0 if unsupported."""
+    return self._storage_api.batch_fetch_size
+
+  def async_fetch_batch(self, channel, priority, items, sink_factory):
+    """Starts asynchronous fetch of multiple small items in a single request.
+
+    Items that couldn't be fetched as part of the batch are fetched individually
+    via 'async_fetch'.
+
+    Arguments:
+      channel: TaskChannel that receives back a list of digests fetched by the
+          batch and each individually fetched digest.
+      priority: thread pool task priority for the fetch.
+      items: dict digest -> expected size of the item (after decompression).
+      sink_factory: function called as sink_factory(digest) that returns the
+          sink for the item, see 'async_fetch'.
+    """
+    def fetch_batch():
+      if self._aborted:
+        raise Aborted()
+      fetched = self._storage_api.fetch_batch(sorted(items))
+      for digest, content in fetched.iteritems():
+        stream = [content]
+        if self._use_zip:
+          stream = zip_decompress(stream, isolated_format.DISK_FILE_CHUNK)
+        verifier = FetchStreamVerifier(
+            stream, self._hash_algo, digest, items[digest])
+        sink_factory(digest)(verifier.run())
+      for digest, size in items.iteritems():
+        if digest not in fetched:
+          self.async_fetch(channel, priority, digest, size, sink_factory(digest))
+      return fetched.keys()
+
+    self.net_thread_pool.add_task_with_channel(channel, priority, fetch_batch)
+
   def get_missing_items(self, items):
     """Yields items that are missing from the server.
 
@@ -752,6 +805,9 @@ class FetchQueue(object):
     self._pending = set()
     self._accessed = set()
     self._fetched = cache.cached_set()
+    # Small items waiting to be fetched in a batch, digest -> size.
+    self._batch = {}
+    self._batch_priority = None
 
   def add(
       self,
@@ -786,6 +842,15 @@ class FetchQueue(object):
 
     # Start fetching.
     self._pending.add(digest)
+    batch_size = self.storage.batch_fetch_size
+    if (batch_size and size != UNKNOWN_FILE_SIZE and
+        size <= MAX_BATCH_FETCH_ITEM_SIZE):
+      self._batch[digest] = size
+      if self._batch_priority is None or priority < self._batch_priority:
+        self._batch_priority = priority
+      if len(self._batch) >= batch_size:
+        self._flush_batch()
+      return
     self.storage.async_fetch(
         self._channel, priority, digest, size,
         functools.partial(self.cache.write, digest))
@@ -803,14 +868,19 @@ class FetchQueue(object):
     # Ensure all requested items are being fetched now.
     assert all(digest in self._pending for digest in digests), (
         digests, self._pending)
+    self._flush_batch()
 
     # Wait for some requested item to finish fetching.
     while self._pending:
-      digest = self._channel.pull()
-      self._pending.remove(digest)
-      self._fetched.add(digest)
-      if digest in digests:
-        return digest
+      result = self._channel.pull()
+      # Batches return the list of digests they fetched.
+      fetched = result if isinstance(result, list) else [result]
+      for digest in fetched:
+        self._pending.remove(digest)
+        self._fetched.add(digest)
+      for digest in fetched:
+        if digest in digests:
+          return digest
 
     # Should never reach this point due to assert above.
     raise RuntimeError('Impossible state')
@@ -824,6 +894,16 @@ class FetchQueue(object):
     self._fetched.add(digest)
     return digest
 
+  def _flush_batch(self):
+    """Starts fetching the items accumulated for a batch fetch, if any."""
+    if not self._batch:
+      return
+    self.storage.async_fetch_batch(
+        self._channel, self._batch_priority, self._batch,
+        lambda digest: functools.partial(self.cache.write, digest))
+    self._batch = {}
+    self._batch_priority = None
+
   @property
   def pending_count(self):
     """Returns number of items to be fetched."""
@@ -1153,6 +1233,19 @@ class DiskCache(LocalCache):
     with self._lock:
       return self._lru.keys_set()
 
+  def reset_stats(self):
+    """Resets the statistics so the instance can be reused for another run.
+
+    Items retrieved during the previous run are not protected anymore.
+    """
+    with self._lock:
+      self._added = []
+      self._evicted = []
+      self._used = []
+      self._protected = None
+      self._initial_number_items = len(self._lru)
+      self._initial_size = sum(self._lru.itervalues())
+
   def cleanup(self):
     """Cleans up the cache directory.
 
@@ -1732,14 +1825,20 @@ def fetch_isolated(isolated_hash, storage, cache, outdir, use_symlinks):
   return bundle
 
 
-def directory_to_metadata(root, algo, blacklist):
-  """Returns the FileItem list and .isolated metadata for a directory."""
+def directory_to_metadata(root, algo, blacklist, prevdicts=None):
+  """Returns the FileItem list and .isolated metadata for a directory.
+
+  prevdicts, if specified, maps relative paths to the metadata of files already
+  hashed, see isolated_format.file_to_metadata().
+  """
   root = file_path.get_native_path_case(root)
   paths = isolated_format.expand_directory_and_symlink(
       root, '.' + os.path.sep, blacklist, sys.platform != 'win32')
+  prevdicts = prevdicts or {}
   metadata = {
     relpath: isolated_format.file_to_metadata(
-        os.path.join(root, relpath), {}, 0, algo, False)
+        os.path.join(root, relpath), prevdicts.get(relpath, {}), 0, algo,
+        False)
     for relpath in paths
   }
   for v in metadata.itervalues():
@@ -1755,7 +1854,7 @@ def directory_to_metadata(root, algo, blacklist):
   return items, metadata
 
 
-def archive_files_to_storage(storage, files, blacklist):
+def archive_files_to_storage(storage, files, blacklist, archived=None):
   """Stores every entries and returns the relevant data.
 
   Arguments:
@@ -1763,6 +1862,10 @@ def archive_files_to_storage(storage, files, blacklist):
     files: list of file paths to upload. If a directory is specified, a
            .isolated file is created and its hash is returned.
     blacklist: function that returns True if a file should be omitted.
+    archived: optional dict of absolute file path -> metadata of the files
+              already uploaded, as returned by IncrementalArchiver.stop().
+              These are neither hashed nor uploaded again if unchanged, and
+              are not included in the cold and hot lists.
 
   Returns:
     tuple(list(tuple(hash, path)), list(FileItem cold), list(FileItem hot)).
@@ -1784,8 +1887,19 @@ def archive_files_to_storage(storage, files, blacklist):
         filepath = os.path.abspath(f)
         if fs.isdir(filepath):
           # Uploading a whole directory.
+          prevdicts = None
+          if archived:
+            prefix = filepath + os.path.sep
+            prevdicts = {
+              p[len(prefix):]: v for p, v in archived.iteritems()
+              if p.startswith(prefix)
+            }
           items, metadata = directory_to_metadata(
-              filepath, storage.hash_algo, blacklist)
+              filepath, storage.hash_algo, blacklist, prevdicts)
+          if prevdicts:
+            # The content is already on the server.
+            done = set(v['h'] for v in prevdicts.itervalues())
+            items = [i for i in items if i.digest not in done]
 
           # Create the .isolated file.
           if not tempdir:
@@ -1831,6 +1945,112 @@ def archive_files_to_storage(storage, files, blacklist):
       file_path.rmtree(tempdir)
 
 
+class IncrementalArchiver(object):
+  """Uploads the files written in a directory while it is still in use.
+
+  Files are hashed and uploaded as soon as they are closed after writing. This
+  is only an optimization; archive_files_to_storage() must still be called once
+  the directory is complete, passing it the result of stop() so only the files
+  missed or modified since are hashed and uploaded.
+
+  Only supported on Linux, see is_supported().
+  """
+
+  # Seconds to wait for more files to batch before uploading.
+  BATCH_DELAY = 0.5
+
+  def __init__(self, storage, root):
+    self._storage = storage
+    self._root = os.path.abspath(root)
+    self._watcher = inotify.Watcher(self._root)
+    self._stop = threading.Event()
+    # Absolute path -> (stat key, digest, size).
+    self._archived = {}
+    self._cold = []
+    self._hot = []
+    self._thread = threading.Thread(
+        target=self._run, name='IncrementalArchiver')
+    self._thread.daemon = True
+    self._thread.start()
+
+  @staticmethod
+  def is_supported():
+    return inotify.is_supported()
+
+  def stop(self):
+    """Stops watching and waits for the pending uploads to complete.
+
+    Returns:
+      tuple(dict(path -> metadata), list(FileItem cold), list(FileItem hot)).
+      Only the files that were not modified since they were uploaded are
+      included.
+    """
+    self._stop.set()
+    self._thread.join()
+    archived = {}
+    for path, (key, digest, size) in self._archived.iteritems():
+      try:
+        st = fs.lstat(path)
+      except OSError:
+        continue
+      if self._stat_key(st) == key:
+        archived[path] = {'h': digest, 's': size, 't': int(round(st.st_mtime))}
+    logging.info(
+        'IncrementalArchiver: %d files uploaded, %d still valid',
+        len(self._archived), len(archived))
+    return (
+        archived,
+        [i for i in self._cold if i.path in archived],
+        [i for i in self._hot if i.path in archived])
+
+  @staticmethod
+  def _stat_key(st):
+    return (st.st_ino, st.st_size, st.st_mtime)
+
+  def _run(self):
+    try:
+      while not self._stop.is_set():
+        paths = self._watcher.read(self.BATCH_DELAY)
+        if paths:
+          # Give the task a chance to close more files.
+          self._stop.wait(self.BATCH_DELAY)
+          paths.extend(self._watcher.read(0))
+          self._archive(paths)
+      # The files closed last.
+      self._archive(self._watcher.read(0))
+    except Aborted:
+      logging.warning('IncrementalArchiver: aborted')
+    except Exception as e:
+      logging.exception('IncrementalArchiver: %s', e)
+    finally:
+      self._watcher.close()
+
+  def _archive(self, paths):
+    items = []
+    for path in sorted(set(paths)):
+      try:
+        st = fs.lstat(path)
+        if not stat.S_ISREG(st.st_mode):
+          continue
+        digest = isolated_format.hash_file(path, self._storage.hash_algo)
+        # Skip the file if it was modified while being hashed.
+        if self._stat_key(fs.lstat(path)) != self._stat_key(st):
+          continue
+      except (IOError, OSError):
+        # Deleted in the meantime.
+        continue
+      item = FileItem(
+          path=path, digest=digest, size=st.st_size,
+          high_priority=path.endswith('.isolated'))
+      items.append((item, self._stat_key(st)))
+    if not items:
+      return
+    uploaded = set(self._storage.upload_items([i for i, _ in items]))
+    for item, key in items:
+      (self._cold if item in uploaded else self._hot).append(item)
+      self._archived[item.path] = (key, item.digest, item.size)
+
+
 def archive(out, namespace, files, blacklist):
   if files == ['-']:
     files = sys.stdin.readlines()
@@ -124,6 +124,17 @@ def _read_full():
   return _CUR_CONTEXT
 
 
+def invalidate_cache():
+  """Forgets the cached LUCI_CONTEXT, it is reloaded on the next read.
+
+  Needed by long-lived processes that change $LUCI_CONTEXT between units of
+  work. Must not be called within write().
+  """
+  global _CUR_CONTEXT
+  with _CUR_CONTEXT_LOCK:
+    _CUR_CONTEXT = None
+
+
 def _mutate(section_values):
   new_val = read_full()
   for section, value in section_values.iteritems():
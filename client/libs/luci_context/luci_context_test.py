@@ -110,6 +110,18 @@ class TestLuciContext(unittest.TestCase):
     self.assertIsNone(r('other'))
     self.assertIsNone(r('something'))
 
+  def test_invalidate_cache(self):
+    self.assertIsNone(luci_context.read('something'))
+    with luci_context._tf({'something': {'data': True}}) as name:
+      os.environ[self.ek] = name
+      try:
+        # Still cached.
+        self.assertIsNone(luci_context.read('something'))
+        luci_context.invalidate_cache()
+        self.assertDictEqual(luci_context.read('something'), {'data': True})
+      finally:
+        del os.environ[self.ek]
+
   def test_stage(self):
     path = None
     with luci_context.stage(something={'data': True}) as path:
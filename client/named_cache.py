@@ -10,12 +10,14 @@ import optparse
 import os
 import random
 import re
+import stat
 import string
 import sys
 
 from utils import lru
 from utils import file_path
 from utils import fs
+from utils import subprocess42
 from utils import threading_utils
 
 
@@ -23,6 +25,11 @@ from utils import threading_utils
 CACHE_NAME_RE = re.compile(ur'^[a-z0-9_]{1,4096}$')
 MAX_CACHE_SIZE = 50
 
+# Version of state.json. Version 3 stores [path, size, number of files] values
+# instead of a bare path. Older versions only read version 2 and delete the
+# named caches when they find a newer state file.
+STATE_VERSION = 3
+
 
 class Error(Exception):
   """Named cache specific error."""
@@ -38,19 +45,29 @@ class CacheManager(object):
       "build_chromium" could be build artefacts of the Chromium.
     path is a directory path relative to the task run dir. Cache installation
       puts the requested cache directory at the path.
+
+  The size and number of files of each cache is measured when it is
+  uninstalled, so it is known without walking the caches.
   """
 
-  def __init__(self, root_dir):
+  def __init__(self, root_dir, fork=False):
     """Initializes NamedCaches.
 
     |root_dir| is a directory for persistent cache storage.
+
+    If |fork| is True, install() clones the cache with copy-on-write file
+    copies instead of moving it, so the cache stays available to other tasks
+    while it is in use. It falls back to moving the cache when the file system
+    doesn't support it.
     """
     assert isinstance(root_dir, unicode), root_dir
     assert file_path.isabs(root_dir), root_dir
     self.root_dir = root_dir
+    self.fork = fork
     self._lock = threading_utils.LockWithAssert()
-    # LRU {cache_name -> cache_location}
-    # It is saved to |root_dir|/state.json.
+    # LRU {cache_name -> [cache_location, size, number of files]}
+    # It is saved to |root_dir|/state.json. Entries saved by older versions are
+    # only the cache location, see _get_entry().
     self._lru = None
 
   @contextlib.contextmanager
@@ -70,7 +87,7 @@ class CacheManager(object):
       assert self._lru is None, 'acquired lock, but self._lru is not None'
       if os.path.isfile(state_path):
         try:
-          self._lru = lru.LRUDict.load(state_path)
+          self._lru = lru.LRUDict.load(state_path, max_version=STATE_VERSION)
         except ValueError:
           logging.exception('failed to load named cache state file')
           logging.warning('deleting named caches')
@@ -82,7 +99,7 @@ class CacheManager(object):
         yield
       finally:
         file_path.ensure_tree(self.root_dir)
-        self._lru.save(state_path)
+        self._lru.save(state_path, version=STATE_VERSION)
         self._lru = None
 
   def __len__(self):
@@ -123,8 +140,28 @@ class CacheManager(object):
     self._lock.assert_locked()
     return self._lru.keys_set()
 
+  def get_size(self, name):
+    """Returns tuple(size in bytes, number of files) of a cache.
+
+    Both are None if unknown. NamedCache must be open.
+
+    Raises KeyError if cache is not found.
+    """
+    self._lock.assert_locked()
+    _, size, files = self._get_entry(name)
+    return size, files
+
+  @property
+  def total_size(self):
+    """Returns the sum of the known sizes of the caches, in bytes.
+
+    NamedCache must be open.
+    """
+    self._lock.assert_locked()
+    return sum(self._get_entry(name)[1] or 0 for name in self._lru)
+
   def install(self, path, name):
-    """Moves the directory for the specified named cache to |path|.
+    """Moves or forks the directory for the specified named cache to |path|.
 
     NamedCache must be open. path must be absolute, unicode and must not exist.
 
@@ -137,12 +174,20 @@ class CacheManager(object):
       if os.path.isdir(path):
         raise Error('installation directory %r already exists' % path)
 
-      rel_cache = self._lru.get(name)
-      if rel_cache:
+      if name in self._lru:
+        rel_cache = self._get_entry(name)[0]
         abs_cache = os.path.join(self.root_dir, rel_cache)
         if os.path.isdir(abs_cache):
-          logging.info('Moving %r to %r', abs_cache, path)
           file_path.ensure_tree(os.path.dirname(path))
+          if self.fork:
+            try:
+              logging.info('Forking %r to %r', abs_cache, path)
+              _clone_tree(abs_cache, path)
+              self._lru.touch(name)
+              return
+            except Error as e:
+              logging.warning('Failed to fork %r, moving it: %s', name, e)
+          logging.info('Moving %r to %r', abs_cache, path)
           fs.rename(abs_cache, path)
           self._remove(name)
           return
@@ -174,11 +219,20 @@ class CacheManager(object):
             'Directory %r does not exist anymore. Cache lost.', path)
         return
 
-      rel_cache = self._lru.get(name)
-      if rel_cache:
-        # Do not crash because cache already exists.
-        logging.warning('overwriting an existing named cache %r', name)
+      size, files = _get_recursive_size(path)
+      old_cache = None
+      if name in self._lru:
+        rel_cache = self._get_entry(name)[0]
         create_named_link = False
+        if os.path.isdir(os.path.join(self.root_dir, rel_cache)):
+          # The cache was forked or recreated in the meantime. Replace it once
+          # the new content is in place.
+          if not self.fork:
+            # Do not crash because cache already exists.
+            logging.warning('overwriting an existing named cache %r', name)
+          old_cache = rel_cache
+          rel_cache = self._allocate_dir()
+          create_named_link = True
       else:
         rel_cache = self._allocate_dir()
         create_named_link = True
@@ -188,13 +242,15 @@ class CacheManager(object):
       logging.info('Moving %r to %r', path, abs_cache)
       file_path.ensure_tree(os.path.dirname(abs_cache))
       fs.rename(path, abs_cache)
-      self._lru.add(name, rel_cache)
+      self._lru.add(name, [rel_cache, size, files])
+      if old_cache:
+        file_path.rmtree(os.path.join(self.root_dir, old_cache))
 
       if create_named_link:
         # Create symlink <root_dir>/<named>/<name> -> <root_dir>/<short name>
         # for user convenience.
         named_path = self._get_named_path(name)
-        if os.path.exists(named_path):
+        if os.path.lexists(named_path):
           file_path.remove(named_path)
         else:
           file_path.ensure_tree(os.path.dirname(named_path))
@@ -211,13 +267,15 @@ class CacheManager(object):
           'cannot uninstall cache named %r at %r: %s' % (
             name, path, ex))
 
-  def trim(self, min_free_space):
+  def trim(self, min_free_space, max_size=None):
     """Purges cache.
 
     Removes cache directories that were not accessed for a long time
-    until there is enough free space and the number of caches is sane.
+    until there is enough free space, the total size of the caches fits in
+    max_size and the number of caches is sane.
 
-    If min_free_space is None, disk free space is not checked.
+    If min_free_space is None, disk free space is not checked. If max_size is
+    None, the total size is not checked; caches of unknown size are ignored.
 
     NamedCache must be open.
 
@@ -232,16 +290,20 @@ class CacheManager(object):
     free_space = 0
     if min_free_space:
       free_space = file_path.get_free_space(self.root_dir)
+    size = self.total_size if max_size else 0
     while ((min_free_space and free_space < min_free_space)
+           or (max_size and size > max_size)
            or len(self._lru) > MAX_CACHE_SIZE):
       logging.info(
-          'Making space for named cache %d > %d or %d > %d',
-          free_space, min_free_space, len(self._lru), MAX_CACHE_SIZE)
+          'Making space for named cache %d > %d or %d > %d or %d > %d',
+          free_space, min_free_space, size, max_size, len(self._lru),
+          MAX_CACHE_SIZE)
       try:
         name, _ = self._lru.get_oldest()
       except KeyError:
         return total
       logging.info('Removing named cache %r', name)
+      size -= self._get_entry(name)[1] or 0
       self._remove(name)
       if min_free_space:
         free_space = file_path.get_free_space(self.root_dir)
@@ -278,9 +340,9 @@ class CacheManager(object):
       Number of caches deleted.
     """
     self._lock.assert_locked()
-    rel_path = self._lru.get(name)
-    if not rel_path:
+    if name not in self._lru:
       return
+    rel_path = self._get_entry(name)[0]
 
     named_dir = self._get_named_path(name)
     if fs.islink(named_dir):
@@ -294,6 +356,17 @@ class CacheManager(object):
   def _get_named_path(self, name):
     return os.path.join(self.root_dir, 'named', name)
 
+  def _get_entry(self, name):
+    """Returns tuple(relative path, size, number of files) of a cache.
+
+    Raises KeyError if cache is not found.
+    """
+    value = self._lru[name]
+    if isinstance(value, basestring):
+      # Saved by an older version, the size is unknown.
+      return value, None, None
+    return tuple(value)
+
 
 def add_named_cache_options(parser):
   group = optparse.OptionGroup(parser, 'Named caches')
@@ -311,6 +384,16 @@ def add_named_cache_options(parser):
   group.add_option(
       '--named-cache-root',
       help='Cache root directory. Default=%default')
+  group.add_option(
+      '--named-cache-max-size', type='int', default=0,
+      help='Trims the named caches, least recently used first, so their total '
+           'size fits in this amount of bytes. 0 means unlimited. '
+           'Default=%default')
+  group.add_option(
+      '--named-cache-fork', action='store_true',
+      help='Installs the named caches with copy-on-write copies instead of '
+           'moving them, when supported by the file system, so they remain '
+           'available to concurrent tasks')
   parser.add_option_group(group)
 
 
@@ -324,8 +407,12 @@ def process_named_cache_options(parser, options):
           'cache name %r does not match %r' % (name, CACHE_NAME_RE.pattern))
     if not path:
       parser.error('cache path cannot be empty')
+  if options.named_cache_max_size < 0:
+    parser.error('--named-cache-max-size must be positive')
   if options.named_cache_root:
-    return CacheManager(unicode(os.path.abspath(options.named_cache_root)))
+    return CacheManager(
+        unicode(os.path.abspath(options.named_cache_root)),
+        fork=options.named_cache_fork)
   return None
 
 
@@ -334,3 +421,48 @@ def _check_abs(path):
     raise Error('named cache installation path must be unicode')
   if not os.path.isabs(path):
     raise Error('named cache installation path must be absolute')
+
+
+def _get_recursive_size(path):
+  """Returns tuple(size in bytes, number of files) of a directory tree.
+
+  Symlinks are not followed and hardlinked files are only counted once.
+  """
+  size = 0
+  files = 0
+  seen = set()
+  for root, _dirs, filenames in fs.walk(path):
+    for f in filenames:
+      try:
+        st = fs.lstat(os.path.join(root, f))
+      except OSError:
+        continue
+      if st.st_nlink > 1:
+        if (st.st_dev, st.st_ino) in seen:
+          continue
+        seen.add((st.st_dev, st.st_ino))
+      files += 1
+      if stat.S_ISREG(st.st_mode):
+        size += st.st_size
+  return size, files
+
+
+def _clone_tree(src, dst):
+  """Copies a directory tree with copy-on-write file copies.
+
+  Raises Error if not supported by the file system.
+  """
+  if sys.platform.startswith('linux'):
+    cmd = ['cp', '-a', '--reflink=always', src, dst]
+  elif sys.platform == 'darwin':
+    # Uses clonefile(2) on APFS.
+    cmd = ['cp', '-a', '-c', src, dst]
+  else:
+    raise Error('copy-on-write copies are not supported on %s' % sys.platform)
+  proc = subprocess42.Popen(
+      cmd, stdout=subprocess42.PIPE, stderr=subprocess42.STDOUT)
+  out, _ = proc.communicate()
+  if proc.returncode:
+    if fs.isdir(dst):
+      file_path.rmtree(dst)
+    raise Error('%s failed: %s' % (' '.join(cmd), out.strip()))
@@ -37,16 +37,24 @@ import json
 import logging
 import optparse
 import os
+import select
+import signal
+import socket
 import sys
 import tempfile
+import threading
 import time
+import traceback
 
 from third_party.depot_tools import fix_encoding
 
 from utils import file_path
 from utils import fs
+from utils import inotify
 from utils import large
+from utils import local_daemon
 from utils import logging_utils
+from utils import net
 from utils import on_error
 from utils import subprocess42
 from utils import tools
@@ -56,9 +64,13 @@ from libs import luci_context
 
 import auth
 import cipd
+import isolated_format
 import isolateserver
 import named_cache
 
+if sys.platform != 'win32':
+  import fcntl  # pylint: disable=F0401
+
 
 # Absolute path to this file (can be None if running from zip on Mac).
 THIS_FILE_PATH = os.path.abspath(
@@ -107,6 +119,17 @@ ISOLATED_OUT_DIR = u'io'
 ISOLATED_TMP_DIR = u'it'
 
 
+# A run_isolated daemon exits after being idle for this amount of time, in
+# seconds.
+DAEMON_IDLE_TIMEOUT = 10*60
+
+
+# In daemon mode, DiskCache instances reused across tasks, keyed by their
+# settings. Each value is [DiskCache, state file signature when the last task
+# completed]. None when not running as a daemon.
+_warm_caches = None
+
+
 OUTLIVING_ZOMBIE_MSG = """\
 *** Swarming tried multiple times to delete the %s directory and failed ***
 *** Hard failing the task ***
@@ -428,9 +451,26 @@ def link_outputs_to_outdir(run_dir, out_dir, outputs):
       logging.info("Couldn't collect output file %s: %s", o, e)
 
 
-def delete_and_upload(storage, out_dir, leak_temp_dir):
+def start_incremental_archiver(storage, out_dir):
+  """Returns an isolateserver.IncrementalArchiver watching out_dir, or None if
+  not supported.
+  """
+  if not isolateserver.IncrementalArchiver.is_supported():
+    logging.warning('Incremental upload is not supported on this platform')
+    return None
+  try:
+    return isolateserver.IncrementalArchiver(storage, out_dir)
+  except inotify.Error as e:
+    logging.warning('Failed to watch %s: %s', out_dir, e)
+    return None
+
+
+def delete_and_upload(storage, out_dir, leak_temp_dir, archiver=None):
   """Deletes the temporary run directory and uploads results back.
 
+  If archiver is specified, it is stopped and the files it already uploaded
+  are not uploaded again.
+
   Returns:
     tuple(outputs_ref, success, stats)
     - outputs_ref: a dict referring to the results archived back to the isolated
@@ -447,18 +487,25 @@ def delete_and_upload(storage, out_dir, leak_temp_dir):
   hot = []
   start = time.time()
 
+  archived = None
+  if archiver:
+    with tools.Profiler('IncrementalArchiveOutput'):
+      archived, a_cold, a_hot = archiver.stop()
+    cold = [i.size for i in a_cold]
+    hot = [i.size for i in a_hot]
+
   if fs.isdir(out_dir) and fs.listdir(out_dir):
     with tools.Profiler('ArchiveOutput'):
       try:
         results, f_cold, f_hot = isolateserver.archive_files_to_storage(
-            storage, [out_dir], None)
+            storage, [out_dir], None, archived)
         outputs_ref = {
           'isolated': results[0][0],
           'isolatedserver': storage.location,
           'namespace': storage.namespace,
         }
-        cold = sorted(i.size for i in f_cold)
-        hot = sorted(i.size for i in f_hot)
+        cold = sorted(cold + [i.size for i in f_cold])
+        hot = sorted(hot + [i.size for i in f_hot])
       except isolateserver.Aborted:
         # This happens when a signal SIGTERM was received while uploading data.
         # There is 2 causes:
@@ -482,8 +529,8 @@ def delete_and_upload(storage, out_dir, leak_temp_dir):
     logging.exception('Had difficulties removing out_dir %s: %s', out_dir, e)
   stats = {
     'duration': time.time() - start,
-    'items_cold': base64.b64encode(large.pack(cold)),
-    'items_hot': base64.b64encode(large.pack(hot)),
+    'items_cold': base64.b64encode(large.pack(sorted(cold))),
+    'items_hot': base64.b64encode(large.pack(sorted(hot))),
   }
   return outputs_ref, success, stats
 
@@ -492,7 +539,7 @@ def map_and_run(
     command, isolated_hash, storage, isolate_cache, outputs,
     install_named_caches, leak_temp_dir, root_dir, hard_timeout, grace_period,
     bot_file, switch_to_account, install_packages_fn, use_symlinks, raw_cmd,
-    constant_run_path):
+    constant_run_path, incremental_upload=False):
   """Runs a command with optional isolated input/output.
 
   See run_tha_test for argument documentation.
@@ -548,7 +595,8 @@ def map_and_run(
   if constant_run_path and root_dir:
     run_dir = os.path.join(root_dir, ISOLATED_RUN_DIR)
     if os.path.isdir(run_dir):
-      file_path.rmtree(run_dir)
+      # Left over by a previous task. Delete it while this one runs.
+      file_path.rmtree_async(run_dir)
     os.mkdir(run_dir)
   else:
     run_dir = make_temp_dir(ISOLATED_RUN_DIR, root_dir)
@@ -557,6 +605,7 @@ def map_and_run(
   out_dir = make_temp_dir(ISOLATED_OUT_DIR, root_dir) if storage else None
   tmp_dir = make_temp_dir(ISOLATED_TMP_DIR, root_dir)
   cwd = run_dir
+  archiver = None
 
   try:
     with install_packages_fn(run_dir) as cipd_info:
@@ -595,6 +644,9 @@ def map_and_run(
       command = process_command(command, out_dir, bot_file)
       file_path.ensure_command_has_abs_path(command, cwd)
 
+      if out_dir and incremental_upload:
+        archiver = start_incremental_archiver(storage, out_dir)
+
       with install_named_caches(run_dir):
         sys.stdout.flush()
         start = time.time()
@@ -653,11 +705,13 @@ def map_and_run(
             if result['exit_code'] == 0:
               result['exit_code'] = 1
 
-      # This deletes out_dir if leak_temp_dir is not set.
+      # This deletes out_dir if leak_temp_dir is not set. The files already
+      # closed by the command were uploaded in the meantime by the archiver.
       if out_dir:
         isolated_stats = result['stats'].setdefault('isolated', {})
         result['outputs_ref'], success, isolated_stats['upload'] = (
-            delete_and_upload(storage, out_dir, leak_temp_dir))
+            delete_and_upload(storage, out_dir, leak_temp_dir, archiver))
+        archiver = None
       if not success and result['exit_code'] == 0:
         result['exit_code'] = 1
     except Exception as e:
@@ -665,6 +719,9 @@ def map_and_run(
       if out_dir:
         logging.exception('Leaking out_dir %s: %s', out_dir, e)
       result['internal_failure'] = str(e)
+    finally:
+      if archiver:
+        archiver.stop()
   return result
 
 
@@ -672,7 +729,7 @@ def run_tha_test(
     command, isolated_hash, storage, isolate_cache, outputs,
     install_named_caches, leak_temp_dir, result_json, root_dir, hard_timeout,
     grace_period, bot_file, switch_to_account, install_packages_fn,
-    use_symlinks, raw_cmd):
+    use_symlinks, raw_cmd, incremental_upload=False):
   """Runs an executable and records execution metadata.
 
   Either command or isolated_hash must be specified.
@@ -719,6 +776,8 @@ def run_tha_test(
                          install_client_and_packages.
     use_symlinks: create tree with symlinks instead of hardlinks.
     raw_cmd: ignore the command in the isolated file.
+    incremental_upload: upload the files of the output directory as they are
+                        closed while the command is running.
 
   Returns:
     Process exit code that should be used.
@@ -739,7 +798,7 @@ def run_tha_test(
       command, isolated_hash, storage, isolate_cache, outputs,
       install_named_caches, leak_temp_dir, root_dir, hard_timeout, grace_period,
       bot_file, switch_to_account, install_packages_fn, use_symlinks, raw_cmd,
-      True)
+      True, incremental_upload)
   logging.info('Result:\n%s', tools.format_json(result, dense=True))
 
   if result_json:
@@ -934,7 +993,8 @@ def clean_caches(options, isolate_cache, named_cache_manager):
         isolate_cache.get_timestamp(oldest_isolated) if oldest_isolated else 0,
       ),
       (
-        lambda: named_cache_manager.trim(options.min_free_space),
+        lambda: named_cache_manager.trim(
+            options.min_free_space, options.named_cache_max_size),
         named_cache_manager.get_timestamp(oldest_named) if oldest_named else 0,
       ),
     ]
@@ -948,6 +1008,237 @@ def clean_caches(options, isolate_cache, named_cache_manager):
   return total
 
 
+def _get_state_signature(cache):
+  """Returns a value that changes whenever the cache's state file is written."""
+  try:
+    st = fs.stat(cache.state_file)
+    return st.st_mtime, st.st_size
+  except OSError:
+    return None
+
+
+def get_isolate_cache(options):
+  """Returns the isolate cache to use.
+
+  In daemon mode, the DiskCache of the previous task is reused as long as its
+  state file was not modified by another process in the meantime, e.g. by
+  'run_isolated --clean'. This saves loading the state file on every task.
+  """
+  if _warm_caches is None or not options.cache:
+    return isolateserver.process_cache_options(options, trim=False)
+  key = (
+    os.path.abspath(options.cache), options.max_cache_size,
+    options.min_free_space, options.max_items,
+    isolated_format.get_hash_algo(options.namespace).__name__)
+  warm = _warm_caches.get(key)
+  if warm and _get_state_signature(warm[0]) == warm[1]:
+    warm[0].reset_stats()
+    return warm[0]
+  cache = isolateserver.process_cache_options(options, trim=False)
+  _warm_caches[key] = [cache, None]
+  return cache
+
+
+### Daemon mode.
+
+
+def _set_cloexec(fd):
+  fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.fcntl(fd, fcntl.F_GETFD) | 1)
+
+
+def _reset_logging():
+  """Undoes the logging set up by the previous parse_args() call.
+
+  This leaves the root logger as in a new process.
+  """
+  root = logging.getLogger()
+  for handler in root.handlers[:]:
+    root.removeHandler(handler)
+    handler.close()
+  root.setLevel(logging.WARNING)
+
+
+def _relay_output(read_fd, conn, stop):
+  """Forwards the task's output to the client until EOF.
+
+  Processes outliving the task may hold the pipe open, so once |stop| is set,
+  it gives up when no output is pending or after one more second.
+  """
+  deadline = None
+  while True:
+    ready = select.select([read_fd], [], [], 0.1)[0]
+    if stop.is_set():
+      deadline = deadline or time.time() + 1
+      if not ready or time.time() > deadline:
+        return
+    if not ready:
+      continue
+    data = os.read(read_fd, 65536)
+    if not data:
+      return
+    try:
+      local_daemon.send_frame(conn, local_daemon.OUTPUT, data)
+    except socket.error:
+      # Keep draining the pipe so the task doesn't block on writes.
+      pass
+
+
+def _watch_control(conn, running, lock):
+  """Translates the client's control frames into signals to this process.
+
+  The signal is handled exactly like when run_isolated is running as a child
+  process of the client. Closing the connection is treated as TERMINATE.
+  """
+  while True:
+    try:
+      kind, _ = local_daemon.recv_frame(conn)
+    except socket.error:
+      kind = None
+    sig = signal.SIGKILL if kind == local_daemon.KILL else signal.SIGTERM
+    with lock:
+      if not running[0]:
+        return
+      logging.warning('Daemon client requested signal %d', sig)
+      os.kill(os.getpid(), sig)
+    if kind is None:
+      return
+
+
+def _run_daemon_task(conn, request):
+  """Runs main() for one request, with its output redirected to the client.
+
+  Returns:
+    The exit code of main().
+  """
+  old_env = os.environ.copy()
+  old_cwd = os.getcwd()
+  sys.stdout.flush()
+  sys.stderr.flush()
+  saved_fds = [os.dup(1), os.dup(2)]
+  read_fd, write_fd = os.pipe()
+  _set_cloexec(read_fd)
+  os.dup2(write_fd, 1)
+  os.dup2(write_fd, 2)
+  os.close(write_fd)
+  stop = threading.Event()
+  relay = threading.Thread(
+      target=_relay_output, args=(read_fd, conn, stop), name='relay')
+  relay.daemon = True
+  relay.start()
+  running = [True]
+  lock = threading.Lock()
+  control = threading.Thread(
+      target=_watch_control, args=(conn, running, lock), name='control')
+  control.daemon = True
+  control.start()
+  try:
+    os.environ.clear()
+    os.environ.update(request['env'])
+    os.chdir(request['cwd'])
+    # $LUCI_CONTEXT points to a different file for every task.
+    luci_context.invalidate_cache()
+    _reset_logging()
+    try:
+      return main(request['args'])
+    except SystemExit as e:
+      # parser.error().
+      return e.code if isinstance(e.code, int) else 1
+    except Exception:
+      traceback.print_exc()
+      return 1
+  finally:
+    with lock:
+      running[0] = False
+    sys.stdout.flush()
+    sys.stderr.flush()
+    _reset_logging()
+    for fd, saved in ((1, saved_fds[0]), (2, saved_fds[1])):
+      os.dup2(saved, fd)
+      os.close(saved)
+    stop.set()
+    relay.join()
+    os.close(read_fd)
+    os.environ.clear()
+    os.environ.update(old_env)
+    os.chdir(old_cwd)
+    for warm in _warm_caches.itervalues():
+      warm[1] = _get_state_signature(warm[0])
+
+
+def _serve_one(conn, secret, version):
+  """Serves a connection.
+
+  Returns:
+    False if the daemon must exit.
+  """
+  conn.settimeout(local_daemon.ACCEPT_TIMEOUT)
+  try:
+    kind, payload = local_daemon.recv_frame(conn)
+    request = json.loads(payload) if kind == local_daemon.REQUEST else None
+  except (socket.error, ValueError) as e:
+    logging.warning('Invalid daemon request: %s', e)
+    return True
+  if not request or request.get('secret') != secret:
+    logging.warning('Ignoring unauthenticated daemon request')
+    return True
+  if request.get('version') != version:
+    logging.info('Version changed; exiting')
+    local_daemon.send_frame(
+        conn, local_daemon.EXIT, json.dumps({'error': 'version mismatch'}))
+    return False
+  conn.settimeout(None)
+  local_daemon.send_frame(
+      conn, local_daemon.ACCEPT, json.dumps({'pid': os.getpid()}))
+  exit_code = _run_daemon_task(conn, request)
+  local_daemon.send_frame(
+      conn, local_daemon.EXIT, json.dumps({'exit_code': exit_code}))
+  return True
+
+
+def serve(address_file, version, idle_timeout):
+  """Runs tasks requested via local_daemon until idle for |idle_timeout|.
+
+  Tasks are run one at a time in this process, so the module imports, the
+  isolate cache index and the HTTP connection pools stay warm across tasks.
+  """
+  global _warm_caches
+  _warm_caches = {}
+  server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+  _set_cloexec(server.fileno())
+  server.bind(('127.0.0.1', 0))
+  server.listen(1)
+  secret = os.urandom(16).encode('hex')
+  local_daemon.write_address_file(
+      address_file, server.getsockname()[1], secret)
+  logging.info('Daemon listening on port %d', server.getsockname()[1])
+  try:
+    while True:
+      server.settimeout(idle_timeout)
+      try:
+        conn, _ = server.accept()
+      except socket.timeout:
+        logging.info('Idle for %ds; exiting', idle_timeout)
+        return 0
+      _set_cloexec(conn.fileno())
+      try:
+        if not _serve_one(conn, secret, version):
+          return 0
+      except socket.error as e:
+        logging.warning('Daemon connection failed: %s', e)
+      finally:
+        try:
+          # Wakes up the control thread.
+          conn.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+          pass
+        conn.close()
+  finally:
+    server.close()
+    address = local_daemon.read_address_file(address_file)
+    if address and address.get('pid') == os.getpid():
+      file_path.try_remove(address_file)
+
+
 def create_option_parser():
   parser = logging_utils.OptionParserWithLogging(
       usage='%prog <options> [command to run or extra args]',
@@ -995,6 +1286,11 @@ def create_option_parser():
            'specified by --output option (there can be multiple) will be '
            'returned. Note that if a file in OUT_DIR has the same path '
            'as an --output option, the --output version will be returned.')
+  parser.add_option(
+      '--incremental-upload', action='store_true',
+      help='Uploads the files written in $(ISOLATED_OUTDIR) as soon as they '
+           'are closed while the command is running, so only the remaining '
+           'ones are uploaded once it exits. Only supported on Linux')
   parser.add_option(
       '-a', '--argsfile',
       # This is actually handled in parse_args; it's included here purely so it
@@ -1014,6 +1310,21 @@ def create_option_parser():
   cipd.add_cipd_options(parser)
   named_cache.add_named_cache_options(parser)
 
+  daemon_group = optparse.OptionGroup(parser, 'Daemon')
+  daemon_group.add_option(
+      '--daemon', metavar='ADDRESS_FILE',
+      help='Runs as a long-lived daemon serving local_daemon requests, one at '
+           'a time, instead of running a task. The address to connect to is '
+           'written to ADDRESS_FILE. Not supported on Windows')
+  daemon_group.add_option(
+      '--daemon-version',
+      help='Version expected in the requests; the daemon exits on mismatch')
+  daemon_group.add_option(
+      '--daemon-idle-timeout', type='float', default=DAEMON_IDLE_TIMEOUT,
+      help='Exits the daemon after this amount of seconds without request. '
+           'Default: %default')
+  parser.add_option_group(daemon_group)
+
   debug_group = optparse.OptionGroup(parser, 'Debugging')
   debug_group.add_option(
       '--leak-temp-dir',
@@ -1064,10 +1375,17 @@ def parse_args(args):
 def main(args):
   (parser, options, args) = parse_args(args)
 
+  if options.daemon:
+    if sys.platform == 'win32':
+      parser.error('--daemon is not supported on Windows.')
+    return serve(
+        unicode(os.path.abspath(options.daemon)), options.daemon_version,
+        options.daemon_idle_timeout)
+
   if not file_path.enable_symlink():
     logging.error('Symlink support is not enabled')
 
-  isolate_cache = isolateserver.process_cache_options(options, trim=False)
+  isolate_cache = get_isolate_cache(options)
   named_cache_manager = named_cache.process_named_cache_options(parser, options)
   if options.clean:
     if options.isolated:
@@ -1088,6 +1406,10 @@ def main(args):
     parser.error('--isolated or command to run is required.')
 
   auth.process_auth_options(parser, options)
+  if _warm_caches is not None:
+    # The cached HTTP services outlive the task; only their connection pools
+    # are reused.
+    net.reset_authenticators()
 
   isolateserver.process_isolate_server_options(
       parser, options, True, False)
@@ -1162,7 +1484,8 @@ def main(args):
             options.switch_to_account,
             install_packages_fn,
             options.use_symlinks,
-            options.raw_cmd)
+            options.raw_cmd,
+            options.incremental_upload)
     return run_tha_test(
         args,
         options.isolated,
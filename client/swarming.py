@@ -271,6 +271,17 @@ def trigger_task_shards(swarming, task_request, shards):
 # How often to print status updates to stdout in 'collect'.
 STATUS_UPDATE_INTERVAL = 15 * 60.
 
+# Maximum duration of a single tasks/wait call. The server caps it anyway.
+WAIT_TIMEOUT = 45.
+
+# Maximum number of task IDs sent in a single tasks/wait call. It matches the
+# server limit.
+WAIT_MAX_TASKS = 1000
+
+# Number of consecutive failed tasks/wait calls after which the remaining tasks
+# are polled one by one instead.
+WAIT_MAX_ERRORS = 3
+
 
 class State(object):
   """States in which a task can be.
@@ -543,15 +554,93 @@ def retrieve_results(
       if fetch_stdout:
         out = net.url_read_json(output_url)
         result['output'] = out.get('output') if out else out
-      # Record the result, try to fetch attached output files (if any).
-      if output_collector:
-        # TODO(vadimsh): Respect |should_stop| and |deadline| when fetching.
-        output_collector.process_shard_result(shard_index, result)
-      if result.get('internal_failure'):
-        logging.error('Internal error!')
-      elif result['state'] == 'BOT_DIED':
-        logging.error('Bot died!')
-      return result
+      return _process_result(shard_index, result, output_collector)
+
+
+class WaitNotSupported(Exception):
+  """The tasks/wait API is not implemented by the server or keeps failing."""
+
+
+def wait_results(
+    base_url, task_ids, timeout, should_stop, include_perf, fetch_stdout):
+  """Retrieves results for many task IDs with a single pending request.
+
+  Contrary to retrieve_results(), it doesn't poll each task. It does hanging
+  tasks/wait calls for up to WAIT_MAX_TASKS tasks at a time, which return as
+  soon as one of them stops running.
+
+  Yields:
+    (task_id, <result dict>) as the tasks stop running. The tasks still running
+    at the deadline are not yielded.
+
+  Transient errors are retried by net. Other errors, e.g. a 404 because the
+  server predates the API or a task was deleted, end the wait on the first call
+  and after WAIT_MAX_ERRORS consecutive failures past it.
+
+  Raises:
+    WaitNotSupported if the first call or WAIT_MAX_ERRORS consecutive calls
+    fail. The tasks not yielded yet must then be polled with retrieve_results(),
+    which reports the errors of each task.
+  """
+  assert timeout is None or isinstance(timeout, float), timeout
+  url = '%s/api/swarming/v1/tasks/wait' % base_url
+  deadline = now() + timeout if timeout else None
+  remaining = list(task_ids)
+  supported = False
+  errors = 0
+
+  while remaining and not should_stop.is_set():
+    wait = WAIT_TIMEOUT
+    if deadline:
+      wait = min(wait, deadline - now())
+      if wait <= 0:
+        logging.error('wait_results(%s) timed out', base_url)
+        return
+
+    batch = remaining[:WAIT_MAX_TASKS]
+    data = {
+      'include_output': fetch_stdout,
+      'include_performance_stats': include_perf,
+      'task_ids': batch,
+      'timeout_secs': max(int(wait), 1),
+    }
+    result = net.url_read_json(url, data=data)
+    if not result or result.get('error'):
+      errors += 1
+      if not supported or errors >= WAIT_MAX_ERRORS:
+        raise WaitNotSupported()
+      logging.warning('Error while waiting for tasks: %s', result)
+      should_stop.wait(1.)
+      continue
+    supported = True
+    errors = 0
+
+    items = result.get('items') or []
+    outputs = result.get('outputs') or []
+    done = set()
+    for i, item in enumerate(items):
+      if item['task_id'] not in batch or item['task_id'] in done:
+        continue
+      if fetch_stdout:
+        item['output'] = outputs[i].get('output') if i < len(outputs) else None
+      done.add(item['task_id'])
+      yield item['task_id'], item
+    # Rotate the tasks still running to the end so all of them are waited for
+    # when there are more than WAIT_MAX_TASKS.
+    remaining = remaining[len(batch):] + [t for t in batch if t not in done]
+
+
+def _process_result(shard_index, result, output_collector):
+  """Records a result of a task that is not running anymore."""
+  # Record the result, try to fetch attached output files (if any).
+  if output_collector:
+    # TODO(vadimsh): Respect |should_stop| and |deadline| when fetching.
+    output_collector.process_shard_result(shard_index, result)
+  if result.get('internal_failure'):
+    logging.error('Internal error!')
+  elif result['state'] == 'BOT_DIED':
+    logging.error('Bot died!')
+  return result
 
 
 def convert_to_old_format(result):
@@ -610,6 +699,10 @@ def yield_results(
   Timed out shards are NOT yielded at all. Caller can compare number of yielded
   shards with len(task_keys) to verify all shards completed.
 
+  All the tasks are waited for by a single wait_results() call, on a thread of
+  its own. The other threads are only used to process the results and to fall
+  back to one retrieve_results() call per shard when tasks/wait can't be used.
+
   max_threads is optional and is used to limit the number of parallel fetches
   done. Since in general the number of task_keys is in the range <=10, it's not
   worth normally to limit the number threads. Mostly used for testing purposes.
@@ -626,7 +719,9 @@ def yield_results(
   should_stop = threading.Event()
   results_channel = threading_utils.TaskChannel()
 
-  with threading_utils.ThreadPool(number_threads, number_threads, 0) as pool:
+  # Threads are started on demand. One more is needed for wait_all_shards(), so
+  # the results are processed while it waits for the other tasks.
+  with threading_utils.ThreadPool(0, number_threads + 1, 0) as pool:
     try:
       # Adds a task to the thread pool to call 'retrieve_results' and return
       # the results together with shard_index that produced them (as a tuple).
@@ -637,9 +732,35 @@ def yield_results(
             task_id, timeout, should_stop, output_collector, include_perf,
             fetch_stdout)
 
-      # Enqueue 'retrieve_results' calls for each shard key to run in parallel.
-      for shard_index, task_id in enumerate(task_ids):
-        enqueue_retrieve_results(shard_index, task_id)
+      # Waits for all the shards, then sends each result to the channel once
+      # processed.
+      def wait_all_shards():
+        shards = collections.OrderedDict()
+        for shard_index, task_id in enumerate(task_ids):
+          shards.setdefault(task_id, []).append(shard_index)
+        try:
+          for task_id, result in wait_results(
+              swarm_base_url, list(shards), timeout, should_stop, include_perf,
+              fetch_stdout):
+            for shard_index in shards.pop(task_id):
+              task_fn = lambda i, r, c: (i, _process_result(i, r, c))
+              pool.add_task(
+                  0, results_channel.wrap_task(task_fn), shard_index, result,
+                  output_collector)
+        except WaitNotSupported:
+          logging.info('tasks/wait can\'t be used, polling each task')
+          for task_id, indexes in shards.iteritems():
+            for shard_index in indexes:
+              enqueue_retrieve_results(shard_index, task_id)
+          return
+        except Exception:
+          logging.exception('Unexpected exception in wait_results')
+        # Timed out or aborted.
+        for indexes in shards.itervalues():
+          for shard_index in indexes:
+            results_channel.send_result((shard_index, None))
+
+      pool.add_task(0, wait_all_shards)
 
       # Wait for all of them to finish.
       shards_remaining = range(len(task_ids))
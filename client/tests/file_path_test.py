@@ -4,6 +4,7 @@
 # Use of this source code is governed under the Apache License, Version 2.0
 # that can be found in the LICENSE file.
 
+import errno
 import getpass
 import logging
 import os
@@ -190,6 +191,100 @@ class FilePathTest(auto_stub.TestCase):
     # In particular, it fails when the input argument is a str.
     file_path.rmtree(str(subdir))
 
+  def make_deep_tree(self, root):
+    """Creates a tree with a few levels of directories, and returns the list of
+    the relative paths of its files.
+    """
+    files = []
+    for i in xrange(3):
+      for j in xrange(3):
+        d = os.path.join(root, u'd%d' % i, u'e%d' % j)
+        fs.makedirs(d)
+        for k in xrange(3):
+          write_content(os.path.join(d, u'f%d' % k), 'x')
+          files.append(os.path.join(u'd%d' % i, u'e%d' % j, u'f%d' % k))
+      write_content(os.path.join(root, u'd%d' % i, u'g'), 'x')
+      files.append(os.path.join(u'd%d' % i, u'g'))
+    return sorted(files)
+
+  def test_rmtree_parallel(self):
+    for threads in (0, 4):
+      self.mock(file_path, 'TREE_THREADS', threads)
+      root = os.path.join(self.tempdir, u'root%d' % threads)
+      self.make_deep_tree(root)
+      file_path.make_tree_read_only(root)
+      self.assertTrue(file_path.rmtree(root))
+      self.assertFalse(fs.exists(root))
+
+  def test_make_tree_writeable_parallel(self):
+    self.mock(file_path, 'TREE_THREADS', 4)
+    root = os.path.join(self.tempdir, u'root')
+    files = self.make_deep_tree(root)
+    file_path.make_tree_read_only(root)
+    for f in files:
+      self.assertMaskedFileMode(os.path.join(root, f), 0100444)
+    file_path.make_tree_writeable(root)
+    for f in files:
+      self.assertMaskedFileMode(os.path.join(root, f), 0100644)
+
+  def test_walk_tree(self):
+    self.mock(file_path, 'TREE_THREADS', 4)
+    root = os.path.join(self.tempdir, u'root')
+    files = self.make_deep_tree(root)
+    actual = []
+    def process(dirpath, _dirnames, filenames):
+      actual.extend(
+          os.path.relpath(os.path.join(dirpath, f), root) for f in filenames)
+    file_path._walk_tree(root, process)
+    self.assertEqual(files, sorted(actual))
+
+  def test_rmtree_async(self):
+    root = os.path.join(self.tempdir, u'root')
+    self.make_deep_tree(root)
+    thread = file_path.rmtree_async(root)
+    # The path can be reused right away.
+    self.assertFalse(fs.exists(root))
+    fs.mkdir(root)
+    thread.join()
+    self.assertEqual([u'root'], fs.listdir(self.tempdir))
+
+  def test_readable_copy(self):
+    infile = os.path.join(self.tempdir, u'in')
+    content = os.urandom(3 * 1024 * 1024 + 1)
+    write_content(infile, content)
+    fs.chmod(infile, 0500)
+    # Each function falls back to the next one if the file system doesn't
+    # support it, and ultimately to a copy in user space.
+    for i, fn in enumerate(file_path._COPY_FUNCTIONS + (None,)):
+      self.mock(file_path, '_COPY_FUNCTIONS', (fn,) if fn else ())
+      self.mock(file_path, '_COPY_METHODS', {})
+      outfile = os.path.join(self.tempdir, u'out%d' % i)
+      file_path.readable_copy(outfile, infile)
+      with fs.open(outfile, 'rb') as f:
+        self.assertEqual(content, f.read())
+      self.assertFileMode(outfile, 0100544, umask=0)
+
+  def test_readable_copy_unsupported(self):
+    calls = []
+    def copy(dst, src, size):
+      calls.append((dst.name, src.name, size))
+      raise OSError(errno.EXDEV, 'Invalid cross-device link')
+    self.mock(file_path, '_COPY_FUNCTIONS', (copy,))
+    self.mock(file_path, '_COPY_METHODS', {})
+    infile = os.path.join(self.tempdir, u'in')
+    write_content(infile, 'data')
+    for name in (u'out1', u'out2'):
+      outfile = os.path.join(self.tempdir, name)
+      file_path.readable_copy(outfile, infile)
+      with fs.open(outfile, 'rb') as f:
+        self.assertEqual('data', f.read())
+    # The function is only tried once for this pair of file systems.
+    dev = fs.stat(self.tempdir).st_dev
+    self.assertEqual(
+        [(fs.extend(os.path.join(self.tempdir, u'out1')), fs.extend(infile), 4)],
+        calls)
+    self.assertEqual({(dev, dev): ()}, file_path._COPY_METHODS)
+
   if sys.platform == 'darwin':
     def test_native_case_symlink_wrong_case(self):
       base_dir = file_path.get_native_path_case(BASE_DIR)
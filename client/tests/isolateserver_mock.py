@@ -119,6 +119,16 @@ class IsolateServerHandler(httpserver_mock.MockHandler):
       self._storage_helper(body)
     elif self.path.startswith('/api/isolateservice/v1/finalize_gs_upload'):
       self._storage_helper(body, True)
+    elif self.path.startswith('/api/isolateservice/v1/retrieve_batch'):
+      request = json.loads(body)
+      namespace = request['namespace']['namespace']
+      contents = self.server.contents.get(namespace, {})
+      self._json({
+        'items': [
+          {'digest': d, 'content': contents[d]}
+          for d in request['digests'] if contents.get(d) is not None
+        ],
+      })
     elif self.path.startswith('/api/isolateservice/v1/retrieve'):
       request = json.loads(body)
       namespace = request['namespace']['namespace']
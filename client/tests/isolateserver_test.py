@@ -15,6 +15,7 @@ import StringIO
 import sys
 import tarfile
 import tempfile
+import time
 import unittest
 import zlib
 
@@ -30,6 +31,7 @@ from depot_tools import fix_encoding
 from utils import file_path
 from utils import fs
 from utils import logging_utils
+from utils import net
 from utils import threading_utils
 
 import isolateserver_mock
@@ -602,6 +604,66 @@ class IsolateServerStorageApiTest(TestCase):
     with self.assertRaises(IOError):
       _ = ''.join(storage.fetch(item, 0, 0))
 
+  @staticmethod
+  def mock_fetch_batch_request(server, namespace, digests, response):
+    return (
+      server + '/api/isolateservice/v1/retrieve_batch',
+      {
+          'data': {
+              'digests': digests,
+              'namespace': {
+                  'compression': '',
+                  'digest_hash': 'sha-1',
+                  'namespace': namespace,
+              },
+          },
+          'read_timeout': 60,
+      },
+      response,
+    )
+
+  def test_fetch_batch(self):
+    server = 'http://example.com'
+    namespace = 'default'
+    inline = 'small content'
+    gs = 'content in gs'
+    inline_digest = isolateserver_mock.hash_content(inline)
+    gs_digest = isolateserver_mock.hash_content(gs)
+    missing_digest = isolateserver_mock.hash_content('missing')
+    digests = [inline_digest, gs_digest, missing_digest]
+    self.expected_requests([
+      self.mock_fetch_batch_request(
+          server, namespace, digests,
+          {
+            'items': [
+              {'digest': inline_digest, 'content': base64.b64encode(inline)},
+              {
+                'digest': gs_digest,
+                'url': server + '/some/gs/url/%s/%s' % (namespace, gs_digest),
+              },
+            ],
+          }),
+      self.mock_gs_request(server, namespace, gs_digest, gs),
+    ])
+    storage = isolate_storage.IsolateServer(server, namespace)
+    self.assertEqual(
+        {inline_digest: inline}, storage.fetch_batch(digests))
+    # The GS URL returned by the batch is used directly.
+    self.assertEqual(gs, ''.join(storage.fetch(gs_digest, 0, 0)))
+    self.assertEqual(
+        isolate_storage.ITEMS_PER_FETCH_BATCH, storage.batch_fetch_size)
+
+  def test_fetch_batch_failure(self):
+    server = 'http://example.com'
+    namespace = 'default'
+    digest = isolateserver_mock.hash_content('something')
+    self.expected_requests([
+      self.mock_fetch_batch_request(server, namespace, [digest], None),
+    ])
+    storage = isolate_storage.IsolateServer(server, namespace)
+    self.assertEqual({}, storage.fetch_batch([digest]))
+    self.assertEqual(0, storage.batch_fetch_size)
+
   def test_fetch_offset_success(self):
     server = 'http://example.com'
     namespace = 'default'
@@ -792,6 +854,17 @@ class IsolateServerStorageApiTest(TestCase):
     with self.assertRaises(isolated_format.MappingError):
       storage.contains([])
 
+  def test_http2_engine(self):
+    self.mock(net, '_request_engine_cls_per_host', {})
+    self.mock(net, 'hyper', None)
+    isolate_storage.IsolateServer('https://example.com', 'default')
+    self.assertEqual(
+        net.RequestsLibEngine, net.get_engine_class('https://example.com'))
+    self.mock(net, 'hyper', object())
+    isolate_storage.IsolateServer('https://example.com', 'default')
+    self.assertEqual(
+        net.Http2Engine, net.get_engine_class('https://example.com'))
+
   def test_contains_format_failure(self):
     server = 'http://example.com'
     namespace = 'default'
@@ -867,7 +940,7 @@ class IsolateServerStorageSmokeTest(unittest.TestCase):
   def test_upload_items_gzip(self):
     self.run_upload_items_test('default-gzip')
 
-  def run_push_and_fetch_test(self, namespace):
+  def run_push_and_fetch_test(self, namespace, with_size=False):
     storage = isolateserver.get_storage(self.server.url, namespace)
 
     # Upload items.
@@ -883,7 +956,10 @@ class IsolateServerStorageSmokeTest(unittest.TestCase):
     pending = set()
     for item in items:
       pending.add(item.digest)
-      queue.add(item.digest)
+      if with_size:
+        queue.add(item.digest, item.size)
+      else:
+        queue.add(item.digest)
 
     # Wait for fetch to complete.
     while pending:
@@ -904,6 +980,12 @@ class IsolateServerStorageSmokeTest(unittest.TestCase):
   def test_push_and_fetch_gzip(self):
     self.run_push_and_fetch_test('default-gzip')
 
+  def test_push_and_fetch_batch(self):
+    self.run_push_and_fetch_test('default', with_size=True)
+
+  def test_push_and_fetch_batch_gzip(self):
+    self.run_push_and_fetch_test('default-gzip', with_size=True)
+
   if sys.maxsize == (2**31) - 1:
     def test_archive_multiple_huge_file(self):
       self.server.discard_content()
@@ -970,6 +1052,30 @@ class IsolateServerDownloadTest(TestCase):
       self._requests = []
     super(IsolateServerDownloadTest, self).tearDown()
 
+  @staticmethod
+  def mock_fetch_batch_request(server, contents):
+    """Returns the expected /retrieve_batch request for [(digest, content)]."""
+    return (
+      server + '/api/isolateservice/v1/retrieve_batch',
+      {
+          'data': {
+              'digests': sorted(h for h, _ in contents),
+              'namespace': {
+                  'namespace': 'default-gzip',
+                  'digest_hash': 'sha-1',
+                  'compression': 'flate',
+              },
+          },
+          'read_timeout': 60,
+      },
+      {
+        'items': [
+          {'digest': h, 'content': base64.b64encode(zlib.compress(v))}
+          for h, v in contents
+        ],
+      },
+    )
+
   def test_download_two_files(self):
     # Test downloading two files.
     actual = {}
@@ -1035,8 +1141,8 @@ class IsolateServerDownloadTest(TestCase):
     }
     isolated_data = json.dumps(isolated, sort_keys=True, separators=(',',':'))
     isolated_hash = isolateserver_mock.hash_content(isolated_data)
-    requests = [(v['h'], files[k]) for k, v in isolated['files'].iteritems()]
-    requests.append((isolated_hash, isolated_data))
+    batch = [(v['h'], files[k]) for k, v in isolated['files'].iteritems()]
+    requests = [(isolated_hash, isolated_data)]
     requests = [
       (
         server + '/api/isolateservice/v1/retrieve',
@@ -1055,6 +1161,7 @@ class IsolateServerDownloadTest(TestCase):
         {'content': base64.b64encode(zlib.compress(v))},
       ) for h, v in requests
     ]
+    requests.append(self.mock_fetch_batch_request(server, batch))
     cmd = [
       'download',
       '--isolate-server', server,
@@ -1121,11 +1228,11 @@ class IsolateServerDownloadTest(TestCase):
     }
     isolated_data = json.dumps(isolated, sort_keys=True, separators=(',',':'))
     isolated_hash = isolateserver_mock.hash_content(isolated_data)
-    requests = [
+    batch = [
       (isolated['files']['archive1']['h'], archive),
       (isolated['files']['c']['h'], files['c']),
     ]
-    requests.append((isolated_hash, isolated_data))
+    requests = [(isolated_hash, isolated_data)]
     requests = [
       (
         server + '/api/isolateservice/v1/retrieve',
@@ -1144,6 +1251,7 @@ class IsolateServerDownloadTest(TestCase):
         {'content': base64.b64encode(zlib.compress(v))},
       ) for h, v in requests
     ]
+    requests.append(self.mock_fetch_batch_request(server, batch))
     cmd = [
       'download',
       '--isolate-server', server,
@@ -1256,6 +1364,78 @@ class TestArchive(TestCase):
       self.help_test_archive(['archive'])
 
 
+class FakeUploadStorage(object):
+  """Storage that records the uploaded items."""
+  def __init__(self):
+    self.uploaded = []
+    self.contents = {}
+
+  @property
+  def hash_algo(self):  # pylint: disable=R0201
+    return isolated_format.get_hash_algo('default')
+
+  def upload_items(self, items):
+    self.uploaded.extend(items)
+    for i in items:
+      self.contents[i.digest] = ''.join(i.content())
+    return items
+
+
+@unittest.skipUnless(
+    isolateserver.IncrementalArchiver.is_supported(), 'Requires inotify')
+class IncrementalArchiverTest(TestCase):
+  def setUp(self):
+    super(IncrementalArchiverTest, self).setUp()
+    self.mock(isolateserver.IncrementalArchiver, 'BATCH_DELAY', 0.01)
+    self.storage = FakeUploadStorage()
+
+  def wait_for_uploads(self, count):
+    for _ in xrange(500):
+      if len(self.storage.uploaded) >= count:
+        return
+      time.sleep(0.01)
+    self.fail('Uploaded %d items' % len(self.storage.uploaded))
+
+  def uploaded_paths(self):
+    return sorted(
+        os.path.relpath(i.path, self.tempdir) for i in self.storage.uploaded
+        if i.path.startswith(self.tempdir))
+
+  def test_archive(self):
+    fs.mkdir(os.path.join(self.tempdir, u'd'))
+    archiver = isolateserver.IncrementalArchiver(self.storage, self.tempdir)
+    isolateserver.file_write(os.path.join(self.tempdir, u'a'), ['a'])
+    isolateserver.file_write(os.path.join(self.tempdir, u'd', u'b'), ['b'])
+    # Created after the archiver started.
+    fs.mkdir(os.path.join(self.tempdir, u'e'))
+    time.sleep(0.1)
+    isolateserver.file_write(os.path.join(self.tempdir, u'e', u'c'), ['c'])
+    self.wait_for_uploads(3)
+    archived, cold, hot = archiver.stop()
+    self.assertEqual([u'a', u'd/b', u'e/c'], self.uploaded_paths())
+    self.assertEqual(
+        sorted(os.path.join(self.tempdir, p) for p in (u'a', u'd/b', u'e/c')),
+        sorted(archived))
+    self.assertEqual(3, len(cold))
+    self.assertEqual([], hot)
+
+    # d/b is modified and f is written after stop(); only these two files and
+    # the .isolated file are uploaded at the end.
+    self.storage.uploaded = []
+    isolateserver.file_write(os.path.join(self.tempdir, u'd', u'b'), ['bb'])
+    isolateserver.file_write(os.path.join(self.tempdir, u'f'), ['f'])
+    results, cold, hot = isolateserver.archive_files_to_storage(
+        self.storage, [self.tempdir], None, archived)
+    self.assertEqual([u'd/b', u'f'], self.uploaded_paths())
+    self.assertEqual(3, len(cold))
+    self.assertEqual([], hot)
+    isolated = json.loads(self.storage.contents[results[0][0]])
+    self.assertEqual(
+        [u'a', u'd/b', u'e/c', u'f'], sorted(isolated['files']))
+    self.assertEqual(
+        isolateserver_mock.hash_content('bb'), isolated['files']['d/b']['h'])
+
+
 class DiskCacheTest(TestCase):
   def setUp(self):
     super(DiskCacheTest, self).setUp()
@@ -1325,6 +1505,31 @@ class DiskCacheTest(TestCase):
     cache.cleanup()
     self.assertEqual([u'state.json'], os.listdir(self.tempdir))
 
+  def test_reset_stats(self):
+    # A cache instance reused across runs, like in run_isolated's daemon mode.
+    self._free_disk = 1100
+    h_a = self.to_hash('a')[0]
+    h_b = self.to_hash('b')[0]
+    cache = self.get_cache()
+    cache.write(h_a, 'a')
+    cache.write(h_b, 'b')
+    self.assertEqual([1, 1], cache.added)
+    self.assertEqual(h_a, cache._protected)
+    self.assertEqual(0, cache.initial_number_items)
+
+    cache.reset_stats()
+    self.assertEqual([], cache.added)
+    self.assertEqual([], cache.used)
+    self.assertEqual([], cache.evicted)
+    self.assertEqual(None, cache._protected)
+    self.assertEqual(2, cache.initial_number_items)
+    self.assertEqual(2, cache.initial_size)
+    self.assertTrue(cache.touch(h_b, 1))
+    self.assertEqual(h_b, cache._protected)
+    with cache.getfileobj(h_b) as f:
+      self.assertEqual('b', f.read())
+    self.assertEqual([1], cache.used)
+
   def test_policies_active_trimming(self):
     # Start with a larger cache, add many object.
     # Reload the cache with smaller policies, the cache should be trimmed on
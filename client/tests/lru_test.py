@@ -191,6 +191,18 @@ class LRUDictTest(unittest.TestCase):
     lru_dict = save_and_load(lru_dict)
     self.assert_order(lru_dict, data + [4])
 
+  def test_load_save_version(self):
+    handle, tmp_name = tempfile.mkstemp(prefix=u'lru_test')
+    os.close(handle)
+    try:
+      lru_dict = self.prepare_lru_dict([1, 2])
+      lru_dict.save(tmp_name, version=3)
+      with self.assertRaises(ValueError):
+        lru.LRUDict.load(tmp_name)
+      self.assert_order(lru.LRUDict.load(tmp_name, max_version=3), [1, 2])
+    finally:
+      os.unlink(tmp_name)
+
   def test_corrupted_state_file(self):
     def load_from_state(state_text):
       handle, tmp_name = tempfile.mkstemp(prefix=u'lru_test')
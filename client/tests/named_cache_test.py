@@ -3,8 +3,10 @@
 # Use of this source code is governed under the Apache License, Version 2.0
 # that can be found in the LICENSE file.
 
+import json
 import logging
 import os
+import shutil
 import sys
 import tempfile
 import unittest
@@ -14,9 +16,11 @@ ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(
 sys.path.insert(0, ROOT_DIR)
 sys.path.insert(0, os.path.join(ROOT_DIR, 'third_party'))
 
+from depot_tools import auto_stub
 from depot_tools import fix_encoding
 from utils import file_path
 from utils import fs
+from utils import lru
 import named_cache
 
 
@@ -30,8 +34,9 @@ def read_file(path):
     return f.read()
 
 
-class CacheManagerTest(unittest.TestCase):
+class CacheManagerTest(auto_stub.TestCase):
   def setUp(self):
+    super(CacheManagerTest, self).setUp()
     self.tempdir = tempfile.mkdtemp(prefix=u'named_cache_test')
     self.manager = named_cache.CacheManager(self.tempdir)
 
@@ -93,8 +98,8 @@ class CacheManagerTest(unittest.TestCase):
       self.manager.uninstall(b_path, u'2')
 
       self.assertEqual(3, len(os.listdir(self.manager.root_dir)))
-      path1 = os.path.join(self.manager.root_dir, self.manager._lru['1'])
-      path2 = os.path.join(self.manager.root_dir, self.manager._lru['2'])
+      path1 = os.path.join(self.manager.root_dir, self.manager._get_entry('1')[0])
+      path2 = os.path.join(self.manager.root_dir, self.manager._get_entry('2')[0])
 
       self.assertEqual('x', read_file(os.path.join(path1, u'x')))
       self.assertEqual('y', read_file(os.path.join(path2, u'y')))
@@ -128,8 +133,8 @@ class CacheManagerTest(unittest.TestCase):
       self.manager.uninstall(b_path, '2')
 
       self.assertEqual(3, len(os.listdir(self.manager.root_dir)))
-      path1 = os.path.join(self.manager.root_dir, self.manager._lru['1'])
-      path2 = os.path.join(self.manager.root_dir, self.manager._lru['2'])
+      path1 = os.path.join(self.manager.root_dir, self.manager._get_entry('1')[0])
+      path2 = os.path.join(self.manager.root_dir, self.manager._get_entry('2')[0])
 
       self.assertEqual('x2', read_file(os.path.join(path1, 'x')))
       self.assertEqual('y', read_file(os.path.join(path2, 'y')))
@@ -147,6 +152,131 @@ class CacheManagerTest(unittest.TestCase):
           set(map(str, xrange(10, 10 + named_cache.MAX_CACHE_SIZE))),
           set(os.listdir(os.path.join(self.tempdir, 'named'))))
 
+  def test_size(self):
+    dest_dir = tempfile.mkdtemp(prefix=u'named_cache_test')
+    try:
+      with self.manager.open():
+        a_path = os.path.join(dest_dir, u'a')
+        self.manager.install(a_path, u'1')
+        fs.mkdir(os.path.join(a_path, u'sub'))
+        write_file(os.path.join(a_path, u'x'), 'xx')
+        write_file(os.path.join(a_path, u'sub', u'y'), 'yyy')
+        if sys.platform != 'win32':
+          # Hardlinks are only counted once.
+          os.link(os.path.join(a_path, u'x'), os.path.join(a_path, u'z'))
+        self.manager.uninstall(a_path, u'1')
+        self.assertEqual((5, 2), self.manager.get_size(u'1'))
+        self.assertEqual(5, self.manager.total_size)
+
+      # The size is saved in the state.
+      with self.manager.open():
+        self.assertEqual((5, 2), self.manager.get_size(u'1'))
+
+      # Older versions, which only read version 2, reject the state.
+      state_path = os.path.join(self.tempdir, u'state.json')
+      with open(state_path) as f:
+        self.assertEqual(3, json.load(f)['version'])
+      with self.assertRaises(ValueError):
+        lru.LRUDict.load(state_path)
+    finally:
+      file_path.rmtree(dest_dir)
+
+  def test_old_state(self):
+    # Entries saved by previous versions only contain the path.
+    fs.mkdir(os.path.join(self.tempdir, u'ab'))
+    write_file(os.path.join(self.tempdir, u'ab', u'x'), 'x')
+    with open(os.path.join(self.tempdir, u'state.json'), 'w') as f:
+      f.write('{"version":2,"items":[["1",["ab",1]]]}')
+    dest_dir = tempfile.mkdtemp(prefix=u'named_cache_test')
+    try:
+      with self.manager.open():
+        self.assertEqual((None, None), self.manager.get_size(u'1'))
+        self.assertEqual(0, self.manager.total_size)
+        a_path = os.path.join(dest_dir, u'a')
+        self.manager.install(a_path, u'1')
+        self.assertEqual('x', read_file(os.path.join(a_path, u'x')))
+        self.manager.uninstall(a_path, u'1')
+        self.assertEqual((1, 1), self.manager.get_size(u'1'))
+    finally:
+      file_path.rmtree(dest_dir)
+
+  def test_trim_max_size(self):
+    dest_dir = tempfile.mkdtemp(prefix=u'named_cache_test')
+    try:
+      with self.manager.open():
+        for i in xrange(5):
+          path = os.path.join(dest_dir, unicode(i))
+          self.manager.install(path, unicode(i))
+          write_file(os.path.join(path, u'x'), 'x' * 10)
+          self.manager.uninstall(path, unicode(i))
+        self.assertEqual(50, self.manager.total_size)
+        self.assertEqual(0, self.manager.trim(None, 50))
+        self.assertEqual(2, self.manager.trim(None, 35))
+        self.assertEqual({u'2', u'3', u'4'}, self.manager.available)
+        self.assertEqual(30, self.manager.total_size)
+    finally:
+      file_path.rmtree(dest_dir)
+
+  def test_fork(self):
+    # Copy-on-write copies may not be supported by the file system running the
+    # test.
+    self.mock(
+        named_cache, '_clone_tree',
+        lambda src, dst: shutil.copytree(src, dst, symlinks=True))
+    manager = named_cache.CacheManager(self.tempdir, fork=True)
+    dest_dir = tempfile.mkdtemp(prefix=u'named_cache_test')
+    try:
+      with manager.open():
+        a_path = os.path.join(dest_dir, u'a')
+        b_path = os.path.join(dest_dir, u'b')
+        manager.install(a_path, u'1')
+        write_file(os.path.join(a_path, u'x'), 'x')
+        manager.uninstall(a_path, u'1')
+        old_path = os.path.join(self.tempdir, manager._get_entry(u'1')[0])
+
+        # The cache stays available while it is installed.
+        manager.install(a_path, u'1')
+        manager.install(b_path, u'1')
+        self.assertEqual({u'1'}, manager.available)
+        self.assertEqual('x', read_file(os.path.join(a_path, u'x')))
+        self.assertEqual('x', read_file(os.path.join(b_path, u'x')))
+        self.assertEqual('x', read_file(os.path.join(old_path, u'x')))
+
+        # The last one to be uninstalled wins.
+        write_file(os.path.join(a_path, u'x'), 'a')
+        write_file(os.path.join(b_path, u'x'), 'bb')
+        manager.uninstall(a_path, u'1')
+        manager.uninstall(b_path, u'1')
+        self.assertFalse(os.path.isdir(old_path))
+        path = os.path.join(self.tempdir, manager._get_entry(u'1')[0])
+        self.assertEqual('bb', read_file(os.path.join(path, u'x')))
+        self.assertEqual((2, 1), manager.get_size(u'1'))
+        self.assertEqual(os.readlink(manager._get_named_path(u'1')), path)
+        self.assertEqual(
+            sorted([u'named', os.path.basename(path)]),
+            sorted(os.listdir(self.tempdir)))
+    finally:
+      file_path.rmtree(dest_dir)
+
+  def test_fork_unsupported(self):
+    def clone_tree(_src, _dst):
+      raise named_cache.Error('not supported')
+    self.mock(named_cache, '_clone_tree', clone_tree)
+    manager = named_cache.CacheManager(self.tempdir, fork=True)
+    dest_dir = tempfile.mkdtemp(prefix=u'named_cache_test')
+    try:
+      with manager.open():
+        a_path = os.path.join(dest_dir, u'a')
+        manager.install(a_path, u'1')
+        write_file(os.path.join(a_path, u'x'), 'x')
+        manager.uninstall(a_path, u'1')
+        # Falls back to moving the cache.
+        manager.install(a_path, u'1')
+        self.assertFalse(manager.available)
+        self.assertEqual('x', read_file(os.path.join(a_path, u'x')))
+    finally:
+      file_path.rmtree(dest_dir)
+
   def test_corrupted(self):
     with open(os.path.join(self.tempdir, u'state.json'), 'w') as f:
       f.write('}}}}')
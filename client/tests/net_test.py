@@ -13,6 +13,7 @@ import math
 import os
 import sys
 import unittest
+import urlparse
 
 ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(
     __file__.decode(sys.getfilesystemencoding()))))
@@ -245,6 +246,14 @@ class HttpServiceTest(RetryLoopMockedTest):
     self.assertEqual(result.read(), response)
     self.assertAttempts(2, net.URL_OPEN_TIMEOUT)
 
+  def test_error_is_congestion(self):
+    self.assertTrue(net.TimeoutError().is_congestion)
+    self.assertTrue(net.ConnectionError().is_congestion)
+    self.assertTrue(net.HttpError(429, 'text/plain', None).is_congestion)
+    self.assertTrue(net.HttpError(503, 'text/plain', None).is_congestion)
+    self.assertFalse(net.HttpError(404, 'text/plain', None).is_congestion)
+    self.assertFalse(net.HttpError(500, 'text/plain', None).is_congestion)
+
   def test_request_HTTP_error_with_retry(self):
     response = 'response'
     attempts = []
@@ -360,7 +369,185 @@ class HttpServiceTest(RetryLoopMockedTest):
     self.assertEqual(['filepath'], removed)
 
 
+class FakeHyperResponse(object):
+  def __init__(self, status, headers, content):
+    self.status = status
+    self.headers = FakeHeaderMap(headers)
+    self._content = StringIO.StringIO(content)
+    self.closed = False
+
+  def read(self, amt=None):
+    return self._content.read(*([amt] if amt else []))
+
+  def close(self):
+    self.closed = True
+
+
+class FakeHeaderMap(object):
+  def __init__(self, items):
+    self._items = items
+
+  def items(self):
+    return self._items[:]
+
+
+class Http2EngineTest(auto_stub.TestCase):
+  def setUp(self):
+    super(Http2EngineTest, self).setUp()
+    self.connections = []
+    self.probes = []
+    # Path -> FakeHyperResponse arguments.
+    self.responses = {}
+    test = self
+
+    class HTTP20Error(Exception):
+      pass
+
+    class FakeConnection(object):
+      def __init__(self, host, port, secure, ssl_context, timeout):
+        self.host = host
+        self.port = port
+        self.requests = []
+        self.closed = False
+        test.connections.append(self)
+
+      def request(self, method, url, body=None, headers=None):
+        self.requests.append((method, url, body, headers))
+        return len(self.requests)
+
+      def get_response(self, stream_id):
+        response = test.responses[self.requests[stream_id - 1][1]]
+        if isinstance(response, Exception):
+          raise response
+        return FakeHyperResponse(*response)
+
+      def close(self):
+        self.closed = True
+
+    hyper = type(sys)('hyper')
+    hyper.HTTP20Connection = FakeConnection
+    hyper.tls = type(sys)('hyper.tls')
+    hyper.tls.init_context = lambda cert_path: 'context'
+    hyper.http20 = type(sys)('hyper.http20')
+    hyper.http20.exceptions = type(sys)('hyper.http20.exceptions')
+    hyper.http20.exceptions.HTTP20Error = HTTP20Error
+    self.HTTP20Error = HTTP20Error
+    self.mock(net, 'hyper', hyper)
+
+  def new_engine(self):
+    engine = net.Http2Engine()
+    def probe(url, _timeout):
+      self.probes.append(url.netloc)
+      return url.hostname != 'h1.example.com'
+    engine._probe_h2 = probe
+    return engine
+
+  def request(self, url, method='GET', body=None, headers=None):
+    return net.HttpRequest(
+        method, url, [('a', 'b')], body, headers or {}, 60, True, True)
+
+  def test_request(self):
+    self.responses['/foo?a=b'] = (
+        200, [('content-type', 'text/plain'), ('x-a', '1'), ('x-a', '2')],
+        'hello')
+    engine = self.new_engine()
+    for _ in xrange(2):
+      response = engine.perform_request(self.request(
+          'https://example.com/foo', 'POST', 'body', {'Content-Length': 4}))
+      self.assertEqual('hello', response.read())
+      self.assertEqual('text/plain', response.get_header('Content-Type'))
+      self.assertEqual('1, 2', response.get_header('X-A'))
+    # A single connection is used for both requests.
+    self.assertEqual(['example.com'], self.probes)
+    self.assertEqual(1, len(self.connections))
+    self.assertEqual(('example.com', 443), (
+        self.connections[0].host, self.connections[0].port))
+    self.assertEqual(
+        [('POST', '/foo?a=b', 'body', {'content-length': '4'})] * 2,
+        self.connections[0].requests)
+    self.assertEqual({
+        'connections': 1,
+        'fallback_requests': 0,
+        'max_streams': 1,
+        'requests': 2,
+        'streams': 0,
+      }, engine.get_stats())
+
+  def test_multiplexing(self):
+    engine = self.new_engine()
+    url = urlparse.urlparse('https://example.com/')
+    entries = [engine._get_connection(url, 60) for _ in xrange(5)]
+    # Extra requests are multiplexed over the existing connections.
+    self.assertEqual(net.Http2Engine.CONNECTIONS_PER_HOST, len(self.connections))
+    self.assertEqual([3, 2], [e[1] for e in engine._connections['example.com']])
+    stats = engine.get_stats()
+    self.assertEqual(5, stats['streams'])
+    self.assertEqual(3, stats['max_streams'])
+    self.assertEqual(5, len(entries))
+
+  def test_http_error(self):
+    self.responses['/foo?a=b'] = (
+        404, [('content-type', 'text/plain')], 'not found')
+    engine = self.new_engine()
+    with self.assertRaises(net.HttpError) as ctx:
+      engine.perform_request(self.request('https://example.com/foo'))
+    self.assertEqual(404, ctx.exception.code)
+    self.assertEqual('text/plain', ctx.exception.content_type)
+    headers, body = ctx.exception._extract_response_details(engine)
+    self.assertEqual([('content-type', 'text/plain')], headers)
+    self.assertEqual('not found', body)
+
+  def test_redirect(self):
+    self.responses['/foo?a=b'] = (302, [('location', '/bar')], '')
+    self.responses['/bar'] = (200, [], 'hello')
+    engine = self.new_engine()
+    response = engine.perform_request(self.request('https://example.com/foo'))
+    self.assertEqual('hello', response.read())
+
+  def test_connection_error(self):
+    self.responses['/foo?a=b'] = self.HTTP20Error('reset')
+    engine = self.new_engine()
+    with self.assertRaises(net.ConnectionError):
+      engine.perform_request(self.request('https://example.com/foo'))
+    # The connection is dropped.
+    self.assertTrue(self.connections[0].closed)
+    self.assertEqual([], engine._connections['example.com'])
+    self.assertEqual(0, engine.get_stats()['streams'])
+
+  def test_fallback(self):
+    engine = self.new_engine()
+    fallback = []
+    self.mock(engine._fallback, 'perform_request', fallback.append)
+    requests = [
+      self.request('https://h1.example.com/foo'),
+      self.request('https://h1.example.com/foo'),
+      self.request('http://example.com/foo'),
+    ]
+    for r in requests:
+      engine.perform_request(r)
+    self.assertEqual(requests, fallback)
+    # HTTP/2 support is probed once.
+    self.assertEqual(['h1.example.com'], self.probes)
+    self.assertEqual([], self.connections)
+    self.assertEqual(3, engine.get_stats()['fallback_requests'])
+
+
 class TestNetFunctions(auto_stub.TestCase):
+  def test_set_engine_class_per_host(self):
+    self.mock(net, '_request_engine_cls_per_host', {})
+    self.mock(net, '_http_services', {})
+    net.set_engine_class(net.Http2Engine, 'https://Example.com/')
+    # Setting it again is fine.
+    net.set_engine_class(net.Http2Engine, 'https://example.com')
+    self.assertEqual(
+        net.Http2Engine, net.get_engine_class('https://example.com'))
+    self.assertEqual(
+        net.RequestsLibEngine, net.get_engine_class('https://other.com'))
+    self.assertEqual(net.RequestsLibEngine, net.get_engine_class())
+    service = net.get_http_service('https://example.com', allow_cached=False)
+    self.assertIsInstance(service.engine, net.Http2Engine)
+
+
   def test_fix_url(self):
     data = [
       ('http://foo.com/', 'http://foo.com'),
@@ -90,6 +90,7 @@ class StorageFake(object):
     self._files = files.copy()
     self.namespace = 'default-gzip'
     self.location = 'http://localhost:1'
+    self.batch_fetch_size = 0
 
   def __enter__(self, *_):
     return self
@@ -702,8 +703,8 @@ class RunIsolatedTest(RunIsolatedTestBase):
       os.path.join(cache_small, u'small'): small,
       os.path.join(cache_big, u'big'): big,
       u'state.json':
-          '{"items":[["first",["%s",1]],["second",["%s",3]]],"version":2}' % (
-          cache_big, cache_small),
+          '{"items":[["first",[["%s",%d,1],1]],["second",[["%s",%d,1],3]]],'
+          '"version":3}' % (cache_big, len(big), cache_small, len(small)),
     }
     self.assertEqual(expected, actual)
     expected = {
@@ -738,7 +739,8 @@ class RunIsolatedTest(RunIsolatedTestBase):
     expected = {
       os.path.join(cache_small, u'small'): small,
       u'state.json':
-          '{"items":[["second",["%s",3]]],"version":2}' % cache_small,
+          '{"items":[["second",[["%s",%d,1],3]]],"version":3}' % (
+              cache_small, len(small)),
     }
     self.assertEqual(expected, actual)
     expected = {
@@ -750,7 +752,7 @@ class RunIsolatedTest(RunIsolatedTestBase):
 
 
 class RunIsolatedTestRun(RunIsolatedTestBase):
-  def test_output(self):
+  def _run_test_output(self, incremental_upload):
     # Starts a full isolate server mock and have run_tha_test() uploads results
     # back after the task completed.
     server = isolateserver_mock.MockIsolateServer()
@@ -796,7 +798,8 @@ class RunIsolatedTestRun(RunIsolatedTestBase):
           None,
           run_isolated.noop_install_packages,
           False,
-          False)
+          False,
+          incremental_upload=incremental_upload)
       self.assertEqual(0, ret)
 
       # It uploaded back. Assert the store has a new item containing foo.
@@ -832,6 +835,14 @@ class RunIsolatedTestRun(RunIsolatedTestBase):
     finally:
       server.close()
 
+  def test_output(self):
+    self._run_test_output(False)
+
+  @unittest.skipIf(
+      not isolateserver.IncrementalArchiver.is_supported(), 'Requires inotify')
+  def test_output_incremental_upload(self):
+    self._run_test_output(True)
+
 
 # Like RunIsolatedTestRun, but ensures that specific output files
 # (as opposed to anything in $(ISOLATED_OUTDIR)) are returned.
@@ -540,10 +540,74 @@ class TestSwarmingTrigger(NetTestCase):
     self._check_output('', 'Priority was reset to 200\n')
 
 
+def gen_wait_request(task_ids, response, timeout_secs=10):
+  """Returns an expected tasks/wait call as done by yield_results()."""
+  return (
+    'https://host:9001/api/swarming/v1/tasks/wait',
+    {
+      'data': {
+        'include_output': True,
+        'include_performance_stats': False,
+        'task_ids': task_ids,
+        'timeout_secs': timeout_secs,
+      },
+    },
+    response,
+  )
+
+
 class TestSwarmingCollection(NetTestCase):
+  def setUp(self):
+    super(TestSwarmingCollection, self).setUp()
+    self.mock(swarming, 'now', lambda: 1000.)
+
   def test_success(self):
     self.expected_requests(
         [
+          gen_wait_request(
+              ['10100'],
+              {
+                'items': [gen_result_response()],
+                'outputs': [{'output': OUTPUT}],
+              }),
+        ])
+    expected = [gen_yielded_data(0, output=OUTPUT)]
+    self.assertEqual(expected, get_results(['10100']))
+
+  def test_failure(self):
+    self.expected_requests(
+        [
+          gen_wait_request(
+              ['10100'],
+              {
+                'items': [gen_result_response(exit_code=1)],
+                'outputs': [{'output': OUTPUT}],
+              }),
+        ])
+    expected = [gen_yielded_data(0, output=OUTPUT, exit_code=1)]
+    self.assertEqual(expected, get_results(['10100']))
+
+  def test_no_ids(self):
+    actual = get_results([])
+    self.assertEqual([], actual)
+
+  def test_wait_timeout(self):
+    self.mock(logging, 'error', lambda *_, **__: None)
+    now = [1000., 1000., 1005., 1010.]
+    self.mock(swarming, 'now', lambda: now.pop(0))
+    self.expected_requests(
+        [
+          gen_wait_request(['10100'], {'now': 'now'}),
+          gen_wait_request(['10100'], {'now': 'now'}, timeout_secs=5),
+        ])
+    self.assertEqual([], get_results(['10100']))
+    self.assertEqual([], now)
+
+  def test_wait_not_supported(self):
+    # The server doesn't implement tasks/wait, fall back to polling.
+    self.expected_requests(
+        [
+          gen_wait_request(['10100'], None),
           (
             'https://host:9001/api/swarming/v1/task/10100/result',
             {'retry_50x': False},
@@ -558,41 +622,105 @@ class TestSwarmingCollection(NetTestCase):
     expected = [gen_yielded_data(0, output=OUTPUT)]
     self.assertEqual(expected, get_results(['10100']))
 
-  def test_failure(self):
+  def test_wait_transient_error(self):
+    self.mock(logging, 'warning', lambda *_: None)
     self.expected_requests(
+        [
+          gen_wait_request(
+              ['10100', '10200'],
+              {
+                'items': [gen_result_response()],
+                'outputs': [{'output': SHARD_OUTPUT_1}],
+              }),
+          gen_wait_request(['10200'], None),
+          gen_wait_request(
+              ['10200'],
+              {
+                'items': [gen_result_response(task_id=u'10200')],
+                'outputs': [{'output': SHARD_OUTPUT_2}],
+              }),
+        ])
+    expected = [
+      gen_yielded_data(0, output=SHARD_OUTPUT_1),
+      gen_yielded_data(1, output=SHARD_OUTPUT_2, task_id=u'10200'),
+    ]
+    self.assertEqual(expected, sorted(get_results(['10100', '10200'])))
+
+  def test_wait_repeated_errors(self):
+    # tasks/wait keeps failing, e.g. a task was deleted, fall back to polling.
+    self.mock(logging, 'warning', lambda *_: None)
+    self.expected_requests(
+        [
+          gen_wait_request(
+              ['10100', '10200'],
+              {
+                'items': [gen_result_response()],
+                'outputs': [{'output': SHARD_OUTPUT_1}],
+              }),
+        ] +
+        swarming.WAIT_MAX_ERRORS * [gen_wait_request(['10200'], None)] +
         [
           (
-            'https://host:9001/api/swarming/v1/task/10100/result',
+            'https://host:9001/api/swarming/v1/task/10200/result',
             {'retry_50x': False},
-            gen_result_response(exit_code=1),
+            gen_result_response(task_id=u'10200'),
           ),
           (
-            'https://host:9001/api/swarming/v1/task/10100/stdout',
+            'https://host:9001/api/swarming/v1/task/10200/stdout',
             {},
-            {'output': OUTPUT},
+            {'output': SHARD_OUTPUT_2},
           ),
         ])
-    expected = [gen_yielded_data(0, output=OUTPUT, exit_code=1)]
-    self.assertEqual(expected, get_results(['10100']))
+    expected = [
+      gen_yielded_data(0, output=SHARD_OUTPUT_1),
+      gen_yielded_data(1, output=SHARD_OUTPUT_2, task_id=u'10200'),
+    ]
+    self.assertEqual(expected, sorted(get_results(['10100', '10200'])))
 
-  def test_no_ids(self):
-    actual = get_results([])
-    self.assertEqual([], actual)
+  def test_wait_max_tasks(self):
+    # The tasks are waited for in batches, rotating the ones still running.
+    self.mock(swarming, 'WAIT_MAX_TASKS', 2)
+    self.expected_requests(
+        [
+          gen_wait_request(['10100', '10200'], {'now': 'now'}),
+          gen_wait_request(
+              ['10300', '10100'],
+              {
+                'items': [gen_result_response(task_id=u'10300')],
+                'outputs': [{'output': SHARD_OUTPUT_3}],
+              }),
+          gen_wait_request(
+              ['10200', '10100'],
+              {
+                'items': [
+                  gen_result_response(task_id=u'10100'),
+                  gen_result_response(task_id=u'10200'),
+                ],
+                'outputs': [
+                  {'output': SHARD_OUTPUT_1},
+                  {'output': SHARD_OUTPUT_2},
+                ],
+              }),
+        ])
+    expected = [
+      gen_yielded_data(0, output=SHARD_OUTPUT_1),
+      gen_yielded_data(1, output=SHARD_OUTPUT_2, task_id=u'10200'),
+      gen_yielded_data(2, output=SHARD_OUTPUT_3, task_id=u'10300'),
+    ]
+    actual = get_results(['10100', '10200', '10300'])
+    self.assertEqual(expected, sorted(actual))
 
   def test_url_errors(self):
     self.mock(logging, 'error', lambda *_, **__: None)
     # NOTE: get_results() hardcodes timeout=10.
-    now = {}
-    lock = threading.Lock()
-    def get_now():
-      t = threading.current_thread()
-      with lock:
-        return now.setdefault(t, range(10)).pop(0)
+    now = iter(xrange(100))
     self.mock(swarming.net, 'sleep_before_retry', lambda _x, _y: None)
-    self.mock(swarming, 'now', get_now)
+    self.mock(swarming, 'now', lambda: now.next())
     # The actual number of requests here depends on 'now' progressing to 10
-    # seconds. It's called once per loop. Loop makes 9 iterations.
+    # seconds. It's called once per loop. tasks/wait fails on the first call so
+    # retrieve_results() is used, starting at 2. Loop makes 9 iterations.
     self.expected_requests(
+        [gen_wait_request(['10100'], None, timeout_secs=9)] +
         9 * [
           (
             'https://host:9001/api/swarming/v1/task/10100/result',
@@ -602,46 +730,34 @@ class TestSwarmingCollection(NetTestCase):
         ])
     actual = get_results(['10100'])
     self.assertEqual([], actual)
-    self.assertTrue(all(not v for v in now.itervalues()), now)
+    self.assertEqual(13, now.next())
 
   def test_many_shards(self):
     self.expected_requests(
         [
-          (
-            'https://host:9001/api/swarming/v1/task/10100/result',
-            {'retry_50x': False},
-            gen_result_response(),
-          ),
-          (
-            'https://host:9001/api/swarming/v1/task/10100/stdout',
-            {},
-            {'output': SHARD_OUTPUT_1},
-          ),
-          (
-            'https://host:9001/api/swarming/v1/task/10200/result',
-            {'retry_50x': False},
-            gen_result_response(),
-          ),
-          (
-            'https://host:9001/api/swarming/v1/task/10200/stdout',
-            {},
-            {'output': SHARD_OUTPUT_2},
-          ),
-          (
-            'https://host:9001/api/swarming/v1/task/10300/result',
-            {'retry_50x': False},
-            gen_result_response(),
-          ),
-          (
-            'https://host:9001/api/swarming/v1/task/10300/stdout',
-            {},
-            {'output': SHARD_OUTPUT_3},
-          ),
+          gen_wait_request(
+              ['10100', '10200', '10300'],
+              {
+                'items': [
+                  gen_result_response(),
+                  gen_result_response(task_id=u'10300'),
+                ],
+                'outputs': [
+                  {'output': SHARD_OUTPUT_1},
+                  {'output': SHARD_OUTPUT_3},
+                ],
+              }),
+          gen_wait_request(
+              ['10200'],
+              {
+                'items': [gen_result_response(task_id=u'10200')],
+                'outputs': [{'output': SHARD_OUTPUT_2}],
+              }),
         ])
     expected = [
       gen_yielded_data(0, output=SHARD_OUTPUT_1),
-      gen_yielded_data(1, output=SHARD_OUTPUT_2),
-      gen_yielded_data(2, output=SHARD_OUTPUT_3),
+      gen_yielded_data(1, output=SHARD_OUTPUT_2, task_id=u'10200'),
+      gen_yielded_data(2, output=SHARD_OUTPUT_3, task_id=u'10300'),
     ]
     actual = get_results(['10100', '10200', '10300'])
     self.assertEqual(expected, sorted(actual))
@@ -650,36 +766,20 @@ class TestSwarmingCollection(NetTestCase):
     # Three shards, one failed. All results are passed to output collector.
     self.expected_requests(
         [
-          (
-            'https://host:9001/api/swarming/v1/task/10100/result',
-            {'retry_50x': False},
-            gen_result_response(),
-          ),
-          (
-            'https://host:9001/api/swarming/v1/task/10100/stdout',
-            {},
-            {'output': SHARD_OUTPUT_1},
-          ),
-          (
-            'https://host:9001/api/swarming/v1/task/10200/result',
-            {'retry_50x': False},
-            gen_result_response(),
-          ),
-          (
-            'https://host:9001/api/swarming/v1/task/10200/stdout',
-            {},
-            {'output': SHARD_OUTPUT_2},
-          ),
-          (
-            'https://host:9001/api/swarming/v1/task/10300/result',
-            {'retry_50x': False},
-            gen_result_response(exit_code=1),
-          ),
-          (
-            'https://host:9001/api/swarming/v1/task/10300/stdout',
-            {},
-            {'output': SHARD_OUTPUT_3},
-          ),
+          gen_wait_request(
+              ['10100', '10200', '10300'],
+              {
+                'items': [
+                  gen_result_response(),
+                  gen_result_response(task_id=u'10200'),
+                  gen_result_response(exit_code=1, task_id=u'10300'),
+                ],
+                'outputs': [
+                  {'output': SHARD_OUTPUT_1},
+                  {'output': SHARD_OUTPUT_2},
+                  {'output': SHARD_OUTPUT_3},
+                ],
+              }),
         ])
 
     class FakeOutputCollector(object):
@@ -696,8 +796,9 @@ class TestSwarmingCollection(NetTestCase):
 
     expected = [
       gen_yielded_data(0, output=SHARD_OUTPUT_1),
-      gen_yielded_data(1, output=SHARD_OUTPUT_2),
-      gen_yielded_data(2, output=SHARD_OUTPUT_3, exit_code=1),
+      gen_yielded_data(1, output=SHARD_OUTPUT_2, task_id=u'10200'),
+      gen_yielded_data(
+          2, output=SHARD_OUTPUT_3, exit_code=1, task_id=u'10300'),
     ]
     self.assertEqual(sorted(expected), sorted(output_collector.results))
 
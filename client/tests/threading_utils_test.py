@@ -10,6 +10,7 @@ import functools
 import logging
 import os
 import signal
+import socket
 import sys
 import threading
 import time
@@ -495,7 +496,141 @@ class AutoRetryThreadPoolTest(unittest.TestCase):
       self.assertIn('function_with_some_unusual_name', exc_traceback)
 
   def test_max_value(self):
-    self.assertEqual(16, threading_utils.IOAutoRetryThreadPool.MAX_WORKERS)
+    self.assertEqual(64, threading_utils.IOAutoRetryThreadPool.MAX_WORKERS)
+    self.assertEqual(
+        16, threading_utils.IOAutoRetryThreadPool.INITIAL_CONCURRENCY)
+
+  def run_failing_once(self, exc):
+    """Runs a task failing once with |exc|, returns the pool."""
+    with threading_utils.IOAutoRetryThreadPool() as pool:
+      attempts = []
+      def fetch():
+        attempts.append(1)
+        if len(attempts) == 1:
+          raise exc
+        return 'ok'
+      channel = threading_utils.TaskChannel()
+      pool.add_task_with_channel(channel, 0, fetch)
+      self.assertEqual('ok', channel.pull())
+      pool.join()
+      self.assertEqual(2, len(attempts))
+      self.assertEqual(2, pool.concurrency.latency.count)
+    return pool
+
+  @timeout(10)
+  def test_io_congestion(self):
+    class ThrottledError(IOError):
+      is_congestion = True
+    pool = self.run_failing_once(ThrottledError('HTTP 429'))
+    # The retry succeeded but the failure halved the concurrency.
+    self.assertEqual(8, pool.concurrency.limit)
+    self.assertTrue(pool.get_status().startswith('io 0/8 q0 p50 '))
+
+  @timeout(10)
+  def test_io_not_congestion(self):
+    # E.g. HTTP 404, unrelated to the load.
+    pool = self.run_failing_once(IOError('HTTP 404'))
+    self.assertEqual(16, pool.concurrency.limit)
+
+  def test_is_congestion_error(self):
+    self.assertTrue(threading_utils.is_congestion_error(socket.timeout()))
+    self.assertTrue(threading_utils.is_congestion_error(socket.error()))
+    self.assertFalse(threading_utils.is_congestion_error(IOError('404')))
+
+
+class DurationHistogramTest(unittest.TestCase):
+  def test_empty(self):
+    h = threading_utils.DurationHistogram()
+    self.assertEqual(None, h.percentile(50))
+    self.assertEqual(0, h.count)
+
+  def test_percentile(self):
+    h = threading_utils.DurationHistogram()
+    for d in [0.0005] * 50 + [0.003] * 40 + [0.5] * 9 + [1e6]:
+      h.add(d)
+    self.assertEqual(100, h.count)
+    self.assertEqual(0.001, h.percentile(50))
+    self.assertEqual(0.004, h.percentile(90))
+    self.assertEqual(0.512, h.percentile(99))
+    self.assertEqual(float('inf'), h.percentile(100))
+    buckets = h.buckets
+    self.assertEqual(threading_utils.DurationHistogram.BUCKETS, len(buckets))
+    self.assertEqual((0.001, 50), buckets[0])
+    self.assertEqual((None, 1), buckets[-1])
+
+
+class AdaptiveConcurrencyTest(unittest.TestCase):
+  def setUp(self):
+    super(AdaptiveConcurrencyTest, self).setUp()
+    self.now = 1000.
+    self._old_time = time.time
+    time.time = lambda: self.now
+
+  def tearDown(self):
+    time.time = self._old_time
+    super(AdaptiveConcurrencyTest, self).tearDown()
+
+  def run_window(self, c, duration, congested=False):
+    """Runs as many tasks as the current limit, taking |duration| in total."""
+    tokens = [c.acquire() for _ in xrange(c.limit)]
+    self.now += duration
+    for token in tokens:
+      c.release(token, duration, congested)
+
+  def test_additive_increase(self):
+    c = threading_utils.AdaptiveConcurrency(2, 1, 4)
+    self.run_window(c, 1.)
+    self.assertEqual(3, c.limit)
+    self.run_window(c, 1.)
+    self.assertEqual(4, c.limit)
+    # Capped.
+    self.run_window(c, 1.)
+    self.assertEqual(4, c.limit)
+    self.assertEqual(0, c.active)
+
+  def test_multiplicative_decrease(self):
+    c = threading_utils.AdaptiveConcurrency(8, 1, 16)
+    self.run_window(c, 1., congested=True)
+    # The failures of the tasks that were already running are ignored.
+    self.assertEqual(4, c.limit)
+    self.run_window(c, 1.)
+    self.assertEqual(5, c.limit)
+    self.run_window(c, 1., congested=True)
+    self.assertEqual(2, c.limit)
+
+  def test_minimum(self):
+    c = threading_utils.AdaptiveConcurrency(2, 2, 4)
+    self.run_window(c, 1., congested=True)
+    self.assertEqual(2, c.limit)
+
+  def test_throughput_drop(self):
+    c = threading_utils.AdaptiveConcurrency(4, 1, 16)
+    # 4 tasks/s.
+    self.run_window(c, 1.)
+    self.assertEqual(5, c.limit)
+    # 5 tasks in 2s is slower, undo the increase.
+    self.run_window(c, 2.)
+    self.assertEqual(4, c.limit)
+    # The limit was lowered, so the next window increases it again.
+    self.run_window(c, 2.)
+    self.assertEqual(5, c.limit)
+
+  @timeout(10)
+  def test_acquire_blocks(self):
+    time.time = self._old_time
+    c = threading_utils.AdaptiveConcurrency(1, 1, 1)
+    token = c.acquire()
+    acquired = threading.Event()
+    def acquire():
+      c.acquire()
+      acquired.set()
+    t = threading.Thread(target=acquire)
+    t.start()
+    self.assertFalse(acquired.wait(0.05))
+    c.release(token, 0.05, False)
+    t.join()
+    self.assertTrue(acquired.is_set())
+    self.assertEqual(1, c.active)
 
 
 class FakeProgress(object):
@@ -504,6 +639,15 @@ class FakeProgress(object):
     pass
 
 
+class ProgressTest(unittest.TestCase):
+  def test_add_status(self):
+    progress = threading_utils.Progress([('index', 0), ('size', 2)])
+    progress.use_cr_only = False
+    progress.add_status(lambda: 'io 1/2')
+    line, _ = progress._gen_line('foo')
+    self.assertRegexpMatches(line, r'^\[0/2\]  *[0-9.]+s io 1/2 foo\n$')
+
+
 class WorkerPoolTest(unittest.TestCase):
   def test_normal(self):
     mapper = lambda value: -value
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# Copyright 2017 The LUCI Authors. All rights reserved.
+# Use of this source code is governed under the Apache License, Version 2.0
+# that can be found in the LICENSE file.
+
+"""Benchmarks the tree functions of utils/file_path.py.
+
+Creates a tree of files then times make_tree_read_only(), make_tree_writeable()
+and rmtree() with the directories processed serially and in parallel.
+"""
+
+import optparse
+import os
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__.decode(sys.getfilesystemencoding()))))
+sys.path.insert(0, ROOT_DIR)
+
+from third_party.depot_tools import fix_encoding
+from utils import file_path
+from utils import tools
+
+
+def make_tree(root, nb_files, files_per_dir):
+  """Creates a tree of directories two levels deep with nb_files files."""
+  os.mkdir(root)
+  nb_dirs = max(nb_files / files_per_dir, 1)
+  fanout = max(int(nb_dirs ** 0.5), 1)
+  created = 0
+  for i in xrange(nb_dirs):
+    d = os.path.join(root, str(i % fanout), str(i))
+    os.makedirs(d)
+    for j in xrange(min(files_per_dir, nb_files - created)):
+      with open(os.path.join(d, str(j)), 'wb') as f:
+        f.write('x')
+      created += 1
+
+
+def run(root, threads):
+  """Returns the duration of each operation on the tree."""
+  file_path.TREE_THREADS = threads
+  durations = []
+  for fn in (
+      file_path.make_tree_read_only,
+      file_path.make_tree_writeable,
+      file_path.rmtree):
+    start = time.time()
+    fn(root)
+    durations.append(time.time() - start)
+  return durations
+
+
+def main():
+  tools.disable_buffering()
+  parser = optparse.OptionParser(description=sys.modules[__name__].__doc__)
+  parser.add_option(
+      '-n', '--files', type='int', default=500000, help='Default: %default')
+  parser.add_option(
+      '--files-per-dir', type='int', default=100, help='Default: %default')
+  parser.add_option(
+      '-j', '--threads', type='int', default=max(1, file_path.TREE_THREADS),
+      help='Threads used in parallel mode. Default: %default')
+  parser.add_option(
+      '--dir', help='Directory to create the trees in, to benchmark a '
+                    'specific file system')
+  options, args = parser.parse_args()
+  if args:
+    parser.error('Unexpected arguments: %s' % args)
+  if options.threads < 1:
+    parser.error('--threads must be at least 1')
+
+  tmp = tempfile.mkdtemp(prefix=u'file_path_benchmark', dir=options.dir)
+  try:
+    print('%-8s  %14s  %14s  %10s' % (
+        'mode', 'read_only', 'writeable', 'rmtree'))
+    for name, threads in (('serial', 0), ('parallel', options.threads)):
+      root = os.path.join(tmp, name)
+      make_tree(root, options.files, options.files_per_dir)
+      print('%-8s  %13.2fs  %13.2fs  %9.2fs' % ((name,) + tuple(
+          run(root, threads))))
+  finally:
+    file_path.rmtree(tmp)
+  return 0
+
+
+if __name__ == '__main__':
+  fix_encoding.fix_encoding()
+  sys.exit(main())
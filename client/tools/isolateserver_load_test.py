@@ -210,6 +210,7 @@ def main():
   columns = [('index', 0), ('data', 0), ('size', options.items)]
   progress = Progress(columns)
   storage = isolateserver.get_storage(options.isolate_server, options.namespace)
+  progress.add_status(storage.net_thread_pool.get_status)
   do_item = functools.partial(
       send_and_receive,
       random_pool,
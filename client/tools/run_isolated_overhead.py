@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# Copyright 2017 The LUCI Authors. All rights reserved.
+# Use of this source code is governed under the Apache License, Version 2.0
+# that can be found in the LICENSE file.
+
+"""Benchmarks the per-task overhead of run_isolated.
+
+Runs a trivial command repeatedly, first by starting a new run_isolated process
+each time like task_runner does by default, then through a run_isolated daemon
+as done with --run-isolated-daemon.
+"""
+
+import json
+import optparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__.decode(sys.getfilesystemencoding()))))
+sys.path.insert(0, ROOT_DIR)
+
+from third_party.depot_tools import fix_encoding
+from utils import local_daemon
+from utils import tools
+
+
+RUN_ISOLATED = os.path.join(ROOT_DIR, 'run_isolated.py')
+
+
+def get_args(root_dir):
+  """Returns the run_isolated arguments for a task."""
+  return [
+    '--no-clean',
+    '--cache', os.path.join(root_dir, 'isolated_cache'),
+    '--named-cache-root', os.path.join(root_dir, 'c'),
+    '--log-file', os.path.join(root_dir, 'logs', 'run_isolated.log'),
+    '--root-dir', os.path.join(root_dir, 'w'),
+    '--json', os.path.join(root_dir, 'w', 'isolated_result.json'),
+    '--raw-cmd', '--', sys.executable, '-c', 'pass',
+  ]
+
+
+def run_subprocess(args_file, root_dir):
+  start = time.time()
+  subprocess.check_call(
+      [sys.executable, RUN_ISOLATED, '-a', args_file],
+      cwd=os.path.join(root_dir, 'w'))
+  return time.time() - start
+
+
+def run_daemon(address_file, args_file, root_dir):
+  start = time.time()
+  proc = local_daemon.connect(
+      address_file, 'benchmark', ['-a', args_file],
+      os.path.join(root_dir, 'w'), dict(os.environ))
+  if proc.wait():
+    raise Exception('Task failed')
+  return time.time() - start
+
+
+def print_stats(name, durations):
+  durations = sorted(durations)
+  print('%-10s: %3d runs, average %6.1fms, median %6.1fms, max %6.1fms' % (
+      name, len(durations), sum(durations) / len(durations) * 1000.,
+      durations[len(durations) / 2] * 1000., durations[-1] * 1000.))
+
+
+def main():
+  tools.disable_buffering()
+  parser = optparse.OptionParser(description=sys.modules[__name__].__doc__)
+  parser.add_option(
+      '-n', '--runs', type='int', default=20, help='Default: %default')
+  options, args = parser.parse_args()
+  if args:
+    parser.error('Unexpected arguments: %s' % args)
+  if sys.platform == 'win32':
+    parser.error('The run_isolated daemon is not supported on Windows.')
+
+  root_dir = tempfile.mkdtemp(prefix=u'run_isolated_overhead')
+  daemon = None
+  try:
+    for d in ('logs', 'w'):
+      os.mkdir(os.path.join(root_dir, d))
+    args_file = os.path.join(root_dir, 'args.json')
+    with open(args_file, 'wb') as f:
+      json.dump(get_args(root_dir), f)
+
+    print_stats(
+        'subprocess',
+        [run_subprocess(args_file, root_dir) for _ in xrange(options.runs)])
+
+    address_file = os.path.join(root_dir, 'daemon.json')
+    daemon = subprocess.Popen(
+        [sys.executable, RUN_ISOLATED, '--daemon', address_file,
+         '--daemon-version', 'benchmark', '--no-log'])
+    while not os.path.isfile(address_file):
+      time.sleep(0.01)
+    # The first task warms up the daemon.
+    run_daemon(address_file, args_file, root_dir)
+    print_stats(
+        'daemon',
+        [run_daemon(address_file, args_file, root_dir)
+          for _ in xrange(options.runs)])
+  finally:
+    if daemon:
+      daemon.kill()
+      daemon.wait()
+    shutil.rmtree(root_dir)
+  return 0
+
+
+if __name__ == '__main__':
+  fix_encoding.fix_encoding()
+  sys.exit(main())
@@ -9,6 +9,7 @@ is running and thus it caches results of functions that depend on FS state.
 """
 
 import ctypes
+import errno
 import getpass
 import logging
 import os
@@ -18,11 +19,13 @@ import shlex
 import stat
 import sys
 import tempfile
+import threading
 import time
 import unicodedata
 
 from utils import fs
 from utils import subprocess42
+from utils import threading_utils
 from utils import tools
 
 
@@ -31,6 +34,33 @@ HARDLINK, HARDLINK_WITH_FALLBACK, SYMLINK, SYMLINK_WITH_FALLBACK, COPY = range(
     1, 6)
 
 
+# Maximum number of threads used to process the directories of a tree
+# concurrently, see _walk_tree(). The work is mostly blocked on file system
+# calls, which release the GIL, but on a single core the thread switches cost
+# more than they save. 0 processes the trees serially.
+TREE_THREADS = (
+    min(threading_utils.num_processors() * 4, 32)
+    if sys.platform != 'win32' and threading_utils.num_processors() > 1 else 0)
+
+
+# ioctl(2) request making a file share the extents of another one on copy on
+# write file systems like btrfs and xfs, see ioctl_ficlone(2).
+_FICLONE = 0x40049409
+
+
+# errno values meaning that a way to copy files in the kernel is not supported
+# between two file systems.
+_COPY_UNSUPPORTED = frozenset(
+    getattr(errno, e) for e in (
+      'EINVAL', 'ENOSYS', 'ENOTSUP', 'ENOTTY', 'EOPNOTSUPP', 'EXDEV')
+    if hasattr(errno, e))
+
+
+# (source st_dev, destination st_dev) -> copy functions that worked for the
+# pair of file systems, see _kernel_copy().
+_COPY_METHODS = {}
+
+
 ## OS-specific imports
 
 
@@ -42,6 +72,9 @@ if sys.platform == 'win32':
 elif sys.platform == 'darwin':
   import Carbon.File  #  pylint: disable=F0401
   import MacOS  # pylint: disable=F0401
+elif sys.platform.startswith('linux'):
+  import ctypes.util
+  import fcntl
 
 
 if sys.platform == 'win32':
@@ -876,8 +909,15 @@ def hardlink(source, link_name):
 
 
 def readable_copy(outfile, infile):
-  """Makes a copy of the file that is readable by everyone."""
-  fs.copy2(infile, outfile)
+  """Makes a copy of the file that is readable by everyone.
+
+  The content is cloned or copied by the kernel when the file systems allow it,
+  so it doesn't go through user space.
+  """
+  if _kernel_copy(outfile, infile):
+    fs.copystat(infile, outfile)
+  else:
+    fs.copy2(infile, outfile)
   fs.chmod(
       outfile,
       fs.stat(outfile).st_mode | stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
@@ -1043,26 +1083,26 @@ def make_tree_read_only(root):
 
   This means no file can be created or deleted.
   """
-  err = None
+  errors = []
   logging.debug('make_tree_read_only(%s)', root)
-  for dirpath, dirnames, filenames in fs.walk(root, topdown=True):
+  def process(dirpath, dirnames, filenames):
     for filename in filenames:
       e = set_read_only_swallow(os.path.join(dirpath, filename), True)
-      if not err:
-        err = e
+      if e:
+        errors.append(e)
     if sys.platform != 'win32':
       # It must not be done on Windows.
       for dirname in dirnames:
         e = set_read_only_swallow(os.path.join(dirpath, dirname), True)
-        if not err:
-          err = e
+        if e:
+          errors.append(e)
+  _walk_tree(root, process)
   if sys.platform != 'win32':
     e = set_read_only_swallow(root, True)
-    if not err:
-      err = e
-  if err:
-    # pylint: disable=raising-bad-type
-    raise err
+    if e:
+      errors.append(e)
+  if errors:
+    raise errors[0]
 
 
 def make_tree_files_read_only(root):
@@ -1074,13 +1114,14 @@ def make_tree_files_read_only(root):
   logging.debug('make_tree_files_read_only(%s)', root)
   if sys.platform != 'win32':
     set_read_only(root, False)
-  for dirpath, dirnames, filenames in fs.walk(root, topdown=True):
+  def process(dirpath, dirnames, filenames):
     for filename in filenames:
       set_read_only(os.path.join(dirpath, filename), True)
     if sys.platform != 'win32':
       # It must not be done on Windows.
       for dirname in dirnames:
         set_read_only(os.path.join(dirpath, dirname), False)
+  _walk_tree(root, process)
 
 
 def make_tree_writeable(root):
@@ -1094,13 +1135,14 @@ def make_tree_writeable(root):
   logging.debug('make_tree_writeable(%s)', root)
   if sys.platform != 'win32':
     set_read_only(root, False)
-  for dirpath, dirnames, filenames in fs.walk(root, topdown=True):
+  def process(dirpath, dirnames, filenames):
     for filename in filenames:
       set_read_only(os.path.join(dirpath, filename), False)
     if sys.platform != 'win32':
       # It must not be done on Windows.
       for dirname in dirnames:
         set_read_only(os.path.join(dirpath, dirname), False)
+  _walk_tree(root, process)
 
 
 def make_tree_deleteable(root):
@@ -1115,8 +1157,9 @@ def make_tree_deleteable(root):
   file node has its file permission modified.
   """
   logging.debug('make_tree_deleteable(%s)', root)
-  err = None
-  sudo_failed = False
+  errors = []
+  # Set once sudo failed, to not try again.
+  sudo_failed = []
 
   def try_sudo(p):
     if sys.platform == 'linux2' and not sudo_failed:
@@ -1125,33 +1168,31 @@ def make_tree_deleteable(root):
       with open(os.devnull, 'rb') as f:
         if not subprocess42.call(
             ['sudo', '-n', 'chmod', 'a+rwX', p], stdin=f):
-          return False
+          return
       logging.debug('sudo chmod %s failed', p)
-    return True
+    sudo_failed.append(p)
 
   if sys.platform != 'win32':
     e = set_read_only_swallow(root, False)
     if e:
-      sudo_failed = try_sudo(root)
-    if not err:
-      err = e
-  for dirpath, dirnames, filenames in fs.walk(root, topdown=True):
+      try_sudo(root)
+      errors.append(e)
+  def process(dirpath, dirnames, filenames):
     if sys.platform == 'win32':
       for filename in filenames:
         e = set_read_only_swallow(os.path.join(dirpath, filename), False)
-        if not err:
-          err = e
+        if e:
+          errors.append(e)
     else:
       for dirname in dirnames:
         p = os.path.join(dirpath, dirname)
         e = set_read_only_swallow(p, False)
         if e:
-          sudo_failed = try_sudo(p)
-        if not err:
-          err = e
-  if err:
-    # pylint: disable=raising-bad-type
-    raise err
+          try_sudo(p)
+          errors.append(e)
+  _walk_tree(root, process)
+  if errors:
+    raise errors[0]
 
 
 def rmtree(root):
@@ -1180,7 +1221,7 @@ def rmtree(root):
   for i in xrange(max_tries):
     # errors is a list of tuple(function, path, excinfo).
     errors = []
-    fs.rmtree(root, onerror=lambda *args: errors.append(args))
+    _rmtree(root, lambda *args: errors.append(args))
     if not errors or not fs.exists(root):
       if i:
         sys.stderr.write('Succeeded.\n')
@@ -1225,7 +1266,7 @@ def rmtree(root):
 
   # Now that annoying processes in root are evicted, try again.
   errors = []
-  fs.rmtree(root, onerror=lambda *args: errors.append(args))
+  _rmtree(root, lambda *args: errors.append(args))
   if errors and fs.exists(root):
     # There's no hope: the directory was tried to be removed 4 times. Give up
     # and raise an exception.
@@ -1238,4 +1279,257 @@ def rmtree(root):
   return False
 
 
+def rmtree_async(root):
+  """Moves a directory out of the way and deletes it in a background thread.
+
+  The directory is renamed to a sibling directory so its path can be reused
+  right away. The process doesn't exit before the deletion completes.
+
+  Falls back to rmtree() if the directory can't be renamed.
+
+  Returns:
+    The thread deleting the directory, or None if it was deleted synchronously.
+  """
+  logging.info('rmtree_async(%s)', root)
+  root = unicode(root)
+  trash = tempfile.mkdtemp(
+      prefix=os.path.basename(root) + u'_trash', dir=os.path.dirname(root))
+  try:
+    fs.rename(root, os.path.join(trash, u'd'))
+  except OSError as e:
+    logging.warning('Failed to move %s away, deleting it now: %s', root, e)
+    fs.rmdir(trash)
+    rmtree(root)
+    return None
+  def delete():
+    try:
+      rmtree(trash)
+    except OSError as e:
+      logging.error('Failed to delete %s: %s', trash, e)
+  # Not a daemon thread so the process waits for it before exiting.
+  thread = threading.Thread(target=delete, name='rmtree_async')
+  thread.start()
+  return thread
+
+
 ## Private code.
+
+
+def _walk_tree(root, fn):
+  """Calls fn(dirpath, dirnames, filenames) for each directory in root.
+
+  Like fs.walk(root, topdown=True), fn is called on a directory before its
+  subdirectories are listed so it can change their permissions, and symlinks
+  to directories are not followed. Unlike fs.walk(), the directories are
+  processed concurrently by up to TREE_THREADS threads, so fn must be thread
+  safe. Symlinks to directories are passed in filenames.
+
+  Directories that can't be listed are skipped, like fs.walk() does.
+  """
+  if not TREE_THREADS:
+    for dirpath, dirnames, filenames in fs.walk(root, topdown=True):
+      fn(dirpath, dirnames, filenames)
+    return
+
+  def visit(dirpath):
+    try:
+      names = fs.listdir(dirpath)
+    except OSError:
+      return []
+    dirnames = []
+    filenames = []
+    for name in names:
+      try:
+        is_dir = stat.S_ISDIR(fs.lstat(os.path.join(dirpath, name)).st_mode)
+      except OSError:
+        is_dir = False
+      (dirnames if is_dir else filenames).append(name)
+    fn(dirpath, dirnames, filenames)
+    return [os.path.join(dirpath, d) for d in dirnames]
+  _visit_tree(root, visit)
+
+
+def _visit_tree(root, visit):
+  """Calls visit(dirpath) on root and recursively on the subdirectories it
+  returns, with up to TREE_THREADS threads.
+  """
+  pool = threading_utils.ThreadPool(0, TREE_THREADS, 0, 'tree')
+  def process(dirpath):
+    for subdir in visit(dirpath):
+      pool.add_task(0, process, subdir)
+  try:
+    pool.add_task(0, process, root)
+    pool.join()
+  finally:
+    pool.close()
+
+
+def _rmtree(root, onerror):
+  """Deletes a tree, like fs.rmtree(root, onerror=onerror).
+
+  The files of different directories are deleted concurrently, then the
+  directories are deleted, deepest first. Entries are unlinked without being
+  checked first; only the ones that fail are checked for being a directory.
+  """
+  if not TREE_THREADS:
+    fs.rmtree(root, onerror=onerror)
+    return
+  if fs.islink(root):
+    try:
+      raise OSError('Cannot call rmtree on a symbolic link')
+    except OSError:
+      onerror(fs.islink, root, sys.exc_info())
+    return
+
+  dirs = []
+  def visit(dirpath):
+    dirs.append(dirpath)
+    try:
+      names = fs.listdir(dirpath)
+    except OSError:
+      onerror(fs.listdir, dirpath, sys.exc_info())
+      return []
+    subdirs = []
+    for name in names:
+      p = os.path.join(dirpath, name)
+      try:
+        fs.remove(p)
+      except OSError as e:
+        exc_info = sys.exc_info()
+        # Linux returns EISDIR and OSX returns EPERM when unlinking a
+        # directory.
+        if e.errno in (errno.EISDIR, errno.EPERM) and _is_dir(p):
+          subdirs.append(p)
+        else:
+          onerror(fs.remove, p, exc_info)
+    return subdirs
+  _visit_tree(root, visit)
+
+  dirs.sort(key=lambda p: p.count(os.path.sep), reverse=True)
+  for dirpath in dirs:
+    try:
+      fs.rmdir(dirpath)
+    except OSError as e:
+      if e.errno != errno.ENOENT:
+        onerror(fs.rmdir, dirpath, sys.exc_info())
+
+
+def _is_dir(path):
+  """Returns True if path is a directory, not following symlinks."""
+  try:
+    return stat.S_ISDIR(fs.lstat(path).st_mode)
+  except OSError:
+    return False
+
+
+_libc = None
+
+
+def _get_libc():
+  """Returns libc with copy_file_range() and sendfile() set up, or None."""
+  global _libc
+  if _libc is None:
+    _libc = False
+    try:
+      libc = ctypes.CDLL(
+          ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+      libc.sendfile.argtypes = (
+          ctypes.c_int, ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t)
+      libc.sendfile.restype = ctypes.c_ssize_t
+      # glibc 2.27+.
+      if hasattr(libc, 'copy_file_range'):
+        libc.copy_file_range.argtypes = (
+            ctypes.c_int, ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p,
+            ctypes.c_size_t, ctypes.c_uint)
+        libc.copy_file_range.restype = ctypes.c_ssize_t
+      _libc = libc
+    except (AttributeError, OSError) as e:
+      logging.warning('libc is not available: %s', e)
+  return _libc or None
+
+
+def _copy_loop(fn, size):
+  """Calls fn(count) until size bytes were copied; fn returns the number of
+  bytes copied, like sendfile(2).
+  """
+  copied = 0
+  while copied < size:
+    # Both syscalls copy at most 2GiB at once.
+    n = fn(min(size - copied, 1 << 30))
+    if n < 0:
+      e = ctypes.get_errno()
+      raise OSError(e, os.strerror(e))
+    if not n:
+      raise IOError('partial copy, got %s, wanted %s' % (copied, size))
+    copied += n
+
+
+def _ficlone(dst, src, _size):
+  """Shares the extents of src with dst."""
+  fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+
+
+def _copy_file_range(dst, src, size):
+  """Copies src to dst with copy_file_range(2), which may reflink."""
+  libc = _get_libc()
+  if not libc or not hasattr(libc, 'copy_file_range'):
+    raise OSError(errno.ENOSYS, 'copy_file_range() is not available')
+  _copy_loop(
+      lambda n: libc.copy_file_range(
+          src.fileno(), None, dst.fileno(), None, n, 0),
+      size)
+
+
+def _sendfile(dst, src, size):
+  """Copies src to dst with sendfile(2)."""
+  libc = _get_libc()
+  if not libc:
+    raise OSError(errno.ENOSYS, 'sendfile() is not available')
+  _copy_loop(lambda n: libc.sendfile(dst.fileno(), src.fileno(), None, n), size)
+
+
+# Ways to copy a file in the kernel, by order of preference.
+_COPY_FUNCTIONS = (
+    (_ficlone, _copy_file_range, _sendfile)
+    if sys.platform.startswith('linux') else ())
+
+
+def _kernel_copy(outfile, infile):
+  """Copies the content of infile to outfile without reading it in user space.
+
+  The functions in _COPY_FUNCTIONS are tried in order and the ones that work
+  are remembered per pair of file systems, so the unsupported ones are only
+  tried once.
+
+  Returns:
+    True if the file was copied, False if no function is supported, in which
+    case outfile is not created.
+  """
+  if not _COPY_FUNCTIONS:
+    return False
+  key = (
+      fs.stat(infile).st_dev, fs.stat(os.path.dirname(outfile)).st_dev)
+  functions = _COPY_METHODS.get(key, _COPY_FUNCTIONS)
+  if not functions:
+    return False
+  with fs.open(infile, 'rb') as src:
+    size = os.fstat(src.fileno()).st_size
+    for i, fn in enumerate(functions):
+      try:
+        with fs.open(outfile, 'wb') as dst:
+          fn(dst, src, size)
+      except (IOError, OSError) as e:
+        if e.errno not in _COPY_UNSUPPORTED:
+          if fs.exists(outfile):
+            fs.remove(outfile)
+          raise
+        src.seek(0)
+        continue
+      # An empty file doesn't tell whether the function works.
+      if size:
+        _COPY_METHODS[key] = functions[i:]
+      return True
+  logging.info('No kernel copy between devices %s and %s', *key)
+  _COPY_METHODS[key] = ()
+  fs.remove(outfile)
+  return False
@@ -0,0 +1,146 @@
+# Copyright 2017 The LUCI Authors. All rights reserved.
+# Use of this source code is governed under the Apache License, Version 2.0
+# that can be found in the LICENSE file.
+
+"""Recursive file watcher based on Linux's inotify, implemented with ctypes."""
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import sys
+
+
+# Events, see inotify(7).
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+
+
+_IN_NONBLOCK = 04000
+_IN_CLOEXEC = 02000000
+
+
+# struct inotify_event, without the variable length name.
+_EVENT = struct.Struct('iIII')
+
+
+_libc = None
+
+
+def _get_libc():
+  """Returns the libc functions needed, or None if inotify is not available."""
+  global _libc
+  if _libc is None:
+    _libc = False
+    if sys.platform.startswith('linux'):
+      try:
+        libc = ctypes.CDLL(
+            ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1.argtypes = (ctypes.c_int,)
+        libc.inotify_add_watch.argtypes = (
+            ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        _libc = libc
+      except (AttributeError, OSError) as e:
+        logging.warning('inotify is not available: %s', e)
+  return _libc or None
+
+
+def is_supported():
+  """Returns True if Watcher can be used on this platform."""
+  return bool(_get_libc())
+
+
+class Error(Exception):
+  """Raised when a watch can't be set."""
+
+
+class Watcher(object):
+  """Watches a directory tree recursively for files closed after writing.
+
+  Subdirectories created or moved into the tree are watched as they appear.
+  Files closed in a subdirectory before its watch was set are not reported, so
+  users must still do a final scan of the tree.
+  """
+
+  def __init__(self, root):
+    libc = _get_libc()
+    if not libc:
+      raise Error('inotify is not supported on this platform')
+    fd = libc.inotify_init1(_IN_NONBLOCK|_IN_CLOEXEC)
+    if fd < 0:
+      e = ctypes.get_errno()
+      raise Error('inotify_init1() failed: %s' % os.strerror(e))
+    self._libc = libc
+    self._fd = fd
+    self._buf = ''
+    # Watch descriptor -> directory.
+    self._dirs = {}
+    # True if events were lost.
+    self.overflowed = False
+    self._add_tree(root)
+
+  def close(self):
+    if self._fd is not None:
+      os.close(self._fd)
+      self._fd = None
+
+  def read(self, timeout):
+    """Returns the paths of the files closed after writing or moved in the
+    tree, waiting up to |timeout| seconds for at least one event.
+    """
+    if not select.select([self._fd], [], [], timeout)[0]:
+      return []
+    out = []
+    try:
+      while True:
+        data = os.read(self._fd, 65536)
+        if not data:
+          break
+        self._buf += data
+    except OSError as e:
+      if e.errno != errno.EAGAIN:
+        raise
+    while len(self._buf) >= _EVENT.size:
+      wd, mask, _cookie, length = _EVENT.unpack_from(self._buf)
+      end = _EVENT.size + length
+      if len(self._buf) < end:
+        break
+      name = self._buf[_EVENT.size:end].rstrip('\0')
+      self._buf = self._buf[end:]
+      if mask & IN_Q_OVERFLOW:
+        self.overflowed = True
+        continue
+      parent = self._dirs.get(wd)
+      if parent is None or not name:
+        continue
+      path = os.path.join(
+          parent, name.decode(sys.getfilesystemencoding(), 'replace'))
+      if mask & IN_ISDIR:
+        if mask & (IN_CREATE|IN_MOVED_TO):
+          try:
+            self._add_tree(path)
+          except Error as e:
+            logging.warning('%s', e)
+      elif mask & (IN_CLOSE_WRITE|IN_MOVED_TO):
+        out.append(path)
+    return out
+
+  def _add_tree(self, root):
+    for dirpath, _dirnames, _filenames in os.walk(root):
+      wd = self._libc.inotify_add_watch(
+          self._fd, dirpath.encode(sys.getfilesystemencoding()),
+          IN_CLOSE_WRITE|IN_MOVED_TO|IN_CREATE)
+      if wd < 0:
+        e = ctypes.get_errno()
+        if e == errno.ENOENT:
+          # Deleted in the meantime.
+          continue
+        raise Error(
+            'inotify_add_watch(%s) failed: %s' % (dirpath, os.strerror(e)))
+      self._dirs[wd] = dirpath
@@ -0,0 +1,272 @@
+# Copyright 2017 The LUCI Authors. All rights reserved.
+# Use of this source code is governed under the Apache License, Version 2.0
+# that can be found in the LICENSE file.
+
+"""Protocol to run commands in a long-lived local daemon.
+
+The daemon listens on 127.0.0.1 on a random port. The port, the daemon's process
+id and a shared secret are stored in an address file only readable by the
+current user.
+
+A connection runs exactly one command. Every message is a frame: a single letter
+describing the frame type, the payload size as a 4 bytes big endian unsigned
+integer, then the payload.
+
+- The client sends REQUEST, the daemon replies ACCEPT or EXIT with an error.
+- The daemon streams the output of the command as OUTPUT frames, then sends
+  EXIT with the exit code.
+- The client may send TERMINATE or KILL at any time.
+"""
+
+import json
+import os
+import select
+import socket
+import struct
+import time
+
+from utils import subprocess42
+
+
+# Frames sent by the client. REQUEST payload is a JSON dict with the keys
+# 'secret', 'version', 'args', 'cwd' and 'env'.
+REQUEST = 'R'
+TERMINATE = 'T'
+KILL = 'K'
+
+
+# Frames sent by the daemon. ACCEPT payload is a JSON dict with the key 'pid'.
+# EXIT payload is a JSON dict with either 'exit_code' or 'error'.
+ACCEPT = 'A'
+OUTPUT = 'O'
+EXIT = 'E'
+
+
+_HEADER = struct.Struct('>cI')
+
+
+# Maximum time to wait for the daemon to accept a request.
+ACCEPT_TIMEOUT = 10.
+
+
+class Error(Exception):
+  """Raised when the daemon can't be used."""
+
+
+### Frames.
+
+
+def send_frame(sock, kind, payload=''):
+  """Sends a single frame."""
+  sock.sendall(_HEADER.pack(kind, len(payload)) + payload)
+
+
+def _parse_frame(buf):
+  """Returns (kind, payload, size consumed) or None if buf is incomplete."""
+  if len(buf) < _HEADER.size:
+    return None
+  kind, length = _HEADER.unpack(str(buf[:_HEADER.size]))
+  end = _HEADER.size + length
+  if len(buf) < end:
+    return None
+  return kind, str(buf[_HEADER.size:end]), end
+
+
+def recv_frame(sock):
+  """Receives a single frame on a blocking socket.
+
+  Returns:
+    tuple(kind, payload) or (None, None) if the connection was closed.
+  """
+  buf = bytearray()
+  needed = _HEADER.size
+  while len(buf) < needed:
+    data = sock.recv(needed - len(buf))
+    if not data:
+      return None, None
+    buf += data
+    if len(buf) == _HEADER.size:
+      needed += _HEADER.unpack(str(buf))[1]
+  kind, payload, _ = _parse_frame(buf)
+  return kind, payload
+
+
+### Address file.
+
+
+def write_address_file(path, port, secret):
+  """Atomically writes the address file, only readable by the current user."""
+  tmp = path + '.tmp'
+  fd = os.open(tmp, os.O_WRONLY|os.O_CREAT|os.O_TRUNC, 0600)
+  with os.fdopen(fd, 'wb') as f:
+    json.dump({'pid': os.getpid(), 'port': port, 'secret': secret}, f)
+  os.rename(tmp, path)
+
+
+def read_address_file(path):
+  """Returns the content of the address file or None."""
+  try:
+    with open(path, 'rb') as f:
+      return json.load(f)
+  except (IOError, OSError, ValueError):
+    return None
+
+
+### Client side.
+
+
+class Process(object):
+  """A command run by the daemon.
+
+  Implements the subset of subprocess42.Popen used to monitor a process.
+  """
+
+  def __init__(self, sock, args, pid):
+    self._sock = sock
+    self._buf = bytearray()
+    self._eof = False
+    self.args = args
+    # The daemon's pid; the command itself runs in a grand child process.
+    self.pid = pid
+    self.returncode = None
+
+  def poll(self):
+    while self.returncode is None:
+      frame = self._recv_frame(0)
+      if not frame:
+        break
+      self._process(frame)
+    return self.returncode
+
+  def yield_any(self, maxsize=None, timeout=None):
+    """Yields ('stdout', data) until the command terminates.
+
+    Yields (None, None) if no output is available within |timeout| seconds.
+    Both |maxsize| and |timeout| can be callable, like in subprocess42.
+    """
+    while self.returncode is None:
+      frame = self._recv_frame(timeout() if callable(timeout) else timeout)
+      if not frame:
+        if self.returncode is None:
+          yield None, None
+        continue
+      data = self._process(frame)
+      while data:
+        size = maxsize() if callable(maxsize) else maxsize
+        if not size or size <= 0:
+          size = len(data)
+        yield 'stdout', data[:size]
+        data = data[size:]
+
+  def wait(self, timeout=None):
+    """Discards the output until the command terminates."""
+    deadline = None if timeout is None else time.time() + timeout
+    while self.returncode is None:
+      remaining = None
+      if deadline is not None:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+          raise subprocess42.TimeoutExpired(self.args, timeout)
+      frame = self._recv_frame(remaining)
+      if frame:
+        self._process(frame)
+    return self.returncode
+
+  def terminate(self):
+    self._send(TERMINATE)
+
+  def kill(self):
+    self._send(KILL)
+
+  def _send(self, kind):
+    if self.returncode is None:
+      try:
+        send_frame(self._sock, kind)
+      except socket.error:
+        pass
+
+  def _process(self, frame):
+    """Handles a frame and returns the output it carries, if any."""
+    kind, payload = frame
+    if kind == OUTPUT:
+      return payload
+    if kind == EXIT:
+      self.returncode = json.loads(payload).get('exit_code', 1)
+      self._sock.close()
+    return None
+
+  def _recv_frame(self, timeout):
+    """Returns the next frame or None on timeout.
+
+    If the daemon disappeared, the command is considered killed.
+    """
+    deadline = None if timeout is None else time.time() + timeout
+    while True:
+      frame = _parse_frame(self._buf)
+      if frame:
+        kind, payload, end = frame
+        del self._buf[:end]
+        return kind, payload
+      if self._eof:
+        if self.returncode is None:
+          self.returncode = -9
+          self._sock.close()
+        return None
+      remaining = None
+      if deadline is not None:
+        remaining = max(deadline - time.time(), 0)
+      if not select.select([self._sock], [], [], remaining)[0]:
+        return None
+      try:
+        data = self._sock.recv(65536)
+      except socket.error:
+        data = ''
+      if not data:
+        self._eof = True
+      self._buf += data
+
+
+def connect(address_file, version, args, cwd, env):
+  """Asks the daemon to run a command.
+
+  Arguments:
+    address_file: path to the daemon's address file.
+    version: the version the daemon must be running, otherwise it shuts down.
+    args: the command line arguments of the command.
+    cwd: the directory to run the command in.
+    env: the environment variables of the command.
+
+  Returns:
+    Process instance.
+
+  Raises:
+    Error if the daemon is not running, is incompatible or refused the request.
+  """
+  address = read_address_file(address_file)
+  if not address:
+    raise Error('Daemon is not running')
+  try:
+    sock = socket.create_connection(
+        ('127.0.0.1', address['port']), ACCEPT_TIMEOUT)
+  except socket.error as e:
+    raise Error('Failed to connect to the daemon: %s' % e)
+  try:
+    send_frame(sock, REQUEST, json.dumps({
+      'args': args,
+      'cwd': cwd,
+      'env': env,
+      'secret': address['secret'],
+      'version': version,
+    }))
+    kind, payload = recv_frame(sock)
+    if kind != ACCEPT:
+      error = json.loads(payload).get('error') if kind == EXIT else None
+      raise Error('Daemon refused the request: %s' % (error or 'closed'))
+    sock.settimeout(None)
+    return Process(sock, args, json.loads(payload)['pid'])
+  except (socket.error, ValueError) as e:
+    sock.close()
+    raise Error('Failed to send the request to the daemon: %s' % e)
+  except Error:
+    sock.close()
+    raise
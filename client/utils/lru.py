@@ -51,10 +51,13 @@ class LRUDict(object):
     return self._items[key][0]
 
   @classmethod
-  def load(cls, state_file):
+  def load(cls, state_file, max_version=2):
     """Loads previously saved state and returns LRUDict in that state.
 
-    Raises ValueError if state file is corrupted.
+    max_version is the latest state version the caller can read, see save().
+
+    Raises ValueError if state file is corrupted or its version is newer than
+    max_version.
     """
     try:
       state = json.load(open(state_file, 'r'))
@@ -81,10 +84,10 @@ class LRUDict(object):
         raise ValueError(
             'Broken state file %s, version %r is not an integer' % (
               state_file, state_ver))
-      if state_ver > 2:
+      if state_ver > max_version:
         raise ValueError(
             'Unsupported state file %s, version is %d. '
-            'Latest supported is 2' % (state_file, state_ver))
+            'Latest supported is %d' % (state_file, state_ver, max_version))
       state_items = state.get('items')
       if not isinstance(state_items, list):
         raise ValueError(
@@ -118,14 +121,19 @@ class LRUDict(object):
     lru._dirty = False
     return lru
 
-  def save(self, state_file):
-    """Saves cache state to a file if it was modified."""
+  def save(self, state_file, version=2):
+    """Saves cache state to a file if it was modified.
+
+    Callers storing values that older readers can't handle save with a higher
+    version, so that older readers reject the state file instead of misusing
+    the values.
+    """
     if not self._dirty:
       return False
 
     with open(state_file, 'wb') as f:
       contents = {
-        'version': 2,
+        'version': version,
         'items': self._items.items(),
       }
       json.dump(contents, f, separators=(',',':'))
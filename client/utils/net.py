@@ -27,6 +27,13 @@ from utils import authenticators
 from utils import oauth
 from utils import tools
 
+try:
+  # Optional, used by Http2Engine.
+  import hyper
+  import hyper.tls
+except ImportError:
+  hyper = None
+
 # TODO(vadimsh): Refactor this stuff to be less magical, less global and less
 # bad.
 
@@ -75,10 +82,18 @@ _auth_config = None
 # Default is RequestsLibEngine.
 _request_engine_cls = None
 
+# Server URL -> class to use to send HTTP requests to it, overriding
+# _request_engine_cls. Set by 'set_engine_class'.
+_request_engine_cls_per_host = {}
+
 
 class NetError(IOError):
   """Generic network related error."""
 
+  # True if the server or the network is overloaded, so that callers send fewer
+  # requests at once, see threading_utils.is_congestion_error().
+  is_congestion = False
+
   def __init__(self, inner_exc=None):
     super(NetError, self).__init__(str(inner_exc or self.__doc__))
     self.inner_exc = inner_exc
@@ -87,10 +102,14 @@ class NetError(IOError):
 class TimeoutError(NetError):
   """Timeout while reading HTTP response."""
 
+  is_congestion = True
+
 
 class ConnectionError(NetError):
   """Failed to connect to the server."""
 
+  is_congestion = True
+
 
 class HttpError(NetError):
   """Server returned HTTP error code."""
@@ -98,6 +117,8 @@ class HttpError(NetError):
   def __init__(self, code, content_type, inner_exc):
     super(HttpError, self).__init__(inner_exc)
     self.code = code
+    # Too Many Requests and Service Unavailable are the server throttling.
+    self.is_congestion = code in (429, 503)
     self.content_type = content_type
     self._details = None  # (list with header pairs, response body)
 
@@ -111,21 +132,39 @@ class HttpError(NetError):
     return self._details
 
 
-def set_engine_class(engine_cls):
-  """Globally changes a class to use to execute HTTP requests.
+def set_engine_class(engine_cls, urlhost=None):
+  """Changes a class to use to execute HTTP requests, globally or for requests
+  to |urlhost| only.
 
   Default engine is RequestsLibEngine that uses 'requests' library. Changing the
   engine on the fly is not supported. It must be set before the first request.
+  An engine set for a given server takes precedence over the global one.
 
   Custom engine class should support same public interface as RequestsLibEngine.
   """
   global _request_engine_cls
+  if urlhost:
+    urlhost = str(urlhost).lower().rstrip('/')
+    with _http_services_lock:
+      if _request_engine_cls_per_host.get(urlhost) is engine_cls:
+        return
+      assert urlhost not in _request_engine_cls_per_host, urlhost
+      if urlhost in _http_services:
+        logging.warning(
+            'Engine for %s set after the first request, ignoring', urlhost)
+      _request_engine_cls_per_host[urlhost] = engine_cls
+    return
   assert _request_engine_cls is None
   _request_engine_cls = engine_cls
 
 
-def get_engine_class():
-  """Returns a class to use to execute HTTP requests."""
+def get_engine_class(urlhost=None):
+  """Returns a class to use to execute HTTP requests, for |urlhost| if given."""
+  if urlhost:
+    engine_cls = _request_engine_cls_per_host.get(
+        str(urlhost).lower().rstrip('/'))
+    if engine_cls:
+      return engine_cls
   return _request_engine_cls or RequestsLibEngine
 
 
@@ -227,22 +266,11 @@ def get_http_service(urlhost, allow_cached=True):
   requests to given base urlhost.
   """
   def new_service():
-    # Create separate authenticator only if engine is not providing
-    # authentication already. Also we use signed URLs for Google Storage, no
-    # need for special authentication.
-    authenticator = None
-    engine_cls = get_engine_class()
-    is_gs = GS_STORAGE_HOST_URL_RE.match(urlhost)
-    conf = get_oauth_config()
-    if not engine_cls.provides_auth and not is_gs and not conf.disabled:
-      authenticator = (
-          authenticators.LuciContextAuthenticator()
-          if conf.use_luci_context_auth else
-          authenticators.OAuthAuthenticator(urlhost, conf))
+    engine_cls = get_engine_class(urlhost)
     return HttpService(
         urlhost,
         engine=engine_cls(),
-        authenticator=authenticator)
+        authenticator=_create_authenticator(urlhost, engine_cls))
 
   # Ensure consistency in url naming.
   urlhost = str(urlhost).lower().rstrip('/')
@@ -257,6 +285,32 @@ def get_http_service(urlhost, allow_cached=True):
     return service
 
 
+def _create_authenticator(urlhost, engine_cls):
+  """Returns the Authenticator to use for urlhost or None."""
+  # Create separate authenticator only if engine is not providing
+  # authentication already. Also we use signed URLs for Google Storage, no
+  # need for special authentication.
+  conf = get_oauth_config()
+  if (engine_cls.provides_auth or GS_STORAGE_HOST_URL_RE.match(urlhost) or
+      conf.disabled):
+    return None
+  if conf.use_luci_context_auth:
+    return authenticators.LuciContextAuthenticator()
+  return authenticators.OAuthAuthenticator(urlhost, conf)
+
+
+def reset_authenticators():
+  """Recreates the authenticators of the cached HttpService instances.
+
+  The engines, and thus their connection pools, are kept. Used by long-lived
+  processes after the authentication configuration changed.
+  """
+  with _http_services_lock:
+    for urlhost, service in _http_services.iteritems():
+      service.authenticator = _create_authenticator(
+          urlhost, get_engine_class(urlhost))
+
+
 def disable_oauth_config():
   """Disables OAuth-based authentication performed by this module.
 
@@ -768,6 +822,229 @@ class RequestsLibEngine(object):
       raise ConnectionError(e)
 
 
+class Http2ResponseError(Exception):
+  """HTTP error code returned by a server through Http2Engine."""
+
+  def __init__(self, status, headers, content):
+    super(Http2ResponseError, self).__init__('HTTP %d' % status)
+    self.status = status
+    self.headers = headers
+    self.content = content
+
+
+class Http2Engine(object):
+  """Class that knows how to execute HttpRequests over HTTP/2 via the hyper
+  library.
+
+  Requests to a server are multiplexed as concurrent streams over at most
+  CONNECTIONS_PER_HOST connections, instead of one connection per concurrent
+  request with RequestsLibEngine. Whether a server supports HTTP/2 is checked
+  with ALPN on the first request to it. Requests to servers that don't, or
+  that aren't over https, go through RequestsLibEngine. Cookies are not
+  supported.
+  """
+
+  # This engine doesn't know how to authenticate requests on transport level.
+  provides_auth = False
+
+  # Maximum number of connections to a server; each one carries many streams.
+  CONNECTIONS_PER_HOST = 2
+
+  # Maximum number of redirects followed for a request.
+  MAX_REDIRECTS = 5
+
+  @staticmethod
+  def is_supported():
+    """Returns True if the hyper library and ALPN are available."""
+    return bool(hyper) and getattr(ssl, 'HAS_ALPN', False)
+
+  @classmethod
+  def parse_request_exception(cls, exc):
+    """Extracts HTTP headers and body from inner exceptions put in HttpError."""
+    if isinstance(exc, Http2ResponseError):
+      return exc.headers.items(), exc.content
+    return RequestsLibEngine.parse_request_exception(exc)
+
+  @classmethod
+  def timeout_exception_classes(cls):
+    """A tuple of exception classes that represent timeout.
+
+    Will be caught while reading a streaming response in HttpResponse.read and
+    transformed to TimeoutError.
+    """
+    return RequestsLibEngine.timeout_exception_classes()
+
+  def __init__(self):
+    super(Http2Engine, self).__init__()
+    self._fallback = RequestsLibEngine()
+    self._ssl_context = None
+    self._lock = threading.Lock()
+    # host:port -> list of [connection, streams in flight], or None if the
+    # server doesn't support HTTP/2.
+    self._connections = {}
+    self._stats = {
+      'connections': 0,
+      'fallback_requests': 0,
+      'max_streams': 0,
+      'requests': 0,
+      'streams': 0,
+    }
+
+  def get_stats(self):
+    """Returns a dict with the request multiplexing counters:
+      connections: HTTP/2 connections opened.
+      requests: requests sent over HTTP/2.
+      streams: requests in flight over HTTP/2 at the moment.
+      max_streams: maximum number of requests seen in flight at once on a
+                   single connection.
+      fallback_requests: requests sent through RequestsLibEngine.
+    """
+    with self._lock:
+      return self._stats.copy()
+
+  def perform_request(self, request, redirects=0):
+    """Sends a HttpRequest to the server and reads back the response.
+
+    Returns HttpResponse.
+
+    Raises:
+      ConnectionError - failed to establish connection to the server.
+      TimeoutError - timeout while connecting or reading response.
+      HttpError - server responded with >= 400 error code.
+    """
+    url = urlparse.urlparse(request.get_full_url())
+    entry = self._get_connection(url, request.timeout) if (
+        url.scheme == 'https') else None
+    if not entry:
+      with self._lock:
+        self._stats['fallback_requests'] += 1
+      return self._fallback.perform_request(request)
+
+    path = urlparse.urlunparse(('', '') + url[2:])
+    # HTTP/2 header names are lower case.
+    headers = dict(
+        (k.lower(), str(v)) for k, v in request.headers.iteritems())
+    try:
+      try:
+        stream_id = entry[0].request(
+            request.method, path, body=request.body, headers=headers)
+        response = entry[0].get_response(stream_id)
+      finally:
+        with self._lock:
+          entry[1] -= 1
+          self._stats['streams'] -= 1
+    except socket.timeout as e:
+      self._drop_connection(url.netloc, entry)
+      raise TimeoutError(e)
+    except (
+        socket.error, ssl.SSLError,
+        hyper.http20.exceptions.HTTP20Error) as e:
+      self._drop_connection(url.netloc, entry)
+      raise ConnectionError(e)
+
+    response_headers = {}
+    for key, value in response.headers.items():
+      if key in response_headers:
+        value = '%s, %s' % (response_headers[key], value)
+      response_headers[key] = value
+    response_headers = get_case_insensitive_dict(response_headers)
+
+    location = response_headers.get('Location')
+    if (request.follow_redirects and location and
+        response.status in (301, 302, 303, 307, 308)):
+      response.close()
+      if redirects >= self.MAX_REDIRECTS:
+        raise ConnectionError('Too many redirects for %s' % request.url)
+      method = request.method
+      body = request.body
+      if response.status == 303:
+        method = 'GET'
+        body = None
+      redirect = HttpRequest(
+          method, urlparse.urljoin(request.get_full_url(), location), [],
+          body, request.headers, request.timeout, request.stream, True)
+      return self.perform_request(redirect, redirects + 1)
+
+    if response.status >= 400:
+      raise HttpError(
+          response.status, response_headers.get('Content-Type'),
+          Http2ResponseError(
+              response.status, response_headers, response.read()))
+    return HttpResponse(response, request.get_full_url(), response_headers)
+
+  def _get_connection(self, url, timeout):
+    """Returns the least busy [connection, streams in flight] to the server, with
+    the stream counted, or None if the server doesn't support HTTP/2.
+    """
+    host = url.netloc
+    with self._lock:
+      known = host in self._connections
+      if known and self._connections[host] is None:
+        return None
+    if not known:
+      supported = self._probe_h2(url, timeout)
+      if not supported:
+        if supported is not None:
+          with self._lock:
+            self._connections[host] = None
+        return None
+
+    with self._lock:
+      entries = self._connections.setdefault(host, [])
+      if entries is None:
+        return None
+      entry = min(entries, key=lambda e: e[1]) if entries else None
+      if (not entry or entry[1]) and len(entries) < self.CONNECTIONS_PER_HOST:
+        if self._ssl_context is None:
+          self._ssl_context = hyper.tls.init_context(
+              cert_path=tools.get_cacerts_bundle())
+        entry = [
+          hyper.HTTP20Connection(
+              url.hostname, url.port or 443, secure=True,
+              ssl_context=self._ssl_context, timeout=timeout),
+          0,
+        ]
+        entries.append(entry)
+        self._stats['connections'] += 1
+      entry[1] += 1
+      self._stats['requests'] += 1
+      self._stats['streams'] += 1
+      self._stats['max_streams'] = max(self._stats['max_streams'], entry[1])
+      return entry
+
+  def _drop_connection(self, host, entry):
+    """Closes a connection that failed so the next request opens a new one."""
+    with self._lock:
+      entries = self._connections.get(host)
+      if entries:
+        entries[:] = [e for e in entries if e is not entry]
+    try:
+      entry[0].close()
+    except Exception as e:
+      logging.debug('Failed to close the connection to %s: %s', host, e)
+
+  @staticmethod
+  def _probe_h2(url, timeout):
+    """Returns True if the server negotiates HTTP/2 with ALPN, False if it
+    doesn't and None if it couldn't be reached.
+    """
+    try:
+      context = ssl.create_default_context(cafile=tools.get_cacerts_bundle())
+      context.set_alpn_protocols(['h2', 'http/1.1'])
+      sock = socket.create_connection((url.hostname, url.port or 443), timeout)
+      try:
+        sock = context.wrap_socket(sock, server_hostname=url.hostname)
+        protocol = sock.selected_alpn_protocol()
+      finally:
+        sock.close()
+    except (socket.error, ssl.SSLError) as e:
+      # Let the fallback engine report the error.
+      logging.warning('Failed to probe HTTP/2 on %s: %s', url.netloc, e)
+      return None
+    logging.info('%s negotiated %s', url.netloc, protocol)
+    return protocol == 'h2'
+
+
 class RetryAttempt(object):
   """Contains information about current retry attempt.
 
@@ -9,6 +9,7 @@ import inspect
 import logging
 import os
 import Queue
+import socket
 import sys
 import threading
 import time
@@ -374,7 +375,7 @@ class AutoRetryThreadPool(ThreadPool):
   def _task_executer(self, priority, channel, func, *args, **kwargs):
     """Wraps the function and automatically retry on exceptions."""
     try:
-      result = func(*args, **kwargs)
+      result = self._call(func, args, kwargs)
       if channel is None:
         return result
       channel.send_result(result)
@@ -404,16 +405,190 @@ class AutoRetryThreadPool(ThreadPool):
         raise
       channel.send_exception()
 
+  def _call(self, func, args, kwargs):
+    """Runs a task. Overridden to wrap the execution of each attempt."""
+    return func(*args, **kwargs)
+
+
+class DurationHistogram(object):
+  """Thread-safe histogram of durations with exponentially growing buckets."""
+  # Upper bound of the first bucket, in seconds. Each next bucket is twice as
+  # large, the last one is unbounded.
+  FIRST_BUCKET = 0.001
+  BUCKETS = 20
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._counts = [0] * self.BUCKETS
+
+  def add(self, duration):
+    """Records one duration, in seconds."""
+    index = 0
+    bound = self.FIRST_BUCKET
+    while duration > bound and index < self.BUCKETS - 1:
+      index += 1
+      bound *= 2
+    with self._lock:
+      self._counts[index] += 1
+
+  @property
+  def buckets(self):
+    """Returns the list of (upper bound in seconds, count) of each bucket. The
+    upper bound of the last bucket is None.
+    """
+    with self._lock:
+      counts = self._counts[:]
+    bounds = [self.FIRST_BUCKET * 2**i for i in xrange(self.BUCKETS - 1)]
+    return zip(bounds + [None], counts)
+
+  @property
+  def count(self):
+    with self._lock:
+      return sum(self._counts)
+
+  def percentile(self, percent):
+    """Returns the upper bound of the bucket holding the |percent| percentile,
+    float('inf') for the last bucket, or None if nothing was recorded.
+    """
+    buckets = self.buckets
+    total = sum(c for _, c in buckets)
+    if not total:
+      return None
+    seen = 0
+    for bound, count in buckets:
+      seen += count
+      if seen * 100. >= total * percent:
+        return bound if bound is not None else float('inf')
+
+
+class AdaptiveConcurrency(object):
+  """Limits how many tasks run at once, adapting the limit to the observed
+  throughput and congestion with additive increase, multiplicative decrease.
+
+  - The limit is halved as soon as a task reports congestion, like an error
+    or HTTP 429 from the server. The tasks that were already running at that
+    time are then ignored, since they were started with the previous limit.
+  - Otherwise after each window of |limit| completed tasks, the limit is
+    increased by one, unless the previous increase lowered the throughput,
+    in which case it is decreased by one.
+  """
+  # The previous increase is undone if the throughput drops below this ratio of
+  # the one of the previous window.
+  THROUGHPUT_DROP = 0.9
+
+  def __init__(self, initial, minimum, maximum):
+    assert 1 <= minimum <= initial <= maximum, (minimum, initial, maximum)
+    self.minimum = minimum
+    self.maximum = maximum
+    self.latency = DurationHistogram()
+    self._cond = threading.Condition()
+    self._limit = initial
+    self._active = 0
+    # Incremented each time the limit is lowered because of congestion.
+    self._epoch = 0
+    # Current window.
+    self._done = 0
+    self._start = time.time()
+    # Tasks per second in the previous window and whether the limit was raised
+    # after it.
+    self._rate = None
+    self._raised = False
+
+  @property
+  def limit(self):
+    """Maximum number of concurrent tasks at the moment."""
+    return self._limit
+
+  @property
+  def active(self):
+    """Number of tasks running at the moment."""
+    return self._active
+
+  def acquire(self):
+    """Blocks until a task can start.
+
+    Returns:
+      Token to pass to release().
+    """
+    with self._cond:
+      while self._active >= self._limit:
+        self._cond.wait()
+      self._active += 1
+      return self._epoch
+
+  def release(self, token, duration, congested):
+    """Signals the end of a task started with acquire().
+
+    Arguments:
+      token: value returned by acquire().
+      duration: time it took to run the task, in seconds.
+      congested: True if the task failed in a way hinting that too many tasks
+                 run at once.
+    """
+    self.latency.add(duration)
+    with self._cond:
+      self._active -= 1
+      self._cond.notify_all()
+      if token != self._epoch:
+        return
+      self._done += 1
+      now = time.time()
+      if congested:
+        self._epoch += 1
+        self._rate = None
+        self._set_limit(self._limit / 2, now, 'congestion')
+      elif self._done >= self._limit:
+        rate = self._done / max(now - self._start, 0.001)
+        if (self._raised and self._rate and
+            rate < self._rate * self.THROUGHPUT_DROP):
+          limit, reason = self._limit - 1, 'lower throughput'
+        else:
+          limit, reason = self._limit + 1, 'window completed'
+        self._rate = rate
+        self._set_limit(limit, now, reason)
+
+  def _set_limit(self, limit, now, reason):
+    """Changes the limit and starts a new window. Must be called with the lock
+    held.
+    """
+    limit = max(self.minimum, min(self.maximum, limit))
+    if limit != self._limit:
+      logging.debug(
+          'Concurrency %d -> %d: %s', self._limit, limit, reason)
+    self._raised = limit > self._limit
+    self._limit = limit
+    self._done = 0
+    self._start = now
+
+
+def is_congestion_error(exc):
+  """Returns True if |exc| means the server or the network is overloaded.
+
+  Errors of utils.net tell so with their is_congestion attribute: timeouts,
+  connection failures and HTTP 429 and 503 responses. Other errors, e.g. HTTP
+  404, are not related to the load.
+  """
+  return (
+      isinstance(exc, socket.error) or
+      bool(getattr(exc, 'is_congestion', False)))
+
 
 class IOAutoRetryThreadPool(AutoRetryThreadPool):
   """Thread pool that automatically retries on IOError.
 
   Supposed to be used for IO bound tasks, and thus default maximum number of
   worker threads is independent of number of CPU cores.
+
+  The number of tasks running at once adapts to the throughput, and is reduced
+  when tasks fail because the server throttles requests or the network is
+  overloaded, see is_congestion_error() and AdaptiveConcurrency.
   """
   # Initial and maximum number of worker threads.
   INITIAL_WORKERS = 2
-  MAX_WORKERS = 16 if sys.maxsize > 2L**32 else 8
+  MAX_WORKERS = 64 if sys.maxsize > 2L**32 else 16
+  # Number of tasks run at once, initially and at least.
+  INITIAL_CONCURRENCY = 16 if sys.maxsize > 2L**32 else 8
+  MIN_CONCURRENCY = 1
   RETRIES = 5
 
   def __init__(self):
@@ -424,6 +599,37 @@ class IOAutoRetryThreadPool(AutoRetryThreadPool):
         self.MAX_WORKERS,
         0,
         'io')
+    self.concurrency = AdaptiveConcurrency(
+        self.INITIAL_CONCURRENCY, self.MIN_CONCURRENCY, self.MAX_WORKERS)
+
+  def get_status(self):
+    """Returns the concurrency, queue depth and latency percentiles of the
+    tasks as a short string, e.g. to be passed to Progress.add_status().
+    """
+    def fmt(seconds):
+      if seconds is None:
+        return '-'
+      if seconds == float('inf'):
+        return 'inf'
+      return '%dms' % (seconds * 1000)
+    latency = self.concurrency.latency
+    return 'io %d/%d q%d p50 %s p90 %s p99 %s' % (
+        self.concurrency.active, self.concurrency.limit, self.tasks.qsize(),
+        fmt(latency.percentile(50)), fmt(latency.percentile(90)),
+        fmt(latency.percentile(99)))
+
+  def _call(self, func, args, kwargs):
+    token = self.concurrency.acquire()
+    start = time.time()
+    congested = False
+    try:
+      return func(*args, **kwargs)
+    # pylint: disable=catching-non-exception
+    except self._swallowed_exceptions as e:
+      congested = is_congestion_error(e)
+      raise
+    finally:
+      self.concurrency.release(token, time.time() - start, congested)
 
 
 class Progress(object):
@@ -448,10 +654,19 @@ class Progress(object):
     self._columns_lookup = dict((c[0], i) for i, c in enumerate(columns))
     # Setting it to True forces a print on the first print_update() call.
     self._value_changed = True
+    self._status_fns = []
 
     # To be used in all threads.
     self._queued_updates = Queue.Queue()
 
+  def add_status(self, fn):
+    """Adds a function returning a short string appended to each printed line.
+
+    To be used for values that are sampled instead of accumulated, like the
+    status of a thread pool, see IOAutoRetryThreadPool.get_status().
+    """
+    self._status_fns.append(fn)
+
   def update_item(self, name, raw=False, **kwargs):
     """Queue information to print out.
 
@@ -514,8 +729,9 @@ class Progress(object):
 
   def _gen_line(self, name):
     """Generates the line to be printed."""
-    next_line = ('[%s] %6.2fs %s') % (
-        self._render_columns(), time.time() - self.start, name)
+    status = ''.join('%s ' % fn() for fn in self._status_fns)
+    next_line = ('[%s] %6.2fs %s%s') % (
+        self._render_columns(), time.time() - self.start, status, name)
     # Fill it with whitespace only if self.use_cr_only is set.
     prefix = ''
     if self.use_cr_only and self._last_printed_line: